@@ -0,0 +1,144 @@
+"""Location and loading of the ndx-binned-spikes namespace."""
+
+import copy
+import hashlib
+import json
+import os
+from importlib.resources import files
+
+NAMESPACE_NAME = "ndx-binned-spikes"
+
+# Bump when the layout of the cache changes so that old caches are ignored
+SPEC_CACHE_VERSION = 1
+
+_namespace_loaded = False
+
+
+def get_spec_path() -> str:
+    """The path to the namespace YAML file of the extension."""
+    # Get path to the namespace.yaml file with the expected location when installed not in editable mode
+    location_of_package = files(__package__)
+    spec_path = location_of_package / "spec" / f"{NAMESPACE_NAME}.namespace.yaml"
+
+    # If that path does not exist, we are likely running in editable mode. Use the local path instead
+    if not os.path.exists(spec_path):
+        spec_path = location_of_package.parent.parent.parent / "spec" / f"{NAMESPACE_NAME}.namespace.yaml"
+
+    return str(spec_path)
+
+
+def get_spec_cache_path(spec_path: str) -> str:
+    """The path of the pre-parsed spec cache that sits next to the namespace YAML file."""
+    return os.path.join(os.path.dirname(spec_path), f"{NAMESPACE_NAME}.spec-cache.json")
+
+
+def _get_extension_sources(spec_path: str) -> list:
+    """The extension YAML files of the namespace, read without a YAML parser."""
+    namespace_file_name = os.path.basename(spec_path)
+    return sorted(
+        file_name
+        for file_name in os.listdir(os.path.dirname(spec_path))
+        if file_name.startswith(NAMESPACE_NAME) and file_name.endswith(".yaml") and file_name != namespace_file_name
+    )
+
+
+def compute_spec_hash(spec_path: str) -> str:
+    """A hash of the contents of the namespace file and of the extension files next to it."""
+    spec_directory = os.path.dirname(spec_path)
+    spec_hash = hashlib.sha256()
+    for file_name in [os.path.basename(spec_path)] + _get_extension_sources(spec_path):
+        spec_hash.update(file_name.encode())
+        with open(os.path.join(spec_directory, file_name), "rb") as file:
+            spec_hash.update(file.read())
+
+    return spec_hash.hexdigest()
+
+
+def write_spec_cache(spec_path: str) -> str:
+    """
+    Parse the namespace and extension YAML files and store the result as JSON next to them.
+
+    Loading the namespace from this cache skips the YAML parser. The cache records a hash of the YAML files so that
+    it is ignored once they change.
+
+    Returns
+    -------
+    str
+        The path of the cache.
+    """
+    from hdmf.spec.namespace import YAMLSpecReader
+
+    reader = YAMLSpecReader(indir=os.path.dirname(spec_path))
+    namespaces = reader.read_namespace(spec_path)
+    specs = {
+        schema["source"]: reader.read_spec(schema["source"])
+        for namespace in namespaces
+        for schema in namespace["schema"]
+        if "source" in schema
+    }
+
+    cache = dict(
+        cache_version=SPEC_CACHE_VERSION,
+        spec_hash=compute_spec_hash(spec_path),
+        namespaces=namespaces,
+        specs=specs,
+    )
+    cache_path = get_spec_cache_path(spec_path)
+    with open(cache_path, "w") as file:
+        json.dump(cache, file, indent=1)
+        file.write("\n")
+
+    return cache_path
+
+
+def read_spec_cache(spec_path: str):
+    """The cached namespaces and specs, or None if the cache is missing, unreadable or stale."""
+    try:
+        with open(get_spec_cache_path(spec_path), "r") as file:
+            cache = json.load(file)
+    except (OSError, ValueError):
+        return None
+
+    if cache.get("cache_version") != SPEC_CACHE_VERSION or cache.get("spec_hash") != compute_spec_hash(spec_path):
+        return None
+
+    return cache
+
+
+def _make_cached_spec_reader(spec_path: str, cache: dict):
+    from hdmf.spec.namespace import SpecReader
+
+    class CachedSpecReader(SpecReader):
+        """Serves the namespaces and specs of the cache instead of parsing the YAML files."""
+
+        def read_namespace(self, namespace_path):
+            return copy.deepcopy(cache["namespaces"])
+
+        def read_spec(self, spec_path):
+            return copy.deepcopy(cache["specs"][os.path.basename(spec_path)])
+
+    # Same source as the YAML reader would have, so pynwb sees the namespace file as already loaded either way
+    return CachedSpecReader(source=os.path.dirname(spec_path))
+
+
+def load_namespace():
+    """
+    Load the namespace into the pynwb type map. Calling it more than once has no effect.
+
+    The pre-parsed spec cache is used when it is up to date; otherwise the YAML files are parsed.
+    """
+    global _namespace_loaded
+    if _namespace_loaded:
+        return
+
+    from pynwb import get_type_map, load_namespaces
+
+    spec_path = get_spec_path()
+    cache = read_spec_cache(spec_path)
+    if cache is None:
+        load_namespaces(spec_path)
+    else:
+        type_map = get_type_map(copy=False)
+        type_map.load_namespaces(namespace_path=spec_path, reader=_make_cached_spec_reader(spec_path, cache))
+
+    _namespace_loaded = True
@@ -0,0 +1,150 @@
+"""
+Asyncio read API for BinnedSpikes and BinnedAlignedSpikes.
+
+The reads run in a bounded thread pool so they do not block the event loop. Reads of the same file are serialized
+with a per-file lock while different files are read in parallel. Concurrent requests are coalesced: a request for
+a time range that overlaps ranges that are already being read waits for those reads, reads only the bins they do not
+cover and stitches the parts, and concurrent requests for the same condition share a single read. The reads in
+flight are tracked per event loop, so a reader can be used from several event loops.
+"""
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import numpy as np
+
+from .masking import mask_block
+from .utils import read_block
+
+DEFAULT_MAX_WORKERS = 4
+
+
+def _get_file_key(data):
+    """An identifier of the file `data` is stored in; in-memory arrays get their own key."""
+    file = getattr(data, "file", None)
+    filename = getattr(file, "filename", None)
+    return filename if filename is not None else id(data)
+
+
+class AsyncDataReader:
+    """
+    Runs the reads of the async accessors in a bounded thread pool, coalescing concurrent overlapping requests.
+
+    The arrays returned to coalesced requests can share memory, so they should not be modified in place.
+
+    Parameters
+    ----------
+    max_workers : int, default: 4
+        The maximum number of reads running at the same time.
+    """
+
+    def __init__(self, max_workers: int = DEFAULT_MAX_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ndx-binned-spikes-aio")
+        self._file_locks = {}
+        self._lock = threading.Lock()
+        # Maps (event loop, container id) to the (start_bin, stop_bin, future) of its time range reads in flight
+        self._time_range_reads = {}
+        # Maps (event loop, container id, condition index) to the future of the read in flight
+        self._condition_reads = {}
+
+    def _get_file_lock(self, data) -> threading.Lock:
+        with self._lock:
+            return self._file_locks.setdefault(_get_file_key(data), threading.Lock())
+
+    def _read(self, data, read):
+        with self._get_file_lock(data):
+            return read()
+
+    def _submit(self, data, read) -> asyncio.Future:
+        return asyncio.get_running_loop().run_in_executor(self._executor, self._read, data, read)
+
+    def _start_time_range_read(self, key, binned_spikes, start_bin: int, stop_bin: int) -> asyncio.Future:
+        """Submit the read of the bins `start_bin:stop_bin`, tracked as in flight until it is done."""
+        data = binned_spikes._readable_data
+        selection = (slice(None), slice(start_bin, stop_bin))
+        validity_mask = binned_spikes.validity_mask
+
+        def read():
+            return mask_block(read_block(data, selection), validity_mask, binned_spikes.data.shape, selection)
+
+        future = self._submit(data, read)
+        entry = (start_bin, stop_bin, future)
+        self._time_range_reads.setdefault(key, []).append(entry)
+
+        def forget(_):
+            in_flight = self._time_range_reads[key]
+            in_flight.remove(entry)
+            if not in_flight:
+                del self._time_range_reads[key]
+
+        future.add_done_callback(forget)
+        return future
+
+    async def read_bins(self, binned_spikes, start_bin: int, stop_bin: int) -> np.ndarray:
+        """Read `binned_spikes.data[:, start_bin:stop_bin]`, sharing the bins of the overlapping reads in flight."""
+        key = (asyncio.get_running_loop(), id(binned_spikes))
+        in_flight = sorted(self._time_range_reads.get(key, []), key=lambda entry: entry[0])
+
+        # Cover the range with the reads in flight and new reads of the bins they miss, from left to right
+        parts = []
+        position = start_bin
+        while position < stop_bin:
+            covering = [entry for entry in in_flight if entry[0] <= position < entry[1]]
+            if covering:
+                read_start, read_stop, future = max(covering, key=lambda entry: entry[1])
+                part_stop = min(read_stop, stop_bin)
+                parts.append((future, slice(position - read_start, part_stop - read_start)))
+            else:
+                part_stop = min([entry[0] for entry in in_flight if entry[0] > position] + [stop_bin])
+                future = self._start_time_range_read(key, binned_spikes, position, part_stop)
+                parts.append((future, slice(None)))
+            position = part_stop
+        if not parts:
+            parts.append((self._start_time_range_read(key, binned_spikes, start_bin, stop_bin), slice(None)))
+
+        blocks = [(await asyncio.shield(future))[:, part_slice] for future, part_slice in parts]
+        if len(blocks) == 1:
+            return blocks[0]
+        concatenate = np.ma.concatenate if binned_spikes.validity_mask is not None else np.concatenate
+        return concatenate(blocks, axis=1)
+
+    async def read_condition(self, binned_aligned_spikes, condition_index: int) -> np.ndarray:
+        """Read the data of a condition, sharing the read with the concurrent requests for the same condition."""
+        key = (asyncio.get_running_loop(), id(binned_aligned_spikes), condition_index)
+        future = self._condition_reads.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        def read():
+            # asanyarray keeps the mask of the data of a container with a `validity_mask`
+            return np.asanyarray(binned_aligned_spikes.get_data_for_condition(condition_index)[:])
+
+        future = self._submit(binned_aligned_spikes.data, read)
+        self._condition_reads[key] = future
+        try:
+            return await asyncio.shield(future)
+        finally:
+            del self._condition_reads[key]
+
+    def close(self):
+        """Wait for the reads in progress and release the threads."""
+        self._executor.shutdown(wait=True)
+
+
+_default_reader: Optional[AsyncDataReader] = None
+_default_reader_lock = threading.Lock()
+
+
+def get_default_reader() -> AsyncDataReader:
+    """
+    The reader used by the async accessors when none is given, created on first use.
+
+    It can be shared by several event loops, as the reads in flight are tracked per event loop.
+    """
+    global _default_reader
+    with _default_reader_lock:
+        if _default_reader is None:
+            _default_reader = AsyncDataReader()
+        return _default_reader
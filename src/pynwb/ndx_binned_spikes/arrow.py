@@ -0,0 +1,155 @@
+"""
+Export of binned data to Apache Arrow, for Polars, DuckDB and other Arrow consumers.
+
+pyarrow is an optional dependency, install it with `pip install ndx-binned-spikes[arrow]`.
+
+Two layouts are available:
+
+- "tensor": the data as an Arrow tensor with the same shape as `data`.
+- "long": a table with one row per unit, event (BinnedAlignedSpikes only) and bin, with the columns `unit`,
+  `event`, `bin`, `count` and `condition` (BinnedAlignedSpikes with conditions only). The rows are ordered like
+  the entries of `data`. The table is produced in record batches of whole units and the index columns are
+  generated one batch at a time, so no index array spans the whole table.
+
+In-memory C-contiguous data is exported without copying the counts; disk-backed data is read one batch at a time.
+
+With a `validity_mask`, the long layout leaves out the rows of the invalid entries (the counts are then copied). The
+tensor layout and DLPack cannot represent the mask and raise a ValueError.
+"""
+
+from typing import Dict, Iterator, Optional
+
+import numpy as np
+
+from .utils import get_chunk_length, iter_slices, read_block
+
+# The (device type, device id) of numpy arrays in the DLPack protocol
+DLPACK_CPU_DEVICE = (1, 0)
+
+
+def import_pyarrow():
+    """Import pyarrow, with an explanation of how to install it if it is missing."""
+    try:
+        import pyarrow
+    except ImportError as error:
+        raise ImportError(
+            "Exporting to Arrow requires pyarrow. Install it with `pip install ndx-binned-spikes[arrow]`."
+        ) from error
+
+    return pyarrow
+
+
+def iter_long_format_columns(container, units_per_batch: Optional[int] = None) -> Iterator[Dict[str, np.ndarray]]:
+    """
+    Yield the columns of the long layout as numpy arrays, one batch of whole units at a time.
+
+    Parameters
+    ----------
+    container : BinnedSpikes or BinnedAlignedSpikes
+        The container to export.
+    units_per_batch : int, optional
+        The number of units of each batch. By default the batches are around 64 MiB of counts.
+
+    Yields
+    ------
+    dict
+        The `unit`, `event` (aligned data only), `bin`, `count` and `condition` (aligned data with conditions only)
+        columns of the batch, without the rows of the entries marked invalid by the `validity_mask`.
+    """
+    data = container._readable_data
+    validity_mask = getattr(container, "validity_mask", None)
+    shape = tuple(data.shape)
+    is_aligned = len(shape) == 3
+    units_per_batch = units_per_batch or get_chunk_length(data, axis=0)
+
+    condition_indices = None
+    if is_aligned and container.has_multiple_conditions:
+        condition_indices = np.asarray(container.condition_indices[:])
+
+    for unit_slice in iter_slices(shape[0], units_per_batch):
+        block = read_block(data, unit_slice)
+        # A view when the block is C-contiguous, which is the case for whole units of in-memory data
+        counts = block.reshape(-1)
+        block_shape = block.shape
+
+        columns = dict(unit=np.repeat(np.arange(unit_slice.start, unit_slice.stop, dtype="uint32"), block[0].size))
+        if is_aligned:
+            columns["event"] = np.broadcast_to(
+                np.arange(shape[1], dtype="uint64")[np.newaxis, :, np.newaxis], block_shape
+            ).reshape(-1)
+        columns["bin"] = np.broadcast_to(np.arange(shape[-1], dtype="uint32"), block_shape).reshape(-1)
+        columns["count"] = counts
+        if condition_indices is not None:
+            columns["condition"] = np.broadcast_to(
+                condition_indices[np.newaxis, :, np.newaxis], block_shape
+            ).reshape(-1)
+
+        if validity_mask is not None:
+            valid = validity_mask.get_valid(shape, unit_slice).reshape(-1)
+            columns = {name: column[valid] for name, column in columns.items()}
+
+        yield columns
+
+
+def to_arrow(container, layout: str = "long", stream: bool = False, units_per_batch: Optional[int] = None):
+    """
+    Export a BinnedSpikes or BinnedAlignedSpikes to Arrow.
+
+    Parameters
+    ----------
+    container : BinnedSpikes or BinnedAlignedSpikes
+        The container to export.
+    layout : str, default: "long"
+        "long" for a table with one row per entry of `data`, or "tensor" for an Arrow tensor.
+    stream : bool, default: False
+        For the long layout, return a `pyarrow.RecordBatchReader` that reads the batches on demand instead of a
+        `pyarrow.Table`.
+    units_per_batch : int, optional
+        The number of units of each record batch. By default the batches are around 64 MiB of counts.
+
+    Returns
+    -------
+    pyarrow.Table, pyarrow.RecordBatchReader or pyarrow.Tensor
+    """
+    if layout not in ("long", "tensor"):
+        raise ValueError(f"`layout` should be 'long' or 'tensor', got '{layout}'.")
+
+    pyarrow = import_pyarrow()
+
+    if layout == "tensor":
+        _check_no_validity_mask(container, "an Arrow tensor")
+        data = container._readable_data
+        array = data if isinstance(data, np.ndarray) else read_block(data, Ellipsis)
+        return pyarrow.Tensor.from_numpy(np.ascontiguousarray(array))
+
+    batches = (
+        pyarrow.RecordBatch.from_pydict(columns)
+        for columns in iter_long_format_columns(container, units_per_batch=units_per_batch)
+    )
+    first_batch = next(batches, None)
+    if first_batch is None:
+        raise ValueError(f"'{container.name}' has no units to export.")
+
+    def all_batches():
+        yield first_batch
+        yield from batches
+
+    if stream:
+        return pyarrow.RecordBatchReader.from_batches(first_batch.schema, all_batches())
+
+    return pyarrow.Table.from_batches(list(all_batches()))
+
+
+def _check_no_validity_mask(container, target: str):
+    if getattr(container, "validity_mask", None) is not None:
+        raise ValueError(
+            f"'{container.name}' has a `validity_mask` that {target} cannot represent; export the long layout, which "
+            "leaves out the invalid entries, or use `get_masked_data`."
+        )
+
+
+def to_dlpack_array(container) -> np.ndarray:
+    """The data as a numpy array for DLPack export: in-memory arrays as they are, disk-backed data read in full."""
+    _check_no_validity_mask(container, "DLPack")
+    data = container._readable_data
+    return data if isinstance(data, np.ndarray) else read_block(data, Ellipsis)
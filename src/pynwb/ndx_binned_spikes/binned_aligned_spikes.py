@@ -0,0 +1,1013 @@
+"""The BinnedAlignedSpikes data interface."""
+
+import numpy as np
+from typing import TYPE_CHECKING, Callable, Iterator, Mapping, Optional, Sequence, Tuple, Union
+from pynwb import register_class, register_map
+from pynwb.core import NWBDataInterface
+from pynwb.io.core import NWBContainerMapper
+from hdmf.build import BuildManager
+from hdmf.spec import Spec
+from hdmf.utils import docval, get_data_shape, getargs
+from hdmf.common import DynamicTableRegion
+
+from ._namespace import load_namespace
+from .instrumentation import instrumented
+from .masking import ValidityMask, accumulate_masked_condition_sums, as_validity_mask, mask_block
+from .windows import OverlappingWindowsData
+from .utils import (
+    accumulate_condition_sums,
+    copy_units_region,
+    find_event_violations,
+    get_chunk_length,
+    get_condition_codes,
+    get_event_order,
+    iter_slices,
+    permute_events,
+    read_block,
+    read_units_selection,
+)
+
+# The analysis modules are imported by the methods that use them, so importing the classes stays cheap
+if TYPE_CHECKING:
+    from .aio import AsyncDataReader
+    from .cache import ChunkCache
+    from .decoding import Fold
+    from .resampling import BootstrapResult, PermutationResult
+
+load_namespace()
+
+
+@register_class(neurodata_type="BinnedAlignedSpikes", namespace="ndx-binned-spikes")  # noqa
+class BinnedAlignedSpikes(NWBDataInterface):
+    __nwbfields__ = (
+        "name",
+        "description",
+        "bin_width_in_ms",
+        "event_to_bin_offset_in_ms",
+        "data",
+        "timestamps",
+        "condition_indices",
+        "condition_labels",
+        {"name": "units_region", "child": True},  # TODO, I forgot why this is included
+        "checksum_manifest",
+        "validity_mask",
+    )
+
+    DEFAULT_NAME = "BinnedAlignedSpikes"
+    DEFAULT_DESCRIPTION = "Spikes data binned and aligned to the event timestamps of one or multiple conditions."
+
+    @docval(
+        {
+            "name": "name",
+            "type": str,
+            "doc": "The name of this container",
+            "default": DEFAULT_NAME,
+        },
+        {
+            "name": "description",
+            "type": str,
+            "doc": "A description of what the data represents",
+            "default": DEFAULT_DESCRIPTION,
+        },
+        {
+            "name": "bin_width_in_ms",
+            "type": float,
+            "doc": "The length in milliseconds of the bins",
+        },
+        {
+            "name": "event_to_bin_offset_in_ms",
+            "type": float,
+            "doc": (
+                "The time in milliseconds from the event to the beginning of the first bin. A negative value indicates"
+                "that the first bin is before the event whereas a positive value indicates that the first bin is "
+                "after the event."
+            ),
+            "default": 0.0,
+        },
+        {
+            "name": "data",
+            "type": "array_data",
+            "shape": [(None, None, None)],
+            "doc": (
+                "The binned data. It should be an array whose first dimension is the number of units, "
+                "the second dimension is the number of events, and the third dimension is the number of bins. "
+                "Dense events with overlapping windows can be given as an `OverlappingWindowsData`, which stores "
+                "each covered bin once."
+            ),
+        },
+        {
+            "name": "event_timestamps",
+            "type": "array_data",
+            "doc": (
+                "The timestamps at which the events occurred. It is assumed that they map positionally to "
+                "the second index of the data.",
+            ),
+            "shape": (None,),
+        },
+        {
+            "name": "condition_indices",
+            "type": "array_data",
+            "doc": (
+                "The index of the condition that each entry of `event_timestamps` corresponds to "
+                "(e.g. a stimuli type, trial number, category, etc.)."
+                "This is only used when the data is aligned to multiple conditions"
+            ),
+            "shape": (None,),
+            "default": None,
+        },
+        {
+            "name":"condition_labels",
+            "type": "array_data",
+            "doc": (
+                "The labels of the conditions that the data is aligned to. The size of this array should match "
+                "the number of conditions. This is only used when the data is aligned to multiple conditions. "
+                "First condition is index 0, second is index 1, etc."
+            ),
+            "shape": (None,),
+            "default": None,
+        },
+        {
+            "name": "units_region",
+            "type": DynamicTableRegion,
+            "doc": "A reference to the Units table region that contains the units of the data.",
+            "default": None,
+        },
+        {
+            "name": "checksum_manifest",
+            "type": str,
+            "doc": (
+                "A JSON manifest with content hashes of the data, the binning parameters and the source spike times. "
+                "See `ndx_binned_spikes.checksums`."
+            ),
+            "default": None,
+        },
+        {
+            "name": "validity_mask",
+            "type": (ValidityMask, "array_data"),
+            "doc": (
+                "The valid entries of the data, as a `ValidityMask` or a boolean array with the number of dimensions "
+                "of the data whose axes have the length of the data axes or 1 (e.g. a (1, number_of_events, 1) "
+                "mask of the valid events). It is stored bit-packed and honoured by the accessors and reductions."
+            ),
+            "default": None,
+        },
+    )
+    def __init__(self, **kwargs):
+
+        name = kwargs.pop("name")
+        super().__init__(name=name)
+
+        self._validate(**kwargs)
+        kwargs["validity_mask"] = as_validity_mask(kwargs["validity_mask"], get_data_shape(kwargs["data"]))
+        self.has_multiple_conditions = kwargs["condition_indices"] is not None
+
+        for key in kwargs:
+            setattr(self, key, kwargs[key])
+
+    @staticmethod
+    @instrumented
+    def _validate(data, event_timestamps, condition_indices, condition_labels, **kwargs):
+        """
+        Check that the event arrays are consistent with the data and sorted by time.
+
+        The arrays are checked blockwise in a single pass, in parallel for large arrays, so memory stays flat as the
+        number of events grows.
+        """
+        data_shape = get_data_shape(data)
+
+        if data_shape[1] != event_timestamps.shape[0]:
+            msg = (
+                f"The number of event_timestamps must match the second axis of data: \n"
+                f"event_timestamps.size: {event_timestamps.size} \n" 
+                f"data.shape[1]: {data_shape[1]}"
+            )
+            raise ValueError(msg)
+
+        if condition_indices is not None and get_data_shape(condition_indices)[0] != event_timestamps.shape[0]:
+            raise ValueError(
+                "The number of event_timestamps must match the condition_indices: \n"
+                f"event_timestamps.size: {event_timestamps.shape[0]} \n"
+                f"condition_indices.size: {get_data_shape(condition_indices)[0]}"
+            )
+
+        number_of_conditions = None if condition_labels is None else get_data_shape(condition_labels)[0]
+        first_unsorted, first_out_of_range = find_event_violations(
+            event_timestamps, condition_indices, number_of_conditions=number_of_conditions
+        )
+
+        if first_unsorted is not None:
+            error_msg = (
+                "The event_timestamps must be monotonically increasing and the data and condition_indices "
+                "must be sorted by event_timestamps. Use the `BinnedAlignedSpikes.sort_data_by_event_timestamps` "
+                "method to do this automatically before initializing `BinnedAlignedSpikes`. \n"
+                f"First violation at index {first_unsorted}: {event_timestamps[first_unsorted - 1]} is followed "
+                f"by {event_timestamps[first_unsorted]}."
+            )
+            raise ValueError(error_msg)
+
+        if first_out_of_range is not None:
+            if number_of_conditions is None:
+                valid_range = "non-negative"
+            else:
+                valid_range = f"smaller than the number of condition_labels ({number_of_conditions})"
+            raise ValueError(
+                f"The condition_indices must be {valid_range}. "
+                f"The index of event {first_out_of_range} is {condition_indices[first_out_of_range]}."
+            )
+
+    def set_chunk_cache(self, cache: Optional["ChunkCache"], chunk_shape: Optional[Tuple[int, ...]] = None):
+        """
+        Serve the reads of `data` made by the methods of this container from an in-memory chunk cache.
+
+        The cache can be shared by many containers; containers that read the same dataset of the same file share
+        its chunks. Indexing `data` directly bypasses the cache.
+
+        Parameters
+        ----------
+        cache : ChunkCache or None
+            The cache to use, or None to read `data` directly again.
+        chunk_shape : tuple of int, optional
+            The shape of the cached blocks. Defaults to the storage chunks of `data`.
+        """
+        from .cache import CachedDataset
+
+        self._cached_data = None if cache is None else CachedDataset(self.data, cache, chunk_shape=chunk_shape)
+
+    @property
+    def _readable_data(self):
+        cached_data = getattr(self, "_cached_data", None)
+        return self.data if cached_data is None else cached_data
+
+    @instrumented
+    def get_data_for_condition(self, condition_index):
+
+        if not self.has_multiple_conditions:
+            if self.validity_mask is None:
+                return self.data
+            return self.get_masked_data()
+
+        mask = self.condition_indices[:] == condition_index
+        selection = (slice(None), mask, slice(None))
+        binned_spikes_for_unit = read_block(self._readable_data, selection)
+
+        return mask_block(binned_spikes_for_unit, self.validity_mask, self.data.shape, selection)
+
+    @instrumented
+    def get_masked_data(self, selection=Ellipsis) -> np.ndarray:
+        """
+        Read `data[selection]` as a masked array with the dtype of the data, where the invalid entries are masked.
+
+        Without a `validity_mask` nothing is masked.
+        """
+        block = read_block(self._readable_data, selection)
+        if self.validity_mask is None:
+            return np.ma.MaskedArray(block)
+        return mask_block(block, self.validity_mask, self.data.shape, selection)
+
+    async def aget_data_for_condition(
+        self,
+        condition_index: int,
+        reader: Optional["AsyncDataReader"] = None,
+    ) -> np.ndarray:
+        """
+        Async version of `get_data_for_condition` that reads in a thread pool without blocking the event loop.
+
+        Concurrent requests for the same condition share a single read.
+
+        Parameters
+        ----------
+        condition_index : int
+            The index of the condition.
+        reader : AsyncDataReader, optional
+            The reader that runs the reads. Defaults to a shared reader from `ndx_binned_spikes.aio`.
+        """
+        from .aio import get_default_reader
+
+        reader = reader or get_default_reader()
+        return await reader.read_condition(self, condition_index)
+
+    @instrumented
+    def get_event_timestamps_for_condition(self, condition_index):
+
+        if not self.has_multiple_conditions:
+            return self.event_timestamps
+
+        mask = self.condition_indices == condition_index
+        event_timestamps = self.event_timestamps[mask]
+
+        return event_timestamps
+
+    @instrumented
+    def select_units(
+        self,
+        ids: Optional[Sequence[int]] = None,
+        where: Optional[Union[Callable, Mapping]] = None,
+    ) -> np.ndarray:
+        """
+        Read the data of a subset of the units referenced by `units_region`.
+
+        Only the selected rows of `data` are read. Adjacent rows are read together in a single selection.
+
+        Parameters
+        ----------
+        ids : sequence of int, optional
+            The ids of the units in the Units table. The output follows the order of `ids`.
+        where : callable or mapping, optional
+            A filter on the columns of the Units table, e.g. `{"quality": "good"}`. See
+            `ndx_binned_spikes.utils.get_units_selection` for the accepted forms.
+
+        Returns
+        -------
+        np.ndarray
+            The data of the selected units.
+        """
+        return read_units_selection(self, ids=ids, where=where)
+
+    def iter_conditions(self, prefetch: int = 1) -> Iterator[Tuple[int, np.ndarray]]:
+        """
+        Iterate over the data of each condition, reading the next conditions on a background thread.
+
+        Reading overlaps with the processing done by the caller, which hides the read latency of disk-backed or
+        remote data. The conditions are yielded in increasing order of condition index.
+
+        Parameters
+        ----------
+        prefetch : int, default: 1
+            The number of conditions read ahead. At most `prefetch + 2` conditions are in memory at a time. With 0
+            the data is read in the calling thread.
+
+        Yields
+        ------
+        condition_index : int
+            The index of the condition.
+        data : np.ndarray
+            The data of the condition, with shape (number_of_units, number_of_events_in_condition, number_of_bins),
+            masked when there is a `validity_mask`.
+        """
+        from .prefetch import iter_prefetched
+
+        conditions, _ = get_condition_codes(self)
+
+        def make_read(condition_index):
+            # asanyarray keeps the mask of the data of a container with a `validity_mask`
+            return lambda: (condition_index, np.asanyarray(self.get_data_for_condition(condition_index)[:]))
+
+        return iter_prefetched((make_read(int(condition)) for condition in conditions), prefetch=prefetch)
+
+    def iter_event_blocks(
+        self,
+        block_size: Optional[int] = None,
+        prefetch: int = 1,
+    ) -> Iterator[Tuple[slice, np.ndarray]]:
+        """
+        Iterate over consecutive blocks of events, reading the next blocks on a background thread.
+
+        Parameters
+        ----------
+        block_size : int, optional
+            The number of events in each block. By default it is chosen to keep the blocks around 64 MiB.
+        prefetch : int, default: 1
+            The number of blocks read ahead. At most `prefetch + 2` blocks are in memory at a time. With 0 the
+            data is read in the calling thread.
+
+        Yields
+        ------
+        event_slice : slice
+            The events of the block.
+        data : np.ndarray
+            The data of the block, with shape (number_of_units, block_size, number_of_bins), masked when there is a
+            `validity_mask`.
+        """
+        from .prefetch import iter_prefetched
+
+        block_size = block_size or get_chunk_length(self.data, axis=1)
+
+        def read(event_slice):
+            selection = (slice(None), event_slice, slice(None))
+            block = read_block(self._readable_data, selection)
+            return event_slice, mask_block(block, self.validity_mask, self.data.shape, selection)
+
+        def make_read(event_slice):
+            return lambda: read(event_slice)
+
+        event_slices = iter_slices(self.number_of_events, block_size)
+        return iter_prefetched((make_read(event_slice) for event_slice in event_slices), prefetch=prefetch)
+
+    def _derive(
+        self,
+        data,
+        bin_width_in_ms: float,
+        event_to_bin_offset_in_ms: float,
+        name: Optional[str] = None,
+        validity_mask: Optional[ValidityMask] = None,
+    ):
+        """A new BinnedAlignedSpikes with the same events, conditions and units but different bins."""
+        condition_indices = None if self.condition_indices is None else np.asarray(self.condition_indices[:])
+        condition_labels = None if self.condition_labels is None else np.asarray(self.condition_labels[:])
+
+        return BinnedAlignedSpikes(
+            name=name or self.name,
+            description=self.description,
+            bin_width_in_ms=float(bin_width_in_ms),
+            event_to_bin_offset_in_ms=float(event_to_bin_offset_in_ms),
+            data=data,
+            event_timestamps=np.asarray(self.event_timestamps[:]),
+            condition_indices=condition_indices,
+            condition_labels=condition_labels,
+            units_region=copy_units_region(self.units_region),
+            validity_mask=validity_mask,
+        )
+
+    @instrumented
+    def rebin(
+        self,
+        factor: int,
+        name: Optional[str] = None,
+        events_per_chunk: Optional[int] = None,
+    ) -> "BinnedAlignedSpikes":
+        """
+        Merge every `factor` consecutive bins into a single bin of width `factor * bin_width_in_ms`.
+
+        Trailing bins that do not fill a complete new bin are dropped. The data is read in chunks of events so
+        disk-backed data is never loaded at once. A new bin is valid if all the merged bins are valid.
+
+        Parameters
+        ----------
+        factor : int
+            The number of bins to merge.
+        name : str, optional
+            The name of the new container. Defaults to the name of this container.
+        events_per_chunk : int, optional
+            The number of events read at a time. By default it is chosen to keep the chunks around 64 MiB.
+
+        Returns
+        -------
+        BinnedAlignedSpikes
+            A new container with the summed counts.
+        """
+        if factor < 1:
+            raise ValueError(f"The rebinning factor should be a positive integer, got {factor}.")
+
+        number_of_bins = self.number_of_bins // factor
+        if number_of_bins == 0:
+            raise ValueError(f"The rebinning factor {factor} is larger than the number of bins {self.number_of_bins}.")
+
+        data_type = np.zeros(0, dtype=self.data.dtype).sum().dtype
+        rebinned_data = np.empty((self.number_of_units, self.number_of_events, number_of_bins), dtype=data_type)
+
+        events_per_chunk = events_per_chunk or get_chunk_length(self.data, axis=1)
+        for event_slice in iter_slices(self.number_of_events, events_per_chunk):
+            chunk = read_block(self._readable_data, (slice(None), event_slice, slice(0, number_of_bins * factor)))
+            chunk_shape = (chunk.shape[0], chunk.shape[1], number_of_bins, factor)
+            rebinned_data[:, event_slice, :] = chunk.reshape(chunk_shape).sum(axis=-1)
+
+        return self._derive(
+            data=rebinned_data,
+            bin_width_in_ms=self.bin_width_in_ms * factor,
+            event_to_bin_offset_in_ms=self.event_to_bin_offset_in_ms,
+            name=name,
+            validity_mask=None if self.validity_mask is None else self.validity_mask.reduce_bins(factor),
+        )
+
+    @instrumented
+    def crop(
+        self,
+        start_ms: float,
+        stop_ms: float,
+        name: Optional[str] = None,
+        events_per_chunk: Optional[int] = None,
+    ) -> "BinnedAlignedSpikes":
+        """
+        Keep only the bins that lie within a window relative to the events.
+
+        Parameters
+        ----------
+        start_ms : float
+            The start of the window in milliseconds relative to the event, in the same reference as
+            `event_to_bin_offset_in_ms`.
+        stop_ms : float
+            The end of the window in milliseconds relative to the event.
+        name : str, optional
+            The name of the new container. Defaults to the name of this container.
+        events_per_chunk : int, optional
+            The number of events read at a time. By default it is chosen to keep the chunks around 64 MiB.
+
+        Returns
+        -------
+        BinnedAlignedSpikes
+            A new container with the bins that fully fit within `[start_ms, stop_ms]` and the corresponding
+            `event_to_bin_offset_in_ms`.
+        """
+        # A small tolerance so that window edges that fall on bin edges are not lost to rounding
+        tolerance = 1e-9
+        bin_width_in_ms = self.bin_width_in_ms
+        first_bin = max(0, int(np.ceil((start_ms - self.event_to_bin_offset_in_ms) / bin_width_in_ms - tolerance)))
+        stop_bin = int(np.floor((stop_ms - self.event_to_bin_offset_in_ms) / bin_width_in_ms + tolerance))
+        stop_bin = min(self.number_of_bins, stop_bin)
+
+        if stop_bin <= first_bin:
+            raise ValueError(f"No complete bin falls within the window [{start_ms}, {stop_ms}] ms.")
+
+        cropped_data = np.empty(
+            (self.number_of_units, self.number_of_events, stop_bin - first_bin), dtype=self.data.dtype
+        )
+        events_per_chunk = events_per_chunk or get_chunk_length(self.data, axis=1)
+        for event_slice in iter_slices(self.number_of_events, events_per_chunk):
+            selection = (slice(None), event_slice, slice(first_bin, stop_bin))
+            cropped_data[:, event_slice, :] = read_block(self._readable_data, selection)
+
+        validity_mask = self.validity_mask
+        if validity_mask is not None:
+            validity_mask = validity_mask.select(axis=2, index=slice(first_bin, stop_bin))
+
+        return self._derive(
+            data=cropped_data,
+            bin_width_in_ms=bin_width_in_ms,
+            event_to_bin_offset_in_ms=self.event_to_bin_offset_in_ms + first_bin * bin_width_in_ms,
+            name=name,
+            validity_mask=validity_mask,
+        )
+
+    @instrumented
+    def to_firing_rate(
+        self,
+        kernel: str = "gaussian",
+        sigma_ms: float = 20.0,
+        as_container: bool = False,
+        name: Optional[str] = None,
+        dtype: str = "float64",
+        out=None,
+        events_per_chunk: Optional[int] = None,
+    ):
+        """
+        Estimate firing rates in Hz by smoothing the counts of each event window with a kernel.
+
+        The kernel is applied along the bins of each event independently; bins outside of the window are treated
+        as having no spikes. The data is processed in chunks of events so disk-backed data is never loaded at once.
+        With a `validity_mask` the invalid bins are left out: each rate is the kernel-weighted mean of the valid bins
+        around it, the rates of the invalid bins are NaN and the new container keeps the mask.
+
+        Parameters
+        ----------
+        kernel : str, default: "gaussian"
+            One of "gaussian", "boxcar" or "exponential" (causal).
+        sigma_ms : float, default: 20.0
+            The scale of the kernel in milliseconds: the standard deviation of the gaussian kernel, the full width
+            of the boxcar kernel or the time constant of the exponential kernel.
+        as_container : bool, default: False
+            If True, return the rates as a new BinnedAlignedSpikes instead of an array.
+        name : str, optional
+            The name of the new container when `as_container` is True. Defaults to the name of this container.
+        dtype : str, default: "float64"
+            The data type of the rates. Ignored when `out` is given.
+        out : array-like, optional
+            Where to write the rates, e.g. a `np.memmap` or an h5py dataset, to keep rates larger than memory out of
+            core. It must have the shape of `data`. Defaults to a new in-memory array.
+        events_per_chunk : int, optional
+            The number of events processed at a time. By default it is chosen to keep the chunks around 64 MiB.
+
+        Returns
+        -------
+        np.ndarray or BinnedAlignedSpikes
+            The firing rates with the same shape as `data`, in `out` when given.
+        """
+        from .smoothing import convolve_same, make_kernel
+
+        weights, origin = make_kernel(kernel=kernel, sigma_ms=sigma_ms, bin_width_in_ms=self.bin_width_in_ms)
+        bin_width_in_seconds = self.bin_width_in_ms / 1000.0
+
+        if out is None:
+            rates = np.empty(self.data.shape, dtype=dtype)
+        elif tuple(out.shape) != tuple(self.data.shape):
+            raise ValueError(f"`out` should have shape {tuple(self.data.shape)}, got {tuple(out.shape)}.")
+        else:
+            rates = out
+        events_per_chunk = events_per_chunk or get_chunk_length(self.data, axis=1)
+        for event_slice in iter_slices(self.number_of_events, events_per_chunk):
+            selection = (slice(None), event_slice, slice(None))
+            chunk = read_block(self._readable_data, selection)
+            valid = None if self.validity_mask is None else self.validity_mask.get_valid(self.data.shape, selection)
+            chunk_rates = convolve_same(chunk, weights, origin, valid=valid) / bin_width_in_seconds
+            rates[:, event_slice, :] = chunk_rates if valid is None else np.where(valid, chunk_rates, np.nan)
+
+        if not as_container:
+            return rates
+
+        return self._derive(
+            data=rates,
+            bin_width_in_ms=self.bin_width_in_ms,
+            event_to_bin_offset_in_ms=self.event_to_bin_offset_in_ms,
+            name=name,
+            validity_mask=self.validity_mask,
+        )
+
+    @instrumented
+    def to_population_matrix(
+        self,
+        layout: str = "samples_by_units",
+        average_over_events: bool = True,
+        dtype: str = "float64",
+        out: Optional[np.ndarray] = None,
+        events_per_chunk: Optional[int] = None,
+    ) -> np.ndarray:
+        """
+        Arrange the data as a two dimensional population matrix for dimensionality reduction.
+
+        With `average_over_events` the rows (samples) are the bins of the average response to each condition,
+        ordered by condition index and then by bin. Otherwise the rows are the bins of every event, ordered by
+        event and then by bin, i.e. the events are concatenated in time. With a `validity_mask` the averages only
+        include the valid events of each unit and bin, and are NaN without valid events; the concatenated events
+        have NaNs in place of the invalid counts, so the output should have a float dtype.
+
+        The data is read once, in chunks of events, and written directly into the output so no intermediate
+        copies of the full matrix are made.
+
+        Parameters
+        ----------
+        layout : str, default: "samples_by_units"
+            "samples_by_units" for a (samples, units) matrix as expected by scikit-learn, or "units_by_samples"
+            for its transpose.
+        average_over_events : bool, default: True
+            Whether to average the events of each condition (conditions * bins samples) or to concatenate all the
+            events (events * bins samples).
+        dtype : str, default: "float64"
+            The data type of the output. Ignored when `out` is given.
+        out : np.ndarray, optional
+            A preallocated array to write the matrix to, e.g. a `np.memmap`. It must have the output shape.
+        events_per_chunk : int, optional
+            The number of events read at a time. By default it is chosen to keep the chunks around 64 MiB.
+
+        Returns
+        -------
+        np.ndarray
+            The population matrix.
+        """
+        if layout not in ("samples_by_units", "units_by_samples"):
+            raise ValueError(f"`layout` should be 'samples_by_units' or 'units_by_samples', got '{layout}'.")
+
+        number_of_units, number_of_events, number_of_bins = self.data.shape
+        conditions, codes = get_condition_codes(self)
+        number_of_row_blocks = conditions.size if average_over_events else number_of_events
+        number_of_samples = number_of_row_blocks * number_of_bins
+
+        shape = (number_of_samples, number_of_units)
+        if layout == "units_by_samples":
+            shape = shape[::-1]
+
+        if out is None:
+            out = np.empty(shape, dtype=dtype)
+        elif out.shape != shape:
+            raise ValueError(f"`out` should have shape {shape}, got {out.shape}.")
+        elif not out.flags.c_contiguous:
+            raise ValueError("`out` should be a C-contiguous array.")
+        if self.validity_mask is not None and not np.issubdtype(out.dtype, np.floating):
+            raise ValueError("With a `validity_mask` the population matrix has NaNs, it should have a float dtype.")
+
+        # Views of the output with separate axes for the row blocks, the bins and the units
+        if layout == "samples_by_units":
+            out_view = out.reshape(number_of_row_blocks, number_of_bins, number_of_units)
+            data_to_output_axes = (1, 2, 0)
+        else:
+            out_view = out.reshape(number_of_units, number_of_row_blocks, number_of_bins)
+            data_to_output_axes = (0, 1, 2)
+
+        if average_over_events:
+            if self.validity_mask is None:
+                sums, events_per_condition = accumulate_condition_sums(
+                    self._readable_data, codes, conditions.size, events_per_chunk=events_per_chunk
+                )
+                counts = events_per_condition[:, np.newaxis, np.newaxis]
+            else:
+                sums, counts = accumulate_masked_condition_sums(
+                    self._readable_data, self.validity_mask, codes, conditions.size, events_per_chunk=events_per_chunk
+                )
+            # Without a mask every condition has events; with one, the entries without valid events are NaN
+            means = np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+            # Conditions take the place of the events in the (units, events, bins) axes of the data
+            out_view[...] = means.transpose(1, 0, 2).transpose(data_to_output_axes)
+            return out
+
+        events_per_chunk = events_per_chunk or get_chunk_length(self.data, axis=1)
+        for event_slice in iter_slices(number_of_events, events_per_chunk):
+            selection = (slice(None), event_slice, slice(None))
+            chunk = read_block(self._readable_data, selection)
+            if self.validity_mask is not None:
+                chunk = np.where(self.validity_mask.get_valid(self.data.shape, selection), chunk, np.nan)
+            if layout == "samples_by_units":
+                out_view[event_slice] = chunk.transpose(data_to_output_axes)
+            else:
+                out_view[:, event_slice] = chunk
+
+        return out
+
+    @instrumented
+    def compute_noise_correlations(
+        self,
+        bin_slice: slice = slice(None),
+        per_condition: bool = True,
+        return_covariance: bool = False,
+        dtype: str = "float64",
+        unit_block_size: Optional[int] = None,
+        events_per_chunk: Optional[int] = None,
+    ) -> np.ndarray:
+        """
+        Compute the noise correlations of the spike counts of all the pairs of units.
+
+        See `ndx_binned_spikes.correlations.compute_noise_correlations` for the description of the parameters.
+        """
+        from .correlations import compute_noise_correlations
+
+        return compute_noise_correlations(
+            self,
+            bin_slice=bin_slice,
+            per_condition=per_condition,
+            return_covariance=return_covariance,
+            dtype=dtype,
+            unit_block_size=unit_block_size,
+            events_per_chunk=events_per_chunk,
+        )
+
+    @instrumented
+    def compute_response_onset(
+        self,
+        baseline_bins: Optional[slice] = None,
+        threshold: Optional[float] = None,
+        method: str = "zscore",
+        response_bins: Optional[slice] = None,
+        min_consecutive_bins: int = 1,
+        events_per_chunk: Optional[int] = None,
+    ) -> np.ndarray:
+        """
+        Detect the response onset of every unit in every condition, as a structured array with times in ms.
+
+        See `ndx_binned_spikes.latency.compute_response_onset` for the description of the parameters.
+        """
+        from .latency import compute_response_onset
+
+        return compute_response_onset(
+            self,
+            baseline_bins=baseline_bins,
+            threshold=threshold,
+            method=method,
+            response_bins=response_bins,
+            min_consecutive_bins=min_consecutive_bins,
+            events_per_chunk=events_per_chunk,
+        )
+
+    def iter_folds(
+        self,
+        n_splits: int = 5,
+        stratify_by_condition: bool = True,
+        feature_bins: slice = slice(None),
+        sum_over_bins: bool = False,
+        batch_size: Optional[int] = None,
+        shuffle: bool = True,
+        seed: Optional[int] = None,
+        dtype: str = "float32",
+        cache_path: Optional[str] = None,
+    ) -> Iterator["Fold"]:
+        """
+        Iterate over cross-validation folds of the events for decoding, reading the data only once.
+
+        See `ndx_binned_spikes.decoding.iter_folds` for the description of the parameters.
+        """
+        from .decoding import iter_folds
+
+        return iter_folds(
+            self,
+            n_splits=n_splits,
+            stratify_by_condition=stratify_by_condition,
+            feature_bins=feature_bins,
+            sum_over_bins=sum_over_bins,
+            batch_size=batch_size,
+            shuffle=shuffle,
+            seed=seed,
+            dtype=dtype,
+            cache_path=cache_path,
+        )
+
+    @instrumented
+    def bootstrap_psth(
+        self,
+        n_resamples: int = 1000,
+        statistic: str = "mean",
+        conditions: Optional[Sequence[int]] = None,
+        confidence_level: float = 0.95,
+        seed=None,
+        max_workers: Optional[int] = None,
+    ) -> "BootstrapResult":
+        """
+        Bootstrap the PSTH of each condition by resampling its events with replacement.
+
+        See `ndx_binned_spikes.resampling.bootstrap_psth` for the description of the parameters.
+        """
+        from .resampling import bootstrap_psth
+
+        return bootstrap_psth(
+            self,
+            n_resamples=n_resamples,
+            statistic=statistic,
+            conditions=conditions,
+            confidence_level=confidence_level,
+            seed=seed,
+            max_workers=max_workers,
+        )
+
+    @instrumented
+    def permutation_test(
+        self,
+        condition_a: int,
+        condition_b: int,
+        bin_slice: slice = slice(None),
+        n_resamples: int = 10_000,
+        alternative: str = "two-sided",
+        seed=None,
+        max_workers: Optional[int] = None,
+    ) -> "PermutationResult":
+        """
+        Test, for each unit, whether the mean spike count in `bin_slice` differs between two conditions.
+
+        See `ndx_binned_spikes.resampling.permutation_test` for the description of the parameters.
+        """
+        from .resampling import permutation_test
+
+        return permutation_test(
+            self,
+            condition_a=condition_a,
+            condition_b=condition_b,
+            bin_slice=bin_slice,
+            n_resamples=n_resamples,
+            alternative=alternative,
+            seed=seed,
+            max_workers=max_workers,
+        )
+
+    def to_arrow(self, layout: str = "long", stream: bool = False, units_per_batch: Optional[int] = None):
+        """
+        Export the data to Apache Arrow without copying in-memory data. Requires pyarrow.
+
+        Parameters
+        ----------
+        layout : str, default: "long"
+            "long" for a table with the columns `unit`, `event`, `bin`, `count` and `condition` (if there are
+            conditions), or "tensor" for an Arrow tensor with the shape of `data`.
+        stream : bool, default: False
+            For the long layout, return a `pyarrow.RecordBatchReader` that reads the data one batch of units at a time
+            instead of a `pyarrow.Table`.
+        units_per_batch : int, optional
+            The number of units of each record batch. By default the batches are around 64 MiB of counts.
+
+        Returns
+        -------
+        pyarrow.Table, pyarrow.RecordBatchReader or pyarrow.Tensor
+        """
+        from . import arrow
+
+        return arrow.to_arrow(self, layout=layout, stream=stream, units_per_batch=units_per_batch)
+
+    def __dlpack__(self, **kwargs):
+        """Export `data` through the DLPack protocol, e.g. `torch.from_dlpack`. In-memory data is not copied."""
+        from . import arrow
+
+        return arrow.to_dlpack_array(self).__dlpack__(**kwargs)
+
+    def __dlpack_device__(self):
+        from . import arrow
+
+        return arrow.DLPACK_CPU_DEVICE
+
+    @staticmethod
+    def sort_data_by_event_timestamps(
+        data: np.ndarray,
+        event_timestamps: np.ndarray,
+        condition_indices: Optional[np.ndarray] = None,
+        *extra_arrays: np.ndarray,
+        out=None,
+        events_per_chunk: Optional[int] = None,
+    ) -> Tuple[np.ndarray, ...]:
+        """
+        Sort the events by timestamp, as required by the constructor, with a deterministic order for ties.
+
+        The sort is stable and uses the keys (timestamp, condition index, original position), so events with the
+        same timestamp are ordered by condition and otherwise keep their original order.
+
+        Parameters
+        ----------
+        data : array-like
+            The (units, events, bins) data. Disk-backed data is read sequentially in chunks of events.
+        event_timestamps : np.ndarray
+            The timestamp of each event.
+        condition_indices : np.ndarray, optional
+            The condition of each event.
+        *extra_arrays : np.ndarray
+            Other per-event arrays to sort in the same order.
+        out : array-like, optional
+            Where to write the sorted data, e.g. a `np.memmap` or an h5py dataset, to sort data larger than memory.
+            Defaults to a new in-memory array.
+        events_per_chunk : int, optional
+            The number of events read at a time. By default it is chosen to keep the chunks around 64 MiB.
+
+        Returns
+        -------
+        tuple
+            The sorted data, event timestamps and condition indices (None if not given), followed by the sorted
+            extra arrays.
+        """
+        event_timestamps = np.asarray(event_timestamps)
+        sorted_indices = get_event_order(event_timestamps, condition_indices)
+
+        if isinstance(data, np.ndarray) and out is None:
+            data = data[:, sorted_indices, :]
+        else:
+            data = permute_events(data, sorted_indices, out=out, events_per_chunk=events_per_chunk)
+
+        event_timestamps = event_timestamps[sorted_indices]
+        if condition_indices is not None:
+            condition_indices = np.asarray(condition_indices)[sorted_indices]
+        extra_arrays = tuple(np.asarray(extra_array)[sorted_indices] for extra_array in extra_arrays)
+
+        return (data, event_timestamps, condition_indices) + extra_arrays
+
+    @property
+    def number_of_units(self):
+        return get_data_shape(self.data)[0]
+
+    @property
+    def number_of_events(self):
+        return get_data_shape(self.data)[1]
+
+    @property
+    def number_of_bins(self):
+        return get_data_shape(self.data)[2]
+    
+
+    @property
+    def number_of_conditions(self):
+        if self.has_multiple_conditions:
+            return np.unique(self.condition_indices).size
+        else:
+            return 1
+
+
+@register_map(BinnedAlignedSpikes)
+class BinnedAlignedSpikesMap(NWBContainerMapper):
+    """
+    Stores an `OverlappingWindowsData` in the `window_data` and `window_starts` datasets instead of `data`, and a
+    `ValidityMask` as its packed bits with the unpacked shape as an attribute.
+    """
+
+    @NWBContainerMapper.constructor_arg("validity_mask")
+    def validity_mask_carg(self, builder, manager):
+        validity_mask = builder.get("validity_mask")
+        if validity_mask is None:
+            return None
+        return ValidityMask(validity_mask.data, validity_mask.attributes["mask_shape"])
+
+    @NWBContainerMapper.constructor_arg("data")
+    def data_carg(self, builder, manager):
+        # The spec makes both datasets optional, but exactly one of them stores the data
+        window_data = builder.get("window_data")
+        if (window_data is None) == (builder.get("data") is None):
+            raise ValueError(
+                f"'{builder.name}' should have exactly one of the `data` and `window_data` datasets, got "
+                f"{'neither' if window_data is None else 'both'}."
+            )
+        if window_data is None:
+            return builder["data"].data
+        if builder.get("window_starts") is None:
+            raise ValueError(f"'{builder.name}' has a `window_data` dataset without `window_starts`.")
+
+        return OverlappingWindowsData(
+            window_data=window_data.data,
+            window_starts=builder["window_starts"].data,
+            number_of_bins=int(window_data.attributes["number_of_bins"]),
+        )
+
+    @docval(
+        {"name": "spec", "type": Spec, "doc": "the spec to get the attribute value for"},
+        {"name": "container", "type": BinnedAlignedSpikes, "doc": "the container to get the attribute value from"},
+        {"name": "manager", "type": BuildManager, "doc": "the BuildManager used for managing this build"},
+        returns="the value of the attribute",
+    )
+    def get_attr_value(self, **kwargs):
+        """Get the value of the attribute corresponding to this spec from the given container."""
+        spec, container, manager = getargs("spec", "container", "manager", kwargs)
+        windows = container.data if isinstance(container.data, OverlappingWindowsData) else None
+
+        if spec.name == "data" and spec.parent is self.spec:
+            return None if windows is not None else container.data
+        if spec.name == "window_data" and spec.parent is self.spec:
+            if windows is None:
+                return None
+            return windows.window_data if windows.window_data_io is None else windows.window_data_io
+        if spec.name == "window_starts" and spec.parent is self.spec:
+            return None if windows is None else windows.window_starts.astype("uint64")
+        if spec.name == "number_of_bins" and spec.parent is not None and spec.parent.name == "window_data":
+            return None if windows is None else np.uint64(windows.number_of_bins)
+        validity_mask = container.validity_mask
+        if spec.name == "validity_mask" and spec.parent is self.spec:
+            return None if validity_mask is None else validity_mask.packed
+        if spec.name == "mask_shape" and spec.parent is not None and spec.parent.name == "validity_mask":
+            return None if validity_mask is None else np.asarray(validity_mask.shape, dtype="uint64")
+
+        return super().get_attr_value(spec, container, manager)
@@ -0,0 +1,451 @@
+"""The BinnedSpikes data interface."""
+
+import numpy as np
+from typing import TYPE_CHECKING, Callable, Mapping, Optional, Sequence, Tuple, Union
+from pynwb import register_class, register_map
+from pynwb.core import NWBDataInterface
+from pynwb.io.core import NWBContainerMapper
+from hdmf.build import BuildManager
+from hdmf.spec import Spec
+from hdmf.utils import docval, get_data_shape, getargs
+from hdmf.common import DynamicTableRegion
+
+from ._namespace import load_namespace
+from .instrumentation import instrumented
+from .masking import ValidityMask, as_validity_mask, mask_block
+from .utils import (
+    copy_units_region,
+    get_chunk_length,
+    iter_slices,
+    read_block,
+    read_units_selection,
+)
+
+# The analysis modules are imported by the methods that use them, so importing the classes stays cheap
+if TYPE_CHECKING:
+    from .aio import AsyncDataReader
+    from .cache import ChunkCache
+
+load_namespace()
+
+
+@register_class(neurodata_type="BinnedSpikes", namespace="ndx-binned-spikes")  # noqa
+class BinnedSpikes(NWBDataInterface):
+    __nwbfields__ = (
+        "name",
+        "description",
+        "bin_width_in_ms",
+        "start_time_in_ms",
+        "data",
+        {"name": "units_region", "child": True},
+        "checksum_manifest",
+        "validity_mask",
+    )
+
+    DEFAULT_NAME = "BinnedSpikes"
+    DEFAULT_DESCRIPTION = "Binned spike counts."
+
+    @docval(
+        {
+            "name": "name",
+            "type": str,
+            "doc": "The name of this container",
+            "default": DEFAULT_NAME,
+        },
+        {
+            "name": "description",
+            "type": str,
+            "doc": "A description of what the data represents",
+            "default": DEFAULT_DESCRIPTION,
+        },
+        {
+            "name": "bin_width_in_ms",
+            "type": float,
+            "doc": "The length in milliseconds of the bins",
+        },
+        {
+            "name": "start_time_in_ms",
+            "type": float,
+            "doc": (
+                "The timestamp of the beginning of the first bin in milliseconds. The default "
+                "value is 0, which represents the beginning of the session."
+            ),
+            "default": 0.0,
+        },
+        {
+            "name": "data",
+            "type": "array_data",
+            "shape": [(None, None)],
+            "doc": (
+                "The binned data. It should be an array whose first dimension is the number of units, "
+                "and the second dimension is the number of bins."
+            ),
+        },
+        {
+            "name": "units_region",
+            "type": DynamicTableRegion,
+            "doc": "A reference to the Units table region that contains the units of the data.",
+            "default": None,
+        },
+        {
+            "name": "checksum_manifest",
+            "type": str,
+            "doc": (
+                "A JSON manifest with content hashes of the data, the binning parameters and the source spike times. "
+                "See `ndx_binned_spikes.checksums`."
+            ),
+            "default": None,
+        },
+        {
+            "name": "validity_mask",
+            "type": (ValidityMask, "array_data"),
+            "doc": (
+                "The valid entries of the data, as a `ValidityMask` or a boolean array with the number of dimensions "
+                "of the data whose axes have the length of the data axes or 1 (e.g. a (1, number_of_bins) mask of "
+                "artifact periods). It is stored bit-packed and honoured by the accessors."
+            ),
+            "default": None,
+        },
+    )
+    def __init__(self, **kwargs):
+        name = kwargs.pop("name")
+        super().__init__(name=name)
+
+        kwargs["validity_mask"] = as_validity_mask(kwargs["validity_mask"], get_data_shape(kwargs["data"]))
+
+        for key in kwargs:
+            setattr(self, key, kwargs[key])
+
+    @classmethod
+    def from_spike_arrays(
+        cls,
+        spike_times,
+        spike_clusters,
+        bin_width_in_ms: float,
+        start_time_in_ms: float = 0.0,
+        stop_time_in_ms: Optional[float] = None,
+        unit_ids=None,
+        sampling_frequency: Optional[float] = None,
+        out=None,
+        dtype="uint32",
+        spikes_per_block: Optional[int] = None,
+        bins_per_tile: Optional[int] = None,
+        name: str = DEFAULT_NAME,
+        description: str = DEFAULT_DESCRIPTION,
+        units_region: Optional[DynamicTableRegion] = None,
+    ) -> "BinnedSpikes":
+        """
+        Bin flat spike time and cluster arrays, as written by spike sorters, in a single pass over blocks of spikes.
+
+        The rows of `data` follow `unit_ids`, by default the sorted cluster ids of `spike_clusters`; pass a
+        `units_region` that references the units in the same order. See `ndx_binned_spikes.binning.bin_spike_arrays`
+        for the description of the parameters.
+        """
+        from .binning import bin_spike_arrays
+
+        data, _ = bin_spike_arrays(
+            spike_times,
+            spike_clusters,
+            bin_width_in_ms=bin_width_in_ms,
+            start_time_in_ms=start_time_in_ms,
+            stop_time_in_ms=stop_time_in_ms,
+            unit_ids=unit_ids,
+            sampling_frequency=sampling_frequency,
+            out=out,
+            dtype=dtype,
+            spikes_per_block=spikes_per_block,
+            bins_per_tile=bins_per_tile,
+        )
+        return cls(
+            name=name,
+            description=description,
+            bin_width_in_ms=float(bin_width_in_ms),
+            start_time_in_ms=float(start_time_in_ms),
+            data=data,
+            units_region=units_region,
+        )
+
+    def set_chunk_cache(self, cache: Optional["ChunkCache"], chunk_shape: Optional[Tuple[int, ...]] = None):
+        """
+        Serve the reads of `data` made by the methods of this container from an in-memory chunk cache.
+
+        The cache can be shared by many containers; containers that read the same dataset of the same file share
+        its chunks. Indexing `data` directly bypasses the cache.
+
+        Parameters
+        ----------
+        cache : ChunkCache or None
+            The cache to use, or None to read `data` directly again.
+        chunk_shape : tuple of int, optional
+            The shape of the cached blocks. Defaults to the storage chunks of `data`.
+        """
+        from .cache import CachedDataset
+
+        self._cached_data = None if cache is None else CachedDataset(self.data, cache, chunk_shape=chunk_shape)
+
+    @property
+    def _readable_data(self):
+        cached_data = getattr(self, "_cached_data", None)
+        return self.data if cached_data is None else cached_data
+
+    @property
+    def number_of_units(self):
+        return get_data_shape(self.data)[0]
+
+    @property
+    def number_of_bins(self):
+        return get_data_shape(self.data)[1]
+
+    @instrumented
+    def select_units(
+        self,
+        ids: Optional[Sequence[int]] = None,
+        where: Optional[Union[Callable, Mapping]] = None,
+    ) -> np.ndarray:
+        """
+        Read the data of a subset of the units referenced by `units_region`.
+
+        Only the selected rows of `data` are read. Adjacent rows are read together in a single selection.
+
+        Parameters
+        ----------
+        ids : sequence of int, optional
+            The ids of the units in the Units table. The output follows the order of `ids`.
+        where : callable or mapping, optional
+            A filter on the columns of the Units table, e.g. `{"quality": "good"}`. See
+            `ndx_binned_spikes.utils.get_units_selection` for the accepted forms.
+
+        Returns
+        -------
+        np.ndarray
+            The data of the selected units.
+        """
+        return read_units_selection(self, ids=ids, where=where)
+
+    @instrumented
+    def get_masked_data(self, selection=Ellipsis) -> np.ndarray:
+        """
+        Read `data[selection]` as a masked array with the dtype of the data, where the invalid entries are masked.
+
+        Without a `validity_mask` nothing is masked.
+        """
+        block = read_block(self._readable_data, selection)
+        if self.validity_mask is None:
+            return np.ma.MaskedArray(block)
+        return mask_block(block, self.validity_mask, self.data.shape, selection)
+
+    def get_bin_slice_for_time_range(self, start_ms: float, stop_ms: float) -> slice:
+        """
+        The bins whose start time lies within `[start_ms, stop_ms)`, clipped to the bins of the data.
+
+        Parameters
+        ----------
+        start_ms : float
+            The start of the time range in milliseconds, in the same reference as `start_time_in_ms`.
+        stop_ms : float
+            The end of the time range in milliseconds.
+
+        Returns
+        -------
+        slice
+            The range of bins, possibly empty.
+        """
+        # A small tolerance so that range edges that fall on bin edges are not lost to rounding
+        tolerance = 1e-9
+        first_bin = int(np.ceil((start_ms - self.start_time_in_ms) / self.bin_width_in_ms - tolerance))
+        stop_bin = int(np.ceil((stop_ms - self.start_time_in_ms) / self.bin_width_in_ms - tolerance))
+        first_bin = min(max(first_bin, 0), self.number_of_bins)
+        stop_bin = min(max(stop_bin, first_bin), self.number_of_bins)
+
+        return slice(first_bin, stop_bin)
+
+    @instrumented
+    def get_data_in_time_range(self, start_ms: float, stop_ms: float) -> np.ndarray:
+        """
+        Read the bins whose start time lies within `[start_ms, stop_ms)`.
+
+        Returns
+        -------
+        np.ndarray
+            Array of shape (number_of_units, number_of_bins_in_range), masked when there is a `validity_mask`.
+        """
+        selection = (slice(None), self.get_bin_slice_for_time_range(start_ms, stop_ms))
+        return mask_block(read_block(self._readable_data, selection), self.validity_mask, self.data.shape, selection)
+
+    async def aget_data_in_time_range(
+        self,
+        start_ms: float,
+        stop_ms: float,
+        reader: Optional["AsyncDataReader"] = None,
+    ) -> np.ndarray:
+        """
+        Async version of `get_data_in_time_range` that reads in a thread pool without blocking the event loop.
+
+        Concurrent requests for ranges contained in a range that is already being read share that read.
+
+        Parameters
+        ----------
+        start_ms : float
+            The start of the time range in milliseconds.
+        stop_ms : float
+            The end of the time range in milliseconds.
+        reader : AsyncDataReader, optional
+            The reader that runs the reads. Defaults to a shared reader from `ndx_binned_spikes.aio`.
+        """
+        from .aio import get_default_reader
+
+        bin_slice = self.get_bin_slice_for_time_range(start_ms, stop_ms)
+        reader = reader or get_default_reader()
+        return await reader.read_bins(self, bin_slice.start, bin_slice.stop)
+
+    @instrumented
+    def to_firing_rate(
+        self,
+        kernel: str = "gaussian",
+        sigma_ms: float = 20.0,
+        as_container: bool = False,
+        name: Optional[str] = None,
+        dtype: str = "float64",
+        out=None,
+        bins_per_chunk: Optional[int] = None,
+    ):
+        """
+        Estimate firing rates in Hz by smoothing the counts of each unit with a kernel.
+
+        The data is processed in chunks of bins with overlap-save: each chunk is read together with the
+        neighbouring bins the kernel needs, so the result is the same as smoothing the whole session at once while
+        disk-backed data is never loaded at once. Bins before the first and after the last bin are treated as
+        having no spikes. With a `validity_mask` the invalid bins are left out: each rate is the kernel-weighted mean
+        of the valid bins around it, the rates of the invalid bins are NaN and the new container keeps the mask.
+
+        Parameters
+        ----------
+        kernel : str, default: "gaussian"
+            One of "gaussian", "boxcar" or "exponential" (causal).
+        sigma_ms : float, default: 20.0
+            The scale of the kernel in milliseconds: the standard deviation of the gaussian kernel, the full width
+            of the boxcar kernel or the time constant of the exponential kernel.
+        as_container : bool, default: False
+            If True, return the rates as a new BinnedSpikes instead of an array.
+        name : str, optional
+            The name of the new container when `as_container` is True. Defaults to the name of this container.
+        dtype : str, default: "float64"
+            The data type of the rates. Ignored when `out` is given.
+        out : array-like, optional
+            Where to write the rates, e.g. a `np.memmap` or an h5py dataset, to keep rates larger than memory out of
+            core. It must have the shape of `data`. Defaults to a new in-memory array.
+        bins_per_chunk : int, optional
+            The number of bins processed at a time. By default it is chosen to keep the chunks around 64 MiB.
+
+        Returns
+        -------
+        np.ndarray or BinnedSpikes
+            The firing rates with the same shape as `data`, in `out` when given.
+        """
+        from .smoothing import convolve_valid, convolve_valid_normalized, make_kernel
+
+        weights, origin = make_kernel(kernel=kernel, sigma_ms=sigma_ms, bin_width_in_ms=self.bin_width_in_ms)
+        bin_width_in_seconds = self.bin_width_in_ms / 1000.0
+        context_before = weights.size - 1 - origin
+        context_after = origin
+        number_of_bins = self.number_of_bins
+
+        if out is None:
+            rates = np.empty(self.data.shape, dtype=dtype)
+        elif tuple(out.shape) != tuple(self.data.shape):
+            raise ValueError(f"`out` should have shape {tuple(self.data.shape)}, got {tuple(out.shape)}.")
+        else:
+            rates = out
+        bins_per_chunk = bins_per_chunk or get_chunk_length(self.data, axis=1)
+        for bin_slice in iter_slices(number_of_bins, bins_per_chunk):
+            start = bin_slice.start - context_before
+            stop = bin_slice.stop + context_after
+            selection = (slice(None), slice(max(start, 0), min(stop, number_of_bins)))
+            chunk = read_block(self._readable_data, selection).astype("float64", copy=False)
+            pad_width = [(0, 0), (max(0, -start), max(0, stop - number_of_bins))]
+            padded = np.pad(chunk, pad_width)
+            if self.validity_mask is None:
+                rates[:, bin_slice] = convolve_valid(padded, weights) / bin_width_in_seconds
+            else:
+                valid = self.validity_mask.get_valid(self.data.shape, selection)
+                padded_valid = np.pad(valid, pad_width, constant_values=True)
+                chunk_rates = convolve_valid_normalized(padded, padded_valid, weights) / bin_width_in_seconds
+                core_valid = self.validity_mask.get_valid(self.data.shape, (slice(None), bin_slice))
+                rates[:, bin_slice] = np.where(core_valid, chunk_rates, np.nan)
+
+        if not as_container:
+            return rates
+
+        return BinnedSpikes(
+            name=name or self.name,
+            description=self.description,
+            bin_width_in_ms=self.bin_width_in_ms,
+            start_time_in_ms=self.start_time_in_ms,
+            data=rates,
+            units_region=copy_units_region(self.units_region),
+            validity_mask=self.validity_mask,
+        )
+
+    def to_arrow(self, layout: str = "long", stream: bool = False, units_per_batch: Optional[int] = None):
+        """
+        Export the data to Apache Arrow without copying in-memory data. Requires pyarrow.
+
+        Parameters
+        ----------
+        layout : str, default: "long"
+            "long" for a table with the columns `unit`, `bin` and `count`,
+            or "tensor" for an Arrow tensor with the shape of `data`.
+        stream : bool, default: False
+            For the long layout, return a `pyarrow.RecordBatchReader` that reads the data one batch of units at a time
+            instead of a `pyarrow.Table`.
+        units_per_batch : int, optional
+            The number of units of each record batch. By default the batches are around 64 MiB of counts.
+
+        Returns
+        -------
+        pyarrow.Table, pyarrow.RecordBatchReader or pyarrow.Tensor
+        """
+        from . import arrow
+
+        return arrow.to_arrow(self, layout=layout, stream=stream, units_per_batch=units_per_batch)
+
+    def __dlpack__(self, **kwargs):
+        """Export `data` through the DLPack protocol, e.g. `torch.from_dlpack`. In-memory data is not copied."""
+        from . import arrow
+
+        return arrow.to_dlpack_array(self).__dlpack__(**kwargs)
+
+    def __dlpack_device__(self):
+        from . import arrow
+
+        return arrow.DLPACK_CPU_DEVICE
+
+
+@register_map(BinnedSpikes)
+class BinnedSpikesMap(NWBContainerMapper):
+    """Stores a `ValidityMask` as its packed bits with the unpacked shape as an attribute."""
+
+    @NWBContainerMapper.constructor_arg("validity_mask")
+    def validity_mask_carg(self, builder, manager):
+        validity_mask = builder.get("validity_mask")
+        if validity_mask is None:
+            return None
+        return ValidityMask(validity_mask.data, validity_mask.attributes["mask_shape"])
+
+    @docval(
+        {"name": "spec", "type": Spec, "doc": "the spec to get the attribute value for"},
+        {"name": "container", "type": BinnedSpikes, "doc": "the container to get the attribute value from"},
+        {"name": "manager", "type": BuildManager, "doc": "the BuildManager used for managing this build"},
+        returns="the value of the attribute",
+    )
+    def get_attr_value(self, **kwargs):
+        """Get the value of the attribute corresponding to this spec from the given container."""
+        spec, container, manager = getargs("spec", "container", "manager", kwargs)
+        validity_mask = container.validity_mask
+
+        if spec.name == "validity_mask" and spec.parent is self.spec:
+            return None if validity_mask is None else validity_mask.packed
+        if spec.name == "mask_shape" and spec.parent is not None and spec.parent.name == "validity_mask":
+            return None if validity_mask is None else np.asarray(validity_mask.shape, dtype="uint64")
+
+        return super().get_attr_value(spec, container, manager)
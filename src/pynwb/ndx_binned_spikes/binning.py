@@ -0,0 +1,218 @@
+"""
+Binning of flat spike arrays, as written by spike sorters, into a (units, bins) count matrix.
+
+Sorters like Kilosort or tools like Phy write all the spikes of a session as two flat arrays, the time of each spike
+and the cluster it was assigned to. `bin_spike_arrays` bins them in a single pass over blocks of spikes, so the
+arrays can be memory-mapped and are never loaded at once, and no per-unit list of spike times is built:
+
+    spike_times = np.load("spike_times.npy", mmap_mode="r")
+    spike_clusters = np.load("spike_clusters.npy", mmap_mode="r")
+    data, unit_ids = bin_spike_arrays(spike_times, spike_clusters, bin_width_in_ms=10.0, sampling_frequency=30000.0)
+
+The counts of each block are computed with a single `np.bincount` over the combined (row, bin) index of its spikes.
+The output is accumulated in tiles of bins; when the spikes are sorted by time, as sorters write them, each tile is
+written to the output once the spikes have moved past it, so an on-disk output (a `np.memmap` or an h5py dataset)
+is written progressively, tile by tile. Unsorted spikes are supported too, with the tiles added to the output.
+"""
+
+from typing import Optional, Tuple
+
+import numpy as np
+
+from .utils import DEFAULT_CHUNK_SIZE_IN_BYTES, iter_slices, read_block
+
+DEFAULT_SPIKES_PER_BLOCK = 4_000_000
+
+# Tolerance when converting spike times to bins, so spikes that fall on bin edges are not lost to rounding
+_BIN_EDGE_TOLERANCE = 1e-9
+
+
+def _to_bins(times, bin_width_in_ms: float, start_time_in_ms: float, sampling_frequency: Optional[float]):
+    """The bin of each spike, before clipping to the bins of the output."""
+    times = np.asarray(times, dtype="float64")
+    times_in_ms = times * (1000.0 if sampling_frequency is None else 1000.0 / sampling_frequency)
+    return np.floor((times_in_ms - start_time_in_ms) / bin_width_in_ms + _BIN_EDGE_TOLERANCE).astype("int64")
+
+
+def _scan_spike_arrays(spike_times, spike_clusters, spikes_per_block: int, find_unit_ids: bool, find_last: bool):
+    """The sorted cluster ids and the last spike time, read in blocks."""
+    unit_ids = np.empty(0, dtype=np.asarray(spike_clusters[:0]).dtype)
+    last_time = None
+    for block_slice in iter_slices(len(spike_times), spikes_per_block):
+        if find_unit_ids:
+            unit_ids = np.union1d(unit_ids, np.asarray(spike_clusters[block_slice]))
+        if find_last:
+            block_last_time = np.max(np.asarray(spike_times[block_slice]))
+            last_time = block_last_time if last_time is None else max(last_time, block_last_time)
+    return unit_ids, last_time
+
+
+def _get_unit_rows(unit_ids: np.ndarray):
+    """A function that maps cluster ids to their row in `unit_ids`, or -1 for clusters that are not included."""
+    sorter = np.argsort(unit_ids, kind="stable")
+    sorted_ids = unit_ids[sorter]
+    if np.any(sorted_ids[1:] == sorted_ids[:-1]):
+        raise ValueError("`unit_ids` should not contain duplicates.")
+
+    def get_rows(clusters):
+        if sorted_ids.size == 0:
+            return np.full(clusters.shape, -1, dtype="int64")
+        positions = np.minimum(np.searchsorted(sorted_ids, clusters), sorted_ids.size - 1)
+        return np.where(sorted_ids[positions] == clusters, sorter[positions], -1)
+
+    return get_rows
+
+
+def bin_spike_arrays(
+    spike_times,
+    spike_clusters,
+    bin_width_in_ms: float,
+    start_time_in_ms: float = 0.0,
+    stop_time_in_ms: Optional[float] = None,
+    unit_ids=None,
+    sampling_frequency: Optional[float] = None,
+    out=None,
+    dtype="uint32",
+    spikes_per_block: Optional[int] = None,
+    bins_per_tile: Optional[int] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Count the spikes of each cluster in consecutive bins from flat spike time and cluster arrays.
+
+    Bin `b` covers `[start_time_in_ms + b * bin_width_in_ms, start_time_in_ms + (b + 1) * bin_width_in_ms)`.
+    Spikes outside the bins and spikes of clusters not in `unit_ids` are ignored.
+
+    Parameters
+    ----------
+    spike_times : array-like
+        The time of each spike, in seconds, or in samples when `sampling_frequency` is given. It can be
+        memory-mapped or disk-backed; it is read in blocks of `spikes_per_block` spikes.
+    spike_clusters : array-like
+        The cluster (unit) id of each spike, with the length of `spike_times`.
+    bin_width_in_ms : float
+        The width of the bins in milliseconds.
+    start_time_in_ms : float, default: 0.0
+        The start of the first bin in milliseconds, in the reference of the spike times.
+    stop_time_in_ms : float, optional
+        The end of the binned period; the last bin is the one that contains it, excluded if it falls on its start.
+        Defaults to the bin of the last spike.
+    unit_ids : array-like, optional
+        The cluster id of each row of the output. Defaults to the sorted ids found in `spike_clusters`.
+    sampling_frequency : float, optional
+        The sampling frequency in Hz of spike times given as sample indices, as written by Kilosort.
+    out : array-like, optional
+        Where to write the counts, with shape (number_of_units, number_of_bins), e.g. a `np.memmap` or an h5py
+        dataset. Every entry is written. Defaults to a new in-memory array.
+    dtype : data-type, default: "uint32"
+        The dtype of the new output array. A ValueError is raised if a count does not fit in the dtype of the output.
+    spikes_per_block : int, optional
+        The number of spikes read at a time. Defaults to `DEFAULT_SPIKES_PER_BLOCK`.
+    bins_per_tile : int, optional
+        The number of bins of the tiles written to the output. Defaults to the chunks of an h5py `out` along the
+        bins, or to tiles of around 64 MiB of counts.
+
+    Returns
+    -------
+    out : array-like
+        The counts, with shape (number_of_units, number_of_bins).
+    unit_ids : np.ndarray
+        The cluster id of each row of `out`.
+    """
+    if len(spike_times) != len(spike_clusters):
+        raise ValueError(
+            f"`spike_times` and `spike_clusters` should have the same length, got {len(spike_times)} and "
+            f"{len(spike_clusters)}."
+        )
+    if bin_width_in_ms <= 0:
+        raise ValueError(f"`bin_width_in_ms` should be positive, got {bin_width_in_ms}.")
+    spikes_per_block = spikes_per_block or DEFAULT_SPIKES_PER_BLOCK
+
+    # A first pass over the spikes is only needed for the parameters that are not given
+    find_unit_ids, find_last = unit_ids is None, stop_time_in_ms is None and len(spike_times) > 0
+    if find_unit_ids or find_last:
+        found_unit_ids, last_time = _scan_spike_arrays(
+            spike_times, spike_clusters, spikes_per_block, find_unit_ids, find_last
+        )
+    unit_ids = found_unit_ids if find_unit_ids else np.asarray(unit_ids)
+    get_rows = _get_unit_rows(unit_ids)
+
+    if stop_time_in_ms is not None:
+        duration_in_bins = (stop_time_in_ms - start_time_in_ms) / bin_width_in_ms
+        number_of_bins = max(int(np.ceil(duration_in_bins - _BIN_EDGE_TOLERANCE)), 0)
+    elif find_last:
+        last_bin = int(_to_bins([last_time], bin_width_in_ms, start_time_in_ms, sampling_frequency)[0])
+        number_of_bins = max(last_bin + 1, 0)
+    else:
+        number_of_bins = 0
+
+    number_of_units = unit_ids.size
+    shape = (number_of_units, number_of_bins)
+    zero_filled = out is None
+    if out is None:
+        out = np.zeros(shape, dtype=dtype)
+    elif tuple(out.shape) != shape:
+        raise ValueError(f"`out` should have shape {shape}, got {tuple(out.shape)}.")
+    max_count = np.iinfo(out.dtype).max if np.issubdtype(out.dtype, np.integer) else None
+
+    if bins_per_tile is None:
+        chunks = getattr(out, "chunks", None)
+        if chunks:
+            bins_per_tile = chunks[1]
+        else:
+            bins_per_tile = max(1, DEFAULT_CHUNK_SIZE_IN_BYTES // (8 * max(number_of_units, 1)))
+    bins_per_tile = min(bins_per_tile, max(number_of_bins, 1))
+
+    pending = {}
+    written = set()
+
+    def flush(tile):
+        tile_slice = slice(tile * bins_per_tile, min((tile + 1) * bins_per_tile, number_of_bins))
+        counts = pending.pop(tile)[:, : tile_slice.stop - tile_slice.start]
+        if tile in written:
+            counts = counts + read_block(out, (slice(None), tile_slice))
+        if max_count is not None and counts.size and counts.max() > max_count:
+            raise ValueError(f"The spike counts of some bins do not fit in the dtype of the output, {out.dtype}.")
+        out[:, tile_slice] = counts
+        written.add(tile)
+
+    sorted_by_time = True
+    last_bin = 0
+    for block_slice in iter_slices(len(spike_times), spikes_per_block):
+        bins = _to_bins(spike_times[block_slice], bin_width_in_ms, start_time_in_ms, sampling_frequency)
+        rows = get_rows(np.asarray(spike_clusters[block_slice]))
+        kept = (rows >= 0) & (bins >= 0) & (bins < number_of_bins)
+        bins, rows = bins[kept], rows[kept]
+        if bins.size == 0:
+            continue
+
+        sorted_by_time = sorted_by_time and bins[0] >= last_bin and bool(np.all(bins[1:] >= bins[:-1]))
+        tiles = bins // bins_per_tile
+        if not sorted_by_time:
+            order = np.argsort(tiles, kind="stable")
+            bins, rows, tiles = bins[order], rows[order], tiles[order]
+        last_bin = bins[-1]
+
+        # The spikes of each tile are counted with one bincount over their combined (row, bin in tile) index
+        boundaries = np.concatenate(([0], np.flatnonzero(np.diff(tiles)) + 1, [tiles.size]))
+        for first, stop in zip(boundaries[:-1], boundaries[1:]):
+            tile = int(tiles[first])
+            linear_index = rows[first:stop] * bins_per_tile + (bins[first:stop] - tile * bins_per_tile)
+            counts = np.bincount(linear_index, minlength=number_of_units * bins_per_tile)
+            counts = counts.reshape(number_of_units, bins_per_tile)
+            pending[tile] = counts if tile not in pending else pending[tile] + counts
+
+        # With sorted spikes, the tiles before the last one are complete
+        for tile in sorted(pending):
+            if not sorted_by_time or tile < tiles[-1]:
+                flush(tile)
+
+    for tile in sorted(pending):
+        flush(tile)
+    if not zero_filled:
+        number_of_tiles = -(-number_of_bins // bins_per_tile)
+        for tile in range(number_of_tiles):
+            if tile not in written:
+                tile_slice = slice(tile * bins_per_tile, min((tile + 1) * bins_per_tile, number_of_bins))
+                out[:, tile_slice] = 0
+
+    return out, unit_ids
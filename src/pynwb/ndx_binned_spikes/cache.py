@@ -0,0 +1,273 @@
+"""
+An in-memory cache of the chunks of binned datasets, shared by all the containers that use it.
+
+The cache stores decoded blocks aligned to the storage chunks of the dataset (or to a regular grid for contiguous
+datasets), so overlapping requests reuse the blocks they have in common. It is bounded by a byte budget with least
+recently used eviction:
+
+    cache = ChunkCache(max_bytes=512 * 1024**2)
+    binned_aligned_spikes.set_chunk_cache(cache)
+    binned_aligned_spikes.get_data_for_condition(0)  # reads the chunks
+    binned_aligned_spikes.get_data_for_condition(0)  # served from memory
+    cache.stats
+"""
+
+import itertools
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import numpy as np
+
+from .instrumentation import record_cache_access
+from .utils import expand_selection, normalize_axis_index, read_block
+
+DEFAULT_CACHE_SIZE_IN_BYTES = 256 * 1024**2
+
+# Target size of the blocks used for datasets without storage chunks
+DEFAULT_BLOCK_SIZE_IN_BYTES = 1024**2
+
+
+def guess_block_shape(shape: Tuple[int, ...], itemsize: int, block_size_in_bytes: int = DEFAULT_BLOCK_SIZE_IN_BYTES):
+    """A block shape for datasets without storage chunks: the largest axis is halved until the block fits."""
+    block_shape = [max(1, length) for length in shape]
+    while int(np.prod(block_shape)) * itemsize > block_size_in_bytes and max(block_shape) > 1:
+        largest_axis = int(np.argmax(block_shape))
+        block_shape[largest_axis] = (block_shape[largest_axis] + 1) // 2
+
+    return tuple(block_shape)
+
+
+class ChunkCache:
+    """
+    Thread-safe LRU cache of dataset chunks with a byte budget.
+
+    Parameters
+    ----------
+    max_bytes : int, default: 256 MiB
+        The maximum total size of the cached chunks. Chunks larger than the budget are not cached.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_SIZE_IN_BYTES):
+        self.max_bytes = max_bytes
+        self._chunks = OrderedDict()
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._chunks)
+
+    def get(self, key) -> Optional[np.ndarray]:
+        """The cached chunk for `key`, or None."""
+        with self._lock:
+            chunk = self._chunks.get(key)
+            if chunk is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._chunks.move_to_end(key)
+
+        record_cache_access("chunk_cache", hit=chunk is not None)
+        return chunk
+
+    def put(self, key, chunk: np.ndarray):
+        """Store `chunk`, evicting the least recently used chunks to stay within the budget."""
+        if chunk.nbytes > self.max_bytes:
+            return
+
+        chunk.flags.writeable = False
+        with self._lock:
+            previous = self._chunks.pop(key, None)
+            if previous is not None:
+                self.nbytes -= previous.nbytes
+            self._chunks[key] = chunk
+            self.nbytes += chunk.nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._chunks.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+                self.evictions += 1
+
+    def clear(self):
+        """Remove all the chunks. The statistics are kept."""
+        with self._lock:
+            self._chunks.clear()
+            self.nbytes = 0
+
+    @property
+    def stats(self) -> dict:
+        """The hits, misses, evictions and the current size of the cache."""
+        with self._lock:
+            return dict(
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                number_of_chunks=len(self._chunks),
+                nbytes=self.nbytes,
+                max_bytes=self.max_bytes,
+            )
+
+
+class _DatasetIdentity:
+    """A key for in-memory data, equal only to the same object, which it keeps alive so its id is not reused."""
+
+    __slots__ = ("data",)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __hash__(self) -> int:
+        return id(self.data)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, _DatasetIdentity) and other.data is self.data
+
+
+def _get_dataset_key(data):
+    """
+    Identify the dataset so that containers reading the same dataset of the same file share its chunks.
+
+    Files are identified by their path together with their inode, size and modification time, so the chunks of a
+    file that was rewritten since are not served. Datasets of files open for writing are not shared.
+    """
+    file = getattr(data, "file", None)
+    filename = getattr(file, "filename", None)
+    if filename is None or getattr(data, "name", None) is None or getattr(file, "mode", "r") != "r":
+        return _DatasetIdentity(data)
+    try:
+        file_stat = os.stat(filename)
+    except OSError:
+        # e.g. in-memory files
+        return _DatasetIdentity(data)
+    file_identity = (file_stat.st_dev, file_stat.st_ino, file_stat.st_size, file_stat.st_mtime_ns)
+    return (filename, file_identity, data.name)
+
+
+def _normalize_index(index, length: int):
+    """
+    Turn an index of one axis into the part of the axis to read and the index relative to it.
+
+    The part to read is a (start, stop) range for integers and slices, and the sorted unique positions for arrays,
+    so scattered positions only read the chunks that contain them.
+    """
+    if isinstance(index, slice):
+        start, stop, step = index.indices(length)
+        if step < 0:
+            # Read the forward range and index it in reverse
+            indices = np.arange(start, stop, step)
+            if indices.size == 0:
+                return (0, 0), slice(0, 0)
+            return (int(indices.min()), int(indices.max()) + 1), indices - indices.min()
+        if stop <= start:
+            return (start, start), slice(0, 0)
+        return (start, stop), slice(0, stop - start, step)
+
+    indices = normalize_axis_index(index, length)
+    if isinstance(indices, int):
+        return (indices, indices + 1), 0
+    positions, relative = np.unique(indices, return_inverse=True)
+    return positions, relative
+
+
+class CachedDataset:
+    """
+    Read-only array-like view of a dataset whose reads go through a `ChunkCache`.
+
+    Supports integers, slices, one boolean or integer array per selection and Ellipsis, like h5py datasets. The
+    selection is assembled from the cached chunks that contain it and the missing chunks are read and cached.
+
+    Parameters
+    ----------
+    data : array-like
+        The dataset, usually an h5py.Dataset.
+    cache : ChunkCache
+        The cache to store the chunks in. It can be shared by many datasets.
+    chunk_shape : tuple of int, optional
+        The shape of the cached blocks. Defaults to the storage chunks of `data`, or to blocks of about 1 MiB.
+    """
+
+    # Reads of the underlying data are counted by `read_block` when the chunks are loaded
+    counts_own_reads = True
+
+    def __init__(self, data, cache: ChunkCache, chunk_shape: Optional[Tuple[int, ...]] = None):
+        self.data = data
+        self.cache = cache
+        self.shape = tuple(data.shape)
+        self.dtype = np.dtype(data.dtype)
+        self.ndim = len(self.shape)
+        if chunk_shape is None:
+            chunk_shape = getattr(data, "chunks", None) or guess_block_shape(self.shape, self.dtype.itemsize)
+        self.chunk_shape = tuple(int(length) for length in chunk_shape)
+        self._key = (_get_dataset_key(data), self.chunk_shape)
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None):
+        array = self[...]
+        return array if dtype is None else array.astype(dtype)
+
+    def _get_chunk(self, chunk_index: Tuple[int, ...]) -> np.ndarray:
+        key = (self._key, chunk_index)
+        chunk = self.cache.get(key)
+        if chunk is None:
+            selection = tuple(
+                slice(index * length, min((index + 1) * length, extent))
+                for index, length, extent in zip(chunk_index, self.chunk_shape, self.shape)
+            )
+            chunk = read_block(self.data, selection)
+            self.cache.put(key, chunk)
+
+        return chunk
+
+    def read_box(self, box) -> np.ndarray:
+        """
+        Assemble the part of each axis in `box` from the cached chunks.
+
+        Each axis is a (start, stop) range or a sorted array of unique positions, of which only the chunks that
+        contain a position are read.
+        """
+        output = np.empty(
+            tuple(part.size if isinstance(part, np.ndarray) else part[1] - part[0] for part in box), dtype=self.dtype
+        )
+        if output.size == 0:
+            return output
+
+        chunk_ranges = [
+            np.unique(part // length)
+            if isinstance(part, np.ndarray)
+            else range(part[0] // length, (part[1] - 1) // length + 1)
+            for part, length in zip(box, self.chunk_shape)
+        ]
+        for chunk_index in itertools.product(*chunk_ranges):
+            chunk_index = tuple(int(index) for index in chunk_index)
+            chunk = self._get_chunk(chunk_index)
+            chunk_selection, output_selection = [], []
+            for index, length, part in zip(chunk_index, self.chunk_shape, box):
+                chunk_start = index * length
+                if isinstance(part, np.ndarray):
+                    first, stop = np.searchsorted(part, [chunk_start, chunk_start + length])
+                    chunk_selection.append(part[first:stop] - chunk_start)
+                    output_selection.append(slice(first, stop))
+                    continue
+                start, stop = part
+                overlap_start, overlap_stop = max(start, chunk_start), min(stop, chunk_start + length)
+                chunk_selection.append(slice(overlap_start - chunk_start, overlap_stop - chunk_start))
+                output_selection.append(slice(overlap_start - start, overlap_stop - start))
+            output[tuple(output_selection)] = chunk[tuple(chunk_selection)]
+
+        return output
+
+    def __getitem__(self, selection) -> np.ndarray:
+        selection = expand_selection(selection, self.ndim)
+        normalized = [_normalize_index(index, length) for index, length in zip(selection, self.shape)]
+
+        number_of_array_indices = sum(isinstance(relative, np.ndarray) for _, relative in normalized)
+        if number_of_array_indices > 1:
+            raise TypeError("Only one boolean or integer array index is supported per selection.")
+
+        box = [part for part, _ in normalized]
+        return self.read_box(box)[tuple(relative for _, relative in normalized)]
@@ -0,0 +1,311 @@
+"""
+Content checksums of BinnedSpikes and BinnedAlignedSpikes for change detection.
+
+A checksum manifest records, in the `checksum_manifest` attribute of the container:
+
+- the binning parameters,
+- a hash of the data of each unit and of each block of events (or bins for BinnedSpikes),
+- a hash of the source spike times of each unit and, for BinnedAlignedSpikes, of the event timestamps and
+  condition indices of each block of events.
+
+Before rebinning, `find_changes` compares the manifest with the current inputs and returns the units and the
+blocks that have to be recomputed; when nothing changed the rebuild can be skipped. `verify_checksums` checks that
+the stored data still matches its hashes.
+
+    add_checksum_manifest(binned_aligned_spikes, spike_times=spike_times)  # before writing
+    ...
+    changes = find_changes(read_binned_aligned_spikes, spike_times=new_spike_times, event_timestamps=new_timestamps)
+    if not changes.any:
+        ...  # up to date
+"""
+
+import hashlib
+import json
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from .utils import get_chunk_length, iter_slices, read_block
+
+CHECKSUM_MANIFEST_VERSION = 1
+
+# 64 bit hashes keep the manifest small enough for an HDF5 attribute with thousands of units
+_DIGEST_SIZE = 8
+
+
+def _new_hash():
+    return hashlib.blake2b(digest_size=_DIGEST_SIZE)
+
+
+def hash_array(array) -> str:
+    """A hash of the dtype, shape and contents of an array."""
+    array = np.ascontiguousarray(array)
+    array_hash = _new_hash()
+    array_hash.update(f"{array.dtype.str}{array.shape}".encode())
+    array_hash.update(array.tobytes())
+    return array_hash.hexdigest()
+
+
+def _hash_spike_times(spike_times) -> str:
+    return hash_array(np.asarray(spike_times, dtype="float64"))
+
+
+def _is_aligned(container) -> bool:
+    return hasattr(container, "event_timestamps")
+
+
+def _get_parameters(container) -> dict:
+    if _is_aligned(container):
+        return dict(
+            neurodata_type="BinnedAlignedSpikes",
+            bin_width_in_ms=float(container.bin_width_in_ms),
+            event_to_bin_offset_in_ms=float(container.event_to_bin_offset_in_ms),
+            number_of_bins=int(container.number_of_bins),
+        )
+
+    return dict(
+        neurodata_type="BinnedSpikes",
+        bin_width_in_ms=float(container.bin_width_in_ms),
+        start_time_in_ms=float(container.start_time_in_ms),
+    )
+
+
+def get_source_spike_times(container) -> Optional[List[np.ndarray]]:
+    """The spike times of the units referenced by `units_region`, or None if they are not available."""
+    units_region = container.units_region
+    if units_region is None or "spike_times" not in units_region.table.colnames:
+        return None
+
+    spike_times = units_region.table["spike_times"]
+    return [np.asarray(spike_times[int(row)], dtype="float64") for row in np.asarray(units_region.data[:])]
+
+
+def _hash_event_blocks(event_timestamps, condition_indices, block_size: int) -> List[str]:
+    event_timestamps = np.asarray(event_timestamps[:], dtype="float64")
+    condition_indices = None if condition_indices is None else np.asarray(condition_indices[:], dtype="int64")
+
+    hashes = []
+    for block_slice in iter_slices(event_timestamps.size, block_size):
+        block_hash = _new_hash()
+        block_hash.update(event_timestamps[block_slice].tobytes())
+        if condition_indices is not None:
+            block_hash.update(condition_indices[block_slice].tobytes())
+        hashes.append(block_hash.hexdigest())
+
+    return hashes
+
+
+def compute_checksum_manifest(
+    container,
+    spike_times: Optional[Sequence[np.ndarray]] = None,
+    block_size: Optional[int] = None,
+) -> dict:
+    """
+    Compute the checksum manifest of a BinnedSpikes or BinnedAlignedSpikes.
+
+    The data is read once, in blocks along the event (or bin) axis.
+
+    Parameters
+    ----------
+    container : BinnedSpikes or BinnedAlignedSpikes
+        The container.
+    spike_times : sequence of np.ndarray, optional
+        The spike times each row of `data` was computed from. Defaults to the `spike_times` of the units referenced by
+        `units_region`, if any.
+    block_size : int, optional
+        The number of events (or bins) of each hashed block. By default the blocks are around 64 MiB.
+
+    Returns
+    -------
+    dict
+        The manifest.
+    """
+    data = container._readable_data
+    axis_length = data.shape[1]
+    block_size = block_size or get_chunk_length(data, axis=1)
+
+    number_of_units = data.shape[0]
+    unit_hashes = [_new_hash() for _ in range(number_of_units)]
+    block_hashes = []
+    for block_slice in iter_slices(axis_length, block_size):
+        selection = (slice(None), block_slice) + (slice(None),) * (len(data.shape) - 2)
+        block = np.ascontiguousarray(read_block(data, selection))
+        block_hashes.append(hash_array(block))
+        for unit_hash, unit_block in zip(unit_hashes, block):
+            unit_hash.update(unit_block.tobytes())
+
+    if spike_times is None:
+        spike_times = get_source_spike_times(container)
+
+    manifest = dict(
+        version=CHECKSUM_MANIFEST_VERSION,
+        parameters=_get_parameters(container),
+        dtype=np.dtype(data.dtype).str,
+        shape=[int(length) for length in data.shape],
+        block_size=int(block_size),
+        unit_hashes=[unit_hash.hexdigest() for unit_hash in unit_hashes],
+        block_hashes=block_hashes,
+        source_unit_hashes=None if spike_times is None else [_hash_spike_times(times) for times in spike_times],
+    )
+    if _is_aligned(container):
+        condition_indices = container.condition_indices if container.has_multiple_conditions else None
+        manifest["event_block_hashes"] = _hash_event_blocks(container.event_timestamps, condition_indices, block_size)
+
+    return manifest
+
+
+def add_checksum_manifest(
+    container,
+    spike_times: Optional[Sequence[np.ndarray]] = None,
+    block_size: Optional[int] = None,
+) -> dict:
+    """
+    Compute the checksum manifest and store it in the `checksum_manifest` attribute, to be written with the file.
+
+    The attribute can only be set once, so this should be called on a new container before writing it.
+    """
+    manifest = compute_checksum_manifest(container, spike_times=spike_times, block_size=block_size)
+    container.checksum_manifest = json.dumps(manifest, separators=(",", ":"))
+    return manifest
+
+
+def read_checksum_manifest(container) -> dict:
+    """The stored manifest of `container`. Raises a ValueError if it has none."""
+    if container.checksum_manifest is None:
+        raise ValueError(f"'{container.name}' has no checksum manifest, see `add_checksum_manifest`.")
+
+    manifest = json.loads(container.checksum_manifest)
+    if manifest.get("version") != CHECKSUM_MANIFEST_VERSION:
+        raise ValueError(f"Unsupported checksum manifest version {manifest.get('version')}.")
+
+    return manifest
+
+
+@dataclass
+class Changes:
+    """The parts of a binned container whose inputs changed."""
+
+    #: True if the binning parameters or the number of units or events changed, so everything must be recomputed
+    everything: bool = False
+    #: The rows of `data` whose source spike times changed
+    units: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype="int64"))
+    #: The blocks that changed, as slices of the event axis (of the bin axis for BinnedSpikes)
+    blocks: List[slice] = field(default_factory=list)
+
+    @property
+    def any(self) -> bool:
+        """Whether anything has to be recomputed."""
+        return self.everything or self.units.size > 0 or len(self.blocks) > 0
+
+
+def _hash_parameter(value) -> str:
+    """A hash of a binning parameter, equal for numbers of equal value whatever their type."""
+    array = np.asarray(value) if isinstance(value, (bool, int, float, np.generic, np.ndarray)) else None
+    if array is not None and array.dtype.kind in "biuf":
+        return hash_array(array.astype("float64"))
+
+    parameter_hash = _new_hash()
+    parameter_hash.update(value.encode() if isinstance(value, str) else repr(value).encode())
+    return parameter_hash.hexdigest()
+
+
+def _find_differences(stored_hashes: Sequence[str], current_hashes: Sequence[str]) -> np.ndarray:
+    differences = [
+        position for position, (stored, current) in enumerate(zip(stored_hashes, current_hashes)) if stored != current
+    ]
+    return np.array(differences, dtype="int64")
+
+
+def find_changes(
+    container,
+    spike_times: Optional[Sequence[np.ndarray]] = None,
+    event_timestamps: Optional[np.ndarray] = None,
+    condition_indices: Optional[np.ndarray] = None,
+    **parameters,
+) -> Changes:
+    """
+    Compare the stored checksum manifest with the current inputs of the binning.
+
+    Parameters
+    ----------
+    container : BinnedSpikes or BinnedAlignedSpikes
+        A container with a checksum manifest.
+    spike_times : sequence of np.ndarray, optional
+        The current spike times of each row of `data`. If None, the units are not compared.
+    event_timestamps : np.ndarray, optional
+        The current event timestamps (BinnedAlignedSpikes only). Defaults to those of the container when only
+        `condition_indices` is given. If both are None, the events are not compared.
+    condition_indices : np.ndarray, optional
+        The current condition indices, compared together with `event_timestamps`. Defaults to those of the
+        container.
+    **parameters
+        The current binning parameters, e.g. `bin_width_in_ms=10.0`. Parameters not given are not compared, and
+        parameters of another type than the stored ones, e.g. a string for a number, are changed.
+
+    Returns
+    -------
+    Changes
+        The units and blocks of events to recompute, or `everything=True`.
+    """
+    manifest = read_checksum_manifest(container)
+    stored_parameters = manifest["parameters"]
+
+    unknown_parameters = set(parameters) - set(stored_parameters)
+    if unknown_parameters:
+        raise ValueError(f"Unknown binning parameters {sorted(unknown_parameters)}.")
+    if any(_hash_parameter(value) != _hash_parameter(stored_parameters[name]) for name, value in parameters.items()):
+        return Changes(everything=True)
+
+    changes = Changes()
+    if spike_times is not None:
+        stored_hashes = manifest["source_unit_hashes"]
+        if stored_hashes is None or len(stored_hashes) != len(spike_times):
+            return Changes(everything=True)
+        current_hashes = [_hash_spike_times(times) for times in spike_times]
+        changes.units = _find_differences(stored_hashes, current_hashes)
+
+    if event_timestamps is not None or condition_indices is not None:
+        if "event_block_hashes" not in manifest:
+            raise ValueError("Event timestamps and condition indices can only be compared for a BinnedAlignedSpikes.")
+        # The argument that is not given is the one of the container, so only the other one is compared
+        if event_timestamps is None:
+            event_timestamps = container.event_timestamps
+        if condition_indices is None and container.has_multiple_conditions:
+            condition_indices = container.condition_indices
+        if len(event_timestamps) != manifest["shape"][1]:
+            return Changes(everything=True)
+        block_size = manifest["block_size"]
+        current_hashes = _hash_event_blocks(np.asarray(event_timestamps), condition_indices, block_size)
+        block_slices = list(iter_slices(len(event_timestamps), block_size))
+        changed_blocks = _find_differences(manifest["event_block_hashes"], current_hashes)
+        changes.blocks = [block_slices[block] for block in changed_blocks]
+
+    return changes
+
+
+def verify_checksums(container) -> Changes:
+    """
+    Check that the data still matches the hashes of the stored manifest.
+
+    Returns
+    -------
+    Changes
+        The units and blocks (slices of the event or bin axis) whose data does not match; `everything` if the shape,
+        data type or parameters differ.
+    """
+    manifest = read_checksum_manifest(container)
+    data = container._readable_data
+    if [int(length) for length in data.shape] != manifest["shape"] or np.dtype(data.dtype).str != manifest["dtype"]:
+        return Changes(everything=True)
+
+    current = compute_checksum_manifest(container, spike_times=[], block_size=manifest["block_size"])
+    if current["parameters"] != manifest["parameters"]:
+        return Changes(everything=True)
+
+    block_slices = list(iter_slices(data.shape[1], manifest["block_size"]))
+    changed_blocks = _find_differences(manifest["block_hashes"], current["block_hashes"])
+    return Changes(
+        units=_find_differences(manifest["unit_hashes"], current["unit_hashes"]),
+        blocks=[block_slices[block] for block in changed_blocks],
+    )
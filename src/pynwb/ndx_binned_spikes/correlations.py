@@ -0,0 +1,289 @@
+"""Spike count (noise) covariance and correlation of the units of a BinnedAlignedSpikes."""
+
+from typing import Optional
+
+import numpy as np
+
+from .utils import get_chunk_length, get_condition_codes, iter_slices, read_block
+
+
+def _accumulate_gram(gram: np.ndarray, counts: np.ndarray, unit_block_size: Optional[int], right=None):
+    """
+    Add `counts @ counts.T` to `gram`, optionally one tile of units at a time (upper triangle only).
+
+    With `right`, add the non-symmetric `counts @ right.T` instead, computing all the tiles.
+    """
+    symmetric = right is None
+    right = counts if symmetric else right
+    if unit_block_size is None:
+        gram += counts @ right.T
+        return
+
+    number_of_units = counts.shape[0]
+    for row_slice in iter_slices(number_of_units, unit_block_size):
+        for column_slice in iter_slices(number_of_units, unit_block_size):
+            if symmetric and column_slice.start < row_slice.start:
+                continue
+            gram[row_slice, column_slice] += counts[row_slice] @ right[column_slice].T
+
+
+def _symmetrize_from_upper(matrix: np.ndarray):
+    lower = np.tril_indices(matrix.shape[0], k=-1)
+    matrix[lower] = matrix.T[lower]
+
+
+def _covariance_to_correlation(covariance: np.ndarray):
+    standard_deviations = np.sqrt(np.diagonal(covariance).copy())
+    with np.errstate(divide="ignore", invalid="ignore"):
+        covariance /= standard_deviations[:, np.newaxis]
+        covariance /= standard_deviations[np.newaxis, :]
+
+
+def _read_counts(data, validity_mask, event_slice, bin_slice):
+    """The float64 (units, events) spike counts of a chunk, zeroed where invalid, and their validity or None."""
+    selection = (slice(None), event_slice, bin_slice)
+    counts = read_block(data, selection).sum(axis=2, dtype="float64")
+    if validity_mask is None:
+        return counts, None
+    valid = validity_mask.get_valid(data.shape, selection).all(axis=2)
+    # The invalid counts are zeroed so they do not contribute to the sums and products
+    return np.where(valid, counts, 0.0), valid
+
+
+def _compute_masked_covariances(
+    data, validity_mask, codes, number_of_conditions, bin_slice, unit_block_size, events_per_chunk
+):
+    """The pairwise-complete noise covariances of each condition, see `compute_noise_correlations`."""
+    number_of_units, number_of_events, _ = data.shape
+    shape = (number_of_conditions, number_of_units, number_of_units)
+    # For each condition and pair (i, j) of units, over the events where both counts are valid: the sum of the
+    # counts of i (`unit_sums[c, i, j]`) and the number of events (`pair_counts[c, i, j]`)
+    unit_sums = np.zeros(shape, dtype="float64")
+    pair_counts = np.zeros(shape, dtype="float64")
+    grams = np.zeros(shape, dtype="float64")
+
+    events_per_chunk = events_per_chunk or get_chunk_length(data, axis=1)
+    for event_slice in iter_slices(number_of_events, events_per_chunk):
+        counts, valid = _read_counts(data, validity_mask, event_slice, bin_slice)
+        valid = valid.astype("float64")
+        chunk_codes = codes[event_slice]
+
+        for condition_position in np.unique(chunk_codes):
+            in_condition = chunk_codes == condition_position
+            condition_counts, condition_valid = counts[:, in_condition], valid[:, in_condition]
+            _accumulate_gram(unit_sums[condition_position], condition_counts, unit_block_size, right=condition_valid)
+            _accumulate_gram(pair_counts[condition_position], condition_valid, unit_block_size)
+            _accumulate_gram(grams[condition_position], condition_counts, unit_block_size)
+
+    if unit_block_size is not None:
+        for matrix in list(pair_counts) + list(grams):
+            _symmetrize_from_upper(matrix)
+
+    # The sum over the events valid for both units of the product of their deviations from the condition means
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_products = np.where(pair_counts > 0, unit_sums * unit_sums.transpose(0, 2, 1) / pair_counts, 0.0)
+        return np.where(pair_counts > 1, (grams - mean_products) / (pair_counts - 1), np.nan)
+
+
+def _compute_centered_covariances(
+    data, validity_mask, codes, number_of_conditions, bin_slice, per_condition, dtype, unit_block_size, events_per_chunk
+):
+    """
+    The noise covariances from the products of the deviations from the condition means, see
+    `compute_noise_correlations`.
+
+    The condition means are computed in a first pass over the data, so the products of the deviations, which do not
+    lose precision to cancellation, are accumulated in `dtype` in the second pass.
+    """
+    number_of_units, number_of_events, _ = data.shape
+    events_per_chunk = events_per_chunk or get_chunk_length(data, axis=1)
+
+    # The sum and the number of the valid counts of each unit in each condition
+    sums = np.zeros((number_of_conditions, number_of_units), dtype="float64")
+    numbers = np.zeros((number_of_conditions, number_of_units), dtype="float64")
+    for event_slice in iter_slices(number_of_events, events_per_chunk):
+        counts, valid = _read_counts(data, validity_mask, event_slice, bin_slice)
+        chunk_codes = codes[event_slice]
+        for condition_position in np.unique(chunk_codes):
+            in_condition = chunk_codes == condition_position
+            sums[condition_position] += counts[:, in_condition].sum(axis=1)
+            numbers[condition_position] += in_condition.sum() if valid is None else valid[:, in_condition].sum(axis=1)
+    means = sums / np.maximum(numbers, 1)
+
+    number_of_grams = number_of_conditions if per_condition else 1
+    grams = np.zeros((number_of_grams, number_of_units, number_of_units), dtype=dtype)
+    pair_counts = None if validity_mask is None else np.zeros(grams.shape, dtype="float64")
+    for event_slice in iter_slices(number_of_events, events_per_chunk):
+        counts, valid = _read_counts(data, validity_mask, event_slice, bin_slice)
+        chunk_codes = codes[event_slice]
+        deviations = counts - means[chunk_codes].T
+        if valid is not None:
+            deviations[~valid] = 0.0
+            valid = valid.astype("float64")
+        deviations = deviations.astype(dtype, copy=False)
+
+        if not per_condition:
+            _accumulate_gram(grams[0], deviations, unit_block_size)
+            if valid is not None:
+                _accumulate_gram(pair_counts[0], valid, unit_block_size)
+            continue
+        for condition_position in np.unique(chunk_codes):
+            in_condition = chunk_codes == condition_position
+            _accumulate_gram(grams[condition_position], deviations[:, in_condition], unit_block_size)
+            if valid is not None:
+                _accumulate_gram(pair_counts[condition_position], valid[:, in_condition], unit_block_size)
+
+    if unit_block_size is not None:
+        for matrix in list(grams) + ([] if pair_counts is None else list(pair_counts)):
+            _symmetrize_from_upper(matrix)
+
+    # One degree of freedom is used by the mean of each condition
+    if validity_mask is None:
+        degrees_of_freedom = numbers[:, :1, np.newaxis] - 1
+        if not per_condition:
+            degrees_of_freedom = np.array(number_of_events - np.count_nonzero(numbers[:, 0]))
+    elif per_condition:
+        degrees_of_freedom = pair_counts - 1
+    else:
+        # The number of conditions where both units have valid counts
+        has_counts = (numbers > 0).astype("float64")
+        degrees_of_freedom = pair_counts[0] - has_counts.T @ has_counts
+
+    covariances = grams if per_condition else grams[0]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(degrees_of_freedom > 0, covariances / degrees_of_freedom.astype(dtype), np.nan).astype(dtype)
+
+
+def compute_noise_correlations(
+    binned_aligned_spikes,
+    bin_slice: slice = slice(None),
+    per_condition: bool = True,
+    return_covariance: bool = False,
+    dtype: str = "float64",
+    unit_block_size: Optional[int] = None,
+    events_per_chunk: Optional[int] = None,
+) -> np.ndarray:
+    """
+    Compute the noise correlations (or covariances) of the spike counts of all the pairs of units.
+
+    The spike count of each unit in each event is the sum of the bins in `bin_slice`. The noise covariance is the
+    covariance of these counts after subtracting the mean count of the event's condition. The data is read once,
+    in chunks of events, and the sums and cross products of the counts of each condition are accumulated with
+    matrix products, so only the unit x unit outputs and one chunk of events are kept in memory.
+
+    With a `validity_mask`, the count of a unit in an event is valid if all its bins in `bin_slice` are, and the
+    covariance of each pair of units uses the events where both counts are valid. Per condition, the covariances are
+    pairwise-complete, with the condition means of the events valid for each pair, which keeps two more
+    (number_of_conditions, number_of_units, number_of_units) accumulators. Pooled, the counts are centered on the
+    condition mean of the valid counts of each unit, computed in a first pass, so no accumulator has a condition
+    axis.
+
+    Parameters
+    ----------
+    binned_aligned_spikes : BinnedAlignedSpikes
+        The data.
+    bin_slice : slice, default: slice(None)
+        The bins that are summed to obtain the spike count of each event.
+    per_condition : bool, default: True
+        If True, return one matrix per condition. Otherwise return a single matrix pooling the residuals of all
+        the conditions.
+    return_covariance : bool, default: False
+        Return covariances instead of correlations.
+    dtype : str, default: "float64"
+        The data type of the outputs. With float64 the data is read once and the sums and cross products of the
+        counts are accumulated. With another dtype, e.g. float32 to halve the memory of the unit x unit
+        accumulators, the condition means are computed in a first pass and the products of the deviations from
+        them are accumulated in `dtype` in a second pass, as the difference between the cross products and the
+        product of the means would lose most of the precision of float32. The per-condition pairwise-complete
+        covariances of masked data are accumulated in float64 and cast to `dtype`.
+    unit_block_size : int, optional
+        If given, the unit x unit products are computed one tile of `unit_block_size` units at a time, which
+        bounds the size of the temporaries for very large numbers of units.
+    events_per_chunk : int, optional
+        The number of events read at a time. By default it is chosen to keep the chunks around 64 MiB.
+
+    Returns
+    -------
+    np.ndarray
+        An array of shape (number_of_conditions, number_of_units, number_of_units), with the conditions sorted by
+        condition index, if `per_condition`; otherwise an array of shape (number_of_units, number_of_units).
+        Entries for units without variance (or conditions with fewer than two events) are NaN.
+    """
+    data = binned_aligned_spikes._readable_data
+    number_of_units, number_of_events, _ = data.shape
+    conditions, codes = get_condition_codes(binned_aligned_spikes)
+    number_of_conditions = conditions.size
+
+    validity_mask = getattr(binned_aligned_spikes, "validity_mask", None)
+    covariances = None
+    if validity_mask is not None and per_condition:
+        covariances = _compute_masked_covariances(
+            data,
+            validity_mask,
+            codes,
+            number_of_conditions,
+            bin_slice=bin_slice,
+            unit_block_size=unit_block_size,
+            events_per_chunk=events_per_chunk,
+        )
+    elif validity_mask is not None or np.dtype(dtype) != np.float64:
+        covariances = _compute_centered_covariances(
+            data,
+            validity_mask,
+            codes,
+            number_of_conditions,
+            bin_slice=bin_slice,
+            per_condition=per_condition,
+            dtype=dtype,
+            unit_block_size=unit_block_size,
+            events_per_chunk=events_per_chunk,
+        )
+    if covariances is not None:
+        if not return_covariance:
+            for covariance in covariances if per_condition else [covariances]:
+                _covariance_to_correlation(covariance)
+        return covariances.astype(dtype, copy=False)
+
+    sums = np.zeros((number_of_conditions, number_of_units), dtype="float64")
+    number_of_grams = number_of_conditions if per_condition else 1
+    grams = np.zeros((number_of_grams, number_of_units, number_of_units), dtype="float64")
+
+    events_per_chunk = events_per_chunk or get_chunk_length(data, axis=1)
+    for event_slice in iter_slices(number_of_events, events_per_chunk):
+        counts = read_block(data, (slice(None), event_slice, bin_slice)).sum(axis=2, dtype="float64")
+        chunk_codes = codes[event_slice]
+
+        for condition_position in np.unique(chunk_codes):
+            condition_counts = counts[:, chunk_codes == condition_position]
+            sums[condition_position] += condition_counts.sum(axis=1)
+            if per_condition:
+                _accumulate_gram(grams[condition_position], condition_counts, unit_block_size)
+
+        if not per_condition:
+            _accumulate_gram(grams[0], counts, unit_block_size)
+
+    if unit_block_size is not None:
+        for gram in grams:
+            _symmetrize_from_upper(gram)
+
+    events_per_condition = np.bincount(codes, minlength=number_of_conditions).astype("float64")
+
+    if per_condition:
+        covariances = grams
+        for condition_position, covariance in enumerate(covariances):
+            condition_sums = sums[condition_position]
+            number_of_condition_events = events_per_condition[condition_position]
+            covariance -= np.outer(condition_sums, condition_sums) / max(number_of_condition_events, 1)
+            covariance /= number_of_condition_events - 1 if number_of_condition_events > 1 else np.nan
+    else:
+        covariances = grams[0]
+        # Sum over conditions of the outer product of the condition sums divided by the condition events
+        covariances -= sums.T @ (sums / np.maximum(events_per_condition, 1)[:, np.newaxis])
+        degrees_of_freedom = number_of_events - number_of_conditions
+        covariances /= degrees_of_freedom if degrees_of_freedom > 0 else np.nan
+
+    if not return_covariance:
+        for covariance in covariances if per_condition else [covariances]:
+            _covariance_to_correlation(covariance)
+
+    return covariances.astype(dtype, copy=False)
@@ -0,0 +1,366 @@
+"""
+Cross-validation folds of the events of a BinnedAlignedSpikes for decoding analyses.
+
+The features of all the events (the counts of every unit in the selected bins) are read once, in blocks of
+consecutive events, into a compact (events, features) matrix whose rows are ordered by fold. The test events of
+each fold are then a contiguous block of rows and the training events the rows before and after it, so every fold
+is served from the same matrix without reading the data again. The test rows are views; the training rows of the
+folds in the middle are two blocks, copied into one array by `train_features` and served as views by
+`iter_train_batches`:
+
+    for fold in binned_aligned_spikes.iter_folds(n_splits=5, feature_bins=slice(10, 30), seed=0):
+        model.fit(fold.train_features, fold.train_labels)
+        model.score(fold.test_features, fold.test_labels)
+
+With `cache_path` the matrix is stored in a `.npy` file that is memory-mapped and reused by later runs with the same
+data, features and folds; a JSON file next to it records what the cache was built from.
+"""
+
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+from typing import Iterator, Optional, Tuple
+
+import numpy as np
+
+from .utils import get_chunk_length, iter_slices, read_block
+
+# Bump when the layout of the cache changes so that old caches are rebuilt
+FEATURE_CACHE_VERSION = 2
+
+
+@dataclass
+class Fold:
+    """
+    The training and test events of one fold of the feature matrix ordered by fold.
+
+    `features` and `labels` hold all the events; `test_slice` selects the test rows and the rows before and after it
+    (`train_slices`) are the training rows.
+    """
+
+    index: int
+    features: np.ndarray
+    labels: np.ndarray
+    #: The index in the BinnedAlignedSpikes of the event of each row
+    event_indices: np.ndarray
+    test_slice: slice
+    #: The default number of rows of the batches of `iter_train_batches`
+    batch_size: Optional[int] = None
+
+    @property
+    def test_features(self) -> np.ndarray:
+        return self.features[self.test_slice]
+
+    @property
+    def test_labels(self) -> np.ndarray:
+        return self.labels[self.test_slice]
+
+    @property
+    def test_event_indices(self) -> np.ndarray:
+        return self.event_indices[self.test_slice]
+
+    @property
+    def train_slices(self) -> Tuple[slice, slice]:
+        """The rows of the training events, before and after the test rows."""
+        return slice(0, self.test_slice.start), slice(self.test_slice.stop, self.features.shape[0])
+
+    def _concatenate_train_rows(self, array: np.ndarray) -> np.ndarray:
+        before, after = self.train_slices
+        if before.stop == before.start:
+            return array[after]
+        if after.stop == after.start:
+            return array[before]
+        return np.concatenate((array[before], array[after]))
+
+    @property
+    def train_features(self) -> np.ndarray:
+        """
+        The features of the training events.
+
+        A view for the first and last folds. For the other folds the rows before and after the test rows are copied
+        into a new array; use `iter_train_batches` or `train_slices` to read them without copying.
+        """
+        return self._concatenate_train_rows(self.features)
+
+    @property
+    def train_labels(self) -> np.ndarray:
+        return self._concatenate_train_rows(self.labels)
+
+    @property
+    def train_event_indices(self) -> np.ndarray:
+        return self._concatenate_train_rows(self.event_indices)
+
+    def iter_train_batches(self, batch_size: Optional[int] = None) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Iterate over the training events in batches of at most `batch_size` rows, without copying.
+
+        Yields
+        ------
+        features : np.ndarray
+            A view of the features of the batch.
+        labels : np.ndarray
+            A view of the labels of the batch.
+        """
+        batch_size = batch_size or self.batch_size or self.features.shape[0]
+        for train_slice in self.train_slices:
+            for batch_slice in iter_slices(train_slice.stop - train_slice.start, batch_size):
+                rows = slice(train_slice.start + batch_slice.start, train_slice.start + batch_slice.stop)
+                yield self.features[rows], self.labels[rows]
+
+
+def assign_folds(
+    labels: np.ndarray,
+    n_splits: int,
+    stratify_by_condition: bool = True,
+    shuffle: bool = True,
+    seed=None,
+) -> np.ndarray:
+    """
+    The fold of each event.
+
+    With `stratify_by_condition` the events of each condition are dealt to the folds in turn (after shuffling them
+    if `shuffle`), so every fold has the same proportion of each condition, up to one event. Otherwise the events
+    are split into `n_splits` groups of consecutive events (of shuffled events if `shuffle`).
+    """
+    number_of_events = labels.size
+    if not 2 <= n_splits <= number_of_events:
+        raise ValueError(
+            f"`n_splits` should be between 2 and the number of events ({number_of_events}), got {n_splits}."
+        )
+
+    rng = np.random.default_rng(seed)
+    folds = np.empty(number_of_events, dtype="int64")
+    if not stratify_by_condition:
+        order = rng.permutation(number_of_events) if shuffle else np.arange(number_of_events)
+        folds[order] = np.arange(number_of_events) * n_splits // number_of_events
+        return folds
+
+    # Continue dealing each condition where the previous one stopped so the folds have similar sizes
+    next_fold = 0
+    for label in np.unique(labels):
+        events = np.flatnonzero(labels == label)
+        if shuffle:
+            events = rng.permutation(events)
+        folds[events] = (next_fold + np.arange(events.size)) % n_splits
+        next_fold = (next_fold + events.size) % n_splits
+
+    return folds
+
+
+def _slice_to_list(bin_slice: slice):
+    return [bin_slice.start, bin_slice.stop, bin_slice.step]
+
+
+def _get_seed_key(seed):
+    """A JSON value identifying the folds drawn with `seed`, anything accepted by `np.random.default_rng`."""
+    if seed is None or isinstance(seed, (int, np.integer)):
+        return None if seed is None else int(seed)
+    if isinstance(seed, np.random.SeedSequence):
+        return dict(entropy=seed.entropy, spawn_key=list(seed.spawn_key), pool_size=seed.pool_size)
+    if isinstance(seed, np.random.Generator):
+        seed = seed.bit_generator
+    if isinstance(seed, np.random.BitGenerator):
+        # The folds are drawn from the current state of the generator
+        return json.loads(json.dumps(seed.state, default=lambda value: np.asarray(value).tolist()))
+    return np.asarray(seed).tolist()
+
+
+def _get_cache_key(container, feature_bins: slice, sum_over_bins: bool, dtype, fold_parameters: dict) -> dict:
+    data = container.data
+    checksum_manifest = container.checksum_manifest
+    if checksum_manifest is not None:
+        checksum_manifest = hashlib.sha256(checksum_manifest.encode()).hexdigest()
+    validity_mask = getattr(container, "validity_mask", None)
+    if validity_mask is not None:
+        mask_hash = hashlib.sha256(repr(validity_mask.shape).encode())
+        mask_hash.update(np.asarray(validity_mask.packed[:], dtype="uint8").tobytes())
+        validity_mask = mask_hash.hexdigest()
+
+    # The data is identified by its container, shape and type, and by its content hashes when it has a manifest
+    return dict(
+        version=FEATURE_CACHE_VERSION,
+        object_id=container.object_id,
+        data_shape=[int(length) for length in data.shape],
+        data_dtype=np.dtype(data.dtype).str,
+        checksum_manifest=checksum_manifest,
+        validity_mask=validity_mask,
+        feature_bins=_slice_to_list(feature_bins),
+        sum_over_bins=sum_over_bins,
+        dtype=np.dtype(dtype).str,
+        **fold_parameters,
+    )
+
+
+def _get_metadata_path(cache_path: str) -> str:
+    return f"{cache_path}.json"
+
+
+def _read_cache(cache_path: str, key: dict):
+    """The memory-mapped features and the fold layout of a cache built with `key`, or None."""
+    try:
+        with open(_get_metadata_path(cache_path), "r") as file:
+            metadata = json.load(file)
+        if metadata.get("key") != key:
+            return None
+        features = np.load(cache_path, mmap_mode="r")
+    except (OSError, ValueError):
+        return None
+
+    return features, np.asarray(metadata["event_indices"], dtype="int64"), metadata["fold_stops"]
+
+
+def get_number_of_features(container, feature_bins: slice = slice(None), sum_over_bins: bool = False) -> int:
+    """The number of features of each event."""
+    number_of_units, _, number_of_bins = container.data.shape
+    return number_of_units if sum_over_bins else number_of_units * len(range(number_of_bins)[feature_bins])
+
+
+def build_feature_matrix(
+    container,
+    event_indices: np.ndarray,
+    feature_bins: slice = slice(None),
+    sum_over_bins: bool = False,
+    dtype="float32",
+    out: Optional[np.ndarray] = None,
+    events_per_chunk: Optional[int] = None,
+) -> np.ndarray:
+    """
+    Read the features of the events, with row `i` holding the features of event `event_indices[i]`.
+
+    The data is read once in blocks of consecutive events. The features of an event are the counts of all the units
+    in `feature_bins`, ordered by unit and then by bin, or the count of each unit summed over `feature_bins`.
+
+    With a `validity_mask`, the invalid counts are NaN features, and the summed count of a unit is the mean of its
+    valid bins times the number of bins (NaN without valid bins). Integer `dtype`s cannot hold them and are
+    rejected.
+    """
+    data = container._readable_data
+    number_of_events = data.shape[1]
+    validity_mask = getattr(container, "validity_mask", None)
+    if validity_mask is not None and not np.issubdtype(np.dtype(dtype if out is None else out.dtype), np.floating):
+        raise ValueError(
+            "The features of data with a `validity_mask` have NaNs for the invalid counts, use a float `dtype`."
+        )
+    if out is None:
+        number_of_features = get_number_of_features(container, feature_bins, sum_over_bins)
+        out = np.empty((len(event_indices), number_of_features), dtype=dtype)
+
+    row_of_event = np.empty(number_of_events, dtype="int64")
+    row_of_event[event_indices] = np.arange(len(event_indices))
+
+    events_per_chunk = events_per_chunk or get_chunk_length(data, axis=1)
+    for event_slice in iter_slices(number_of_events, events_per_chunk):
+        selection = (slice(None), event_slice, feature_bins)
+        block = read_block(data, selection)
+        if validity_mask is not None:
+            valid = validity_mask.get_valid(data.shape, selection)
+            if sum_over_bins:
+                # The mean of the valid bins, scaled to the number of bins
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    block = np.where(valid, block, 0).sum(axis=2, keepdims=True) / valid.mean(axis=2, keepdims=True)
+            else:
+                block = np.where(valid, block, np.nan)
+        if sum_over_bins:
+            event_features = block.sum(axis=2).T
+        else:
+            event_features = block.transpose(1, 0, 2).reshape(block.shape[1], -1)
+        out[row_of_event[event_slice]] = event_features
+
+    return out
+
+
+def iter_folds(
+    container,
+    n_splits: int = 5,
+    stratify_by_condition: bool = True,
+    feature_bins: slice = slice(None),
+    sum_over_bins: bool = False,
+    batch_size: Optional[int] = None,
+    shuffle: bool = True,
+    seed=None,
+    dtype="float32",
+    cache_path: Optional[str] = None,
+) -> Iterator[Fold]:
+    """
+    Iterate over cross-validation folds of the events of a BinnedAlignedSpikes.
+
+    Parameters
+    ----------
+    container : BinnedAlignedSpikes
+        The data.
+    n_splits : int, default: 5
+        The number of folds.
+    stratify_by_condition : bool, default: True
+        Give every fold the same proportion of each condition.
+    feature_bins : slice, default: slice(None)
+        The bins used as features.
+    sum_over_bins : bool, default: False
+        Use the count of each unit summed over `feature_bins` as features instead of the count of each bin.
+    batch_size : int, optional
+        The default number of rows of the batches of `Fold.iter_train_batches`.
+    shuffle : bool, default: True
+        Shuffle the events before assigning them to the folds.
+    seed : int, SeedSequence or Generator, optional
+        The seed of the shuffling, for reproducible folds. Anything accepted by `np.random.default_rng`.
+    dtype : str, default: "float32"
+        The data type of the features. With a `validity_mask` it should be a float type, as the invalid counts are
+        NaN features (see `build_feature_matrix`).
+    cache_path : str, optional
+        A `.npy` file where the feature matrix is stored and memory-mapped. It is reused when its JSON sidecar shows
+        it was built from the same data with the same features and folds, and rebuilt otherwise.
+
+    Yields
+    ------
+    Fold
+        The training and test events of each fold.
+    """
+    if container.has_multiple_conditions:
+        labels = np.asarray(container.condition_indices[:])
+    else:
+        labels = np.zeros(container.number_of_events, dtype="uint64")
+
+    fold_parameters = dict(
+        n_splits=n_splits,
+        stratify_by_condition=stratify_by_condition,
+        shuffle=shuffle,
+        seed=_get_seed_key(seed),
+    )
+    key = _get_cache_key(container, feature_bins, sum_over_bins, dtype, fold_parameters)
+    cached = None if cache_path is None else _read_cache(cache_path, key)
+
+    if cached is not None:
+        features, event_indices, fold_stops = cached
+    else:
+        folds = assign_folds(labels, n_splits, stratify_by_condition=stratify_by_condition, shuffle=shuffle, seed=seed)
+        # Rows ordered by fold, and by time within each fold
+        event_indices = np.lexsort((np.arange(folds.size), folds))
+        fold_stops = np.cumsum(np.bincount(folds, minlength=n_splits)).tolist()
+
+        out = None
+        if cache_path is not None:
+            # Without the sidecar an interrupted build is never mistaken for a valid cache
+            if os.path.exists(_get_metadata_path(cache_path)):
+                os.remove(_get_metadata_path(cache_path))
+            shape = (event_indices.size, get_number_of_features(container, feature_bins, sum_over_bins))
+            out = np.lib.format.open_memmap(cache_path, mode="w+", dtype=dtype, shape=shape)
+        features = build_feature_matrix(
+            container, event_indices, feature_bins=feature_bins, sum_over_bins=sum_over_bins, dtype=dtype, out=out
+        )
+        if cache_path is not None:
+            features.flush()
+            metadata = dict(key=key, event_indices=event_indices.tolist(), fold_stops=fold_stops)
+            with open(_get_metadata_path(cache_path), "w") as file:
+                json.dump(metadata, file)
+
+    ordered_labels = labels[event_indices]
+    fold_starts = [0] + list(fold_stops[:-1])
+    for index, (start, stop) in enumerate(zip(fold_starts, fold_stops)):
+        yield Fold(
+            index=index,
+            features=features,
+            labels=ordered_labels,
+            event_indices=event_indices,
+            test_slice=slice(int(start), int(stop)),
+            batch_size=batch_size,
+        )
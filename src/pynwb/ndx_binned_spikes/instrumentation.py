@@ -0,0 +1,164 @@
+"""
+Opt-in instrumentation of the data access methods of BinnedSpikes and BinnedAlignedSpikes.
+
+Use the `instrument` context manager to record per-call timings, reads of disk-backed datasets and cache hits and
+misses while it is active:
+
+    with instrument(trace=True) as recorder:
+        binned_aligned_spikes.get_data_for_condition(0)
+
+    recorder.stats  # summary dictionary
+    recorder.to_json("stats.json")
+    recorder.to_chrome_trace("trace.json")  # open in chrome://tracing or https://ui.perfetto.dev
+
+When no recorder is active the instrumented methods only pay for one check of a module level flag.
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
+import numpy as np
+
+# Checked by every instrumented call. Only modified while holding `_lock`
+_enabled = False
+_lock = threading.Lock()
+_active_recorders: List["Recorder"] = []
+
+
+class Recorder:
+    """Accumulates the measurements taken while it is active."""
+
+    def __init__(self, trace: bool = False):
+        self.trace = trace
+        self.calls = {}
+        self.reads = dict(count=0, bytes=0)
+        self.caches = {}
+        self.trace_events = []
+        self._lock = threading.Lock()
+        self._start_ns = time.perf_counter_ns()
+
+    def _record_call(self, name: str, start_ns: int, duration_ns: int, bytes_returned: int):
+        with self._lock:
+            call = self.calls.setdefault(name, dict(count=0, total_time_s=0.0, max_time_s=0.0, bytes_returned=0))
+            call["count"] += 1
+            call["total_time_s"] += duration_ns / 1e9
+            call["max_time_s"] = max(call["max_time_s"], duration_ns / 1e9)
+            call["bytes_returned"] += bytes_returned
+
+            if self.trace:
+                self.trace_events.append(
+                    dict(
+                        name=name,
+                        ph="X",
+                        ts=(start_ns - self._start_ns) / 1e3,
+                        dur=duration_ns / 1e3,
+                        pid=os.getpid(),
+                        tid=threading.get_ident(),
+                    )
+                )
+
+    def _record_read(self, number_of_bytes: int):
+        with self._lock:
+            self.reads["count"] += 1
+            self.reads["bytes"] += number_of_bytes
+
+    def _record_cache_access(self, cache_name: str, hit: bool):
+        with self._lock:
+            cache = self.caches.setdefault(cache_name, dict(hits=0, misses=0))
+            cache["hits" if hit else "misses"] += 1
+
+    @property
+    def stats(self) -> dict:
+        """The recorded calls, reads and cache accesses as a dictionary."""
+        with self._lock:
+            return json.loads(json.dumps(dict(calls=self.calls, reads=self.reads, caches=self.caches)))
+
+    def to_json(self, path: Optional[str] = None) -> str:
+        """The stats as a JSON string, also written to `path` if given."""
+        stats_json = json.dumps(self.stats, indent=2)
+        if path is not None:
+            with open(path, "w") as file:
+                file.write(stats_json)
+        return stats_json
+
+    def to_chrome_trace(self, path: str):
+        """Write the recorded calls in the Chrome trace event format. Requires `trace=True`."""
+        if not self.trace:
+            raise ValueError("The calls were not traced, use `instrument(trace=True)`.")
+
+        with self._lock:
+            trace = dict(traceEvents=list(self.trace_events), displayTimeUnit="ms")
+        with open(path, "w") as file:
+            json.dump(trace, file)
+
+
+def _set_enabled():
+    global _enabled
+    _enabled = bool(_active_recorders)
+
+
+@contextmanager
+def instrument(trace: bool = False) -> Iterator[Recorder]:
+    """
+    Record the instrumented calls made while the context is active, from any thread.
+
+    Parameters
+    ----------
+    trace : bool, default: False
+        Also keep every call as a trace event for `Recorder.to_chrome_trace`.
+
+    Yields
+    ------
+    Recorder
+        The recorder with the measurements.
+    """
+    recorder = Recorder(trace=trace)
+    with _lock:
+        _active_recorders.append(recorder)
+        _set_enabled()
+    try:
+        yield recorder
+    finally:
+        with _lock:
+            _active_recorders.remove(recorder)
+            _set_enabled()
+
+
+def instrumented(method):
+    """Decorator that records the duration and the size of the returned array of `method` when enabled."""
+    name = method.__qualname__
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return method(*args, **kwargs)
+
+        start_ns = time.perf_counter_ns()
+        result = method(*args, **kwargs)
+        duration_ns = time.perf_counter_ns() - start_ns
+
+        bytes_returned = result.nbytes if isinstance(result, np.ndarray) else 0
+        for recorder in list(_active_recorders):
+            recorder._record_call(name, start_ns, duration_ns, bytes_returned)
+        return result
+
+    return wrapper
+
+
+def record_read(number_of_bytes: int):
+    """Record one read from a disk-backed dataset."""
+    if _enabled:
+        for recorder in list(_active_recorders):
+            recorder._record_read(number_of_bytes)
+
+
+def record_cache_access(cache_name: str, hit: bool):
+    """Record a hit or a miss of one of the caches of the package."""
+    if _enabled:
+        for recorder in list(_active_recorders):
+            recorder._record_cache_access(cache_name, hit)
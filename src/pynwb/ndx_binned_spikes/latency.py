@@ -0,0 +1,231 @@
+"""
+Response onset and latency to the first spike of the units of a BinnedAlignedSpikes.
+
+The data is read once, in chunks of events, to accumulate the PSTH of every unit and condition (and, for the
+latency to the first spike, the histogram over the events of their first bin with a spike). The onsets of all the
+units and conditions are then found with array operations on the (units, conditions, bins) PSTH, without per-unit loops.
+Bins are converted to milliseconds relative to the event with `event_to_bin_offset_in_ms` and `bin_width_in_ms`.
+"""
+
+from typing import Optional
+
+import numpy as np
+
+from .utils import get_chunk_length, get_condition_codes, iter_slices, read_block, sum_events_by_code
+
+METHODS = ("zscore", "fraction_of_peak", "first_spike")
+
+DEFAULT_THRESHOLDS = {"zscore": 3.0, "fraction_of_peak": 0.5}
+
+#: The fields of the structured arrays returned by `compute_response_onset`. Bins are indices of the third axis
+#: of the data; the times are those of the beginning of the bins, in milliseconds from the event. Missing onsets
+#: have a bin of -1 and a time of NaN.
+ONSET_DTYPE = np.dtype(
+    [
+        ("unit_index", "int64"),
+        ("condition_index", "uint64"),
+        ("onset_bin", "int64"),
+        ("onset_in_ms", "float64"),
+        ("peak_bin", "int64"),
+        ("peak_in_ms", "float64"),
+        ("peak_value", "float64"),
+        ("baseline_mean", "float64"),
+        ("baseline_std", "float64"),
+        ("number_of_events", "int64"),
+    ]
+)
+
+# Tolerance when converting the event time to a bin edge
+_BIN_EDGE_TOLERANCE = 1e-9
+
+
+def get_default_baseline_bins(number_of_bins: int, bin_width_in_ms: float, event_to_bin_offset_in_ms: float) -> slice:
+    """The bins that end at or before the event."""
+    stop = int(np.floor(-event_to_bin_offset_in_ms / bin_width_in_ms + _BIN_EDGE_TOLERANCE))
+    return slice(0, min(max(stop, 0), number_of_bins))
+
+
+def find_first_true(mask: np.ndarray, min_consecutive_bins: int = 1) -> np.ndarray:
+    """
+    The index along the last axis of the first run of at least `min_consecutive_bins` True values, or -1.
+    """
+    if min_consecutive_bins > 1:
+        if mask.shape[-1] < min_consecutive_bins:
+            return np.full(mask.shape[:-1], -1, dtype="int64")
+        runs = np.lib.stride_tricks.sliding_window_view(mask, min_consecutive_bins, axis=-1)
+        mask = runs.all(axis=-1)
+
+    first = np.argmax(mask, axis=-1).astype("int64")
+    first[~mask.any(axis=-1)] = -1
+    return first
+
+
+def _accumulate(data, validity_mask, codes, number_of_conditions, response_bins, first_spike, events_per_chunk):
+    """
+    The summed valid counts of each condition, the number of valid events summed and, with `first_spike`, the
+    (conditions, units, response bins + 1) histogram of the first valid response bin with spikes of the events, whose
+    last bin counts the events without spikes.
+    """
+    number_of_units, number_of_events, number_of_bins = data.shape
+    sums = np.zeros((number_of_conditions, number_of_units, number_of_bins), dtype="float64")
+    counts = np.bincount(codes, minlength=number_of_conditions).astype("float64")[:, np.newaxis, np.newaxis]
+    if validity_mask is not None:
+        counts = np.zeros_like(sums)
+    number_of_response_bins = len(range(number_of_bins)[response_bins])
+    histogram_shape = (number_of_conditions, number_of_units, number_of_response_bins + 1)
+    first_spike_histogram = np.zeros(histogram_shape, dtype="int64") if first_spike else None
+
+    events_per_chunk = events_per_chunk or get_chunk_length(data, axis=1)
+    for event_slice in iter_slices(number_of_events, events_per_chunk):
+        chunk = read_block(data, (slice(None), event_slice, slice(None)))
+        if validity_mask is not None:
+            valid = validity_mask.get_valid(data.shape, (slice(None), event_slice, slice(None)))
+            # Zeroing the invalid counts keeps the integer type of the chunk
+            chunk = np.where(valid, chunk, 0)
+            counts += sum_events_by_code(valid, codes[event_slice], number_of_conditions)
+        sums += sum_events_by_code(chunk, codes[event_slice], number_of_conditions)
+        if first_spike:
+            first_bins = find_first_true(chunk[:, :, response_bins] > 0)
+            first_bins[first_bins < 0] = number_of_response_bins
+            # One bincount over the combined (condition, unit, first bin) index of the events of the chunk
+            rows = codes[event_slice][np.newaxis, :] * number_of_units + np.arange(number_of_units)[:, np.newaxis]
+            linear_index = rows * (number_of_response_bins + 1) + first_bins
+            first_spike_histogram += np.bincount(
+                linear_index.ravel(), minlength=first_spike_histogram.size
+            ).reshape(histogram_shape)
+
+    return sums, counts, first_spike_histogram
+
+
+def compute_response_onset(
+    binned_aligned_spikes,
+    baseline_bins: Optional[slice] = None,
+    threshold: Optional[float] = None,
+    method: str = "zscore",
+    response_bins: Optional[slice] = None,
+    min_consecutive_bins: int = 1,
+    events_per_chunk: Optional[int] = None,
+) -> np.ndarray:
+    """
+    Detect the response onset of every unit in every condition.
+
+    The PSTH is the mean count per bin over the events of each condition, excluding the entries marked invalid by
+    the `validity_mask` of the container. The methods are:
+
+    * "zscore": the first response bin where the PSTH exceeds the baseline mean by more than `threshold` baseline
+      standard deviations (default 3).
+    * "fraction_of_peak": the first response bin where the PSTH reaches the baseline mean plus `threshold` (default
+      0.5) times the height of the peak above it. Units whose peak does not exceed the baseline have no onset.
+    * "first_spike": the median over the events of the first response bin with a spike (the lower median, so it is
+      a bin). Events without spikes in the response bins are ignored. `threshold` is not used.
+
+    Parameters
+    ----------
+    binned_aligned_spikes : BinnedAlignedSpikes
+        The data.
+    baseline_bins : slice, optional
+        The bins of the baseline. Defaults to the bins that end at or before the event.
+    threshold : float, optional
+        The detection threshold, in baseline standard deviations or as a fraction of the peak depending on `method`.
+    method : str, default: "zscore"
+        "zscore", "fraction_of_peak" or "first_spike".
+    response_bins : slice, optional
+        The bins where the onset and the peak are searched. Defaults to the bins after the baseline.
+    min_consecutive_bins : int, default: 1
+        The number of consecutive bins that have to cross the threshold for the first of them to be the onset.
+    events_per_chunk : int, optional
+        The number of events read at a time. By default it is chosen to keep the chunks around 64 MiB.
+
+    Returns
+    -------
+    np.ndarray
+        A structured array with dtype `ONSET_DTYPE` and one record per unit and condition, ordered by unit and
+        then by condition index.
+    """
+    if method not in METHODS:
+        raise ValueError(f"`method` should be one of {METHODS}, got '{method}'.")
+    if method == "first_spike" and threshold is not None:
+        raise ValueError("`threshold` is not used by the 'first_spike' method.")
+    if min_consecutive_bins < 1:
+        raise ValueError(f"`min_consecutive_bins` should be at least 1, got {min_consecutive_bins}.")
+
+    data = binned_aligned_spikes._readable_data
+    number_of_units, _, number_of_bins = data.shape
+    bin_width_in_ms = binned_aligned_spikes.bin_width_in_ms
+    event_to_bin_offset_in_ms = binned_aligned_spikes.event_to_bin_offset_in_ms
+
+    if baseline_bins is None:
+        baseline_bins = get_default_baseline_bins(number_of_bins, bin_width_in_ms, event_to_bin_offset_in_ms)
+    baseline_range = range(number_of_bins)[baseline_bins]
+    if response_bins is None:
+        response_bins = slice(baseline_range.stop if len(baseline_range) else 0, number_of_bins)
+    response_range = range(number_of_bins)[response_bins]
+    if response_range.step != 1 or len(response_range) == 0:
+        raise ValueError("`response_bins` should select one or more consecutive bins.")
+    if len(baseline_range) == 0 and method != "first_spike":
+        raise ValueError(
+            "The baseline has no bins. Pass `baseline_bins`, or use data with bins before the event "
+            "(a negative `event_to_bin_offset_in_ms`)."
+        )
+
+    conditions, codes = get_condition_codes(binned_aligned_spikes)
+    events_per_condition = np.bincount(codes, minlength=conditions.size)
+    validity_mask = getattr(binned_aligned_spikes, "validity_mask", None)
+    sums, counts, first_spike_histogram = _accumulate(
+        data, validity_mask, codes, conditions.size, response_bins, method == "first_spike", events_per_chunk
+    )
+    # (units, conditions, bins)
+    psth = (sums / np.maximum(counts, 1)).transpose(1, 0, 2)
+
+    if len(baseline_range):
+        baseline = psth[:, :, baseline_bins]
+        baseline_mean, baseline_std = baseline.mean(axis=2), baseline.std(axis=2)
+    else:
+        baseline_mean = baseline_std = np.full(psth.shape[:2], np.nan)
+
+    response = psth[:, :, response_bins]
+    peak_position = np.argmax(response, axis=2)
+    peak_value = np.take_along_axis(response, peak_position[:, :, np.newaxis], axis=2)[:, :, 0]
+
+    if method == "zscore":
+        if threshold is None:
+            threshold = DEFAULT_THRESHOLDS[method]
+        crossing = response > (baseline_mean + threshold * baseline_std)[:, :, np.newaxis]
+        onset_position = find_first_true(crossing, min_consecutive_bins)
+    elif method == "fraction_of_peak":
+        if threshold is None:
+            threshold = DEFAULT_THRESHOLDS[method]
+        if not 0 < threshold <= 1:
+            raise ValueError(f"`threshold` should be in (0, 1] for the 'fraction_of_peak' method, got {threshold}.")
+        level = baseline_mean + threshold * (peak_value - baseline_mean)
+        crossing = response >= level[:, :, np.newaxis]
+        onset_position = find_first_true(crossing, min_consecutive_bins)
+        onset_position[peak_value <= baseline_mean] = -1
+    else:
+        # The lower median is the first bin whose cumulative count exceeds half of the events with spikes, rounded
+        # down, as `np.nanquantile(..., method="lower")` would find over the first bin of every event
+        cumulative = np.cumsum(first_spike_histogram[:, :, :-1], axis=2).transpose(1, 0, 2)
+        number_with_spikes = cumulative[:, :, -1]
+        median_rank = (number_with_spikes - 1) // 2
+        onset_position = np.argmax(cumulative > median_rank[:, :, np.newaxis], axis=2).astype("int64")
+        onset_position[number_with_spikes == 0] = -1
+
+    onset_bin = np.where(onset_position >= 0, onset_position + response_range.start, -1)
+    peak_bin = peak_position + response_range.start
+
+    def bins_to_ms(bins):
+        return event_to_bin_offset_in_ms + bins * bin_width_in_ms
+
+    result = np.empty(number_of_units * conditions.size, dtype=ONSET_DTYPE)
+    result["unit_index"] = np.repeat(np.arange(number_of_units), conditions.size)
+    result["condition_index"] = np.tile(conditions, number_of_units)
+    result["onset_bin"] = onset_bin.ravel()
+    result["onset_in_ms"] = np.where(onset_bin >= 0, bins_to_ms(onset_bin), np.nan).ravel()
+    result["peak_bin"] = peak_bin.ravel()
+    result["peak_in_ms"] = bins_to_ms(peak_bin).ravel()
+    result["peak_value"] = peak_value.ravel()
+    result["baseline_mean"] = baseline_mean.ravel()
+    result["baseline_std"] = baseline_std.ravel()
+    result["number_of_events"] = np.tile(events_per_condition, number_of_units)
+
+    return result
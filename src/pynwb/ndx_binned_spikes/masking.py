@@ -0,0 +1,193 @@
+"""
+Bit-packed validity masks of the bins of BinnedSpikes and BinnedAlignedSpikes.
+
+Artifact periods, bad units or invalid trials are marked in a boolean mask stored with one bit per entry next to
+`data`, so the counts keep their integer type instead of being turned into NaNs. The mask has the number of
+dimensions of the data and each of its axes has either the length of the data axis or length 1, in which case it
+applies to all the entries of that axis:
+
+    # Invalid trials of a BinnedAlignedSpikes, a (1, number_of_events, 1) mask
+    validity_mask = ValidityMask.for_axis(valid_events, axis=1, ndim=3)
+    # Artifact periods of a BinnedSpikes, a (1, number_of_bins) mask
+    validity_mask = ValidityMask.for_axis(valid_bins, axis=1, ndim=2)
+    # Any combination, with the full shape of the data
+    validity_mask = ValidityMask.from_bool(valid)
+
+The accessors of the containers return `np.ma.MaskedArray` views with the dtype of the data, and the reductions
+only count the valid entries.
+"""
+
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+from .utils import accumulate_condition_sums, expand_selection, normalize_axis_index, read_block
+
+# The bit order of the packed masks, so the first entry is the least significant bit of the first byte
+BIT_ORDER = "little"
+
+
+class ValidityMask:
+    """
+    A boolean mask of the valid entries of the data, packed with one bit per entry.
+
+    Parameters
+    ----------
+    packed : array-like
+        The bits of the mask in row-major order, packed into uint8 with `np.packbits(..., bitorder="little")`. It
+        can be disk-backed.
+    shape : sequence of int
+        The shape of the unpacked mask. Each axis has the length of the corresponding axis of the data or 1.
+    """
+
+    def __init__(self, packed, shape: Sequence[int]):
+        self.packed = packed
+        self.shape = tuple(int(length) for length in shape)
+
+        expected_number_of_bytes = (self.size + 7) // 8
+        if len(packed) != expected_number_of_bytes:
+            raise ValueError(
+                f"A mask with shape {self.shape} should be packed into {expected_number_of_bytes} bytes, "
+                f"got {len(packed)}."
+            )
+
+    @classmethod
+    def from_bool(cls, valid) -> "ValidityMask":
+        """Pack a boolean array where True marks the valid entries."""
+        valid = np.asarray(valid, dtype=bool)
+        return cls(np.packbits(valid, axis=None, bitorder=BIT_ORDER), valid.shape)
+
+    @classmethod
+    def for_axis(cls, valid, axis: int, ndim: int) -> "ValidityMask":
+        """A mask of the entries of one axis (e.g. the units, events or bins) that applies to all the other axes."""
+        valid = np.asarray(valid, dtype=bool)
+        if valid.ndim != 1:
+            raise ValueError(f"The mask of an axis should be a 1D array, got {valid.ndim} dimensions.")
+        shape = [1] * ndim
+        shape[axis] = valid.size
+        return cls.from_bool(valid.reshape(shape))
+
+    @property
+    def ndim(self) -> int:
+        return len(self.shape)
+
+    @property
+    def size(self) -> int:
+        return int(np.prod(self.shape))
+
+    @property
+    def nbytes(self) -> int:
+        """The size of the packed mask."""
+        return len(self.packed)
+
+    def to_bool(self) -> np.ndarray:
+        """The whole unpacked mask, with `shape`. Use `get_valid` to unpack only the entries of a selection."""
+        return self._unpack(0, self.size).reshape(self.shape)
+
+    def _unpack(self, start: int, stop: int) -> np.ndarray:
+        """The bits `start:stop` of the flattened mask, reading only the bytes that contain them."""
+        first_byte = start // 8
+        packed = read_block(self.packed, slice(first_byte, (stop + 7) // 8))
+        bits = np.unpackbits(np.asarray(packed, dtype="uint8"), bitorder=BIT_ORDER)
+        return bits[start - 8 * first_byte : stop - 8 * first_byte].view(bool)
+
+    def check_data_shape(self, data_shape: Sequence[int]):
+        """Raise a ValueError if the mask does not apply to data of shape `data_shape`."""
+        data_shape = tuple(int(length) for length in data_shape)
+        if len(data_shape) != self.ndim or any(
+            length not in (1, data_length) for length, data_length in zip(self.shape, data_shape)
+        ):
+            raise ValueError(
+                f"The validity mask with shape {self.shape} does not match the data with shape {data_shape}: each "
+                "axis of the mask should have the length of the data axis or 1."
+            )
+
+    def get_valid(self, data_shape: Sequence[int], selection=Ellipsis) -> np.ndarray:
+        """
+        The validity of the entries `data[selection]` of data of shape `data_shape`, as a read-only array.
+
+        Only the bytes covering the range selected on the first axis of the mask longer than 1 are unpacked, since
+        the mask is stored in row-major order and the axes before it have length 1.
+        """
+        data_shape = tuple(int(length) for length in data_shape)
+        selection = expand_selection(selection, self.ndim)
+        axis = next((axis for axis, length in enumerate(self.shape) if length > 1), None)
+        if axis is None:
+            return np.broadcast_to(self.to_bool(), data_shape)[selection]
+
+        index = normalize_axis_index(selection[axis], data_shape[axis])
+        if isinstance(index, slice):
+            positions = range(index.start, index.stop, index.step)
+            start, stop = (min(positions), max(positions) + 1) if len(positions) else (0, 0)
+            # The stop of a decreasing slice that reaches the first entry is negative, i.e. None
+            shifted_stop = index.stop - start if index.stop - start >= 0 else None
+            shifted_index = slice(index.start - start, shifted_stop, index.step)
+        else:
+            start, stop = (int(np.min(index)), int(np.max(index)) + 1) if np.size(index) else (0, 0)
+            shifted_index = index - start
+
+        entries_per_index = int(np.prod(self.shape[axis + 1 :]))
+        valid = self._unpack(start * entries_per_index, stop * entries_per_index)
+        valid = valid.reshape((1,) * axis + (stop - start,) + self.shape[axis + 1 :])
+        range_shape = data_shape[:axis] + (stop - start,) + data_shape[axis + 1 :]
+        return np.broadcast_to(valid, range_shape)[selection[:axis] + (shifted_index,) + selection[axis + 1 :]]
+
+    def select(self, axis: int, index) -> "ValidityMask":
+        """The mask of the entries `index` of `axis`, e.g. for cropped or subsetted data."""
+        if self.shape[axis] == 1:
+            return self
+        selection = [slice(None)] * self.ndim
+        selection[axis] = index
+        return ValidityMask.from_bool(self.get_valid(self.shape, tuple(selection)))
+
+    def reduce_bins(self, factor: int) -> "ValidityMask":
+        """The mask of the bins merged by groups of `factor` along the last axis: valid if all the bins are."""
+        if self.shape[-1] == 1:
+            return self
+        number_of_bins = self.shape[-1] // factor
+        valid = self.to_bool()[..., : number_of_bins * factor]
+        return ValidityMask.from_bool(valid.reshape(valid.shape[:-1] + (number_of_bins, factor)).all(axis=-1))
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(shape={self.shape}, nbytes={self.nbytes})"
+
+
+def as_validity_mask(validity_mask, data_shape: Sequence[int]) -> Optional[ValidityMask]:
+    """A ValidityMask from a ValidityMask or a boolean array, checked against the shape of the data."""
+    if validity_mask is None:
+        return None
+    if not isinstance(validity_mask, ValidityMask):
+        validity_mask = ValidityMask.from_bool(validity_mask)
+    validity_mask.check_data_shape(data_shape)
+    return validity_mask
+
+
+def mask_block(block: np.ndarray, validity_mask: Optional[ValidityMask], data_shape, selection) -> np.ndarray:
+    """`block = data[selection]` as a masked array of the same dtype, or unchanged without a mask."""
+    if validity_mask is None:
+        return block
+    return np.ma.MaskedArray(block, mask=~validity_mask.get_valid(data_shape, selection))
+
+
+def accumulate_masked_condition_sums(
+    data,
+    validity_mask: ValidityMask,
+    codes: np.ndarray,
+    number_of_conditions: int,
+    events_per_chunk: Optional[int] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Sum the valid entries of the (units, events, bins) `data` over the events of each condition in a single pass.
+
+    See `accumulate_condition_sums`, which this calls with the `validity_mask`.
+
+    Returns
+    -------
+    sums : np.ndarray
+        Array of shape (number_of_conditions, units, bins) with the summed valid counts, as float64.
+    counts : np.ndarray
+        Array of shape (number_of_conditions, units, bins) with the number of valid events summed.
+    """
+    return accumulate_condition_sums(
+        data, codes, number_of_conditions, events_per_chunk=events_per_chunk, validity_mask=validity_mask
+    )
@@ -0,0 +1,253 @@
+"""
+A pool of open NWB files and of the containers resolved in them.
+
+Opening an NWB file reads its cached namespaces and builds every container, so services that repeatedly reach the
+same BinnedAlignedSpikes or BinnedSpikes pay that cost on each request. `open_binned` keeps the files open in a
+thread-safe pool with LRU and idle time eviction and returns the already built containers on later calls.
+
+Files are opened outside of the lock of the pool, so a slow file does not block the requests for the other files,
+and concurrent requests for the same file wait for a single opening. `NWBFilePool.lease` keeps a file open while it
+is used: a leased file that is evicted is only closed when its last lease ends.
+"""
+
+import atexit
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Mapping, Optional
+
+DEFAULT_MAX_OPEN_FILES = 32
+
+
+class _PoolEntry:
+
+    def __init__(self, io, nwbfile):
+        self.io = io
+        self.nwbfile = nwbfile
+        self.objects = {}
+        self.last_access = time.monotonic()
+        # The number of leases in use, and whether the entry left the pool while leased
+        self.leases = 0
+        self.evicted = False
+
+
+def resolve_object_path(nwbfile, object_path: str):
+    """
+    Find the container at `object_path` in `nwbfile`, e.g. "processing/ecephys/BinnedAlignedSpikes".
+
+    Each part of the path is the name of a child container, a key of the previous part when it is a dictionary
+    (like the processing modules), or an attribute of the previous container (like "processing" or "units").
+    """
+    current = nwbfile
+    for part in object_path.strip("/").split("/"):
+        if isinstance(current, Mapping):
+            if part not in current:
+                raise KeyError(f"There is no object at '{object_path}': '{part}' not found.")
+            current = current[part]
+            continue
+
+        child = next((child for child in getattr(current, "children", ()) if child.name == part), None)
+        if child is None:
+            child = getattr(current, part, None)
+        if child is None:
+            raise KeyError(f"There is no object at '{object_path}': '{part}' not found.")
+        current = child
+
+    return current
+
+
+class NWBFilePool:
+    """
+    Thread-safe pool of NWB files opened for reading, with the containers already resolved in each of them.
+
+    Closing a file (on eviction, `evict` or `close`) makes the containers that were read from it unusable, so they
+    should not be kept beyond the life of the pool entry. Use `lease` to keep a file open while its containers are
+    used: an evicted file that is leased is closed when its last lease ends.
+
+    Parameters
+    ----------
+    max_open_files : int, default: 32
+        The maximum number of files kept open. The least recently used file is closed when the pool is full.
+    ttl_seconds : float, optional
+        Files that have not been accessed for this long are closed on the next access to the pool.
+    """
+
+    def __init__(self, max_open_files: int = DEFAULT_MAX_OPEN_FILES, ttl_seconds: Optional[float] = None):
+        if max_open_files < 1:
+            raise ValueError(f"`max_open_files` should be a positive integer, got {max_open_files}.")
+
+        self.max_open_files = max_open_files
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        # The futures of the files being opened, so concurrent requests for a file wait for a single opening
+        self._opening = {}
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, path) -> bool:
+        return os.path.abspath(path) in self._entries
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @staticmethod
+    def _close_entry(entry: _PoolEntry):
+        """Close the file of an entry that left the pool, or defer it to the end of its last lease."""
+        if entry.leases:
+            entry.evicted = True
+        else:
+            entry.io.close()
+
+    def _evict_expired(self, now: float):
+        if self.ttl_seconds is None:
+            return
+        expired = [path for path, entry in self._entries.items() if now - entry.last_access > self.ttl_seconds]
+        for path in expired:
+            self._close_entry(self._entries.pop(path))
+
+    @staticmethod
+    def _open_entry(path: str) -> _PoolEntry:
+        from pynwb import NWBHDF5IO
+
+        io = NWBHDF5IO(path, mode="r")
+        try:
+            nwbfile = io.read()
+        except BaseException:
+            io.close()
+            raise
+        return _PoolEntry(io=io, nwbfile=nwbfile)
+
+    def _get_entry(self, path: str, lease: bool = False) -> _PoolEntry:
+        path = os.path.abspath(path)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._evict_expired(now)
+                entry = self._entries.get(path)
+                if entry is not None:
+                    self._entries.move_to_end(path)
+                    entry.last_access = now
+                    if lease:
+                        entry.leases += 1
+                    return entry
+                opening = self._opening.get(path)
+                if opening is None:
+                    opening = self._opening[path] = Future()
+                    break
+
+            # Another thread is opening the file; it is looked up again once open, since it may be evicted meanwhile
+            opening.result()
+
+        try:
+            entry = self._open_entry(path)
+        except BaseException as error:
+            with self._lock:
+                del self._opening[path]
+            opening.set_exception(error)
+            raise
+
+        with self._lock:
+            del self._opening[path]
+            if lease:
+                entry.leases += 1
+            self._entries[path] = entry
+            while len(self._entries) > self.max_open_files:
+                _, least_recently_used = self._entries.popitem(last=False)
+                self._close_entry(least_recently_used)
+        opening.set_result(None)
+        return entry
+
+    def _release(self, entry: _PoolEntry):
+        with self._lock:
+            entry.leases -= 1
+            if entry.evicted and not entry.leases:
+                entry.io.close()
+
+    def _resolve(self, entry: _PoolEntry, object_path: str):
+        with self._lock:
+            container = entry.objects.get(object_path)
+            if container is None:
+                container = resolve_object_path(entry.nwbfile, object_path)
+                entry.objects[object_path] = container
+            return container
+
+    def get_nwbfile(self, path: str):
+        """The NWBFile read from `path`, opening the file if it is not in the pool."""
+        return self._get_entry(path).nwbfile
+
+    def get(self, path: str, object_path: str):
+        """The container at `object_path` in the file at `path`, resolved once per open file."""
+        return self._resolve(self._get_entry(path), object_path)
+
+    @contextmanager
+    def lease(self, path: str, object_path: Optional[str] = None):
+        """
+        Context manager giving the NWBFile read from `path`, or the container at `object_path` in it, and keeping
+        the file open until it exits even if the pool evicts it meanwhile.
+        """
+        entry = self._get_entry(path, lease=True)
+        try:
+            yield entry.nwbfile if object_path is None else self._resolve(entry, object_path)
+        finally:
+            self._release(entry)
+
+    def evict(self, path: str):
+        """Close the file at `path` if it is in the pool."""
+        with self._lock:
+            entry = self._entries.pop(os.path.abspath(path), None)
+            if entry is not None:
+                self._close_entry(entry)
+
+    def close(self):
+        """Close all the files of the pool."""
+        with self._lock:
+            while self._entries:
+                _, entry = self._entries.popitem()
+                self._close_entry(entry)
+
+
+_default_pool: Optional[NWBFilePool] = None
+_default_pool_lock = threading.Lock()
+
+
+def get_default_pool() -> NWBFilePool:
+    """The pool used by `open_binned` when none is given, created on first use and closed at exit."""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = NWBFilePool()
+            atexit.register(_default_pool.close)
+        return _default_pool
+
+
+def open_binned(path: str, object_path: str, pool: Optional[NWBFilePool] = None):
+    """
+    Get a BinnedAlignedSpikes or BinnedSpikes (or any other container) from an NWB file through a pool.
+
+    The first call for a file opens and reads it; later calls return the same container without reopening the file
+    or rebuilding the containers.
+
+    Parameters
+    ----------
+    path : str
+        The path of the NWB file.
+    object_path : str
+        The location of the container in the file, e.g. "processing/ecephys/BinnedAlignedSpikes".
+    pool : NWBFilePool, optional
+        The pool to use. Defaults to a shared pool that is closed at exit.
+
+    Returns
+    -------
+    The container. It stays usable while its file is in the pool.
+    """
+    if pool is None:
+        pool = get_default_pool()
+    return pool.get(path, object_path)
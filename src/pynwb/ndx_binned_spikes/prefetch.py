@@ -0,0 +1,77 @@
+"""Read-ahead of sequential reads on a background thread."""
+
+import queue
+import threading
+from typing import Callable, Iterable, Iterator, TypeVar
+
+T = TypeVar("T")
+
+_ITEM, _ERROR, _DONE = range(3)
+
+# How often a producer blocked on a full queue checks whether the consumer went away
+_PUT_TIMEOUT_IN_SECONDS = 0.1
+
+
+def iter_prefetched(reads: Iterable[Callable[[], T]], prefetch: int) -> Iterator[T]:
+    """
+    Call `reads` in order on a background thread and yield their results in the same order.
+
+    At most `prefetch` results wait in the queue while the caller processes the current one, so at most
+    `prefetch + 2` results (queued, being processed and being read) are in memory at any time. Exceptions raised
+    by a read are re-raised in the caller when its result is reached. If the caller stops iterating early the
+    background thread stops after its current read.
+
+    Parameters
+    ----------
+    reads : iterable of callables
+        Functions without arguments that perform each read.
+    prefetch : int
+        The number of results to read ahead. With 0 the reads are done in the calling thread.
+
+    Yields
+    ------
+    The result of each read.
+    """
+    if prefetch < 0:
+        raise ValueError(f"`prefetch` should be a non-negative integer, got {prefetch}.")
+
+    if prefetch == 0:
+        for read in reads:
+            yield read()
+        return
+
+    results = queue.Queue(maxsize=prefetch)
+    stop = threading.Event()
+
+    def put(message):
+        while not stop.is_set():
+            try:
+                results.put(message, timeout=_PUT_TIMEOUT_IN_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for read in reads:
+                if stop.is_set() or not put((_ITEM, read())):
+                    return
+        except BaseException as exception:  # re-raised in the consumer
+            put((_ERROR, exception))
+            return
+        put((_DONE, None))
+
+    producer = threading.Thread(target=produce, name="ndx-binned-spikes-prefetch", daemon=True)
+    producer.start()
+    try:
+        while True:
+            kind, value = results.get()
+            if kind == _DONE:
+                return
+            if kind == _ERROR:
+                raise value
+            yield value
+    finally:
+        stop.set()
+        producer.join()
@@ -0,0 +1,443 @@
+"""
+Out-of-core rechunking of the data of BinnedSpikes and BinnedAlignedSpikes to change their access pattern.
+
+A dataset written unit by unit (chunks like `(1, number_of_events, number_of_bins)`) is slow to read by event or by
+condition, and the other way around. `rechunk_binned` writes a copy of an NWB file where the data of the binned
+containers has new storage chunks, without ever holding more than `max_memory_in_bytes` of data:
+
+    rechunk_binned("session.nwb", "session_by_event.nwb", target_chunks=(None, 64, None))
+
+When a block that is aligned with both the source and the target chunks fits in memory the data is copied in a
+single pass. Otherwise it is copied in two passes through a temporary dataset whose chunks are the smaller of the
+source and target chunks along each axis, so the first pass reads whole source chunks and the second pass writes
+whole target chunks. The blocks of each pass are read in a pool of threads while the previous ones are written.
+
+The binned data is written by `NWBHDF5IO.export` through `set_data_io`, wrapped in an `H5DataIO` with the target
+chunks around an iterator over the blocks of the last pass, together with the rest of the file, including the
+attributes of the containers and their `units_region` links.
+"""
+
+import math
+import os
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Iterator, Mapping, Optional, Sequence, Tuple, Union
+
+import h5py
+import numpy as np
+from hdmf.data_utils import AbstractDataChunkIterator, DataChunk
+
+from .pool import resolve_object_path
+from .utils import read_block
+
+DEFAULT_MAX_MEMORY_IN_BYTES = 512 * 1024**2
+DEFAULT_MAX_WORKERS = 4
+
+# The storage properties of the source dataset that are kept in the rechunked dataset
+_STORAGE_PROPERTIES = ("compression", "compression_opts", "shuffle", "fletcher32", "scaleoffset", "fillvalue")
+
+ChunkShape = Tuple[Optional[int], ...]
+
+
+@dataclass(frozen=True)
+class RechunkPlan:
+    """How a dataset is copied from its source chunks to the target chunks."""
+
+    #: The chunks of the temporary dataset, or None when the data is copied in a single pass
+    intermediate_chunks: Optional[Tuple[int, ...]]
+    #: The shape of the blocks copied in each pass
+    block_shapes: Tuple[Tuple[int, ...], ...]
+
+    @property
+    def number_of_passes(self) -> int:
+        return len(self.block_shapes)
+
+
+def _fit_block_shape(base_shape: Sequence[int], shape: Sequence[int], max_items: int) -> Tuple[int, ...]:
+    """
+    A block shape close to `base_shape` with at most `max_items` entries.
+
+    Blocks larger than the budget are halved along their largest axis. Blocks that fit are then enlarged by whole
+    multiples of `base_shape`, from the first axis to the last, to copy the data in fewer and larger reads.
+    """
+    block_shape = [max(1, min(base, length)) for base, length in zip(base_shape, shape)]
+    while math.prod(block_shape) > max_items and max(block_shape) > 1:
+        largest_axis = int(np.argmax(block_shape))
+        block_shape[largest_axis] = (block_shape[largest_axis] + 1) // 2
+
+    for axis, length in enumerate(shape):
+        factor = max_items // math.prod(block_shape)
+        if factor < 2:
+            break
+        block_shape[axis] = min(length, block_shape[axis] * factor)
+
+    return tuple(block_shape)
+
+
+def plan_rechunk(
+    shape: Sequence[int],
+    itemsize: int,
+    source_chunks: Sequence[int],
+    target_chunks: Sequence[int],
+    max_memory_in_bytes: int = DEFAULT_MAX_MEMORY_IN_BYTES,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+) -> RechunkPlan:
+    """
+    Choose the passes and block shapes to rechunk a dataset within a memory budget.
+
+    Parameters
+    ----------
+    shape : sequence of int
+        The shape of the dataset.
+    itemsize : int
+        The size in bytes of each entry.
+    source_chunks, target_chunks : sequence of int
+        The storage chunks of the source and of the rechunked dataset.
+    max_memory_in_bytes : int, default: 512 MiB
+        The maximum size of the blocks held in memory at the same time.
+    max_workers : int, default: 4
+        The number of blocks read at the same time; each block gets an equal share of the memory budget.
+
+    Returns
+    -------
+    RechunkPlan
+    """
+    max_items = max_memory_in_bytes // (itemsize * max_workers)
+    if max_items < 1:
+        raise ValueError(f"`max_memory_in_bytes` is too small to hold {max_workers} entries of {itemsize} bytes.")
+
+    aligned_shape = [
+        min(math.lcm(source, target), length) for source, target, length in zip(source_chunks, target_chunks, shape)
+    ]
+    if math.prod(aligned_shape) <= max_items:
+        return RechunkPlan(intermediate_chunks=None, block_shapes=(_fit_block_shape(aligned_shape, shape, max_items),))
+
+    intermediate_chunks = tuple(min(source, target) for source, target in zip(source_chunks, target_chunks))
+    return RechunkPlan(
+        intermediate_chunks=intermediate_chunks,
+        block_shapes=(
+            _fit_block_shape(source_chunks, shape, max_items),
+            _fit_block_shape(target_chunks, shape, max_items),
+        ),
+    )
+
+
+def _iter_blocks(shape: Sequence[int], block_shape: Sequence[int]) -> Iterator[Tuple[slice, ...]]:
+    starts = [range(0, length, step) for length, step in zip(shape, block_shape)]
+    for block_start in np.ndindex(*[len(axis_starts) for axis_starts in starts]):
+        yield tuple(
+            slice(axis_starts[index], min(axis_starts[index] + step, length))
+            for axis_starts, index, step, length in zip(starts, block_start, block_shape, shape)
+        )
+
+
+def _read_blocks(
+    source, block_shape: Sequence[int], max_workers: int
+) -> Iterator[Tuple[Tuple[slice, ...], np.ndarray]]:
+    """Yield the selection and the data of each block of `source` in order, reading up to `max_workers` ahead."""
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ndx-binned-spikes-rechunk") as executor:
+        pending = deque()
+        for selection in _iter_blocks(source.shape, block_shape):
+            if len(pending) == max_workers:
+                read_selection, future = pending.popleft()
+                yield read_selection, future.result()
+            pending.append((selection, executor.submit(read_block, source, selection)))
+
+        while pending:
+            read_selection, future = pending.popleft()
+            yield read_selection, future.result()
+
+
+def copy_blocks(source, destination, block_shape: Sequence[int], max_workers: int = DEFAULT_MAX_WORKERS):
+    """
+    Copy `source` into `destination` block by block, reading up to `max_workers` blocks at the same time.
+
+    The blocks are written in order in the calling thread as soon as they are read, so at most `max_workers` blocks
+    are in memory.
+    """
+    for selection, block in _read_blocks(source, block_shape, max_workers):
+        destination[selection] = block
+
+
+def _get_source_chunks(dataset) -> Tuple[int, ...]:
+    if dataset.chunks is not None:
+        return tuple(dataset.chunks)
+
+    # Contiguous datasets are stored in C order, so reading whole trailing axes is sequential
+    return (1,) + tuple(dataset.shape[1:])
+
+
+def _normalize_target_chunks(target_chunks: ChunkShape, shape: Sequence[int], object_path: str) -> Tuple[int, ...]:
+    if len(target_chunks) != len(shape):
+        raise ValueError(
+            f"The target chunks {tuple(target_chunks)} of '{object_path}' should have {len(shape)} dimensions."
+        )
+    if any(chunk is not None and chunk < 1 for chunk in target_chunks):
+        raise ValueError(f"The target chunks {tuple(target_chunks)} of '{object_path}' should be positive.")
+
+    return tuple(
+        max(1, length) if chunk is None else max(1, min(chunk, length)) for chunk, length in zip(target_chunks, shape)
+    )
+
+
+def rechunk_dataset(
+    source,
+    group,
+    name: str,
+    target_chunks: Sequence[int],
+    max_memory_in_bytes: int = DEFAULT_MAX_MEMORY_IN_BYTES,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+):
+    """
+    Write a copy of the h5py dataset `source` with `target_chunks` as `group[name]`.
+
+    The compression and other filters of `source` are kept. A two pass copy stores its temporary dataset in `group`
+    and deletes it at the end.
+
+    Returns
+    -------
+    h5py.Dataset
+        The rechunked dataset.
+    """
+    plan = plan_rechunk(
+        shape=source.shape,
+        itemsize=source.dtype.itemsize,
+        source_chunks=_get_source_chunks(source),
+        target_chunks=target_chunks,
+        max_memory_in_bytes=max_memory_in_bytes,
+        max_workers=max_workers,
+    )
+    storage_properties = {property_name: getattr(source, property_name) for property_name in _STORAGE_PROPERTIES}
+    destination = group.create_dataset(
+        name, shape=source.shape, dtype=source.dtype, chunks=tuple(target_chunks), **storage_properties
+    )
+
+    if plan.intermediate_chunks is None:
+        copy_blocks(source, destination, plan.block_shapes[0], max_workers=max_workers)
+        return destination
+
+    intermediate_name = f"{name}__intermediate"
+    intermediate = group.create_dataset(
+        intermediate_name, shape=source.shape, dtype=source.dtype, chunks=plan.intermediate_chunks
+    )
+    copy_blocks(source, intermediate, plan.block_shapes[0], max_workers=max_workers)
+    copy_blocks(intermediate, destination, plan.block_shapes[1], max_workers=max_workers)
+    del group[intermediate_name]
+
+    return destination
+
+
+class RechunkIterator(AbstractDataChunkIterator):
+    """
+    Iterate over the blocks of an h5py dataset in the order that writes whole `target_chunks`, to wrap in `H5DataIO`.
+
+    When the blocks aligned with both the source and the target chunks do not fit in memory, the first iteration
+    copies the data to a temporary dataset in `temporary_group` (see `plan_rechunk`) and the blocks are read from it.
+
+    Parameters
+    ----------
+    data : h5py.Dataset
+        The dataset to rechunk.
+    target_chunks : sequence of int
+        The chunks of the written dataset.
+    temporary_group : h5py.Group
+        Where to store the temporary dataset of a two pass copy.
+    name : str
+        The name of the temporary dataset.
+    max_memory_in_bytes : int, default: 512 MiB
+        The maximum size of the blocks held in memory at the same time.
+    max_workers : int, default: 4
+        The number of blocks read at the same time.
+    """
+
+    def __init__(
+        self,
+        data,
+        target_chunks: Sequence[int],
+        temporary_group,
+        name: str,
+        max_memory_in_bytes: int = DEFAULT_MAX_MEMORY_IN_BYTES,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+    ):
+        self.data = data
+        self.target_chunks = tuple(target_chunks)
+        self.plan = plan_rechunk(
+            shape=data.shape,
+            itemsize=data.dtype.itemsize,
+            source_chunks=_get_source_chunks(data),
+            target_chunks=self.target_chunks,
+            max_memory_in_bytes=max_memory_in_bytes,
+            max_workers=max_workers,
+        )
+        self._temporary_group = temporary_group
+        self._name = name
+        self._max_workers = max_workers
+        self._blocks = None
+
+    def _start(self):
+        source = self.data
+        if self.plan.intermediate_chunks is not None:
+            source = self._temporary_group.create_dataset(
+                self._name, shape=self.data.shape, dtype=self.data.dtype, chunks=self.plan.intermediate_chunks
+            )
+            copy_blocks(self.data, source, self.plan.block_shapes[0], max_workers=self._max_workers)
+        return _read_blocks(source, self.plan.block_shapes[-1], self._max_workers)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> DataChunk:
+        if self._blocks is None:
+            self._blocks = self._start()
+        selection, block = next(self._blocks)
+        return DataChunk(data=block, selection=selection)
+
+    def recommended_chunk_shape(self) -> Tuple[int, ...]:
+        return self.target_chunks
+
+    def recommended_data_shape(self) -> Tuple[int, ...]:
+        return tuple(self.data.shape)
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.data.dtype
+
+    @property
+    def maxshape(self) -> Tuple[int, ...]:
+        return tuple(self.data.shape)
+
+
+def _get_stored_dataset(container):
+    """The HDF5 dataset that stores the data of a binned container, `window_data` for overlapping windows."""
+    from .windows import OverlappingWindowsData
+
+    data = container.data
+    return data.window_data if isinstance(data, OverlappingWindowsData) else data
+
+
+def _set_stored_data_io(container, data_io_kwargs: dict, iterator_kwargs: dict):
+    """Wrap the stored dataset of a container in an `H5DataIO` around a `RechunkIterator` for the export."""
+    from hdmf.backends.hdf5 import H5DataIO
+
+    from .windows import OverlappingWindowsData
+
+    data_io_arguments = dict(
+        data_io_class=H5DataIO,
+        data_io_kwargs=data_io_kwargs,
+        data_chunk_iterator_class=RechunkIterator,
+        data_chunk_iterator_kwargs=iterator_kwargs,
+    )
+    if isinstance(container.data, OverlappingWindowsData):
+        container.data.set_data_io(**data_io_arguments)
+    else:
+        container.set_data_io(dataset_name="data", **data_io_arguments)
+    # Export writes the unmodified containers from the builders read from the source file
+    container.set_modified()
+
+
+def _find_binned_containers(nwbfile) -> dict:
+    from .binned_aligned_spikes import BinnedAlignedSpikes
+    from .binned_spikes import BinnedSpikes
+
+    binned_types = (BinnedSpikes, BinnedAlignedSpikes)
+    containers = [container for container in nwbfile.objects.values() if isinstance(container, binned_types)]
+    # The containers were read from the file, so their location is the group of their stored dataset
+    return {_get_stored_dataset(container).parent.name.lstrip("/"): container for container in containers}
+
+
+def rechunk_binned(
+    src_path: str,
+    dst_path: str,
+    target_chunks: Union[ChunkShape, Mapping[str, ChunkShape]],
+    max_memory_in_bytes: int = DEFAULT_MAX_MEMORY_IN_BYTES,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    temporary_directory: Optional[str] = None,
+):
+    """
+    Write a copy of the NWB file at `src_path` where the data of the binned containers has new storage chunks.
+
+    Parameters
+    ----------
+    src_path : str
+        The path of the NWB file to rechunk.
+    dst_path : str
+        The path of the NWB file to write.
+    target_chunks : tuple or dict
+        The new chunks of the data, with `None` for the full length of an axis, e.g. `(None, 64, None)` to read
+        blocks of 64 events of all the units. A tuple is used for every BinnedSpikes and BinnedAlignedSpikes of the
+        file whose data has as many dimensions, and the others are left unchanged; a dictionary maps the location of
+        some of them in the file (e.g. "processing/ecephys/BinnedAlignedSpikes") to their chunks. The data of a
+        BinnedAlignedSpikes stored as overlapping windows is its 2D `window_data`, with chunks of
+        (units, covered bins).
+    max_memory_in_bytes : int, default: 512 MiB
+        The maximum size of the data held in memory at the same time.
+    max_workers : int, default: 4
+        The number of blocks read at the same time.
+    temporary_directory : str, optional
+        Where to store the rechunked datasets before they are written to `dst_path`. Defaults to the directory of
+        `dst_path`, which needs room for them.
+    """
+    from pynwb import NWBHDF5IO
+
+    if os.path.abspath(src_path) == os.path.abspath(dst_path):
+        raise ValueError("`dst_path` should be different from `src_path`.")
+
+    if temporary_directory is None:
+        temporary_directory = os.path.dirname(os.path.abspath(dst_path))
+
+    with NWBHDF5IO(src_path, mode="r") as src_io:
+        nwbfile = src_io.read()
+        if isinstance(target_chunks, Mapping):
+            containers = {path.strip("/"): resolve_object_path(nwbfile, path) for path in target_chunks}
+            chunks_per_path = {path.strip("/"): chunks for path, chunks in target_chunks.items()}
+        else:
+            containers = _find_binned_containers(nwbfile)
+            if not containers:
+                raise ValueError(f"There are no BinnedSpikes or BinnedAlignedSpikes in '{src_path}'.")
+            # A tuple only applies to the stored datasets with as many dimensions
+            containers = {
+                path: container
+                for path, container in containers.items()
+                if _get_stored_dataset(container).ndim == len(target_chunks)
+            }
+            if not containers:
+                raise ValueError(
+                    f"There are no BinnedSpikes or BinnedAlignedSpikes with {len(target_chunks)} dimensions in "
+                    f"'{src_path}'."
+                )
+            chunks_per_path = {path: target_chunks for path in containers}
+
+        file_descriptor, temporary_path = tempfile.mkstemp(suffix=".h5", dir=temporary_directory)
+        os.close(file_descriptor)
+        try:
+            with h5py.File(temporary_path, mode="w") as temporary_file:
+                for index, (object_path, container) in enumerate(containers.items()):
+                    source = _get_stored_dataset(container)
+                    if not isinstance(source, h5py.Dataset):
+                        raise TypeError(f"The data of '{object_path}' is not stored in an HDF5 dataset.")
+
+                    chunks = _normalize_target_chunks(chunks_per_path[object_path], source.shape, object_path)
+                    # H5DataIO has no scale-offset filter, so the other storage properties of the source are kept
+                    storage_properties = {
+                        property_name: getattr(source, property_name)
+                        for property_name in _STORAGE_PROPERTIES
+                        if property_name != "scaleoffset"
+                    }
+                    _set_stored_data_io(
+                        container,
+                        data_io_kwargs=dict(chunks=chunks, **storage_properties),
+                        iterator_kwargs=dict(
+                            target_chunks=chunks,
+                            temporary_group=temporary_file,
+                            name=f"data_{index}",
+                            max_memory_in_bytes=max_memory_in_bytes,
+                            max_workers=max_workers,
+                        ),
+                    )
+
+                with NWBHDF5IO(dst_path, mode="w") as dst_io:
+                    dst_io.export(src_io=src_io, nwbfile=nwbfile)
+        finally:
+            os.remove(temporary_path)
@@ -0,0 +1,324 @@
+"""
+Bootstrap confidence intervals of PSTHs and permutation tests between conditions of a BinnedAlignedSpikes.
+
+The data is read once. Each resample is a set of weights over the events (how many times each event is drawn, or
+whether it is assigned to the first condition), so a batch of resamples is a weight matrix and its statistics for
+all the units and bins are obtained with a single matrix product. Batches are evaluated in parallel threads; the
+random draws only depend on `seed`, not on the number of threads.
+
+With a `validity_mask`, the invalid counts are replaced by zeros and each mean is divided by the number of valid
+events in the resample, obtained with the same weights applied to the validity of the events.
+"""
+
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional, Sequence
+
+import numpy as np
+
+from .utils import get_chunk_length, iter_slices, read_block
+
+ALTERNATIVES = ("two-sided", "greater", "less")
+STATISTICS = ("mean", "rate")
+
+# The size of the (resamples, features) blocks of statistics computed at a time
+_BLOCK_SIZE_IN_BYTES = 64 * 1024**2
+
+_RELATIVE_TOLERANCE = 1e-12
+
+
+@dataclass
+class BootstrapResult:
+    """Bootstrap estimates of the PSTH of each condition."""
+
+    #: The condition indices, in the order of the first axis of the arrays
+    conditions: np.ndarray
+    #: The PSTH of the events, with shape (number_of_conditions, number_of_units, number_of_bins)
+    estimate: np.ndarray
+    #: The standard deviation of the resampled PSTHs
+    standard_error: np.ndarray
+    #: The lower bound of the percentile confidence interval
+    confidence_low: np.ndarray
+    #: The upper bound of the percentile confidence interval
+    confidence_high: np.ndarray
+
+
+@dataclass
+class PermutationResult:
+    """The result of a permutation test between the spike counts of two conditions."""
+
+    #: The mean count of the first condition minus the mean count of the second one, for each unit
+    difference: np.ndarray
+    #: The p-value of each unit
+    p_values: np.ndarray
+    n_resamples: int
+    alternative: str
+
+
+def _draw_bootstrap_weights(rng: np.random.Generator, n_resamples: int, number_of_events: int) -> np.ndarray:
+    """The number of times each event is drawn in each resample, as a (n_resamples, number_of_events) matrix."""
+    draws = rng.integers(0, number_of_events, size=(n_resamples, number_of_events))
+    draws += np.arange(n_resamples)[:, np.newaxis] * number_of_events
+    weights = np.bincount(draws.ravel(), minlength=n_resamples * number_of_events)
+    return weights.reshape(n_resamples, number_of_events).astype("float64")
+
+
+def _draw_permutation_weights(rng: np.random.Generator, n_resamples: int, number_of_events: int, size_a: int):
+    """Indicators of the events assigned to the first condition in each random relabeling of the events."""
+    permutations = rng.permuted(np.tile(np.arange(number_of_events), (n_resamples, 1)), axis=1)
+    weights = np.zeros((n_resamples, number_of_events), dtype="float64")
+    np.put_along_axis(weights, permutations[:, :size_a], 1.0, axis=1)
+    return weights
+
+
+def _map(function, items, max_workers: Optional[int]):
+    if max_workers == 1 or len(items) < 2:
+        return [function(item) for item in items]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(function, items))
+
+
+def bootstrap_psth(
+    binned_aligned_spikes,
+    n_resamples: int = 1000,
+    statistic: str = "mean",
+    conditions: Optional[Sequence[int]] = None,
+    confidence_level: float = 0.95,
+    seed=None,
+    max_workers: Optional[int] = None,
+) -> BootstrapResult:
+    """
+    Bootstrap the PSTH of each condition by resampling its events with replacement.
+
+    Each condition is read once. The resampled PSTHs are the products of a (n_resamples, events) matrix with the
+    number of times each event is drawn and the (events, units x bins) data, evaluated in blocks of units and bins.
+    With a `validity_mask` the means only include the valid events; the resamples without valid events of a unit
+    and bin are left out of its standard error and interval, which are NaN if it has no valid event.
+
+    Parameters
+    ----------
+    binned_aligned_spikes : BinnedAlignedSpikes
+        The data.
+    n_resamples : int, default: 1000
+        The number of bootstrap resamples.
+    statistic : str, default: "mean"
+        "mean" for the mean count per bin, or "rate" for the mean firing rate in Hz.
+    conditions : sequence of int, optional
+        The condition indices to bootstrap. Defaults to all the conditions.
+    confidence_level : float, default: 0.95
+        The coverage of the percentile confidence intervals.
+    seed : int or np.random.SeedSequence, optional
+        The seed of the random draws, for reproducible results.
+    max_workers : int, optional
+        The number of threads evaluating the blocks of units and bins. With 1 everything runs in the calling thread.
+
+    Returns
+    -------
+    BootstrapResult
+    """
+    if statistic not in STATISTICS:
+        raise ValueError(f"`statistic` should be one of {STATISTICS}, got '{statistic}'.")
+    if not 0 < confidence_level < 1:
+        raise ValueError(f"`confidence_level` should be between 0 and 1, got {confidence_level}.")
+
+    if conditions is None:
+        if binned_aligned_spikes.has_multiple_conditions:
+            conditions = np.unique(np.asarray(binned_aligned_spikes.condition_indices[:]))
+        else:
+            conditions = np.zeros(1, dtype="uint64")
+    conditions = np.asarray(conditions)
+
+    number_of_units = binned_aligned_spikes.number_of_units
+    number_of_bins = binned_aligned_spikes.number_of_bins
+    scale = 1000.0 / binned_aligned_spikes.bin_width_in_ms if statistic == "rate" else 1.0
+    tail = (1.0 - confidence_level) / 2.0
+
+    output_shape = (conditions.size, number_of_units * number_of_bins)
+    estimate, standard_error, confidence_low, confidence_high = (np.empty(output_shape) for _ in range(4))
+
+    rngs = [np.random.default_rng(child) for child in np.random.SeedSequence(seed).spawn(conditions.size)]
+    for position, (condition_index, rng) in enumerate(zip(conditions, rngs)):
+        condition_data = np.asanyarray(binned_aligned_spikes.get_data_for_condition(int(condition_index))[:])
+        number_of_events = condition_data.shape[1]
+        if number_of_events == 0:
+            raise ValueError(f"Condition {condition_index} has no events.")
+
+        # One row per event with the bins of all the units, with the invalid counts set to zero
+        events = _to_event_rows(np.ma.filled(condition_data, 0)).astype("float64")
+        weights = _draw_bootstrap_weights(rng, n_resamples, number_of_events)
+        valid_events = None
+        if np.ma.isMaskedArray(condition_data):
+            valid_events = _to_event_rows(~np.ma.getmaskarray(condition_data)).astype("float64")
+        else:
+            weights *= scale / number_of_events
+
+        features_per_block = max(1, _BLOCK_SIZE_IN_BYTES // (8 * n_resamples))
+        feature_slices = list(iter_slices(events.shape[1], features_per_block))
+
+        def evaluate(feature_slice):
+            if valid_events is None:
+                resampled = weights @ events[:, feature_slice]
+                low, high = np.quantile(resampled, [tail, 1.0 - tail], axis=0)
+                return resampled.std(axis=0, ddof=1), low, high
+
+            with np.errstate(divide="ignore", invalid="ignore"):
+                resampled = scale * (weights @ events[:, feature_slice]) / (weights @ valid_events[:, feature_slice])
+            with warnings.catch_warnings():
+                # Units and bins without any valid event are all NaN
+                warnings.simplefilter("ignore", RuntimeWarning)
+                low, high = np.nanquantile(resampled, [tail, 1.0 - tail], axis=0)
+                return np.nanstd(resampled, axis=0, ddof=1), low, high
+
+        for feature_slice, (block_error, block_low, block_high) in zip(
+            feature_slices, _map(evaluate, feature_slices, max_workers)
+        ):
+            standard_error[position, feature_slice] = block_error
+            confidence_low[position, feature_slice] = block_low
+            confidence_high[position, feature_slice] = block_high
+        if valid_events is None:
+            estimate[position] = events.mean(axis=0) * scale
+        else:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                estimate[position] = events.sum(axis=0) / valid_events.sum(axis=0) * scale
+
+    shape = (conditions.size, number_of_units, number_of_bins)
+    return BootstrapResult(
+        conditions=conditions,
+        estimate=estimate.reshape(shape),
+        standard_error=standard_error.reshape(shape),
+        confidence_low=confidence_low.reshape(shape),
+        confidence_high=confidence_high.reshape(shape),
+    )
+
+
+def _to_event_rows(condition_data: np.ndarray) -> np.ndarray:
+    """The (units, events, bins) data as (events, units x bins) rows."""
+    return condition_data.transpose(1, 0, 2).reshape(condition_data.shape[1], -1)
+
+
+def get_event_counts(binned_aligned_spikes, bin_slice: slice = slice(None), events_per_chunk: Optional[int] = None):
+    """
+    The spike count of each unit in each event summed over `bin_slice`, as an (events, units) array.
+
+    With a `validity_mask` it is a masked array where the counts with an invalid bin in `bin_slice` are masked
+    and set to zero.
+    """
+    data = binned_aligned_spikes._readable_data
+    number_of_units, number_of_events, _ = data.shape
+    counts = np.empty((number_of_events, number_of_units), dtype="float64")
+    validity_mask = getattr(binned_aligned_spikes, "validity_mask", None)
+    valid = None if validity_mask is None else np.empty(counts.shape, dtype=bool)
+
+    events_per_chunk = events_per_chunk or get_chunk_length(data, axis=1)
+    for event_slice in iter_slices(number_of_events, events_per_chunk):
+        selection = (slice(None), event_slice, bin_slice)
+        counts[event_slice] = read_block(data, selection).sum(axis=2).T
+        if valid is not None:
+            valid[event_slice] = validity_mask.get_valid(data.shape, selection).all(axis=2).T
+
+    if valid is None:
+        return counts
+    counts[~valid] = 0.0
+    return np.ma.MaskedArray(counts, mask=~valid)
+
+
+def permutation_test(
+    binned_aligned_spikes,
+    condition_a: int,
+    condition_b: int,
+    bin_slice: slice = slice(None),
+    n_resamples: int = 10_000,
+    alternative: str = "two-sided",
+    seed=None,
+    max_workers: Optional[int] = None,
+    resamples_per_batch: int = 1000,
+) -> PermutationResult:
+    """
+    Test, for each unit, whether the mean spike count differs between the events of two conditions.
+
+    The counts summed over `bin_slice` are computed once for every event. The events of both conditions are
+    randomly relabeled `n_resamples` times; each batch of relabelings is a matrix of indicators of the events
+    assigned to `condition_a`, and its differences of means for all the units are one matrix product. With a
+    `validity_mask` the counts with an invalid bin in `bin_slice` are left out of the means; units without valid
+    counts in one of the conditions have a NaN difference and p-value.
+
+    Parameters
+    ----------
+    binned_aligned_spikes : BinnedAlignedSpikes
+        The data.
+    condition_a, condition_b : int
+        The condition indices to compare.
+    bin_slice : slice, default: slice(None)
+        The bins summed to obtain the spike count of each event, e.g. the response window.
+    n_resamples : int, default: 10000
+        The number of random relabelings.
+    alternative : str, default: "two-sided"
+        "two-sided", "greater" (the mean of `condition_a` is larger) or "less".
+    seed : int or np.random.SeedSequence, optional
+        The seed of the random draws, for reproducible results.
+    max_workers : int, optional
+        The number of threads evaluating the batches. With 1 everything runs in the calling thread.
+    resamples_per_batch : int, default: 1000
+        The number of relabelings evaluated together.
+
+    Returns
+    -------
+    PermutationResult
+        The observed differences of means and the p-values, `(1 + extreme null differences) / (1 + n_resamples)`.
+    """
+    if alternative not in ALTERNATIVES:
+        raise ValueError(f"`alternative` should be one of {ALTERNATIVES}, got '{alternative}'.")
+    if not binned_aligned_spikes.has_multiple_conditions:
+        raise ValueError(f"'{binned_aligned_spikes.name}' has no conditions to compare.")
+
+    condition_indices = np.asarray(binned_aligned_spikes.condition_indices[:])
+    events_a = np.flatnonzero(condition_indices == condition_a)
+    events_b = np.flatnonzero(condition_indices == condition_b)
+    if events_a.size == 0 or events_b.size == 0:
+        raise ValueError(f"Both conditions should have events: {events_a.size} and {events_b.size} found.")
+
+    all_counts = get_event_counts(binned_aligned_spikes, bin_slice=bin_slice)
+    events = np.concatenate((events_a, events_b))
+    counts = np.ma.getdata(all_counts)[events]
+    size_a = events_a.size
+    total = counts.sum(axis=0)
+    # The number of valid counts of each unit, or None when they are all valid
+    valid = None
+    if np.ma.isMaskedArray(all_counts):
+        valid = (~np.ma.getmaskarray(all_counts))[events].astype("float64")
+        total_valid = valid.sum(axis=0)
+    else:
+        total_valid = float(events.size)
+
+    def difference_of_means(sum_a, valid_a):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return sum_a / valid_a - (total - sum_a) / (total_valid - valid_a)
+
+    valid_a = size_a if valid is None else valid[:size_a].sum(axis=0)
+    observed = difference_of_means(counts[:size_a].sum(axis=0), valid_a)
+    # Relabelings as extreme as the observed one should not be missed because of rounding errors
+    tolerance = _RELATIVE_TOLERANCE * np.maximum(np.abs(observed), 1.0)
+
+    batch_sizes = [batch.stop - batch.start for batch in iter_slices(n_resamples, resamples_per_batch)]
+    seeds = np.random.SeedSequence(seed).spawn(len(batch_sizes))
+
+    def count_extreme(batch):
+        batch_size, batch_seed = batch
+        weights = _draw_permutation_weights(np.random.default_rng(batch_seed), batch_size, counts.shape[0], size_a)
+        null = difference_of_means(weights @ counts, size_a if valid is None else weights @ valid)
+        if alternative == "greater":
+            return (null >= observed - tolerance).sum(axis=0)
+        if alternative == "less":
+            return (null <= observed + tolerance).sum(axis=0)
+        return (np.abs(null) >= np.abs(observed) - tolerance).sum(axis=0)
+
+    extreme = np.sum(_map(count_extreme, list(zip(batch_sizes, seeds)), max_workers), axis=0)
+    p_values = np.where(np.isnan(observed), np.nan, (1.0 + extreme) / (1.0 + n_resamples))
+    return PermutationResult(
+        difference=observed,
+        p_values=p_values,
+        n_resamples=n_resamples,
+        alternative=alternative,
+    )
@@ -0,0 +1,592 @@
+"""
+BinnedAlignedSpikes split across several NWB files along the event or the unit axis.
+
+Each shard is a regular NWB file with a BinnedAlignedSpikes holding a contiguous range of the events (or of the
+units) of the experiment, so shards can be written independently, e.g. concurrently on separate nodes. A JSON
+manifest lists the shards in order together with the shape and the binning parameters of the whole tensor:
+
+    # On each node
+    with NWBHDF5IO(f"shard-{index}.nwb", mode="w") as io:
+        io.write(nwbfile_with_the_events_of_the_node)
+
+    # Once all the shards are written
+    write_shard_manifest("experiment.json", [(f"shard-{index}.nwb", "acquisition/BinnedAlignedSpikes") ...])
+
+    sharded = ShardedBinnedAlignedSpikes("experiment.json")
+    sharded.get_data_for_condition(2)
+
+`write_shards` splits an existing BinnedAlignedSpikes into shards and writes their manifest in one call.
+`ShardedBinnedAlignedSpikes` reads the shards spanned by each selection in parallel threads.
+"""
+
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+from .masking import ValidityMask, mask_block
+from .pool import DEFAULT_MAX_OPEN_FILES, NWBFilePool
+from .utils import expand_selection, iter_slices, normalize_axis_index, read_block
+
+MANIFEST_VERSION = 1
+DEFAULT_MAX_WORKERS = 4
+
+#: The axis of the data that is split across the shards, by name
+SHARD_AXES = {"units": 0, "events": 1}
+
+
+@dataclass(frozen=True)
+class Shard:
+    """A BinnedAlignedSpikes in an NWB file holding the entries `start:stop` of the sharded axis."""
+
+    #: The path of the NWB file, relative to the manifest unless it is absolute
+    path: str
+    #: The location of the BinnedAlignedSpikes in the file, e.g. "acquisition/BinnedAlignedSpikes"
+    object_path: str
+    start: int
+    stop: int
+
+
+def _check_axis(axis: str) -> int:
+    if axis not in SHARD_AXES:
+        raise ValueError(f"`axis` should be one of {tuple(SHARD_AXES)}, got '{axis}'.")
+    return SHARD_AXES[axis]
+
+
+def get_shard(binned_aligned_spikes, start: int, stop: int, axis: str = "events"):
+    """
+    A new BinnedAlignedSpikes with the entries `start:stop` of the events or of the units of `binned_aligned_spikes`.
+
+    The data of the shard is read into memory, with the part of the `validity_mask` that covers it. The
+    `units_region` is not kept, as the Units table is usually not in the file of the shard.
+    """
+    from .binned_aligned_spikes import BinnedAlignedSpikes
+
+    axis_index = _check_axis(axis)
+    selection = [slice(None)] * 3
+    selection[axis_index] = slice(start, stop)
+    data = read_block(binned_aligned_spikes._readable_data, tuple(selection))
+
+    event_timestamps = np.asarray(binned_aligned_spikes.event_timestamps[:])
+    condition_indices = binned_aligned_spikes.condition_indices
+    if condition_indices is not None:
+        condition_indices = np.asarray(condition_indices[:])
+    if axis == "events":
+        event_timestamps = event_timestamps[start:stop]
+        condition_indices = None if condition_indices is None else condition_indices[start:stop]
+
+    validity_mask = binned_aligned_spikes.validity_mask
+    if validity_mask is not None:
+        validity_mask = validity_mask.select(axis_index, slice(start, stop))
+
+    condition_labels = binned_aligned_spikes.condition_labels
+    return BinnedAlignedSpikes(
+        name=binned_aligned_spikes.name,
+        description=binned_aligned_spikes.description,
+        bin_width_in_ms=binned_aligned_spikes.bin_width_in_ms,
+        event_to_bin_offset_in_ms=binned_aligned_spikes.event_to_bin_offset_in_ms,
+        data=data,
+        event_timestamps=event_timestamps,
+        condition_indices=condition_indices,
+        condition_labels=None if condition_labels is None else np.asarray(condition_labels[:]),
+        validity_mask=validity_mask,
+    )
+
+
+def _open_shards(manifest_directory: str, shards: Sequence[Tuple[str, str]], pool: NWBFilePool):
+    return [pool.get(os.path.join(manifest_directory, path), object_path) for path, object_path in shards]
+
+
+def _get_condition_labels(binned_aligned_spikes) -> Optional[list]:
+    condition_labels = binned_aligned_spikes.condition_labels
+    if condition_labels is None:
+        return None
+    return [label.decode() if isinstance(label, bytes) else str(label) for label in condition_labels[:]]
+
+
+def write_shard_manifest(
+    manifest_path: str,
+    shards: Sequence[Tuple[str, str]],
+    axis: str = "events",
+    pool: Optional[NWBFilePool] = None,
+) -> dict:
+    """
+    Check that the shards form a single BinnedAlignedSpikes and write their manifest.
+
+    The shards must have the same binning parameters, condition labels and data type, and the same length on the
+    axes that are not sharded. When the events are sharded the event timestamps must keep increasing from one
+    shard to the next; when the units are sharded all the shards must have the same events.
+
+    Parameters
+    ----------
+    manifest_path : str
+        The path of the JSON manifest.
+    shards : sequence of (str, str)
+        The path of the NWB file of each shard and the location of its BinnedAlignedSpikes in the file, in the
+        order of the sharded axis. Relative paths are relative to the directory of the manifest.
+    axis : str, default: "events"
+        The sharded axis, "events" or "units".
+    pool : NWBFilePool, optional
+        The pool used to open the shards. By default a pool is created and closed when the manifest is written.
+
+    Returns
+    -------
+    dict
+        The manifest.
+    """
+    axis_index = _check_axis(axis)
+    if not shards:
+        raise ValueError("At least one shard is needed.")
+
+    manifest_directory = os.path.dirname(os.path.abspath(manifest_path))
+    owned_pool = pool is None
+    pool = pool or NWBFilePool(max_open_files=DEFAULT_MAX_OPEN_FILES)
+    try:
+        containers = _open_shards(manifest_directory, shards, pool)
+        first = containers[0]
+        reference = dict(
+            bin_width_in_ms=first.bin_width_in_ms,
+            event_to_bin_offset_in_ms=first.event_to_bin_offset_in_ms,
+            condition_labels=_get_condition_labels(first),
+            dtype=np.dtype(first.data.dtype).str,
+        )
+        other_axes_shape = [length for index, length in enumerate(first.data.shape) if index != axis_index]
+        first_event_timestamps = np.asarray(first.event_timestamps[:])
+        first_condition_indices = None if first.condition_indices is None else np.asarray(first.condition_indices[:])
+
+        shard_entries = []
+        start = 0
+        previous_last_timestamp = -np.inf
+        for (path, object_path), container in zip(shards, containers):
+            properties = dict(
+                bin_width_in_ms=container.bin_width_in_ms,
+                event_to_bin_offset_in_ms=container.event_to_bin_offset_in_ms,
+                condition_labels=_get_condition_labels(container),
+                dtype=np.dtype(container.data.dtype).str,
+            )
+            mismatches = [key for key, value in properties.items() if value != reference[key]]
+            shape = container.data.shape
+            if [length for index, length in enumerate(shape) if index != axis_index] != other_axes_shape:
+                mismatches.append("shape")
+            if (container.condition_indices is None) != (first_condition_indices is None):
+                mismatches.append("condition_indices")
+            if mismatches:
+                raise ValueError(f"The shard '{path}' does not match the first shard: different {mismatches}.")
+
+            event_timestamps = np.asarray(container.event_timestamps[:])
+            if axis == "events" and event_timestamps.size:
+                if event_timestamps[0] < previous_last_timestamp:
+                    raise ValueError(
+                        f"The events of the shard '{path}' start at {event_timestamps[0]}, before the end of the "
+                        f"previous shard at {previous_last_timestamp}. The shards should be in the order of the events."
+                    )
+                previous_last_timestamp = event_timestamps[-1]
+            if axis == "units":
+                condition_indices = container.condition_indices
+                same_conditions = condition_indices is None or np.array_equal(
+                    np.asarray(condition_indices[:]), first_condition_indices
+                )
+                if not np.array_equal(event_timestamps, first_event_timestamps) or not same_conditions:
+                    raise ValueError(f"The shard '{path}' does not have the same events as the first shard.")
+
+            stop = start + shape[axis_index]
+            shard_entries.append(dict(path=path, object_path=object_path, start=start, stop=stop))
+            start = stop
+
+        shape = list(first.data.shape)
+        shape[axis_index] = start
+        manifest = dict(
+            version=MANIFEST_VERSION,
+            name=first.name,
+            description=first.description,
+            axis=axis,
+            shape=[int(length) for length in shape],
+            has_multiple_conditions=first_condition_indices is not None,
+            has_validity_mask=any(container.validity_mask is not None for container in containers),
+            shards=shard_entries,
+            **reference,
+        )
+    finally:
+        if owned_pool:
+            pool.close()
+
+    with open(manifest_path, "w") as file:
+        json.dump(manifest, file, indent=2)
+
+    return manifest
+
+
+def write_shards(
+    binned_aligned_spikes,
+    manifest_path: str,
+    shard_length: int,
+    axis: str = "events",
+    nwbfile_kwargs: Optional[dict] = None,
+) -> dict:
+    """
+    Split a BinnedAlignedSpikes into shards of `shard_length` events or units and write them with their manifest.
+
+    The shards are written next to the manifest, in files named after it, e.g. `experiment-shard-00000.nwb`.
+
+    Parameters
+    ----------
+    binned_aligned_spikes : BinnedAlignedSpikes
+        The data to split. It can be disk-backed; one shard is read at a time.
+    manifest_path : str
+        The path of the JSON manifest.
+    shard_length : int
+        The number of events or units of each shard, the last one possibly shorter.
+    axis : str, default: "events"
+        The sharded axis, "events" or "units".
+    nwbfile_kwargs : dict, optional
+        The arguments of the NWBFile of each shard. They default to the session description and start time of the
+        file of `binned_aligned_spikes`, with one identifier per shard.
+
+    Returns
+    -------
+    dict
+        The manifest.
+    """
+    from pynwb import NWBFile, NWBHDF5IO
+
+    axis_index = _check_axis(axis)
+    if shard_length < 1:
+        raise ValueError(f"`shard_length` should be a positive integer, got {shard_length}.")
+
+    if nwbfile_kwargs is None:
+        source_nwbfile = binned_aligned_spikes.get_ancestor(neurodata_type="NWBFile")
+        if source_nwbfile is None:
+            raise ValueError(
+                f"'{binned_aligned_spikes.name}' is not in an NWBFile. Pass the arguments of the NWBFile of the shards "
+                "as `nwbfile_kwargs`."
+            )
+        nwbfile_kwargs = dict(
+            session_description=source_nwbfile.session_description,
+            identifier=source_nwbfile.identifier,
+            session_start_time=source_nwbfile.session_start_time,
+        )
+
+    manifest_directory = os.path.dirname(os.path.abspath(manifest_path))
+    stem = os.path.splitext(os.path.basename(manifest_path))[0]
+    object_path = f"acquisition/{binned_aligned_spikes.name}"
+
+    shards = []
+    length = binned_aligned_spikes.data.shape[axis_index]
+    for index, shard_slice in enumerate(iter_slices(length, shard_length)):
+        path = f"{stem}-shard-{index:05d}.nwb"
+        shard_kwargs = dict(nwbfile_kwargs)
+        shard_kwargs["identifier"] = f"{nwbfile_kwargs['identifier']}-shard-{index:05d}"
+        nwbfile = NWBFile(**shard_kwargs)
+        nwbfile.add_acquisition(get_shard(binned_aligned_spikes, shard_slice.start, shard_slice.stop, axis=axis))
+        with NWBHDF5IO(os.path.join(manifest_directory, path), mode="w") as io:
+            io.write(nwbfile)
+        shards.append((path, object_path))
+
+    return write_shard_manifest(manifest_path, shards, axis=axis)
+
+
+class ShardedData:
+    """
+    The (number_of_units, number_of_events, number_of_bins) data of a sharded BinnedAlignedSpikes.
+
+    Indexing reads only the shards spanned by the selection, in parallel threads, and returns the same values as
+    indexing the full array; at most one of the indices can be an array.
+    """
+
+    def __init__(self, shards: Sequence[Shard], axis: str, shape, dtype, lease_shard_data, executor=None):
+        self.shards = list(shards)
+        self.axis = _check_axis(axis)
+        self.shape = tuple(int(length) for length in shape)
+        self.dtype = np.dtype(dtype)
+        self._lease_shard_data = lease_shard_data
+        self._executor = executor
+        self._stops = np.array([shard.stop for shard in self.shards], dtype="int64")
+
+    @property
+    def ndim(self) -> int:
+        return 3
+
+    @property
+    def size(self) -> int:
+        return int(np.prod(self.shape))
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None):
+        array = self[...]
+        return array if dtype is None else array.astype(dtype, copy=False)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(shape={self.shape}, dtype={self.dtype}, number_of_shards={len(self.shards)})"
+
+    def _read_shard(self, shard_number: int, indices: list, local_positions: np.ndarray) -> np.ndarray:
+        """Read the selected entries of a shard, as a 3D block in the order of `local_positions`."""
+        # Disk-backed datasets need increasing indices, and only the selected positions of the shard are read
+        unique_positions, position_inverse = np.unique(local_positions, return_inverse=True)
+        steps = np.diff(unique_positions)
+        if unique_positions.size == 1 or np.all(steps == steps[0]):
+            # Evenly spaced positions, as selected by an int or a slice, are read as a slice so that another axis
+            # can still have an array index
+            step = int(steps[0]) if steps.size else 1
+            sharded_selection = slice(int(unique_positions[0]), int(unique_positions[-1]) + 1, step)
+        else:
+            sharded_selection = unique_positions
+
+        read_selection = []
+        array_takes = []
+        for axis, index in enumerate(indices):
+            if axis == self.axis:
+                read_selection.append(sharded_selection)
+            elif isinstance(index, int):
+                read_selection.append(slice(index, index + 1))
+            elif isinstance(index, slice):
+                read_selection.append(index)
+            else:
+                unique_index, inverse = np.unique(index, return_inverse=True)
+                read_selection.append(unique_index)
+                array_takes.append((axis, inverse))
+
+        with self._lease_shard_data(shard_number) as shard_data:
+            block = read_block(shard_data, tuple(read_selection))
+        for axis, inverse in array_takes:
+            block = np.take(block, inverse, axis=axis)
+        if position_inverse.size == unique_positions.size and np.all(np.diff(local_positions) > 0):
+            return block
+        return np.take(block, position_inverse, axis=self.axis)
+
+    def __getitem__(self, selection):
+        indices = [
+            normalize_axis_index(index, length) for index, length in zip(expand_selection(selection, 3), self.shape)
+        ]
+        if sum(isinstance(index, np.ndarray) for index in indices) > 1:
+            raise IndexError(f"{self.__class__.__name__} supports at most one array index.")
+
+        sharded_index = indices[self.axis]
+        if isinstance(sharded_index, int):
+            positions = np.array([sharded_index], dtype="int64")
+        elif isinstance(sharded_index, slice):
+            positions = np.arange(self.shape[self.axis])[sharded_index]
+        else:
+            positions = sharded_index.astype("int64")
+
+        output_shape = []
+        for axis, (index, length) in enumerate(zip(indices, self.shape)):
+            if axis == self.axis:
+                output_shape.append(positions.size)
+            elif isinstance(index, int):
+                output_shape.append(1)
+            elif isinstance(index, slice):
+                output_shape.append(len(range(length)[index]))
+            else:
+                output_shape.append(index.size)
+        out = np.empty(output_shape, dtype=self.dtype)
+
+        shard_of_position = np.searchsorted(self._stops, positions, side="right")
+        shard_numbers = np.unique(shard_of_position)
+        output_positions = [np.flatnonzero(shard_of_position == shard_number) for shard_number in shard_numbers]
+
+        def read(item):
+            shard_number, selected = item
+            local_positions = positions[selected] - self.shards[shard_number].start
+            return self._read_shard(int(shard_number), indices, local_positions)
+
+        items = list(zip(shard_numbers, output_positions))
+        if self._executor is None or len(items) < 2:
+            blocks = map(read, items)
+        else:
+            blocks = self._executor.map(read, items)
+        for selected, block in zip(output_positions, blocks):
+            destination = [slice(None)] * 3
+            destination[self.axis] = selected
+            out[tuple(destination)] = block
+
+        result = out[tuple(0 if isinstance(index, int) else slice(None) for index in indices)]
+        if isinstance(indices[0], int) and isinstance(indices[1], slice) and isinstance(indices[2], np.ndarray):
+            # As in numpy, the axis of an array index separated from an integer index by a slice comes first
+            return np.moveaxis(result, -1, 0)
+        return result
+
+
+class ShardedBinnedAlignedSpikes:
+    """
+    Read-only BinnedAlignedSpikes whose data is split across the shards listed in a manifest.
+
+    It has the attributes and the data access methods of BinnedAlignedSpikes (`data` slicing,
+    `get_data_for_condition`, `number_of_events`, ...). The shards are opened on first access and kept open until
+    `close` is called.
+
+    Parameters
+    ----------
+    manifest_path : str
+        The path of the manifest written by `write_shard_manifest` or `write_shards`.
+    max_workers : int, default: 4
+        The number of threads reading the shards spanned by a selection. With 1 the shards are read in the calling
+        thread.
+    pool : NWBFilePool, optional
+        The pool used to open the shards. By default the reader creates its own pool, closed by `close`. The shards
+        are leased from the pool while they are read, so a shared pool does not close them during a read.
+    """
+
+    def __init__(self, manifest_path: str, max_workers: int = DEFAULT_MAX_WORKERS, pool: Optional[NWBFilePool] = None):
+        with open(manifest_path, "r") as file:
+            manifest = json.load(file)
+        if manifest.get("version") != MANIFEST_VERSION:
+            raise ValueError(f"Unsupported manifest version {manifest.get('version')}, expected {MANIFEST_VERSION}.")
+
+        self.manifest_path = manifest_path
+        self.manifest = manifest
+        self.name = manifest["name"]
+        self.description = manifest["description"]
+        self.bin_width_in_ms = manifest["bin_width_in_ms"]
+        self.event_to_bin_offset_in_ms = manifest["event_to_bin_offset_in_ms"]
+        self.has_multiple_conditions = manifest["has_multiple_conditions"]
+        # Manifests written before the validity masks have none
+        self.has_validity_mask = manifest.get("has_validity_mask", False)
+        condition_labels = manifest["condition_labels"]
+        self.condition_labels = None if condition_labels is None else np.asarray(condition_labels)
+        self.axis = manifest["axis"]
+
+        self._directory = os.path.dirname(os.path.abspath(manifest_path))
+        self._owns_pool = pool is None
+        self._pool = pool or NWBFilePool(max_open_files=max(DEFAULT_MAX_OPEN_FILES, max_workers + 1))
+        self._executor = ThreadPoolExecutor(max_workers=max_workers) if max_workers > 1 else None
+        self.shards = [Shard(**shard) for shard in manifest["shards"]]
+        self.data = ShardedData(
+            self.shards,
+            axis=self.axis,
+            shape=manifest["shape"],
+            dtype=manifest["dtype"],
+            lease_shard_data=self._lease_shard_data,
+            executor=self._executor,
+        )
+        self._event_timestamps = None
+        self._condition_indices = None
+        self._validity_mask = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Stop the reading threads and close the shards opened by the reader's own pool."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = self.data._executor = None
+        if self._owns_pool:
+            self._pool.close()
+
+    def get_shard_container(self, shard_number: int):
+        """The BinnedAlignedSpikes of a shard, opening its file if needed."""
+        shard = self.shards[shard_number]
+        return self._pool.get(os.path.join(self._directory, shard.path), shard.object_path)
+
+    @contextmanager
+    def _lease_shard_data(self, shard_number: int):
+        """Context manager giving the data of a shard and keeping its file open until it exits."""
+        shard = self.shards[shard_number]
+        with self._pool.lease(os.path.join(self._directory, shard.path), shard.object_path) as container:
+            yield container._readable_data
+
+    def _read_event_arrays(self):
+        if self.axis == "units":
+            container = self.get_shard_container(0)
+            event_timestamps = np.asarray(container.event_timestamps[:])
+            condition_indices = container.condition_indices
+            condition_indices = None if condition_indices is None else np.asarray(condition_indices[:])
+            return event_timestamps, condition_indices
+
+        containers = [self.get_shard_container(shard_number) for shard_number in range(len(self.shards))]
+        event_timestamps = np.concatenate([np.asarray(container.event_timestamps[:]) for container in containers])
+        condition_indices = None
+        if self.has_multiple_conditions:
+            condition_indices = np.concatenate([np.asarray(container.condition_indices[:]) for container in containers])
+        return event_timestamps, condition_indices
+
+    @property
+    def event_timestamps(self) -> np.ndarray:
+        if self._event_timestamps is None:
+            self._event_timestamps, self._condition_indices = self._read_event_arrays()
+        return self._event_timestamps
+
+    @property
+    def condition_indices(self) -> Optional[np.ndarray]:
+        if self._event_timestamps is None:
+            self._event_timestamps, self._condition_indices = self._read_event_arrays()
+        return self._condition_indices
+
+    @property
+    def _readable_data(self):
+        # The analysis functions of the package read the data of a container through this attribute
+        return self.data
+
+    def _read_validity_mask(self) -> Optional[ValidityMask]:
+        masks = [self.get_shard_container(shard_number).validity_mask for shard_number in range(len(self.shards))]
+        # The axes that are not sharded keep length 1 when no shard has a mask along them
+        shape = list(self.data.shape)
+        for axis in range(3):
+            if axis != self.data.axis and all(mask is None or mask.shape[axis] == 1 for mask in masks):
+                shape[axis] = 1
+
+        parts = []
+        for shard, mask in zip(self.shards, masks):
+            part_shape = list(shape)
+            part_shape[self.data.axis] = shard.stop - shard.start
+            valid = np.ones(part_shape, dtype=bool) if mask is None else np.broadcast_to(mask.to_bool(), part_shape)
+            parts.append(valid)
+        return ValidityMask.from_bool(np.concatenate(parts, axis=self.data.axis))
+
+    @property
+    def validity_mask(self) -> Optional[ValidityMask]:
+        """The validity masks of the shards, joined along the sharded axis, or None if no shard has one."""
+        if self.has_validity_mask and self._validity_mask is None:
+            self._validity_mask = self._read_validity_mask()
+        return self._validity_mask
+
+    def get_masked_data(self, selection=Ellipsis) -> np.ndarray:
+        """Read `data[selection]` as a masked array where the invalid entries are masked."""
+        block = read_block(self.data, selection)
+        if self.validity_mask is None:
+            return np.ma.MaskedArray(block)
+        return mask_block(block, self.validity_mask, self.data.shape, selection)
+
+    def get_data_for_condition(self, condition_index):
+        if not self.has_multiple_conditions:
+            return self.data if self.validity_mask is None else self.get_masked_data()
+
+        selection = (slice(None), self.condition_indices == condition_index, slice(None))
+        return mask_block(self.data[selection], self.validity_mask, self.data.shape, selection)
+
+    def get_event_timestamps_for_condition(self, condition_index):
+        if not self.has_multiple_conditions:
+            return self.event_timestamps
+
+        return self.event_timestamps[self.condition_indices == condition_index]
+
+    @property
+    def number_of_units(self):
+        return self.data.shape[0]
+
+    @property
+    def number_of_events(self):
+        return self.data.shape[1]
+
+    @property
+    def number_of_bins(self):
+        return self.data.shape[2]
+
+    @property
+    def number_of_conditions(self):
+        if self.has_multiple_conditions:
+            return np.unique(self.condition_indices).size
+        else:
+            return 1
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(name={self.name!r}, shape={self.data.shape}, axis={self.axis!r})"
@@ -0,0 +1,132 @@
+"""Smoothing kernels used to estimate firing rates from binned spike counts."""
+
+from typing import Optional, Tuple
+
+import numpy as np
+
+KERNELS = ("gaussian", "boxcar", "exponential")
+
+# Kernels with at most this many taps are applied with shifted sums; longer ones with FFTs
+MAX_TAPS_FOR_DIRECT_CONVOLUTION = 32
+
+# The smallest total kernel weight of the valid bins for which a normalized convolution is defined
+_MIN_VALID_WEIGHT = 1e-9
+
+
+def make_kernel(kernel: str, sigma_ms: float, bin_width_in_ms: float) -> Tuple[np.ndarray, int]:
+    """
+    Build a smoothing kernel sampled at the bin width.
+
+    Parameters
+    ----------
+    kernel : str
+        One of "gaussian", "boxcar" or "exponential".
+    sigma_ms : float
+        The scale of the kernel in milliseconds: the standard deviation of the gaussian kernel, the full width of
+        the boxcar kernel, or the time constant of the causal exponential kernel.
+    bin_width_in_ms : float
+        The width of the bins the kernel is applied to.
+
+    Returns
+    -------
+    weights : np.ndarray
+        The kernel weights, normalized to sum to one.
+    origin : int
+        The index of the weight applied to the bin being estimated. Weights before the origin are applied to later
+        bins and weights after it to earlier bins, so the exponential kernel (origin 0) only looks at the past.
+    """
+    if kernel not in KERNELS:
+        raise ValueError(f"Unknown kernel '{kernel}', it should be one of {KERNELS}.")
+    if sigma_ms <= 0:
+        raise ValueError(f"`sigma_ms` should be positive, got {sigma_ms}.")
+
+    sigma_in_bins = sigma_ms / bin_width_in_ms
+
+    if kernel == "gaussian":
+        half_width = int(np.ceil(4 * sigma_in_bins))
+        taps = np.arange(-half_width, half_width + 1)
+        weights = np.exp(-0.5 * (taps / sigma_in_bins) ** 2)
+        origin = half_width
+    elif kernel == "boxcar":
+        width = max(1, int(round(sigma_in_bins)))
+        weights = np.ones(width)
+        origin = (width - 1) // 2
+    else:
+        taps = np.arange(int(np.ceil(5 * sigma_in_bins)) + 1)
+        weights = np.exp(-taps / sigma_in_bins)
+        origin = 0
+
+    return weights / weights.sum(), origin
+
+
+def _convolve_valid_direct(padded: np.ndarray, weights: np.ndarray, length: int) -> np.ndarray:
+    """Shift-and-add convolution, used for short kernels and for blocks with NaNs so they stay local."""
+    number_of_taps = weights.size
+    output = np.zeros(padded.shape[:-1] + (length,), dtype="float64")
+    for tap, weight in enumerate(weights):
+        start = number_of_taps - 1 - tap
+        output += weight * padded[..., start : start + length]
+
+    return output
+
+
+def _convolve_valid_fft(padded: np.ndarray, weights: np.ndarray, length: int) -> np.ndarray:
+    """FFT convolution over the last axis, vectorized over all the leading axes."""
+    number_of_taps = weights.size
+    fft_size = 1 << int(np.ceil(np.log2(padded.shape[-1] + number_of_taps - 1)))
+    spectrum = np.fft.rfft(padded, n=fft_size, axis=-1) * np.fft.rfft(weights, n=fft_size)
+    full = np.fft.irfft(spectrum, n=fft_size, axis=-1)
+
+    return full[..., number_of_taps - 1 : number_of_taps - 1 + length]
+
+
+def convolve_valid(padded: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """
+    Convolve the last axis of `padded` with `weights`, keeping only the fully overlapping outputs.
+
+    `padded` should already contain the context needed by the kernel: `len(weights) - 1 - origin` bins before
+    and `origin` bins after the bins to estimate. This is the overlap-save building block used to smooth the data
+    chunk by chunk.
+    """
+    padded = np.asarray(padded, dtype="float64")
+    length = padded.shape[-1] - weights.size + 1
+
+    if weights.size <= MAX_TAPS_FOR_DIRECT_CONVOLUTION or np.isnan(padded).any():
+        return _convolve_valid_direct(padded, weights, length)
+
+    return _convolve_valid_fft(padded, weights, length)
+
+
+def convolve_valid_normalized(padded: np.ndarray, valid: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """
+    Like `convolve_valid`, but only over the entries where `valid` is True, renormalizing the weights.
+
+    The output is the kernel-weighted mean of the valid entries around each bin, so invalid entries are left out
+    instead of counted as zeros. Outputs without any valid entry under the kernel are NaN.
+    """
+    valid = np.asarray(valid, dtype=bool)
+    numerator = convolve_valid(np.where(valid, padded, 0.0), weights)
+    denominator = convolve_valid(valid.astype("float64"), weights)
+    # FFT convolutions leave rounding noise where the denominator should be zero
+    covered = denominator > _MIN_VALID_WEIGHT
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(covered, numerator / np.where(covered, denominator, 1.0), np.nan)
+
+
+def convolve_same(
+    block: np.ndarray,
+    weights: np.ndarray,
+    origin: int,
+    valid: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    Convolve the last axis of `block` with `weights`, treating the bins outside `block` as zeros.
+
+    With `valid`, the invalid entries of `block` are left out with `convolve_valid_normalized`; the bins outside
+    `block` are still valid zeros.
+    """
+    pad_width = [(0, 0)] * (block.ndim - 1) + [(weights.size - 1 - origin, origin)]
+    padded = np.pad(np.asarray(block, dtype="float64"), pad_width)
+    if valid is None:
+        return convolve_valid(padded, weights)
+    return convolve_valid_normalized(padded, np.pad(valid, pad_width, constant_values=True), weights)
@@ -1,8 +1,12 @@
-from typing import Optional
+from typing import Optional, Sequence, Union
 
 from ndx_binned_spikes import BinnedAlignedSpikes, BinnedSpikes
 import numpy as np
 from hdmf.common import DynamicTableRegion
+from hdmf.data_utils import GenericDataChunkIterator
+
+# The size of the blocks of events whose counts are drawn at once by `MockBinnedAlignedSpikesDataChunkIterator`
+_GENERATION_BLOCK_SIZE_IN_BYTES = 16 * 1024**2
 
 
 def mock_BinnedAlignedSpikes(
@@ -20,6 +24,7 @@ def mock_BinnedAlignedSpikes(
     units_region: Optional[DynamicTableRegion] = None,
     sort_data: bool = True,
     add_random_nans: bool = False,
+    add_random_invalid_bins: bool = False,
 ) -> BinnedAlignedSpikes:
     """
     Generate a mock BinnedAlignedSpikes object with specified parameters or from given data.
@@ -58,16 +63,18 @@ def mock_BinnedAlignedSpikes(
         A reference to the Units table region that contains the units of the data.
     sort_data: bool, optional
         If True, the data will be sorted by timestamps.
+    add_random_invalid_bins: bool, optional
+        If True, about 10% of the bins are marked invalid in a `validity_mask`, keeping the integer data.
     Returns
     -------
     BinnedAlignedSpikes
         A mock BinnedAlignedSpikes object populated with the provided or generated data and parameters.
     """
     
+    rng = np.random.default_rng(seed=seed)
     if data is not None:
         number_of_units, number_of_events, number_of_bins = data.shape
     else:
-        rng = np.random.default_rng(seed=seed)
         data = rng.integers(low=0, high=100, size=(number_of_units, number_of_events, number_of_bins), dtype="uint64")
 
     # Assert data shapes
@@ -97,7 +104,7 @@ def mock_BinnedAlignedSpikes(
         condition_indices[:number_of_conditions] = rng.choice(all_indices, size=number_of_conditions, replace=False)
         # Then fill the rest with random samples
         condition_indices[number_of_conditions:] = rng.choice(
-            condition_indices[:number_of_events],
+            all_indices,
             size=number_of_events - number_of_conditions,
             replace=True,
         )
@@ -125,6 +132,10 @@ def mock_BinnedAlignedSpikes(
         nan_mask = rng.choice([True, False], size=data.shape, p=[0.1, 0.9])
         data[nan_mask] = np.nan
 
+    validity_mask = None
+    if add_random_invalid_bins:
+        validity_mask = rng.choice([False, True], size=data.shape, p=[0.1, 0.9])
+
     binned_aligned_spikes = BinnedAlignedSpikes(
         bin_width_in_ms=bin_width_in_ms,
         event_to_bin_offset_in_ms=event_to_bin_offset_in_ms,
@@ -133,6 +144,7 @@ def mock_BinnedAlignedSpikes(
         condition_indices=condition_indices,
         condition_labels=condition_labels,
         units_region=units_region,
+        validity_mask=validity_mask,
     )
     return binned_aligned_spikes
 
@@ -146,6 +158,7 @@ def mock_BinnedSpikes(
     data: Optional[np.ndarray] = None,
     units_region: Optional[DynamicTableRegion] = None,
     add_random_nans: bool = False,
+    add_random_invalid_bins: bool = False,
 ) -> BinnedSpikes:
     """
     Generate a mock BinnedSpikes object with specified parameters or from given data.
@@ -169,6 +182,8 @@ def mock_BinnedSpikes(
         A reference to the Units table region that contains the units of the data.
     add_random_nans: bool, optional
         If True, random NaN values will be added to the data.
+    add_random_invalid_bins: bool, optional
+        If True, about 10% of the bins are marked invalid in a `validity_mask`, keeping the integer data.
 
     Returns
     -------
@@ -176,10 +191,10 @@ def mock_BinnedSpikes(
         A mock BinnedSpikes object populated with the provided or generated data and parameters.
     """
     
+    rng = np.random.default_rng(seed=seed)
     if data is not None:
         number_of_units, number_of_bins = data.shape
     else:
-        rng = np.random.default_rng(seed=seed)
         data = rng.integers(low=0, high=100, size=(number_of_units, number_of_bins), dtype="uint64")
 
     # Assert data shapes
@@ -193,14 +208,313 @@ def mock_BinnedSpikes(
     # Add random nans over all the data
     if add_random_nans:
         data = data.astype("float32")
-        rng = np.random.default_rng(seed=seed)
         nan_mask = rng.choice([True, False], size=data.shape, p=[0.1, 0.9])
         data[nan_mask] = np.nan
 
+    validity_mask = None
+    if add_random_invalid_bins:
+        validity_mask = rng.choice([False, True], size=data.shape, p=[0.1, 0.9])
+
     binned_spikes = BinnedSpikes(
         bin_width_in_ms=bin_width_in_ms,
         start_time_in_ms=start_time_in_ms,
         data=data,
         units_region=units_region,
+        validity_mask=validity_mask,
     )
     return binned_spikes
+
+
+def generate_condition_indices(
+    number_of_events: int,
+    number_of_conditions: int,
+    condition_distribution: Union[str, Sequence[float]] = "balanced",
+    seed: int = 0,
+) -> np.ndarray:
+    """
+    Generate the condition index of each event.
+
+    Parameters
+    ----------
+    number_of_events : int
+        The number of events.
+    number_of_conditions : int
+        The number of conditions. Every condition appears at least once.
+    condition_distribution : str or sequence of float, default: "balanced"
+        "balanced" for (almost) the same number of events per condition, "skewed" for a Zipf-like distribution
+        where condition `c` is drawn with probability proportional to `1 / (c + 1)`, or the probability of each
+        condition.
+    seed : int, default: 0
+        Seed for the random number generator.
+
+    Returns
+    -------
+    np.ndarray
+        The condition indices, as uint64.
+    """
+    if number_of_conditions > number_of_events:
+        raise ValueError("The number of conditions should not be larger than the number of events.")
+
+    rng = np.random.default_rng(seed=seed)
+    if isinstance(condition_distribution, str) and condition_distribution == "balanced":
+        condition_indices = np.arange(number_of_events, dtype="uint64") % number_of_conditions
+        return rng.permutation(condition_indices)
+
+    if isinstance(condition_distribution, str) and condition_distribution == "skewed":
+        probabilities = 1.0 / np.arange(1, number_of_conditions + 1)
+    elif isinstance(condition_distribution, str):
+        raise ValueError(f"Unknown condition distribution '{condition_distribution}'.")
+    else:
+        probabilities = np.asarray(condition_distribution, dtype="float64")
+        if probabilities.size != number_of_conditions:
+            raise ValueError("`condition_distribution` should have one probability per condition.")
+
+    condition_indices = np.empty(number_of_events, dtype="uint64")
+    condition_indices[:number_of_conditions] = np.arange(number_of_conditions)
+    condition_indices[number_of_conditions:] = rng.choice(
+        number_of_conditions, size=number_of_events - number_of_conditions, p=probabilities / probabilities.sum()
+    )
+    return rng.permutation(condition_indices)
+
+
+class MockBinnedAlignedSpikesDataChunkIterator(GenericDataChunkIterator):
+    """
+    Generate realistic binned spike counts chunk by chunk, so arbitrarily large mock files can be written.
+
+    Each unit has a gamma distributed baseline firing rate and a gaussian shaped response to the events whose
+    amplitude depends on the condition. The rate of each unit in each event is further modulated by a gamma
+    distributed gain (trial to trial variability) and the counts are drawn from a Poisson distribution.
+
+    The counts are drawn at once for fixed blocks of events, each from a random number generator seeded with
+    `(seed, block_index)`. The blocks only depend on the number of units and bins, so the generated data only depends
+    on the seed and not on the chunk or buffer shapes used to write it. The last block is kept, so the chunks that
+    split its events by units or bins do not draw it again.
+    """
+
+    def __init__(
+        self,
+        condition_indices: np.ndarray,
+        number_of_units: int = 2,
+        number_of_bins: int = 3,
+        bin_width_in_ms: float = 20.0,
+        event_to_bin_offset_in_ms: float = -50.0,
+        baseline_rate_in_hz: float = 5.0,
+        trial_gain_shape: float = 10.0,
+        sparsity: Optional[float] = None,
+        seed: int = 0,
+        dtype: str = "uint16",
+        **kwargs,
+    ):
+        """
+        Parameters
+        ----------
+        condition_indices : np.ndarray
+            The condition index of each event.
+        number_of_units : int, default: 2
+            The number of units.
+        number_of_bins : int, default: 3
+            The number of bins around each event.
+        bin_width_in_ms : float, default: 20.0
+            The width of each bin in milliseconds.
+        event_to_bin_offset_in_ms : float, default: -50.0
+            The time in milliseconds from the event to the beginning of the first bin.
+        baseline_rate_in_hz : float, default: 5.0
+            The mean baseline firing rate of the units.
+        trial_gain_shape : float, default: 10.0
+            The shape of the gamma distribution of the trial to trial gain. Smaller values give more variability.
+        sparsity : float, optional
+            If given, the rates are scaled so that this is the expected fraction of bins without spikes.
+        seed : int, default: 0
+            Seed for the random number generators.
+        dtype : str, default: "uint16"
+            The data type of the counts. Counts are clipped to its maximum value.
+        **kwargs
+            Passed to `GenericDataChunkIterator` (e.g. `buffer_gb`, `chunk_shape`, `buffer_shape`).
+        """
+        self.condition_indices = np.asarray(condition_indices)
+        self.number_of_units = number_of_units
+        self.number_of_events = self.condition_indices.size
+        self.number_of_bins = number_of_bins
+        self.trial_gain_shape = trial_gain_shape
+        self.seed = seed
+        self.data_type = np.dtype(dtype)
+
+        rng = np.random.default_rng(seed=seed)
+        number_of_conditions = int(self.condition_indices.max()) + 1 if self.number_of_events else 1
+
+        baseline_rates = rng.gamma(shape=2.0, scale=baseline_rate_in_hz / 2.0, size=number_of_units)
+        latencies_in_ms = rng.uniform(20.0, 80.0, size=number_of_units)
+        widths_in_ms = rng.uniform(10.0, 50.0, size=number_of_units)
+        amplitudes = rng.gamma(shape=2.0, scale=2.0, size=number_of_units)
+        condition_gains = rng.gamma(shape=4.0, scale=0.25, size=(number_of_conditions, number_of_units))
+
+        bin_centers_in_ms = event_to_bin_offset_in_ms + bin_width_in_ms * (np.arange(number_of_bins) + 0.5)
+        distances_to_peak = (bin_centers_in_ms - latencies_in_ms[:, np.newaxis]) / widths_in_ms[:, np.newaxis]
+        profiles = np.exp(-0.5 * distances_to_peak**2)
+
+        # Expected counts are baseline * (1 + response), stored as the two terms to avoid a conditions x units x bins
+        # table: the response term is scaled by the condition gain of each event
+        bin_width_in_seconds = bin_width_in_ms / 1000.0
+        self._baseline_counts = (baseline_rates * bin_width_in_seconds)[:, np.newaxis]
+        self._response_counts = self._baseline_counts * amplitudes[:, np.newaxis] * profiles
+        self._condition_gains = condition_gains
+        self._rate_scale = 1.0 if sparsity is None else self._find_rate_scale(sparsity)
+
+        bytes_per_event = 8 * max(number_of_units * number_of_bins, 1)
+        self.events_per_block = max(1, _GENERATION_BLOCK_SIZE_IN_BYTES // bytes_per_event)
+        self._last_block = None
+
+        super().__init__(**kwargs)
+
+    def _expected_counts(self, condition_index: int, rate_scale: Optional[float] = None) -> np.ndarray:
+        condition_gains = self._condition_gains[condition_index][:, np.newaxis]
+        rate_scale = self._rate_scale if rate_scale is None else rate_scale
+        return rate_scale * (self._baseline_counts + self._response_counts * condition_gains)
+
+    def _find_rate_scale(self, sparsity: float) -> float:
+        """Bisect the scale of the rates for which the expected fraction of empty bins is `sparsity`."""
+        if not 0.0 < sparsity < 1.0:
+            raise ValueError(f"`sparsity` should be between 0 and 1, got {sparsity}.")
+
+        number_of_conditions = self._condition_gains.shape[0]
+        expected_counts = np.stack(
+            [self._expected_counts(condition, rate_scale=1.0) for condition in range(number_of_conditions)]
+        )
+        low, high = -12.0, 12.0  # log10 of the scale
+        for _ in range(60):
+            middle = (low + high) / 2
+            fraction_of_zeros = np.exp(-(10.0**middle) * expected_counts).mean()
+            low, high = (middle, high) if fraction_of_zeros > sparsity else (low, middle)
+
+        return 10.0 ** ((low + high) / 2)
+
+    def _get_block_counts(self, block_index: int) -> np.ndarray:
+        """The (units, events, bins) counts of the events of a block."""
+        if self._last_block is not None and self._last_block[0] == block_index:
+            return self._last_block[1]
+
+        rng = np.random.default_rng(seed=[self.seed, block_index])
+        first_event = block_index * self.events_per_block
+        event_slice = slice(first_event, min(first_event + self.events_per_block, self.number_of_events))
+        condition_gains = self._condition_gains[self.condition_indices[event_slice].astype("int64")]
+        # (events, units, bins)
+        expected_counts = self._rate_scale * (
+            self._baseline_counts + self._response_counts * condition_gains[:, :, np.newaxis]
+        )
+        trial_gains = rng.gamma(
+            shape=self.trial_gain_shape,
+            scale=1.0 / self.trial_gain_shape,
+            size=(expected_counts.shape[0], self.number_of_units, 1),
+        )
+        counts = rng.poisson(expected_counts * trial_gains)
+
+        if np.issubdtype(self.data_type, np.integer):
+            counts = np.minimum(counts, np.iinfo(self.data_type).max)
+        counts = counts.astype(self.data_type).transpose(1, 0, 2)
+        self._last_block = (block_index, counts)
+        return counts
+
+    def get_event_counts(self, event_index: int) -> np.ndarray:
+        """The (units, bins) counts of one event."""
+        block_index, position = divmod(event_index, self.events_per_block)
+        return self._get_block_counts(block_index)[:, position, :]
+
+    def _get_data(self, selection: tuple) -> np.ndarray:
+        unit_slice, event_slice, bin_slice = selection
+        start, stop, _ = event_slice.indices(self.number_of_events)
+
+        blocks = []
+        last_block_index = max(stop - 1, start) // self.events_per_block
+        for block_index in range(start // self.events_per_block, last_block_index + 1):
+            first_event = block_index * self.events_per_block
+            block_events = slice(max(start - first_event, 0), min(stop - first_event, self.events_per_block))
+            blocks.append(self._get_block_counts(block_index)[unit_slice, block_events, bin_slice])
+
+        return np.concatenate(blocks, axis=1)
+
+    def _get_maxshape(self) -> tuple:
+        return (self.number_of_units, self.number_of_events, self.number_of_bins)
+
+    def _get_dtype(self) -> np.dtype:
+        return self.data_type
+
+
+def mock_streamed_BinnedAlignedSpikes(
+    number_of_units: int = 2,
+    number_of_events: int = 10,
+    number_of_bins: int = 3,
+    number_of_conditions: int = 5,
+    bin_width_in_ms: float = 20.0,
+    event_to_bin_offset_in_ms: float = -50.0,
+    condition_distribution: Union[str, Sequence[float]] = "balanced",
+    sparsity: Optional[float] = None,
+    seed: int = 0,
+    dtype: str = "uint16",
+    units_region: Optional[DynamicTableRegion] = None,
+    **iterator_kwargs,
+) -> BinnedAlignedSpikes:
+    """
+    Generate a mock BinnedAlignedSpikes whose data is produced chunk by chunk when it is written.
+
+    The data is a `MockBinnedAlignedSpikesDataChunkIterator`, so writing the container to HDF5 or Zarr never holds
+    more than one buffer of counts in memory. The generated data is deterministic for a given seed, whatever the
+    chunk and buffer shapes.
+
+    Parameters
+    ----------
+    number_of_units : int, optional
+        The number of units.
+    number_of_events : int, optional
+        The number of events.
+    number_of_bins : int, optional
+        The number of bins.
+    number_of_conditions : int, optional
+        The number of different conditions.
+    bin_width_in_ms : float, optional
+        The width of each bin in milliseconds.
+    event_to_bin_offset_in_ms : float, optional
+        The time in milliseconds from the event to the first bin.
+    condition_distribution : str or sequence of float, optional
+        "balanced", "skewed" or the probability of each condition. See `generate_condition_indices`.
+    sparsity : float, optional
+        The target fraction of bins without spikes.
+    seed : int, optional
+        Seed for the random number generators.
+    dtype : str, optional
+        The data type of the counts.
+    units_region: DynamicTableRegion, optional
+        A reference to the Units table region that contains the units of the data.
+    **iterator_kwargs
+        Passed to the data chunk iterator (e.g. `buffer_gb`, `chunk_shape`, `buffer_shape`).
+
+    Returns
+    -------
+    BinnedAlignedSpikes
+        A mock BinnedAlignedSpikes object whose data is a data chunk iterator.
+    """
+    condition_indices = generate_condition_indices(
+        number_of_events=number_of_events,
+        number_of_conditions=number_of_conditions,
+        condition_distribution=condition_distribution,
+        seed=seed,
+    )
+    data = MockBinnedAlignedSpikesDataChunkIterator(
+        condition_indices=condition_indices,
+        number_of_units=number_of_units,
+        number_of_bins=number_of_bins,
+        bin_width_in_ms=bin_width_in_ms,
+        event_to_bin_offset_in_ms=event_to_bin_offset_in_ms,
+        sparsity=sparsity,
+        seed=seed,
+        dtype=dtype,
+        **iterator_kwargs,
+    )
+
+    return BinnedAlignedSpikes(
+        bin_width_in_ms=bin_width_in_ms,
+        event_to_bin_offset_in_ms=event_to_bin_offset_in_ms,
+        data=data,
+        event_timestamps=np.arange(number_of_events, dtype="float64"),
+        condition_indices=condition_indices,
+        units_region=units_region,
+    )
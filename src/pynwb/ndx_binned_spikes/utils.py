@@ -0,0 +1,485 @@
+"""Helpers shared by the BinnedSpikes and BinnedAlignedSpikes data interfaces."""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, List, Mapping, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from hdmf.common import DynamicTableRegion
+
+from .instrumentation import record_cache_access, record_read
+
+
+def coalesce_indices(indices: np.ndarray) -> List[Tuple[int, int]]:
+    """
+    Group sorted unique indices into runs of consecutive values.
+
+    Parameters
+    ----------
+    indices : np.ndarray
+        Sorted array of unique non-negative integers.
+
+    Returns
+    -------
+    list of tuple
+        The `(start, stop)` bounds of each run, with `stop` exclusive.
+    """
+    if indices.size == 0:
+        return []
+
+    breaks = np.flatnonzero(np.diff(indices) != 1) + 1
+    starts = np.concatenate(([0], breaks))
+    stops = np.concatenate((breaks, [indices.size]))
+
+    return [(int(indices[start]), int(indices[stop - 1]) + 1) for start, stop in zip(starts, stops)]
+
+
+def read_block(data, selection) -> np.ndarray:
+    """Read `data[selection]` into memory, counting the read when `data` is disk-backed and instrumentation is on."""
+    block = np.asarray(data[selection])
+    if not isinstance(data, np.ndarray) and not getattr(data, "counts_own_reads", False):
+        record_read(block.nbytes)
+
+    return block
+
+
+def read_rows(data, rows: Sequence[int]) -> np.ndarray:
+    """
+    Read rows of the first axis of `data`, in the requested order.
+
+    In-memory arrays are indexed directly. For disk-backed datasets (h5py, zarr) the rows are sorted,
+    de-duplicated and grouped into runs of adjacent rows, so that each run is read with a single hyperslab
+    selection instead of one read per row.
+
+    Parameters
+    ----------
+    data : array-like
+        The data to read from. Only the first axis is selected.
+    rows : sequence of int
+        The indices of the rows to read. They can be unsorted and contain repeated values.
+
+    Returns
+    -------
+    np.ndarray
+        An array with `len(rows)` entries on the first axis.
+    """
+    rows = np.asarray(rows, dtype="int64")
+
+    if isinstance(data, np.ndarray):
+        return data[rows]
+
+    unique_rows, inverse = np.unique(rows, return_inverse=True)
+    runs = coalesce_indices(unique_rows)
+    if not runs:
+        return np.asarray(data[0:0])
+
+    blocks = [read_block(data, slice(start, stop)) for start, stop in runs]
+    unique_data = blocks[0] if len(blocks) == 1 else np.concatenate(blocks, axis=0)
+
+    return unique_data[inverse]
+
+
+def _read_table_column(table, column_name: str, table_rows: np.ndarray):
+    """Read the values of a column of `table` only at `table_rows`, preserving their order."""
+    unique_rows, inverse = np.unique(table_rows, return_inverse=True)
+    column = table[column_name]
+    values = column.get(unique_rows.tolist())
+
+    return np.asarray(values, dtype=object if isinstance(values, list) else None)[inverse]
+
+
+def get_units_selection(
+    container,
+    ids: Optional[Sequence[int]] = None,
+    where: Optional[Union[Callable, Mapping]] = None,
+) -> np.ndarray:
+    """
+    Map a selection of units of the linked Units table to rows of `container.data`.
+
+    Only the `id` column and the columns named in `where` are read from the Units table, and only at the rows
+    referenced by `units_region`. The mapping from unit ids to rows of `data` is cached in the container.
+
+    Parameters
+    ----------
+    container : BinnedSpikes or BinnedAlignedSpikes
+        A container with a `units_region`.
+    ids : sequence of int, optional
+        The ids of the units (as in the `id` column of the Units table) to select. The returned rows follow
+        the order of `ids`.
+    where : callable or mapping, optional
+        A filter on the Units table. If a mapping, each key is a column name and each value is either the value
+        the column should be equal to or a callable that receives the column values and returns a boolean mask.
+        If a callable, it receives the Units table and the table rows referenced by `units_region` and
+        should return a boolean mask with one entry per row of `data`.
+
+    Returns
+    -------
+    np.ndarray
+        The indices of the selected rows of `container.data`.
+    """
+    units_region = container.units_region
+    if units_region is None:
+        raise ValueError(
+            f"'{container.name}' has no `units_region`, so units can not be selected by id or by Units table columns."
+        )
+
+    table_rows = np.asarray(units_region.data[:], dtype="int64")
+    data_rows = np.arange(table_rows.size)
+
+    if ids is not None:
+        id_to_data_row = get_unit_id_to_data_row(container)
+        missing_ids = [unit_id for unit_id in ids if unit_id not in id_to_data_row]
+        if missing_ids:
+            raise KeyError(
+                f"The unit ids {missing_ids} are not referenced by the `units_region` of '{container.name}'."
+            )
+        data_rows = np.array([id_to_data_row[unit_id] for unit_id in ids], dtype="int64")
+
+    if where is None:
+        return data_rows
+
+    if callable(where):
+        mask = np.asarray(where(units_region.table, table_rows), dtype=bool)
+    else:
+        mask = np.ones(table_rows.size, dtype=bool)
+        for column_name, condition in where.items():
+            values = _read_table_column(units_region.table, column_name, table_rows)
+            mask &= np.asarray(condition(values) if callable(condition) else values == condition, dtype=bool)
+
+    if mask.shape != table_rows.shape:
+        raise ValueError(f"The `where` filter should return one boolean per unit, got a mask of shape {mask.shape}.")
+
+    return data_rows[mask[data_rows]]
+
+
+def read_units_selection(
+    container,
+    ids: Optional[Sequence[int]] = None,
+    where: Optional[Union[Callable, Mapping]] = None,
+) -> np.ndarray:
+    """
+    Read the rows of `container.data` selected by `get_units_selection`, masked by the `validity_mask` if any.
+
+    This is the implementation of `select_units` of BinnedSpikes and BinnedAlignedSpikes.
+    """
+    from .masking import mask_block
+
+    rows = get_units_selection(container, ids=ids, where=where)
+    return mask_block(read_rows(container._readable_data, rows), container.validity_mask, container.data.shape, rows)
+
+
+def build_unit_id_to_data_row(units_region) -> dict:
+    """Map the ids of the Units table referenced by `units_region` to rows of the data."""
+    table_rows = np.asarray(units_region.data[:], dtype="int64")
+    unit_ids = np.asarray(read_rows(units_region.table.id.data, table_rows))
+
+    return {int(unit_id): data_row for data_row, unit_id in enumerate(unit_ids)}
+
+
+def get_unit_id_to_data_row(container) -> dict:
+    """The mapping from unit ids to rows of `container.data`, built on first use and cached in the container."""
+    id_to_data_row = getattr(container, "_unit_id_to_data_row", None)
+    record_cache_access("unit_id_to_data_row", hit=id_to_data_row is not None)
+    if id_to_data_row is None:
+        id_to_data_row = build_unit_id_to_data_row(container.units_region)
+        container._unit_id_to_data_row = id_to_data_row
+
+    return id_to_data_row
+
+
+DEFAULT_CHUNK_SIZE_IN_BYTES = 64 * 1024**2
+
+
+def iter_slices(length: int, step: int) -> Iterator[slice]:
+    """Yield consecutive slices of size `step` (the last one possibly shorter) covering `range(length)`."""
+    for start in range(0, length, step):
+        yield slice(start, min(start + step, length))
+
+
+def get_chunk_length(data, axis: int, chunk_size_in_bytes: int = DEFAULT_CHUNK_SIZE_IN_BYTES) -> int:
+    """
+    The number of entries along `axis` of `data` that fit in a chunk of `chunk_size_in_bytes`.
+
+    The chunk spans the full extent of the other axes. At least one entry is always returned.
+    """
+    itemsize = np.dtype(getattr(data, "dtype", "float64")).itemsize
+    bytes_per_entry = itemsize * int(np.prod([length for index, length in enumerate(data.shape) if index != axis]))
+
+    return max(1, chunk_size_in_bytes // max(bytes_per_entry, 1))
+
+
+def expand_selection(selection, ndim: int) -> tuple:
+    """The index of each of the `ndim` axes selected by `selection`, expanding the Ellipsis and the missing axes."""
+    if not isinstance(selection, tuple):
+        selection = (selection,)
+    if any(index is Ellipsis for index in selection):
+        position = next(position for position, index in enumerate(selection) if index is Ellipsis)
+        missing_axes = ndim - (len(selection) - 1)
+        selection = selection[:position] + (slice(None),) * missing_axes + selection[position + 1 :]
+    if len(selection) > ndim:
+        raise IndexError(f"Too many indices for an array with {ndim} dimensions: {len(selection)}.")
+
+    return selection + (slice(None),) * (ndim - len(selection))
+
+
+def normalize_axis_index(index, length: int):
+    """An int, a slice or a 1D array of non-negative ints equivalent to `index` on an axis of `length` entries."""
+    if isinstance(index, (int, np.integer)):
+        if not -length <= index < length:
+            raise IndexError(f"Index {index} is out of bounds for an axis with {length} entries.")
+        return int(index) % length
+    if isinstance(index, slice):
+        return slice(*index.indices(length))
+
+    index = np.asarray(index)
+    if index.dtype == bool:
+        if index.shape != (length,):
+            raise IndexError(f"A boolean index should have {length} entries, got {index.shape}.")
+        return np.flatnonzero(index)
+    if index.ndim != 1 or not np.issubdtype(index.dtype, np.integer):
+        raise IndexError("Only integers, slices and 1D integer or boolean arrays are supported as indices.")
+    if index.size and (index.min() < -length or index.max() >= length):
+        raise IndexError(f"Index out of bounds for an axis with {length} entries.")
+    return np.where(index < 0, index + length, index)
+
+
+def copy_units_region(units_region):
+    """A new DynamicTableRegion pointing to the same rows of the same table, to be used by a derived container."""
+    if units_region is None:
+        return None
+
+    return DynamicTableRegion(
+        name=units_region.name,
+        data=np.asarray(units_region.data[:]),
+        table=units_region.table,
+        description=units_region.description,
+    )
+
+
+def get_condition_codes(container) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The conditions present in a BinnedAlignedSpikes and the position of each event's condition among them.
+
+    Returns
+    -------
+    conditions : np.ndarray
+        The sorted unique condition indices. A single condition `0` when the container has no conditions.
+    codes : np.ndarray
+        For each event, the position of its condition in `conditions`.
+    """
+    if not container.has_multiple_conditions:
+        return np.zeros(1, dtype="uint64"), np.zeros(container.number_of_events, dtype="int64")
+
+    conditions, codes = np.unique(np.asarray(container.condition_indices[:]), return_inverse=True)
+    return conditions, codes.astype("int64")
+
+
+def sum_events_by_code(block: np.ndarray, codes: np.ndarray, number_of_conditions: int) -> np.ndarray:
+    """
+    Sum the events of the (units, events, bins) `block` that share a code, as a segment sum over the events.
+
+    The events are stable-sorted by code (unless they already are) and each run of equal codes is summed with
+    `np.add.reduceat`, so the work is proportional to the block and not to the number of conditions.
+
+    Returns
+    -------
+    np.ndarray
+        Array of shape (number_of_conditions, units, bins) with the sums, as float64. Absent codes sum to zero.
+    """
+    number_of_units, _, number_of_bins = block.shape
+    sums = np.zeros((number_of_conditions, number_of_units, number_of_bins), dtype="float64")
+    if len(codes) == 0:
+        return sums
+
+    codes = np.asarray(codes)
+    if np.any(codes[1:] < codes[:-1]):
+        order = np.argsort(codes, kind="stable")
+        codes = codes[order]
+        block = block[:, order, :]
+    # reduceat does not return zeros for empty segments, so only the codes present start a segment
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    segment_sums = np.add.reduceat(block, starts, axis=1, dtype="float64")
+    sums[codes[starts]] = segment_sums.transpose(1, 0, 2)
+    return sums
+
+
+def accumulate_condition_sums(
+    data,
+    codes: np.ndarray,
+    number_of_conditions: int,
+    events_per_chunk: Optional[int] = None,
+    validity_mask=None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Sum the (units, events, bins) `data` over the events of each condition in a single pass over the events.
+
+    With a `validity_mask`, the invalid entries are replaced by zeros in the integer chunks, without converting them
+    to floats first, and the number of valid events summed is counted for every unit and bin.
+
+    Returns
+    -------
+    sums : np.ndarray
+        Array of shape (number_of_conditions, units, bins) with the summed counts, as float64.
+    number_of_events : np.ndarray
+        The number of events of each condition or, with a `validity_mask`, an array of shape
+        (number_of_conditions, units, bins) with the number of valid events summed.
+    """
+    number_of_units, number_of_events, number_of_bins = data.shape
+    sums = np.zeros((number_of_conditions, number_of_units, number_of_bins), dtype="float64")
+    counts = np.zeros_like(sums) if validity_mask is not None else None
+
+    events_per_chunk = events_per_chunk or get_chunk_length(data, axis=1)
+    for event_slice in iter_slices(number_of_events, events_per_chunk):
+        selection = (slice(None), event_slice, slice(None))
+        chunk = read_block(data, selection)
+        if validity_mask is not None:
+            valid = validity_mask.get_valid(data.shape, selection)
+            chunk = np.where(valid, chunk, 0)
+            counts += sum_events_by_code(valid, codes[event_slice], number_of_conditions)
+        sums += sum_events_by_code(chunk, codes[event_slice], number_of_conditions)
+
+    if validity_mask is None:
+        counts = np.bincount(codes, minlength=number_of_conditions)
+    return sums, counts
+
+
+def get_event_order(event_timestamps, condition_indices=None) -> np.ndarray:
+    """
+    The stable order of the events by timestamp, then by condition index, then by original position.
+
+    Events with the same timestamp and condition keep their original relative order, so the order is deterministic.
+    """
+    event_timestamps = np.asarray(event_timestamps)
+    if condition_indices is None:
+        return np.argsort(event_timestamps, kind="stable")
+
+    # The last key of lexsort is the primary one; lexsort is stable so ties keep the original positions
+    return np.lexsort((np.asarray(condition_indices), event_timestamps))
+
+
+def permute_events(data, order: np.ndarray, out=None, events_per_chunk: Optional[int] = None):
+    """
+    Write `data[:, order, :]` into `out`, reading `data` sequentially in chunks of events.
+
+    Each chunk of the source is scattered to its positions in the output, so disk-backed data is read once in
+    storage order and never loaded at once. `out` can be an array, a `np.memmap` or an h5py dataset.
+
+    Parameters
+    ----------
+    data : array-like
+        The (units, events, bins) data to permute.
+    order : np.ndarray
+        The source event of each output event.
+    out : array-like, optional
+        Where to write the permuted data. Defaults to a new in-memory array.
+    events_per_chunk : int, optional
+        The number of events read at a time. By default it is chosen to keep the chunks around 64 MiB.
+
+    Returns
+    -------
+    The output.
+    """
+    if out is None:
+        out = np.empty(data.shape, dtype=data.dtype)
+    elif tuple(out.shape) != tuple(data.shape):
+        raise ValueError(f"`out` should have shape {tuple(data.shape)}, got {tuple(out.shape)}.")
+
+    # Output position of each source event
+    destinations = np.empty_like(order)
+    destinations[order] = np.arange(order.size)
+
+    events_per_chunk = events_per_chunk or get_chunk_length(data, axis=1)
+    for event_slice in iter_slices(order.size, events_per_chunk):
+        chunk = read_block(data, (slice(None), event_slice, slice(None)))
+        chunk_destinations = destinations[event_slice]
+        # h5py only accepts increasing indices
+        increasing = np.argsort(chunk_destinations)
+        out[:, chunk_destinations[increasing], :] = chunk[:, increasing, :]
+
+    return out
+
+
+VALIDATION_BLOCK_SIZE = 1_000_000
+
+# Event arrays with at least this many blocks are validated with a thread pool
+MIN_BLOCKS_FOR_PARALLEL_VALIDATION = 4
+
+
+def _find_violations_in_block(
+    event_timestamps,
+    condition_indices,
+    number_of_conditions: Optional[int],
+    block_slice: slice,
+) -> Tuple[Optional[int], Optional[int]]:
+    # Include the last timestamp of the previous block so that the pairs across block edges are checked
+    start = max(block_slice.start - 1, 0)
+    timestamps = np.asarray(event_timestamps[start : block_slice.stop])
+    # Written as a negation so that NaNs count as violations
+    unsorted = np.flatnonzero(~(timestamps[1:] >= timestamps[:-1]))
+    first_unsorted = start + 1 + int(unsorted[0]) if unsorted.size else None
+
+    first_out_of_range = None
+    if condition_indices is not None:
+        indices = np.asarray(condition_indices[block_slice])
+        out_of_range = indices < 0
+        if number_of_conditions is not None:
+            out_of_range |= indices >= number_of_conditions
+        out_of_range = np.flatnonzero(out_of_range)
+        first_out_of_range = block_slice.start + int(out_of_range[0]) if out_of_range.size else None
+
+    return first_unsorted, first_out_of_range
+
+
+def find_event_violations(
+    event_timestamps,
+    condition_indices=None,
+    number_of_conditions: Optional[int] = None,
+    block_size: int = VALIDATION_BLOCK_SIZE,
+    max_workers: Optional[int] = None,
+) -> Tuple[Optional[int], Optional[int]]:
+    """
+    Find the first unsorted event timestamp and the first condition index out of range in one blockwise pass.
+
+    Only one block of each array is in memory at a time, and no array of the full length is allocated. Arrays with
+    many blocks are checked in parallel threads; numpy releases the GIL for the comparisons.
+
+    Parameters
+    ----------
+    event_timestamps : array-like
+        The event timestamps, which should be monotonically increasing.
+    condition_indices : array-like, optional
+        The condition of each event, which should be non-negative and below `number_of_conditions`.
+    number_of_conditions : int, optional
+        The number of conditions, e.g. the number of condition labels. If None only the sign is checked.
+    block_size : int, default: 1_000_000
+        The number of events checked at a time.
+    max_workers : int, optional
+        The number of threads. By default the thread pool default is used; 1 disables the threads.
+
+    Returns
+    -------
+    first_unsorted : int or None
+        The first index `i` with `event_timestamps[i] < event_timestamps[i - 1]` (or a NaN), if any.
+    first_out_of_range : int or None
+        The first index of a condition index out of range, if any.
+    """
+    block_slices = list(iter_slices(len(event_timestamps), block_size))
+
+    def check(block_slice):
+        return _find_violations_in_block(event_timestamps, condition_indices, number_of_conditions, block_slice)
+
+    if len(block_slices) < MIN_BLOCKS_FOR_PARALLEL_VALIDATION or max_workers == 1:
+        results = map(check, block_slices)
+        first_unsorted = first_out_of_range = None
+        for block_unsorted, block_out_of_range in results:
+            first_unsorted = block_unsorted if first_unsorted is None else first_unsorted
+            first_out_of_range = block_out_of_range if first_out_of_range is None else first_out_of_range
+            if first_unsorted is not None and (condition_indices is None or first_out_of_range is not None):
+                break
+        return first_unsorted, first_out_of_range
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(check, block_slices))
+
+    first_unsorted = next((unsorted for unsorted, _ in results if unsorted is not None), None)
+    first_out_of_range = next((out_of_range for _, out_of_range in results if out_of_range is not None), None)
+    return first_unsorted, first_out_of_range
@@ -0,0 +1,224 @@
+"""
+Compact storage of the aligned data of dense events whose windows overlap.
+
+When events are closer than the length of their windows (e.g. rapid serial stimuli), the full aligned tensor stores
+most bins many times. `OverlappingWindowsData` stores instead the union of the bins covered by the windows once, as
+a (number_of_units, number_of_covered_bins) array, and the position of the first bin of each event in it. It behaves
+like the full (number_of_units, number_of_events, number_of_bins) array, and the windows of any selection of events
+are reconstructed on demand from strided views of the covered bins:
+
+    data = OverlappingWindowsData.from_binned(binned_spikes.data, window_starts=event_bins, number_of_bins=50)
+    binned_aligned_spikes = BinnedAlignedSpikes(data=data, event_timestamps=event_timestamps, ...)
+    binned_aligned_spikes.data[:, 10:20, :]
+
+BinnedAlignedSpikes stores it in its `window_data` and `window_starts` datasets instead of `data`.
+"""
+
+from typing import Optional, Tuple
+
+import numpy as np
+from hdmf.query import HDMFDataset
+from numpy.lib.stride_tricks import sliding_window_view
+
+from .utils import expand_selection, get_chunk_length, iter_slices, normalize_axis_index, read_block
+
+
+class OverlappingWindowsData(HDMFDataset):
+    """
+    Aligned data stored as the union of the bins covered by the event windows.
+
+    Event `e` of unit `u` is `window_data[u, window_starts[e]:window_starts[e] + number_of_bins]`. Indexing returns
+    the same values as the full (number_of_units, number_of_events, number_of_bins) array; at most one of the
+    indices can be an array.
+
+    Parameters
+    ----------
+    window_data : array-like
+        The covered bins, with shape (number_of_units, number_of_covered_bins). It can be disk-backed.
+    window_starts : array-like
+        The position in `window_data` of the first bin of each event. It must be non-decreasing.
+    number_of_bins : int
+        The number of bins of each event window.
+    """
+
+    counts_own_reads = True
+
+    def __init__(self, window_data, window_starts, number_of_bins: int):
+        super().__init__(dataset=window_data)
+        self.window_starts = np.asarray(window_starts[:], dtype="int64")
+        self.number_of_bins = int(number_of_bins)
+        # The DataIO written instead of `window_data`, see `set_data_io`
+        self.window_data_io = None
+
+        number_of_covered_bins = window_data.shape[1]
+        if self.window_starts.ndim != 1:
+            raise ValueError("`window_starts` should be a 1D array.")
+        if np.any(np.diff(self.window_starts) < 0):
+            raise ValueError("`window_starts` should be non-decreasing, as the events are sorted by time.")
+        if self.window_starts.size and (
+            self.window_starts[0] < 0 or self.window_starts[-1] + self.number_of_bins > number_of_covered_bins
+        ):
+            raise ValueError(
+                f"The windows of {self.number_of_bins} bins starting at `window_starts` should be within the "
+                f"{number_of_covered_bins} bins of `window_data`."
+            )
+
+    @classmethod
+    def from_binned(
+        cls,
+        data,
+        window_starts,
+        number_of_bins: int,
+        units_per_chunk: Optional[int] = None,
+    ) -> "OverlappingWindowsData":
+        """
+        Extract the windows of the events from session binned data, keeping each covered bin once.
+
+        Parameters
+        ----------
+        data : array-like
+            Binned data of the whole session with shape (number_of_units, number_of_bins_in_session), e.g. the
+            `data` of a BinnedSpikes. It can be disk-backed.
+        window_starts : array-like
+            The bin of `data` where the window of each event starts. It must be non-decreasing.
+        number_of_bins : int
+            The number of bins of each event window.
+        units_per_chunk : int, optional
+            The number of units read at a time. By default it is chosen to keep the chunks around 64 MiB.
+
+        Returns
+        -------
+        OverlappingWindowsData
+        """
+        window_starts = np.asarray(window_starts, dtype="int64")
+        if np.any(np.diff(window_starts) < 0):
+            raise ValueError("`window_starts` should be non-decreasing, as the events are sorted by time.")
+        if window_starts.size and (window_starts[0] < 0 or window_starts[-1] + number_of_bins > data.shape[1]):
+            raise ValueError(f"The event windows should be within the {data.shape[1]} bins of `data`.")
+
+        if window_starts.size == 0:
+            return cls(np.empty((data.shape[0], 0), dtype=data.dtype), window_starts, number_of_bins)
+
+        # Windows that overlap or touch form runs of covered bins; the bins between runs are not stored
+        run_firsts = np.concatenate(([0], np.flatnonzero(np.diff(window_starts) > number_of_bins) + 1))
+        run_lasts = np.concatenate((run_firsts[1:], [window_starts.size])) - 1
+        run_starts = window_starts[run_firsts]
+        run_stops = window_starts[run_lasts] + number_of_bins
+        run_offsets = np.concatenate(([0], np.cumsum(run_stops - run_starts)[:-1]))
+
+        number_of_covered_bins = int(run_offsets[-1] + run_stops[-1] - run_starts[-1])
+        window_data = np.empty((data.shape[0], number_of_covered_bins), dtype=data.dtype)
+        units_per_chunk = units_per_chunk or get_chunk_length(data, axis=0)
+        for unit_slice in iter_slices(data.shape[0], units_per_chunk):
+            for run_start, run_stop, run_offset in zip(run_starts, run_stops, run_offsets):
+                window_data[unit_slice, run_offset : run_offset + run_stop - run_start] = read_block(
+                    data, (unit_slice, slice(int(run_start), int(run_stop)))
+                )
+
+        run_of_event = np.repeat(np.arange(run_starts.size), run_lasts - run_firsts + 1)
+        covered_window_starts = window_starts - run_starts[run_of_event] + run_offsets[run_of_event]
+
+        return cls(window_data, covered_window_starts, number_of_bins)
+
+    @property
+    def window_data(self):
+        return self.dataset
+
+    def set_data_io(
+        self,
+        data_io_class,
+        data_io_kwargs: dict,
+        data_chunk_iterator_class=None,
+        data_chunk_iterator_kwargs: Optional[dict] = None,
+    ):
+        """
+        Write `window_data` wrapped in a DataIO, e.g. `H5DataIO`, like `hdmf.container.Data.set_data_io`.
+
+        The DataIO is only used when the container is written; indexing keeps reading `window_data`.
+        """
+        data = self.window_data
+        if data_chunk_iterator_class is not None:
+            data = data_chunk_iterator_class(data=data, **(data_chunk_iterator_kwargs or dict()))
+        self.window_data_io = data_io_class(data=data, **data_io_kwargs)
+
+    @property
+    def shape(self) -> Tuple[int, int, int]:
+        return (self.dataset.shape[0], self.window_starts.size, self.number_of_bins)
+
+    @property
+    def ndim(self) -> int:
+        return 3
+
+    @property
+    def size(self) -> int:
+        return int(np.prod(self.shape))
+
+    @property
+    def compression_ratio(self) -> float:
+        """The size of the full aligned array divided by the size of the stored bins."""
+        return self.size / max(int(np.prod(self.dataset.shape)), 1)
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __iter__(self):
+        for unit in range(len(self)):
+            yield self[unit]
+
+    def __array__(self, dtype=None, copy=None):
+        array = self[...]
+        return array if dtype is None else array.astype(dtype, copy=False)
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(shape={self.shape}, dtype={self.dtype}, "
+            f"compression_ratio={self.compression_ratio:.1f})"
+        )
+
+    def _read_units(self, unit_index, column_slice: slice) -> np.ndarray:
+        if not isinstance(unit_index, np.ndarray):
+            return read_block(self.dataset, (unit_index, column_slice))
+
+        # Disk-backed datasets need increasing indices
+        unique_units, inverse = np.unique(unit_index, return_inverse=True)
+        return read_block(self.dataset, (unique_units, column_slice))[inverse]
+
+    def __getitem__(self, selection):
+        unit_index, event_index, bin_index = (
+            normalize_axis_index(index, length) for index, length in zip(expand_selection(selection, 3), self.shape)
+        )
+        if sum(isinstance(index, np.ndarray) for index in (unit_index, event_index, bin_index)) > 1:
+            raise IndexError(f"{self.__class__.__name__} supports at most one array index.")
+
+        starts = self.window_starts[event_index]
+        if isinstance(event_index, int):
+            block = self._read_units(unit_index, slice(int(starts), int(starts) + self.number_of_bins))
+            return block[..., bin_index]
+
+        if starts.size == 0:
+            if isinstance(unit_index, int):
+                units_shape = ()
+            elif isinstance(unit_index, slice):
+                units_shape = (len(range(unit_index.start, unit_index.stop, unit_index.step)),)
+            else:
+                units_shape = (unit_index.size,)
+            return np.empty(units_shape + (0, self.number_of_bins), dtype=self.dtype)[..., bin_index]
+
+        # Read the covered bins spanned by the selected events once and take the windows from a strided view
+        first_bin = int(starts.min())
+        block = self._read_units(unit_index, slice(first_bin, int(starts.max()) + self.number_of_bins))
+        windows = sliding_window_view(block, self.number_of_bins, axis=-1)
+
+        positions = starts - first_bin
+        steps = np.diff(positions)
+        if positions.size > 1 and steps[0] > 0 and np.all(steps == steps[0]):
+            # Evenly spaced windows, e.g. a slice of events of a periodic stimulus, are a view of the block
+            event_windows = windows[..., positions[0] :: steps[0], :][..., : positions.size, :]
+        else:
+            event_windows = windows[..., positions, :]
+
+        if isinstance(unit_index, int) and isinstance(bin_index, np.ndarray):
+            # As in numpy, the axis of an array index separated from an integer index by a slice comes first
+            return np.moveaxis(event_windows[..., bin_index], -1, 0)
+
+        return event_windows[..., bin_index]
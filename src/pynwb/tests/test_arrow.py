@@ -0,0 +1,107 @@
+"""Tests for the Arrow and DLPack export of the binned data interfaces."""
+
+import importlib.util
+import unittest
+
+import numpy as np
+
+from pynwb import NWBHDF5IO
+from pynwb.testing import TestCase, remove_test_file
+from pynwb.testing.mock.file import mock_NWBFile
+from ndx_binned_spikes import BinnedAlignedSpikes
+from ndx_binned_spikes.arrow import iter_long_format_columns
+from ndx_binned_spikes.testing.mock import mock_BinnedAlignedSpikes, mock_BinnedSpikes
+
+HAVE_PYARROW = importlib.util.find_spec("pyarrow") is not None
+
+
+class TestLongFormat(TestCase):
+
+    def setUp(self):
+        self.binned_aligned_spikes = mock_BinnedAlignedSpikes(
+            number_of_units=3, number_of_events=5, number_of_bins=4, number_of_conditions=2
+        )
+
+    def test_columns_match_the_data(self):
+        batches = list(iter_long_format_columns(self.binned_aligned_spikes, units_per_batch=2))
+        self.assertEqual(len(batches), 2)
+
+        columns = {name: np.concatenate([batch[name] for batch in batches]) for name in batches[0]}
+        self.assertEqual(list(columns), ["unit", "event", "bin", "count", "condition"])
+
+        data = self.binned_aligned_spikes.data
+        np.testing.assert_array_equal(columns["count"], data[columns["unit"], columns["event"], columns["bin"]])
+        np.testing.assert_array_equal(
+            columns["condition"], self.binned_aligned_spikes.condition_indices[columns["event"]]
+        )
+        self.assertEqual(columns["count"].size, data.size)
+
+    def test_counts_of_in_memory_data_are_not_copied(self):
+        binned_aligned_spikes = BinnedAlignedSpikes(
+            bin_width_in_ms=1.0, data=np.arange(3 * 5 * 4).reshape(3, 5, 4), event_timestamps=np.arange(5.0)
+        )
+        batch = next(iter_long_format_columns(binned_aligned_spikes, units_per_batch=2))
+        self.assertTrue(np.shares_memory(batch["count"], binned_aligned_spikes.data))
+
+    def test_binned_spikes(self):
+        binned_spikes = mock_BinnedSpikes(number_of_units=2, number_of_bins=6)
+        (columns,) = iter_long_format_columns(binned_spikes)
+
+        self.assertEqual(list(columns), ["unit", "bin", "count"])
+        np.testing.assert_array_equal(columns["count"], binned_spikes.data[columns["unit"], columns["bin"]])
+
+
+class TestDLPack(TestCase):
+
+    def test_in_memory_data_is_not_copied(self):
+        binned_aligned_spikes = mock_BinnedAlignedSpikes()
+        exported = np.from_dlpack(binned_aligned_spikes)
+
+        self.assertTrue(np.shares_memory(exported, binned_aligned_spikes.data))
+        self.assertEqual(binned_aligned_spikes.__dlpack_device__(), (1, 0))
+
+    def test_disk_backed_data(self):
+        path = "test_dlpack.nwb"
+        binned_spikes = mock_BinnedSpikes()
+        nwbfile = mock_NWBFile()
+        nwbfile.add_acquisition(binned_spikes)
+        try:
+            with NWBHDF5IO(path, mode="w") as io:
+                io.write(nwbfile)
+            with NWBHDF5IO(path, mode="r") as io:
+                read_binned_spikes = io.read().acquisition["BinnedSpikes"]
+                np.testing.assert_array_equal(np.from_dlpack(read_binned_spikes), binned_spikes.data)
+        finally:
+            remove_test_file(path)
+
+
+@unittest.skipUnless(HAVE_PYARROW, "pyarrow is not installed")
+class TestToArrow(TestCase):
+
+    def setUp(self):
+        self.binned_aligned_spikes = mock_BinnedAlignedSpikes(
+            number_of_units=3, number_of_events=5, number_of_bins=4, number_of_conditions=2
+        )
+
+    def test_long_table(self):
+        table = self.binned_aligned_spikes.to_arrow(units_per_batch=1)
+
+        self.assertEqual(table.num_rows, self.binned_aligned_spikes.data.size)
+        self.assertEqual(table.column_names, ["unit", "event", "bin", "count", "condition"])
+        np.testing.assert_array_equal(table["count"].to_numpy(), self.binned_aligned_spikes.data.reshape(-1))
+
+    def test_stream(self):
+        reader = self.binned_aligned_spikes.to_arrow(stream=True, units_per_batch=2)
+        self.assertEqual(sum(batch.num_rows for batch in reader), self.binned_aligned_spikes.data.size)
+
+    def test_tensor(self):
+        tensor = self.binned_aligned_spikes.to_arrow(layout="tensor")
+        np.testing.assert_array_equal(tensor.to_numpy(), self.binned_aligned_spikes.data)
+
+
+@unittest.skipIf(HAVE_PYARROW, "pyarrow is installed")
+class TestToArrowWithoutPyarrow(TestCase):
+
+    def test_import_error(self):
+        with self.assertRaisesRegex(ImportError, r"ndx-binned-spikes\[arrow\]"):
+            mock_BinnedSpikes().to_arrow()
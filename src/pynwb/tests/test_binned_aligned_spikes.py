@@ -1,5 +1,11 @@
 """Unit and integration tests for the example BinnedAlignedSpikes extension neurodata type."""
 
+import asyncio
+import os
+import tempfile
+import threading
+
+import h5py
 import numpy as np
 
 from pynwb import NWBHDF5IO
@@ -8,7 +14,11 @@ from pynwb.testing import TestCase, remove_test_file
 from hdmf.common import DynamicTableRegion
 from pynwb.misc import Units
 from ndx_binned_spikes import BinnedAlignedSpikes
+from ndx_binned_spikes.aio import AsyncDataReader
+from ndx_binned_spikes.prefetch import iter_prefetched
 from ndx_binned_spikes.testing.mock import mock_BinnedAlignedSpikes
+from ndx_binned_spikes.masking import ValidityMask
+from ndx_binned_spikes.utils import accumulate_condition_sums, find_event_violations, permute_events
 from pynwb.testing.mock.ecephys import mock_Units
 
 
@@ -349,3 +359,464 @@ class TestBinnedAlignedSpikesSimpleRoundtrip(TestCase):
             read_nwbfile = io.read()
             read_binned_aligned_spikes = read_nwbfile.acquisition["BinnedAlignedSpikes"]
             self.assertContainerEqual(binned_aligned_spikes, read_binned_aligned_spikes)
+
+
+class TestBinnedAlignedSpikesSelectUnits(TestCase):
+    """Test reading subsets of units through the units_region."""
+
+    def setUp(self):
+        self.nwbfile = mock_NWBFile()
+        self.path = "test.nwb"
+
+        units = Units(name="units")
+        units.add_column(name="quality", description="curation label")
+        for unit_id, quality in zip([10, 11, 12], ["good", "bad", "good"]):
+            units.add_row(id=unit_id, spike_times=[1.0], quality=quality)
+        self.nwbfile.units = units
+
+        units_region = DynamicTableRegion(
+            data=[2, 1, 0], table=units, description="region of units table", name="units_region"
+        )
+        self.binned_aligned_spikes = mock_BinnedAlignedSpikes(number_of_units=3, units_region=units_region)
+        self.data = self.binned_aligned_spikes.data
+
+    def tearDown(self):
+        remove_test_file(self.path)
+
+    def test_select_units(self):
+        np.testing.assert_array_equal(self.binned_aligned_spikes.select_units(ids=[10, 11]), self.data[[2, 1]])
+        np.testing.assert_array_equal(
+            self.binned_aligned_spikes.select_units(where={"quality": "good"}), self.data[[0, 2]]
+        )
+
+    def test_select_units_from_file(self):
+        self.nwbfile.add_acquisition(self.binned_aligned_spikes)
+
+        with NWBHDF5IO(self.path, mode="w") as io:
+            io.write(self.nwbfile)
+
+        with NWBHDF5IO(self.path, mode="r", load_namespaces=True) as io:
+            read_binned_aligned_spikes = io.read().acquisition["BinnedAlignedSpikes"]
+
+            selected = read_binned_aligned_spikes.select_units(where={"quality": lambda quality: quality == "good"})
+            np.testing.assert_array_equal(selected, self.data[[0, 2]])
+
+
+class TestBinnedAlignedSpikesRebinAndCrop(TestCase):
+    """Test deriving coarser or shorter windows from a BinnedAlignedSpikes."""
+
+    def setUp(self):
+        self.nwbfile = mock_NWBFile()
+        self.path = "test.nwb"
+
+        self.binned_aligned_spikes = mock_BinnedAlignedSpikes(
+            number_of_units=3,
+            number_of_events=20,
+            number_of_bins=10,
+            number_of_conditions=4,
+            bin_width_in_ms=10.0,
+            event_to_bin_offset_in_ms=-50.0,
+            condition_labels=["a", "b", "c", "d"],
+        )
+        self.data = self.binned_aligned_spikes.data
+
+    def tearDown(self):
+        remove_test_file(self.path)
+
+    def test_rebin(self):
+        rebinned = self.binned_aligned_spikes.rebin(factor=3, events_per_chunk=7)
+
+        expected_data = self.data[:, :, :9].reshape(3, 20, 3, 3).sum(axis=-1)
+        np.testing.assert_array_equal(rebinned.data, expected_data)
+        self.assertEqual(rebinned.bin_width_in_ms, 30.0)
+        self.assertEqual(rebinned.event_to_bin_offset_in_ms, -50.0)
+        np.testing.assert_array_equal(rebinned.condition_indices, self.binned_aligned_spikes.condition_indices)
+        np.testing.assert_array_equal(rebinned.event_timestamps, self.binned_aligned_spikes.event_timestamps)
+
+    def test_rebin_factor_too_large(self):
+        with self.assertRaises(ValueError):
+            self.binned_aligned_spikes.rebin(factor=11)
+
+    def test_crop(self):
+        cropped = self.binned_aligned_spikes.crop(start_ms=-25.0, stop_ms=20.0, events_per_chunk=6)
+
+        # Bins start at -50, -40, ... only those starting at -20 ... 10 end before 20 ms
+        np.testing.assert_array_equal(cropped.data, self.data[:, :, 3:7])
+        self.assertEqual(cropped.event_to_bin_offset_in_ms, -20.0)
+        self.assertEqual(cropped.bin_width_in_ms, 10.0)
+
+    def test_crop_empty_window(self):
+        with self.assertRaises(ValueError):
+            self.binned_aligned_spikes.crop(start_ms=-45.0, stop_ms=-38.0)
+
+    def test_rebin_from_file(self):
+        self.nwbfile.add_acquisition(self.binned_aligned_spikes)
+
+        with NWBHDF5IO(self.path, mode="w") as io:
+            io.write(self.nwbfile)
+
+        with NWBHDF5IO(self.path, mode="r", load_namespaces=True) as io:
+            read_binned_aligned_spikes = io.read().acquisition["BinnedAlignedSpikes"]
+            rebinned = read_binned_aligned_spikes.rebin(factor=2, name="Rebinned", events_per_chunk=3)
+
+            expected_data = self.data.reshape(3, 20, 5, 2).sum(axis=-1)
+            np.testing.assert_array_equal(rebinned.data, expected_data)
+            np.testing.assert_array_equal(rebinned.condition_labels, ["a", "b", "c", "d"])
+
+
+class TestBinnedAlignedSpikesFiringRate(TestCase):
+    """Test the smoothed firing rate estimation per event window."""
+
+    def test_to_firing_rate(self):
+        binned_aligned_spikes = mock_BinnedAlignedSpikes(number_of_events=15, number_of_bins=40, bin_width_in_ms=2.0)
+        data = binned_aligned_spikes.data
+
+        rates = binned_aligned_spikes.to_firing_rate(kernel="boxcar", sigma_ms=6.0, events_per_chunk=4)
+
+        weights = np.ones(3) / 3
+        full = np.apply_along_axis(lambda row: np.convolve(row.astype("float64"), weights), 2, data)
+        np.testing.assert_allclose(rates, full[:, :, 1:41] / 0.002)
+
+    def test_to_firing_rate_into_dataset(self):
+        binned_aligned_spikes = mock_BinnedAlignedSpikes(number_of_events=15, number_of_bins=40)
+        path = "test_firing_rate_out.h5"
+        try:
+            with h5py.File(path, mode="w") as file:
+                out = file.create_dataset("rates", shape=binned_aligned_spikes.data.shape, dtype="float64")
+
+                rates = binned_aligned_spikes.to_firing_rate(sigma_ms=20.0, out=out, events_per_chunk=4)
+
+                self.assertIs(rates, out)
+                np.testing.assert_allclose(out[:], binned_aligned_spikes.to_firing_rate(sigma_ms=20.0))
+        finally:
+            remove_test_file(path)
+
+    def test_to_firing_rate_as_container(self):
+        binned_aligned_spikes = mock_BinnedAlignedSpikes(number_of_events=15, number_of_bins=40)
+
+        rates = binned_aligned_spikes.to_firing_rate(sigma_ms=50.0, as_container=True)
+
+        self.assertIsInstance(rates, BinnedAlignedSpikes)
+        self.assertEqual(rates.data.shape, binned_aligned_spikes.data.shape)
+        np.testing.assert_array_equal(rates.condition_indices, binned_aligned_spikes.condition_indices)
+
+
+class TestBinnedAlignedSpikesPopulationMatrix(TestCase):
+    """Test the export of population matrices."""
+
+    def setUp(self):
+        self.binned_aligned_spikes = mock_BinnedAlignedSpikes(
+            number_of_units=4, number_of_events=30, number_of_bins=5, number_of_conditions=3
+        )
+        self.data = self.binned_aligned_spikes.data
+        self.condition_indices = self.binned_aligned_spikes.condition_indices
+
+    def expected_condition_means(self):
+        return np.stack(
+            [self.data[:, self.condition_indices == condition, :].mean(axis=1) for condition in range(3)]
+        )  # (conditions, units, bins)
+
+    def test_condition_averaged(self):
+        matrix = self.binned_aligned_spikes.to_population_matrix(events_per_chunk=7)
+
+        expected = self.expected_condition_means().transpose(0, 2, 1).reshape(3 * 5, 4)
+        np.testing.assert_allclose(matrix, expected)
+
+    def test_condition_averaged_units_by_samples(self):
+        matrix = self.binned_aligned_spikes.to_population_matrix(layout="units_by_samples", dtype="float32")
+
+        expected = self.expected_condition_means().transpose(1, 0, 2).reshape(4, 3 * 5)
+        self.assertEqual(matrix.dtype, np.float32)
+        np.testing.assert_allclose(matrix, expected, rtol=1e-6)
+
+    def test_event_concatenated(self):
+        matrix = self.binned_aligned_spikes.to_population_matrix(average_over_events=False, events_per_chunk=4)
+
+        expected = self.data.transpose(1, 2, 0).reshape(30 * 5, 4)
+        np.testing.assert_array_equal(matrix, expected)
+
+    def test_event_concatenated_into_memmap(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "matrix.npy")
+            out = np.lib.format.open_memmap(path, mode="w+", dtype="float32", shape=(4, 30 * 5))
+
+            matrix = self.binned_aligned_spikes.to_population_matrix(
+                layout="units_by_samples", average_over_events=False, out=out, events_per_chunk=8
+            )
+            self.assertIs(matrix, out)
+            out.flush()
+            del matrix, out
+
+            np.testing.assert_array_equal(np.load(path), self.data.reshape(4, 30 * 5))
+
+    def test_wrong_out_shape(self):
+        with self.assertRaises(ValueError):
+            self.binned_aligned_spikes.to_population_matrix(out=np.empty((2, 2)))
+
+
+class TestBinnedAlignedSpikesNoiseCorrelations(TestCase):
+    """Test the noise correlation and covariance estimation."""
+
+    def setUp(self):
+        self.binned_aligned_spikes = mock_BinnedAlignedSpikes(
+            number_of_units=6, number_of_events=60, number_of_bins=8, number_of_conditions=3
+        )
+        self.counts = self.binned_aligned_spikes.data[:, :, 2:6].sum(axis=2).astype("float64")
+        self.condition_indices = self.binned_aligned_spikes.condition_indices
+
+    def test_per_condition(self):
+        correlations = self.binned_aligned_spikes.compute_noise_correlations(bin_slice=slice(2, 6), events_per_chunk=7)
+
+        self.assertEqual(correlations.shape, (3, 6, 6))
+        for condition in range(3):
+            expected = np.corrcoef(self.counts[:, self.condition_indices == condition])
+            np.testing.assert_allclose(correlations[condition], expected, atol=1e-10)
+
+    def test_pooled_covariance(self):
+        covariance = self.binned_aligned_spikes.compute_noise_correlations(
+            bin_slice=slice(2, 6), per_condition=False, return_covariance=True, events_per_chunk=11
+        )
+
+        residuals = self.counts.copy()
+        for condition in range(3):
+            mask = self.condition_indices == condition
+            residuals[:, mask] -= residuals[:, mask].mean(axis=1, keepdims=True)
+        expected = residuals @ residuals.T / (60 - 3)
+        np.testing.assert_allclose(covariance, expected, atol=1e-8)
+
+    def test_unit_blocks_and_float32(self):
+        correlations = self.binned_aligned_spikes.compute_noise_correlations(
+            bin_slice=slice(2, 6), dtype="float32", unit_block_size=4
+        )
+
+        self.assertEqual(correlations.dtype, np.float32)
+        for condition in range(3):
+            expected = np.corrcoef(self.counts[:, self.condition_indices == condition])
+            np.testing.assert_allclose(correlations[condition], expected, atol=1e-4)
+
+    def test_float32_matches_float64_for_many_events(self):
+        # The covariance of large counts over many events is a small difference of large cross products
+        rng = np.random.default_rng(seed=0)
+        data = rng.poisson(30, size=(4, 200_000, 1)).astype("uint16")
+        binned_aligned_spikes = BinnedAlignedSpikes(
+            bin_width_in_ms=10.0, data=data, event_timestamps=np.arange(200_000, dtype="float64")
+        )
+
+        covariance_32 = binned_aligned_spikes.compute_noise_correlations(return_covariance=True, dtype="float32")
+        covariance_64 = binned_aligned_spikes.compute_noise_correlations(return_covariance=True, dtype="float64")
+        pooled_32 = binned_aligned_spikes.compute_noise_correlations(
+            per_condition=False, return_covariance=True, dtype="float32", unit_block_size=3
+        )
+
+        self.assertEqual(covariance_32.dtype, np.float32)
+        # The deviations from the condition means are accumulated in float32 without cancellation
+        np.testing.assert_allclose(covariance_32, covariance_64, rtol=1e-4, atol=1e-3)
+        np.testing.assert_allclose(pooled_32, covariance_64[0], rtol=1e-4, atol=1e-3)
+        np.testing.assert_allclose(covariance_64[0], np.cov(data[:, :, 0].astype("float64")), rtol=1e-9)
+
+
+class TestBinnedAlignedSpikesPrefetch(TestCase):
+
+    def setUp(self):
+        self.binned_aligned_spikes = mock_BinnedAlignedSpikes(
+            number_of_units=3, number_of_events=25, number_of_bins=4, number_of_conditions=4
+        )
+
+    def test_iter_conditions(self):
+        for prefetch in (0, 1, 3):
+            conditions = []
+            for condition_index, data in self.binned_aligned_spikes.iter_conditions(prefetch=prefetch):
+                conditions.append(condition_index)
+                np.testing.assert_array_equal(data, self.binned_aligned_spikes.get_data_for_condition(condition_index))
+            self.assertEqual(conditions, [0, 1, 2, 3])
+
+    def test_iter_event_blocks(self):
+        blocks = list(self.binned_aligned_spikes.iter_event_blocks(block_size=10, prefetch=2))
+
+        self.assertEqual([event_slice for event_slice, _ in blocks], [slice(0, 10), slice(10, 20), slice(20, 25)])
+        data = np.concatenate([data for _, data in blocks], axis=1)
+        np.testing.assert_array_equal(data, self.binned_aligned_spikes.data)
+
+    def test_stopping_early_stops_the_reader(self):
+        number_of_threads = threading.active_count()
+        iterator = self.binned_aligned_spikes.iter_event_blocks(block_size=1, prefetch=2)
+        next(iterator)
+        iterator.close()
+
+        self.assertEqual(threading.active_count(), number_of_threads)
+
+    def test_read_errors_are_raised_in_the_caller(self):
+        def failing_read():
+            raise OSError("read failed")
+
+        iterator = iter_prefetched([lambda: 1, failing_read, lambda: 3], prefetch=2)
+        self.assertEqual(next(iterator), 1)
+        with self.assertRaisesWith(OSError, "read failed"):
+            next(iterator)
+
+
+class TestBinnedAlignedSpikesAsync(TestCase):
+
+    def test_aget_data_for_condition(self):
+        binned_aligned_spikes = mock_BinnedAlignedSpikes(number_of_events=12, number_of_conditions=3)
+        reader = AsyncDataReader(max_workers=2)
+
+        async def request_conditions():
+            return await asyncio.gather(
+                *(binned_aligned_spikes.aget_data_for_condition(condition, reader=reader) for condition in [0, 1, 0])
+            )
+
+        try:
+            results = asyncio.run(request_conditions())
+        finally:
+            reader.close()
+
+        for condition, data in zip([0, 1, 0], results):
+            np.testing.assert_array_equal(data, binned_aligned_spikes.get_data_for_condition(condition))
+        # The two requests for the first condition share one read
+        self.assertIs(results[0], results[2])
+
+
+class TestBinnedAlignedSpikesValidation(TestCase):
+
+    def setUp(self):
+        self.data = np.zeros((2, 6, 3), dtype="uint64")
+        self.event_timestamps = np.arange(6, dtype="float64")
+        self.condition_indices = np.array([0, 1, 0, 1, 0, 1], dtype="uint64")
+
+    def test_first_unsorted_timestamp_is_reported(self):
+        event_timestamps = self.event_timestamps.copy()
+        event_timestamps[4] = 2.5
+
+        with self.assertRaisesRegex(ValueError, "First violation at index 4: 3.0 is followed by 2.5"):
+            BinnedAlignedSpikes(bin_width_in_ms=1.0, data=self.data, event_timestamps=event_timestamps)
+
+    def test_condition_indices_out_of_the_labels_range(self):
+        condition_indices = self.condition_indices.copy()
+        condition_indices[3] = 2
+
+        with self.assertRaisesRegex(ValueError, "The index of event 3 is 2"):
+            BinnedAlignedSpikes(
+                bin_width_in_ms=1.0,
+                data=self.data,
+                event_timestamps=self.event_timestamps,
+                condition_indices=condition_indices,
+                condition_labels=np.array(["a", "b"]),
+            )
+
+    def test_condition_indices_length(self):
+        with self.assertRaisesRegex(ValueError, "must match the condition_indices"):
+            BinnedAlignedSpikes(
+                bin_width_in_ms=1.0,
+                data=self.data,
+                event_timestamps=self.event_timestamps,
+                condition_indices=self.condition_indices[:-1],
+            )
+
+    def test_blockwise_and_parallel_checks(self):
+        rng = np.random.default_rng(seed=0)
+        event_timestamps = np.cumsum(rng.random(10_000))
+        condition_indices = rng.integers(0, 3, size=10_000)
+        event_timestamps[5_000] = event_timestamps[4_999] - 1.0
+        event_timestamps[7_000] = np.nan
+        condition_indices[6_000] = -1
+        condition_indices[8_000] = 3
+
+        for max_workers in (1, 4):
+            for block_size in (5_000, 1_000, 10_000):
+                with self.subTest(max_workers=max_workers, block_size=block_size):
+                    violations = find_event_violations(
+                        event_timestamps,
+                        condition_indices,
+                        number_of_conditions=3,
+                        block_size=block_size,
+                        max_workers=max_workers,
+                    )
+                    self.assertEqual(violations, (5_000, 6_000))
+
+        self.assertEqual(find_event_violations(np.sort(event_timestamps[:4_000]), block_size=100), (None, None))
+
+
+class TestBinnedAlignedSpikesSortEvents(TestCase):
+
+    def setUp(self):
+        self.event_timestamps = np.array([3.0, 1.0, 3.0, 1.0, 2.0, 3.0])
+        self.condition_indices = np.array([1, 0, 0, 0, 1, 1])
+        self.data = np.arange(2 * 6 * 2).reshape(2, 6, 2)
+        # Ties on the timestamp are broken by condition and then by original position
+        self.expected_order = np.array([1, 3, 4, 2, 0, 5])
+
+    def test_ties_are_sorted_deterministically(self):
+        data, event_timestamps, condition_indices, event_ids = BinnedAlignedSpikes.sort_data_by_event_timestamps(
+            self.data, self.event_timestamps, self.condition_indices, np.array(["a", "b", "c", "d", "e", "f"])
+        )
+
+        np.testing.assert_array_equal(data, self.data[:, self.expected_order, :])
+        np.testing.assert_array_equal(event_timestamps, self.event_timestamps[self.expected_order])
+        np.testing.assert_array_equal(condition_indices, self.condition_indices[self.expected_order])
+        np.testing.assert_array_equal(event_ids, ["b", "d", "e", "c", "a", "f"])
+
+    def test_without_condition_indices(self):
+        data, event_timestamps, condition_indices = BinnedAlignedSpikes.sort_data_by_event_timestamps(
+            self.data, self.event_timestamps
+        )
+
+        np.testing.assert_array_equal(data, self.data[:, [1, 3, 4, 0, 2, 5], :])
+        self.assertIsNone(condition_indices)
+
+    def test_sort_into_out_of_core_output(self):
+        path = "test_sort_events.h5"
+        try:
+            with h5py.File(path, mode="w") as file:
+                source = file.create_dataset("source", data=self.data)
+                out = file.create_dataset("sorted", shape=self.data.shape, dtype=self.data.dtype)
+
+                data, _, _ = BinnedAlignedSpikes.sort_data_by_event_timestamps(
+                    source, self.event_timestamps, self.condition_indices, out=out, events_per_chunk=4
+                )
+
+                self.assertIs(data, out)
+                np.testing.assert_array_equal(out[:], self.data[:, self.expected_order, :])
+        finally:
+            remove_test_file(path)
+
+
+class TestBinnedAlignedSpikesEventHelpers(TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.data = rng.integers(0, 10, size=(3, 11, 4)).astype("uint8")
+        self.codes = np.array([2, 0, 2, 1, 0, 0, 2, 4, 1, 2, 0])
+        self.number_of_conditions = 5
+
+    def test_permute_events(self):
+        order = np.random.default_rng(1).permutation(11)
+        for events_per_chunk in (1, 3, 11):
+            permuted = permute_events(self.data, order, events_per_chunk=events_per_chunk)
+            np.testing.assert_array_equal(permuted, self.data[:, order, :])
+
+    def test_accumulate_condition_sums(self):
+        expected_sums = np.stack(
+            [self.data[:, self.codes == code, :].sum(axis=1, dtype="float64") for code in range(5)]
+        )
+        for events_per_chunk in (1, 4, 11):
+            sums, number_of_events = accumulate_condition_sums(
+                self.data, self.codes, self.number_of_conditions, events_per_chunk=events_per_chunk
+            )
+            # Condition 3 has no events, so it sums to zero
+            np.testing.assert_array_equal(sums, expected_sums)
+            np.testing.assert_array_equal(number_of_events, [4, 2, 4, 0, 1])
+
+    def test_accumulate_condition_sums_with_validity_mask(self):
+        valid = np.random.default_rng(2).random(self.data.shape) > 0.3
+        validity_mask = ValidityMask.from_bool(valid)
+        masked = np.where(valid, self.data, 0)
+        expected_sums = np.stack([masked[:, self.codes == code, :].sum(axis=1) for code in range(5)])
+        expected_counts = np.stack([valid[:, self.codes == code, :].sum(axis=1) for code in range(5)])
+
+        sums, counts = accumulate_condition_sums(
+            self.data, self.codes, self.number_of_conditions, events_per_chunk=4, validity_mask=validity_mask
+        )
+
+        np.testing.assert_array_equal(sums, expected_sums)
+        np.testing.assert_array_equal(counts, expected_counts)
@@ -1,5 +1,8 @@
 """Unit and integration tests for the BinnedSpikes extension neurodata type."""
 
+import asyncio
+import tempfile
+
 import numpy as np
 
 from pynwb import NWBHDF5IO
@@ -8,6 +11,8 @@ from pynwb.testing import TestCase, remove_test_file
 from hdmf.common import DynamicTableRegion
 from pynwb.misc import Units
 from ndx_binned_spikes import BinnedSpikes
+from ndx_binned_spikes.aio import AsyncDataReader
+from ndx_binned_spikes.smoothing import make_kernel
 from ndx_binned_spikes.testing.mock import mock_BinnedSpikes
 from pynwb.testing.mock.ecephys import mock_Units
 
@@ -175,3 +180,221 @@ class TestBinnedSpikesSimpleRoundtrip(TestCase):
             read_nwbfile = io.read()
             read_binned_spikes = read_nwbfile.acquisition["BinnedSpikes"]
             self.assertContainerEqual(binned_spikes, read_binned_spikes)
+
+
+class TestBinnedSpikesSelectUnits(TestCase):
+    """Test reading subsets of units through the units_region."""
+
+    def setUp(self):
+        self.nwbfile = mock_NWBFile()
+        self.path = "test.nwb"
+
+        units = Units(name="units")
+        units.add_column(name="quality", description="curation label")
+        for unit_id, quality in zip([10, 11, 12, 13, 14], ["good", "bad", "good", "good", "bad"]):
+            units.add_row(id=unit_id, spike_times=[1.0], quality=quality)
+        self.nwbfile.units = units
+
+        # The data rows map to table rows 4, 0, 1, 2 -> unit ids 14, 10, 11, 12
+        self.region_indices = [4, 0, 1, 2]
+        units_region = DynamicTableRegion(
+            data=self.region_indices, table=units, description="region of units table", name="units_region"
+        )
+        self.binned_spikes = mock_BinnedSpikes(number_of_units=4, number_of_bins=6, units_region=units_region)
+        self.data = self.binned_spikes.data
+
+    def tearDown(self):
+        remove_test_file(self.path)
+
+    def test_select_units_by_ids(self):
+        selected = self.binned_spikes.select_units(ids=[12, 14, 10])
+        np.testing.assert_array_equal(selected, self.data[[3, 0, 1]])
+
+    def test_select_units_where_column_value(self):
+        selected = self.binned_spikes.select_units(where={"quality": "good"})
+        np.testing.assert_array_equal(selected, self.data[[1, 3]])
+
+    def test_select_units_where_callable(self):
+        selected = self.binned_spikes.select_units(where=lambda table, rows: rows >= 2)
+        np.testing.assert_array_equal(selected, self.data[[0, 3]])
+
+    def test_select_units_ids_and_where(self):
+        selected = self.binned_spikes.select_units(ids=[14, 12, 11], where={"quality": "good"})
+        np.testing.assert_array_equal(selected, self.data[[3]])
+
+    def test_select_units_unknown_id(self):
+        with self.assertRaises(KeyError):
+            self.binned_spikes.select_units(ids=[13])
+
+    def test_select_units_without_units_region(self):
+        with self.assertRaises(ValueError):
+            mock_BinnedSpikes().select_units(ids=[0])
+
+    def test_select_units_from_file(self):
+        self.nwbfile.add_acquisition(self.binned_spikes)
+
+        with NWBHDF5IO(self.path, mode="w") as io:
+            io.write(self.nwbfile)
+
+        with NWBHDF5IO(self.path, mode="r", load_namespaces=True) as io:
+            read_binned_spikes = io.read().acquisition["BinnedSpikes"]
+
+            selected = read_binned_spikes.select_units(ids=[12, 10, 11], where={"quality": "good"})
+            np.testing.assert_array_equal(selected, self.data[[3, 1]])
+
+
+class TestBinnedSpikesFiringRate(TestCase):
+    """Test the smoothed firing rate estimation."""
+
+    def setUp(self):
+        self.binned_spikes = mock_BinnedSpikes(number_of_units=3, number_of_bins=200, bin_width_in_ms=5.0)
+        self.data = self.binned_spikes.data
+
+    def expected_rates(self, weights, origin):
+        """Reference implementation with a full convolution per unit."""
+        number_of_bins = self.data.shape[1]
+        full = np.array([np.convolve(row.astype("float64"), weights) for row in self.data])
+        return full[:, origin : origin + number_of_bins] / (self.binned_spikes.bin_width_in_ms / 1000.0)
+
+    def test_gaussian_kernel_with_chunks(self):
+        # A long kernel so the FFT path is used and chunks need context from their neighbours
+        weights, origin = make_kernel("gaussian", sigma_ms=40.0, bin_width_in_ms=5.0)
+        rates = self.binned_spikes.to_firing_rate(kernel="gaussian", sigma_ms=40.0, bins_per_chunk=17)
+
+        np.testing.assert_allclose(rates, self.expected_rates(weights, origin))
+        np.testing.assert_allclose(rates, self.binned_spikes.to_firing_rate(kernel="gaussian", sigma_ms=40.0))
+
+    def test_exponential_kernel_is_causal(self):
+        data = np.zeros((1, 50), dtype="uint64")
+        data[0, 20] = 1
+        binned_spikes = mock_BinnedSpikes(data=data, bin_width_in_ms=1.0)
+
+        rates = binned_spikes.to_firing_rate(kernel="exponential", sigma_ms=3.0, bins_per_chunk=7)
+
+        np.testing.assert_array_equal(rates[0, :20], 0.0)
+        self.assertTrue(np.all(np.diff(rates[0, 20:36]) < 0))
+
+    def test_boxcar_kernel(self):
+        rates = self.binned_spikes.to_firing_rate(kernel="boxcar", sigma_ms=15.0, dtype="float32")
+
+        self.assertEqual(rates.dtype, np.float32)
+        np.testing.assert_allclose(rates, self.expected_rates(np.ones(3) / 3, 1), rtol=1e-6)
+
+    def test_nans_stay_local(self):
+        data = np.ones((2, 300), dtype="float32")
+        data[0, 150] = np.nan
+        binned_spikes = mock_BinnedSpikes(data=data, bin_width_in_ms=1.0)
+
+        # 81 taps, long enough for the FFT path to be used if the data had no NaNs
+        rates = binned_spikes.to_firing_rate(kernel="gaussian", sigma_ms=10.0)
+
+        expected_nans = np.zeros(data.shape, dtype=bool)
+        expected_nans[0, 110:191] = True
+        np.testing.assert_array_equal(np.isnan(rates), expected_nans)
+
+    def test_out(self):
+        with tempfile.TemporaryFile() as file:
+            out = np.memmap(file, dtype="float32", mode="w+", shape=self.data.shape)
+            rates = self.binned_spikes.to_firing_rate(kernel="boxcar", sigma_ms=15.0, out=out, bins_per_chunk=9)
+
+            self.assertIs(rates, out)
+            np.testing.assert_allclose(out, self.expected_rates(np.ones(3) / 3, 1), rtol=1e-6)
+        with self.assertRaises(ValueError):
+            self.binned_spikes.to_firing_rate(out=np.empty((1, 2)))
+
+    def test_as_container(self):
+        rates = self.binned_spikes.to_firing_rate(sigma_ms=10.0, as_container=True, name="FiringRates")
+
+        self.assertIsInstance(rates, BinnedSpikes)
+        self.assertEqual(rates.name, "FiringRates")
+        self.assertEqual(rates.bin_width_in_ms, self.binned_spikes.bin_width_in_ms)
+        self.assertEqual(rates.number_of_bins, self.binned_spikes.number_of_bins)
+
+    def test_unknown_kernel(self):
+        with self.assertRaises(ValueError):
+            self.binned_spikes.to_firing_rate(kernel="triangle")
+
+
+class CountingAsyncDataReader(AsyncDataReader):
+    """Counts the reads that reach the thread pool."""
+
+    def __init__(self):
+        super().__init__(max_workers=2)
+        self.number_of_reads = 0
+
+    def _read(self, data, read):
+        self.number_of_reads += 1
+        return super()._read(data, read)
+
+
+class TestBinnedSpikesTimeRange(TestCase):
+
+    def setUp(self):
+        data = np.arange(30, dtype="uint64").reshape(3, 10)
+        self.binned_spikes = BinnedSpikes(bin_width_in_ms=10.0, start_time_in_ms=100.0, data=data)
+
+    def test_get_data_in_time_range(self):
+        # The bins starting at 120, 130 and 140 ms
+        data = self.binned_spikes.get_data_in_time_range(start_ms=115.0, stop_ms=150.0)
+        np.testing.assert_array_equal(data, self.binned_spikes.data[:, 2:5])
+
+    def test_range_is_clipped_to_the_data(self):
+        self.assertEqual(self.binned_spikes.get_bin_slice_for_time_range(0.0, 1000.0), slice(0, 10))
+        self.assertEqual(self.binned_spikes.get_data_in_time_range(500.0, 600.0).shape, (3, 0))
+
+    def test_aget_data_in_time_range(self):
+        reader = CountingAsyncDataReader()
+
+        async def request_overlapping_ranges():
+            return await asyncio.gather(
+                self.binned_spikes.aget_data_in_time_range(100.0, 200.0, reader=reader),
+                self.binned_spikes.aget_data_in_time_range(120.0, 150.0, reader=reader),
+                self.binned_spikes.aget_data_in_time_range(190.0, 200.0, reader=reader),
+            )
+
+        try:
+            full, middle, last = asyncio.run(request_overlapping_ranges())
+        finally:
+            reader.close()
+
+        np.testing.assert_array_equal(full, self.binned_spikes.data)
+        np.testing.assert_array_equal(middle, self.binned_spikes.data[:, 2:5])
+        np.testing.assert_array_equal(last, self.binned_spikes.data[:, 9:10])
+        self.assertEqual(reader.number_of_reads, 1)
+
+    def test_partially_overlapping_requests_read_the_missing_bins(self):
+        reader = CountingAsyncDataReader()
+
+        async def request_partially_overlapping_ranges():
+            return await asyncio.gather(
+                self.binned_spikes.aget_data_in_time_range(100.0, 160.0, reader=reader),
+                self.binned_spikes.aget_data_in_time_range(140.0, 200.0, reader=reader),
+                # Covered by the two reads above, so it is stitched from them
+                self.binned_spikes.aget_data_in_time_range(130.0, 180.0, reader=reader),
+            )
+
+        try:
+            first, second, stitched = asyncio.run(request_partially_overlapping_ranges())
+        finally:
+            reader.close()
+
+        np.testing.assert_array_equal(first, self.binned_spikes.data[:, :6])
+        np.testing.assert_array_equal(second, self.binned_spikes.data[:, 4:])
+        np.testing.assert_array_equal(stitched, self.binned_spikes.data[:, 3:8])
+        self.assertEqual(reader.number_of_reads, 2)
+        self.assertEqual(reader._time_range_reads, {})
+
+    def test_sequential_requests_are_read_again(self):
+        reader = CountingAsyncDataReader()
+
+        async def request_twice():
+            await self.binned_spikes.aget_data_in_time_range(100.0, 200.0, reader=reader)
+            return await self.binned_spikes.aget_data_in_time_range(100.0, 120.0, reader=reader)
+
+        try:
+            data = asyncio.run(request_twice())
+        finally:
+            reader.close()
+
+        np.testing.assert_array_equal(data, self.binned_spikes.data[:, :2])
+        self.assertEqual(reader.number_of_reads, 2)
@@ -0,0 +1,108 @@
+"""Tests for binning flat spike arrays into BinnedSpikes."""
+
+import os
+import tempfile
+
+import h5py
+import numpy as np
+
+from pynwb.testing import TestCase
+from ndx_binned_spikes import BinnedSpikes
+from ndx_binned_spikes.binning import bin_spike_arrays
+
+
+def _bin_per_unit(spike_times, spike_clusters, unit_ids, bin_edges):
+    return np.stack(
+        [np.histogram(spike_times[spike_clusters == unit_id], bins=bin_edges)[0] for unit_id in unit_ids]
+    )
+
+
+class TestBinSpikeArrays(TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(seed=0)
+        self.spike_times = np.sort(rng.uniform(0.0, 10.0, size=20_000))
+        self.spike_clusters = rng.choice([3, 8, 11, 40], size=self.spike_times.size)
+        self.unit_ids = np.array([3, 8, 11, 40])
+        self.bin_edges = np.arange(0.0, 10.0 + 0.025, 0.025)
+
+    def test_sorted_spikes_in_blocks(self):
+        expected = _bin_per_unit(self.spike_times, self.spike_clusters, self.unit_ids, self.bin_edges)
+
+        data, unit_ids = bin_spike_arrays(
+            self.spike_times,
+            self.spike_clusters,
+            bin_width_in_ms=25.0,
+            stop_time_in_ms=10_000.0,
+            spikes_per_block=1000,
+            bins_per_tile=7,
+        )
+        np.testing.assert_array_equal(unit_ids, self.unit_ids)
+        self.assertEqual(data.dtype, np.uint32)
+        np.testing.assert_array_equal(data, expected)
+
+        # The default number of bins ends with the bin of the last spike
+        data, _ = bin_spike_arrays(self.spike_times, self.spike_clusters, bin_width_in_ms=25.0)
+        last_bin = int(self.spike_times[-1] * 1000 // 25)
+        np.testing.assert_array_equal(data, expected[:, : last_bin + 1])
+
+    def test_unsorted_spikes_and_unit_selection(self):
+        order = np.random.default_rng(seed=1).permutation(self.spike_times.size)
+        unit_ids = [40, 3, 99]
+        expected = _bin_per_unit(self.spike_times, self.spike_clusters, unit_ids, self.bin_edges[40:201])
+
+        data, returned_unit_ids = bin_spike_arrays(
+            self.spike_times[order],
+            self.spike_clusters[order],
+            bin_width_in_ms=25.0,
+            start_time_in_ms=1000.0,
+            stop_time_in_ms=5000.0,
+            unit_ids=unit_ids,
+            spikes_per_block=3000,
+            bins_per_tile=16,
+        )
+        np.testing.assert_array_equal(returned_unit_ids, unit_ids)
+        np.testing.assert_array_equal(data, expected)
+
+        with self.assertRaises(ValueError):
+            bin_spike_arrays(self.spike_times, self.spike_clusters, bin_width_in_ms=25.0, unit_ids=[3, 3])
+        with self.assertRaises(ValueError):
+            bin_spike_arrays(self.spike_times, self.spike_clusters[:-1], bin_width_in_ms=25.0)
+
+    def test_memory_mapped_samples_into_hdf5(self):
+        sampling_frequency = 30_000.0
+        spike_samples = np.round(self.spike_times * sampling_frequency).astype("uint64")
+        # 25 ms bins are 750 samples; integer edges avoid the rounding of spikes that fall on bin edges
+        expected = _bin_per_unit(spike_samples, self.spike_clusters, self.unit_ids, np.arange(401) * 750)
+
+        with tempfile.TemporaryDirectory() as directory:
+            np.save(os.path.join(directory, "spike_times.npy"), spike_samples)
+            np.save(os.path.join(directory, "spike_clusters.npy"), self.spike_clusters)
+            spike_times = np.load(os.path.join(directory, "spike_times.npy"), mmap_mode="r")
+            spike_clusters = np.load(os.path.join(directory, "spike_clusters.npy"), mmap_mode="r")
+
+            with h5py.File(os.path.join(directory, "binned.h5"), mode="w") as file:
+                # The output is written tile by tile, following the chunks of the dataset
+                out = file.create_dataset("data", shape=expected.shape, dtype="uint16", chunks=(4, 50), fillvalue=7)
+                binned_spikes = BinnedSpikes.from_spike_arrays(
+                    spike_times,
+                    spike_clusters,
+                    bin_width_in_ms=25.0,
+                    stop_time_in_ms=10_000.0,
+                    sampling_frequency=sampling_frequency,
+                    out=out,
+                    spikes_per_block=2500,
+                    bins_per_tile=100,
+                )
+                self.assertIs(binned_spikes.data, out)
+                self.assertEqual(binned_spikes.bin_width_in_ms, 25.0)
+                np.testing.assert_array_equal(out[:], expected)
+
+    def test_counts_that_do_not_fit(self):
+        spike_times = np.full(300, 0.001)
+        spike_clusters = np.zeros(300, dtype="int64")
+        with self.assertRaises(ValueError):
+            bin_spike_arrays(spike_times, spike_clusters, bin_width_in_ms=10.0, dtype="uint8")
+
+        binned_spikes = BinnedSpikes.from_spike_arrays(spike_times, spike_clusters, bin_width_in_ms=10.0)
+        np.testing.assert_array_equal(binned_spikes.data, [[300]])
@@ -0,0 +1,149 @@
+"""Tests for the chunk cache of binned datasets."""
+
+import numpy as np
+
+from pynwb import NWBHDF5IO
+from pynwb.testing import TestCase, remove_test_file
+from pynwb.testing.mock.file import mock_NWBFile
+from ndx_binned_spikes.cache import CachedDataset, ChunkCache, guess_block_shape
+from ndx_binned_spikes.testing.mock import mock_BinnedAlignedSpikes, mock_BinnedSpikes
+
+
+class TestCachedDataset(TestCase):
+
+    def setUp(self):
+        self.data = np.arange(4 * 32 * 6).reshape(4, 32, 6)
+        self.cache = ChunkCache()
+        self.cached_data = CachedDataset(self.data, self.cache, chunk_shape=(2, 8, 3))
+
+    def test_selections_match_numpy(self):
+        mask = np.zeros(32, dtype=bool)
+        mask[[1, 5, 6, 29]] = True
+        selections = [
+            (slice(None), slice(None), slice(None)),
+            Ellipsis,
+            1,
+            (slice(1, 3), slice(4, 21), 2),
+            (-1, slice(None, None, 4)),
+            (slice(None), mask, slice(None)),
+            (np.array([3, 0, 3]),),
+            (slice(None), slice(20, 2, -3)),
+            (slice(None), slice(10, 10)),
+            (Ellipsis, -2),
+        ]
+        for selection in selections:
+            with self.subTest(selection=selection):
+                np.testing.assert_array_equal(self.cached_data[selection], self.data[selection])
+
+    def test_overlapping_reads_reuse_chunks(self):
+        self.cached_data[:, 0:10, :]
+        misses = self.cache.misses
+        self.cached_data[:, 4:20, :]
+
+        # Only the chunks of the events 16 to 23 are new: 2 chunks of units times 2 chunks of bins
+        self.assertEqual(self.cache.misses - misses, 2 * 2)
+        self.assertGreater(self.cache.hits, 0)
+
+    def test_scattered_positions_read_their_chunks(self):
+        # The positions 1, 30 and 31 are in the first and last of the 4 chunks of events
+        selection = (slice(None), np.array([31, 1, 30, 1]), slice(None))
+        np.testing.assert_array_equal(self.cached_data[selection], self.data[selection])
+        self.assertEqual(self.cache.misses, 2 * 2 * 2)
+
+    def test_in_memory_data_keeps_its_key(self):
+        cache = ChunkCache()
+        CachedDataset(np.zeros((4, 4)), cache, chunk_shape=(2, 2))[...]
+        # The chunks of a released array are not served for a new array, even if it gets the same id
+        np.testing.assert_array_equal(CachedDataset(np.ones((4, 4)), cache, chunk_shape=(2, 2))[...], 1)
+        self.assertEqual(cache.hits, 0)
+
+    def test_byte_budget(self):
+        chunk_size_in_bytes = 2 * 8 * 3 * self.data.itemsize
+        cache = ChunkCache(max_bytes=3 * chunk_size_in_bytes)
+        cached_data = CachedDataset(self.data, cache, chunk_shape=(2, 8, 3))
+
+        np.testing.assert_array_equal(cached_data[...], self.data)
+
+        stats = cache.stats
+        self.assertEqual(stats["number_of_chunks"], 3)
+        self.assertLessEqual(stats["nbytes"], stats["max_bytes"])
+        self.assertEqual(stats["evictions"], 2 * 4 * 2 - 3)
+
+    def test_guess_block_shape(self):
+        block_shape = guess_block_shape((100, 10_000, 50), itemsize=8, block_size_in_bytes=1024**2)
+        self.assertLessEqual(int(np.prod(block_shape)) * 8, 1024**2)
+        self.assertEqual(guess_block_shape((2, 3), itemsize=8), (2, 3))
+
+
+class TestChunkCacheInContainers(TestCase):
+
+    def setUp(self):
+        self.binned_aligned_spikes = mock_BinnedAlignedSpikes(
+            number_of_units=5, number_of_events=40, number_of_bins=6, number_of_conditions=3
+        )
+        nwbfile = mock_NWBFile()
+        nwbfile.add_acquisition(self.binned_aligned_spikes)
+        nwbfile.add_acquisition(mock_BinnedSpikes(number_of_units=3, number_of_bins=50))
+
+        self.path = "test_cache.nwb"
+        with NWBHDF5IO(self.path, mode="w") as io:
+            io.write(nwbfile)
+
+    def tearDown(self):
+        remove_test_file(self.path)
+
+    def test_methods_read_through_the_cache(self):
+        cache = ChunkCache()
+        with NWBHDF5IO(self.path, mode="r") as io:
+            read_binned_aligned_spikes = io.read().acquisition["BinnedAlignedSpikes"]
+            read_binned_aligned_spikes.set_chunk_cache(cache, chunk_shape=(5, 8, 6))
+
+            for condition in range(3):
+                np.testing.assert_array_equal(
+                    read_binned_aligned_spikes.get_data_for_condition(condition),
+                    self.binned_aligned_spikes.get_data_for_condition(condition),
+                )
+            self.assertEqual(cache.misses, 5)
+            self.assertEqual(cache.hits, 2 * 5)
+
+            rebinned = read_binned_aligned_spikes.rebin(2)
+            np.testing.assert_array_equal(rebinned.data, self.binned_aligned_spikes.rebin(2).data)
+
+            read_binned_aligned_spikes.set_chunk_cache(None)
+            read_binned_aligned_spikes.get_data_for_condition(0)
+            self.assertEqual(cache.misses, 5)
+
+    def test_containers_of_the_same_file_share_chunks(self):
+        cache = ChunkCache()
+        with NWBHDF5IO(self.path, mode="r") as first_io, NWBHDF5IO(self.path, mode="r") as second_io:
+            first = first_io.read().acquisition["BinnedSpikes"]
+            second = second_io.read().acquisition["BinnedSpikes"]
+            first.set_chunk_cache(cache)
+            second.set_chunk_cache(cache)
+
+            first.get_data_in_time_range(0.0, 1000.0)
+            misses = cache.misses
+            data = second.get_data_in_time_range(0.0, 1000.0)
+
+            self.assertEqual(cache.misses, misses)
+            np.testing.assert_array_equal(data, first.data[:])
+
+    def test_rewritten_file_is_not_served_from_the_cache(self):
+        cache = ChunkCache()
+        with NWBHDF5IO(self.path, mode="r") as io:
+            binned_spikes = io.read().acquisition["BinnedSpikes"]
+            binned_spikes.set_chunk_cache(cache)
+            binned_spikes.get_data_in_time_range(0.0, 1000.0)
+
+        rewritten_binned_spikes = mock_BinnedSpikes(number_of_units=3, number_of_bins=50, seed=1)
+        nwbfile = mock_NWBFile()
+        nwbfile.add_acquisition(rewritten_binned_spikes)
+        with NWBHDF5IO(self.path, mode="w") as io:
+            io.write(nwbfile)
+
+        with NWBHDF5IO(self.path, mode="r") as io:
+            binned_spikes = io.read().acquisition["BinnedSpikes"]
+            binned_spikes.set_chunk_cache(cache)
+
+            data = binned_spikes.get_data_in_time_range(0.0, 1000.0)
+            np.testing.assert_array_equal(data, rewritten_binned_spikes.data)
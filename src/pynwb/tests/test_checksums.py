@@ -0,0 +1,132 @@
+"""Tests for the content checksums of the binned data interfaces."""
+
+import numpy as np
+
+from hdmf.common import DynamicTableRegion
+from pynwb import NWBHDF5IO
+from pynwb.testing import TestCase, remove_test_file
+from pynwb.testing.mock.file import mock_NWBFile
+from ndx_binned_spikes.checksums import (
+    add_checksum_manifest,
+    compute_checksum_manifest,
+    find_changes,
+    verify_checksums,
+)
+from ndx_binned_spikes.testing.mock import mock_BinnedAlignedSpikes, mock_BinnedSpikes
+
+
+class TestChecksums(TestCase):
+
+    def setUp(self):
+        self.nwbfile = mock_NWBFile()
+        self.spike_times = [np.array([0.1, 0.5]), np.array([0.2]), np.array([0.3, 0.4, 0.9])]
+        for unit_spike_times in self.spike_times:
+            self.nwbfile.add_unit(spike_times=unit_spike_times)
+
+        self.binned_aligned_spikes = mock_BinnedAlignedSpikes(
+            number_of_units=3, number_of_events=20, number_of_bins=4, number_of_conditions=2
+        )
+        self.binned_aligned_spikes.units_region = DynamicTableRegion(
+            name="units_region", data=[0, 1, 2], table=self.nwbfile.units, description="all the units"
+        )
+        self.manifest = add_checksum_manifest(self.binned_aligned_spikes, block_size=8)
+        self.nwbfile.add_acquisition(self.binned_aligned_spikes)
+
+        self.path = "test_checksums.nwb"
+        with NWBHDF5IO(self.path, mode="w") as io:
+            io.write(self.nwbfile)
+
+    def tearDown(self):
+        remove_test_file(self.path)
+
+    def test_unit_hashes_do_not_depend_on_the_block_size(self):
+        manifest = compute_checksum_manifest(self.binned_aligned_spikes, block_size=3)
+
+        self.assertEqual(manifest["unit_hashes"], self.manifest["unit_hashes"])
+        self.assertEqual(len(manifest["block_hashes"]), 7)
+        self.assertEqual(len(self.manifest["block_hashes"]), 3)
+
+    def test_unchanged_inputs(self):
+        with NWBHDF5IO(self.path, mode="r") as io:
+            read_binned_aligned_spikes = io.read().acquisition["BinnedAlignedSpikes"]
+
+            changes = find_changes(
+                read_binned_aligned_spikes,
+                spike_times=self.spike_times,
+                event_timestamps=self.binned_aligned_spikes.event_timestamps,
+                condition_indices=self.binned_aligned_spikes.condition_indices,
+                bin_width_in_ms=self.binned_aligned_spikes.bin_width_in_ms,
+            )
+            self.assertFalse(changes.any)
+            self.assertFalse(verify_checksums(read_binned_aligned_spikes).any)
+
+    def test_changed_inputs(self):
+        spike_times = list(self.spike_times)
+        spike_times[1] = np.array([0.2, 0.7])
+        event_timestamps = np.array(self.binned_aligned_spikes.event_timestamps, dtype="float64")
+        event_timestamps[10] += 0.001
+
+        with NWBHDF5IO(self.path, mode="r") as io:
+            read_binned_aligned_spikes = io.read().acquisition["BinnedAlignedSpikes"]
+
+            changes = find_changes(
+                read_binned_aligned_spikes,
+                spike_times=spike_times,
+                event_timestamps=event_timestamps,
+                condition_indices=self.binned_aligned_spikes.condition_indices,
+            )
+            self.assertFalse(changes.everything)
+            np.testing.assert_array_equal(changes.units, [1])
+            self.assertEqual(changes.blocks, [slice(8, 16)])
+
+            changes = find_changes(read_binned_aligned_spikes, bin_width_in_ms=5.0)
+            self.assertTrue(changes.everything)
+
+            changes = find_changes(read_binned_aligned_spikes, spike_times=spike_times[:2])
+            self.assertTrue(changes.everything)
+
+    def test_partial_inputs(self):
+        event_timestamps = np.array(self.binned_aligned_spikes.event_timestamps, dtype="float64")
+        event_timestamps[3] += 0.001
+        condition_indices = np.array(self.binned_aligned_spikes.condition_indices, dtype="int64")
+        condition_indices[17] = 1 - condition_indices[17]
+
+        with NWBHDF5IO(self.path, mode="r") as io:
+            read_binned_aligned_spikes = io.read().acquisition["BinnedAlignedSpikes"]
+
+            # The argument that is not given defaults to the one of the container
+            changes = find_changes(read_binned_aligned_spikes, event_timestamps=event_timestamps)
+            self.assertEqual(changes.blocks, [slice(0, 8)])
+            changes = find_changes(read_binned_aligned_spikes, condition_indices=condition_indices)
+            self.assertEqual(changes.blocks, [slice(16, 20)])
+            unchanged = find_changes(
+                read_binned_aligned_spikes, condition_indices=self.binned_aligned_spikes.condition_indices
+            )
+            self.assertFalse(unchanged.any)
+
+            # Parameters are compared by value, and parameters of another type are changes
+            self.assertFalse(find_changes(read_binned_aligned_spikes, number_of_bins=np.int32(4)).any)
+            self.assertTrue(find_changes(read_binned_aligned_spikes, bin_width_in_ms="fast").everything)
+            self.assertFalse(find_changes(read_binned_aligned_spikes, neurodata_type="BinnedAlignedSpikes").any)
+
+    def test_verify_detects_modified_data(self):
+        modified = mock_BinnedAlignedSpikes(number_of_units=3, number_of_events=20, number_of_bins=4)
+        add_checksum_manifest(modified, spike_times=self.spike_times, block_size=8)
+        modified.data[2, 17, 0] += 1
+
+        changes = verify_checksums(modified)
+        np.testing.assert_array_equal(changes.units, [2])
+        self.assertEqual(changes.blocks, [slice(16, 20)])
+
+    def test_binned_spikes(self):
+        binned_spikes = mock_BinnedSpikes(number_of_units=2, number_of_bins=30)
+        manifest = add_checksum_manifest(binned_spikes, spike_times=self.spike_times[:2], block_size=10)
+
+        self.assertEqual(manifest["parameters"]["neurodata_type"], "BinnedSpikes")
+        self.assertNotIn("event_block_hashes", manifest)
+        self.assertFalse(find_changes(binned_spikes, spike_times=self.spike_times[:2], start_time_in_ms=0.0).any)
+        self.assertTrue(find_changes(binned_spikes, start_time_in_ms=1.0).everything)
+
+    def test_missing_manifest(self):
+        with self.assertRaises(ValueError):
+            find_changes(mock_BinnedSpikes())
@@ -0,0 +1,88 @@
+"""Tests for the cross-validation folds of BinnedAlignedSpikes."""
+
+import os
+import tempfile
+from unittest import mock
+
+import numpy as np
+
+from pynwb.testing import TestCase
+from ndx_binned_spikes.decoding import assign_folds
+from ndx_binned_spikes.testing.mock import mock_BinnedAlignedSpikes
+
+
+class TestIterFolds(TestCase):
+
+    def setUp(self):
+        self.binned_aligned_spikes = mock_BinnedAlignedSpikes(
+            number_of_units=4, number_of_events=53, number_of_bins=12, number_of_conditions=3
+        )
+        self.data = self.binned_aligned_spikes.data
+        self.condition_indices = np.asarray(self.binned_aligned_spikes.condition_indices)
+
+    def test_folds_partition_the_events(self):
+        folds = list(self.binned_aligned_spikes.iter_folds(n_splits=5, feature_bins=slice(2, 6), seed=0))
+
+        self.assertEqual(len(folds), 5)
+        test_events = np.concatenate([fold.test_event_indices for fold in folds])
+        np.testing.assert_array_equal(np.sort(test_events), np.arange(53))
+
+        for fold in folds:
+            self.assertEqual(fold.test_features.shape[1], 4 * 4)
+            self.assertEqual(fold.train_features.shape[0] + fold.test_features.shape[0], 53)
+            self.assertEqual(len(np.intersect1d(fold.train_event_indices, fold.test_event_indices)), 0)
+            self.assertTrue(np.shares_memory(fold.test_features, fold.features))
+
+            expected = self.data[:, fold.test_event_indices, 2:6].transpose(1, 0, 2).reshape(-1, 16)
+            np.testing.assert_array_equal(fold.test_features, expected)
+            np.testing.assert_array_equal(fold.test_labels, self.condition_indices[fold.test_event_indices])
+
+    def test_stratified_folds_have_the_same_proportions(self):
+        folds = assign_folds(self.condition_indices, n_splits=4, seed=0)
+        for condition_index in range(3):
+            counts = np.bincount(folds[self.condition_indices == condition_index], minlength=4)
+            self.assertLessEqual(counts.max() - counts.min(), 1)
+        fold_sizes = np.bincount(folds)
+        self.assertLessEqual(fold_sizes.max() - fold_sizes.min(), 1)
+
+    def test_summed_features_and_batches(self):
+        fold = next(self.binned_aligned_spikes.iter_folds(n_splits=3, sum_over_bins=True, batch_size=7, seed=1))
+        np.testing.assert_array_equal(fold.test_features, self.data[:, fold.test_event_indices].sum(axis=2).T)
+
+        batches = list(fold.iter_train_batches())
+        self.assertTrue(all(len(features) <= 7 for features, _ in batches))
+        self.assertTrue(all(np.shares_memory(features, fold.features) for features, _ in batches))
+        np.testing.assert_array_equal(np.concatenate([features for features, _ in batches]), fold.train_features)
+        np.testing.assert_array_equal(np.concatenate([labels for _, labels in batches]), fold.train_labels)
+
+    def test_memory_mapped_cache_is_reused(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache_path = os.path.join(directory, "features.npy")
+            folds = list(self.binned_aligned_spikes.iter_folds(n_splits=4, seed=2, cache_path=cache_path))
+            self.assertTrue(os.path.exists(cache_path + ".json"))
+
+            with mock.patch("ndx_binned_spikes.decoding.build_feature_matrix") as build_feature_matrix:
+                cached_folds = list(self.binned_aligned_spikes.iter_folds(n_splits=4, seed=2, cache_path=cache_path))
+                build_feature_matrix.assert_not_called()
+
+            self.assertIsInstance(cached_folds[0].features, np.memmap)
+            for fold, cached_fold in zip(folds, cached_folds):
+                np.testing.assert_array_equal(cached_fold.test_event_indices, fold.test_event_indices)
+                np.testing.assert_array_equal(cached_fold.test_features, fold.test_features)
+
+            other_folds = list(self.binned_aligned_spikes.iter_folds(n_splits=5, seed=2, cache_path=cache_path))
+            self.assertEqual(len(other_folds), 5)
+            del folds, cached_folds, other_folds
+
+    def test_seed_sequences_and_generators(self):
+        expected = [fold.test_event_indices for fold in self.binned_aligned_spikes.iter_folds(n_splits=4, seed=7)]
+        with tempfile.TemporaryDirectory() as directory:
+            cache_path = os.path.join(directory, "features.npy")
+            for seed in (np.random.SeedSequence(7), np.random.default_rng(7)):
+                folds = self.binned_aligned_spikes.iter_folds(n_splits=4, seed=seed, cache_path=cache_path)
+                for fold, test_event_indices in zip(folds, expected):
+                    np.testing.assert_array_equal(fold.test_event_indices, test_event_indices)
+
+    def test_invalid_number_of_splits(self):
+        with self.assertRaises(ValueError):
+            next(self.binned_aligned_spikes.iter_folds(n_splits=1))
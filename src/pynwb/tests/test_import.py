@@ -0,0 +1,138 @@
+"""Tests for the lazy import mode and the namespace loading of the package."""
+
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from hdmf.spec.namespace import YAMLSpecReader
+from pynwb import NWBHDF5IO, get_type_map
+from pynwb.testing import TestCase, remove_test_file
+from pynwb.testing.mock.file import mock_NWBFile
+from ndx_binned_spikes import LAZY_IMPORT_ENVIRONMENT_VARIABLE, BinnedAlignedSpikes
+from ndx_binned_spikes._namespace import get_spec_path, read_spec_cache, write_spec_cache
+from ndx_binned_spikes.testing.mock import mock_BinnedAlignedSpikes
+
+
+def run_python(code: str, lazy: bool) -> subprocess.CompletedProcess:
+    environment = dict(os.environ)
+    environment.pop(LAZY_IMPORT_ENVIRONMENT_VARIABLE, None)
+    if lazy:
+        environment[LAZY_IMPORT_ENVIRONMENT_VARIABLE] = "1"
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code], env=environment, capture_output=True, text=True, check=True
+    )
+    return result
+
+
+def cumulative_import_time_in_us(importtime_output: str, module_name: str) -> int:
+    """The cumulative time reported by `python -X importtime` for a module."""
+    pattern = rf"import time:\s+\d+ \|\s+(\d+) \|\s*{re.escape(module_name)}$"
+    return int(re.search(pattern, importtime_output, flags=re.MULTILINE).group(1))
+
+
+class TestLazyImport(TestCase):
+
+    def setUp(self):
+        self.path = os.path.abspath("test.nwb")
+
+    def tearDown(self):
+        remove_test_file(self.path)
+
+    def test_lazy_import_does_not_import_pynwb(self):
+        code = "import sys, ndx_binned_spikes; print('pynwb' in sys.modules, 'numpy' in sys.modules)"
+
+        self.assertEqual(run_python(code, lazy=True).stdout.strip(), "False False")
+        self.assertEqual(run_python(code, lazy=False).stdout.strip(), "True True")
+
+    def test_lazy_import_time(self):
+        """Guard the import time benefit: the lazy import should be a small fraction of the eager one."""
+        code = "import ndx_binned_spikes"
+        lazy_time = cumulative_import_time_in_us(run_python(code, lazy=True).stderr, "ndx_binned_spikes")
+        eager_time = cumulative_import_time_in_us(run_python(code, lazy=False).stderr, "ndx_binned_spikes")
+
+        self.assertLess(lazy_time, eager_time / 5)
+
+    def test_lazy_import_does_not_patch_the_import_system(self):
+        code = (
+            "import sys, ndx_binned_spikes; import pynwb; "
+            "print(len(sys.meta_path), 'ndx_binned_spikes.binned_spikes' in sys.modules)"
+        )
+        without_package = "import sys; import pynwb; print(len(sys.meta_path), False)"
+
+        self.assertEqual(run_python(code, lazy=True).stdout, run_python(without_package, lazy=True).stdout)
+
+    def test_feature_modules_are_imported_on_use(self):
+        code = (
+            "import sys, ndx_binned_spikes\n"
+            "features = ['arrow', 'aio', 'cache', 'correlations', 'decoding', 'latency', 'resampling', 'smoothing']\n"
+            "print([name for name in features if f'ndx_binned_spikes.{name}' in sys.modules])\n"
+        )
+        self.assertEqual(run_python(code, lazy=False).stdout.strip(), "[]")
+
+    def test_lazy_attribute_access(self):
+        code = (
+            "import ndx_binned_spikes; from ndx_binned_spikes import BinnedSpikes; "
+            "print(BinnedSpikes.__module__)"
+        )
+        self.assertEqual(run_python(code, lazy=True).stdout.strip(), "ndx_binned_spikes.binned_spikes")
+
+    def test_lazy_import_reads_files_with_the_extension_classes(self):
+        nwbfile = mock_NWBFile()
+        nwbfile.add_acquisition(mock_BinnedAlignedSpikes(number_of_conditions=3))
+        with NWBHDF5IO(self.path, mode="w") as io:
+            io.write(nwbfile)
+
+        # The file is read before the classes are ever accessed through the package
+        code = (
+            "import ndx_binned_spikes\n"
+            "ndx_binned_spikes.load_namespaces()\n"
+            "from pynwb import NWBHDF5IO\n"
+            f"with NWBHDF5IO({self.path!r}, mode='r') as io:\n"
+            "    container = io.read().acquisition['BinnedAlignedSpikes']\n"
+            "    print(type(container).__module__, container.number_of_conditions)\n"
+        )
+        output = run_python(code, lazy=True).stdout.strip()
+        self.assertEqual(output, "ndx_binned_spikes.binned_aligned_spikes 3")
+
+
+class TestSpecCache(TestCase):
+
+    def test_cache_is_up_to_date(self):
+        """The shipped cache should match the YAML files. Regenerate it with src/spec/create_extension_spec.py."""
+        self.assertIsNotNone(read_spec_cache(get_spec_path()))
+
+    def test_cache_matches_yaml(self):
+        reader = YAMLSpecReader(indir=os.path.dirname(get_spec_path()))
+        cache = read_spec_cache(get_spec_path())
+
+        self.assertEqual(cache["namespaces"], reader.read_namespace(get_spec_path()))
+        for source, spec in cache["specs"].items():
+            self.assertEqual(spec, reader.read_spec(source))
+
+    def test_namespace_loaded_from_cache(self):
+        type_map = get_type_map(copy=False)
+        spec = type_map.namespace_catalog.get_spec("ndx-binned-spikes", "BinnedAlignedSpikes")
+
+        self.assertEqual(spec.get_dataset("data").dtype, "numeric")
+        self.assertIs(type_map.get_dt_container_cls("BinnedAlignedSpikes", "ndx-binned-spikes"), BinnedAlignedSpikes)
+
+    def test_stale_or_missing_cache_is_ignored(self):
+        spec_directory = os.path.dirname(get_spec_path())
+        with tempfile.TemporaryDirectory() as directory:
+            for file_name in os.listdir(spec_directory):
+                if file_name.endswith(".yaml"):
+                    shutil.copy(os.path.join(spec_directory, file_name), directory)
+            spec_path = os.path.join(directory, os.path.basename(get_spec_path()))
+
+            self.assertIsNone(read_spec_cache(spec_path))
+
+            write_spec_cache(spec_path)
+            self.assertIsNotNone(read_spec_cache(spec_path))
+
+            with open(os.path.join(directory, "ndx-binned-spikes.extensions.yaml"), "a") as file:
+                file.write("\n# a change\n")
+            self.assertIsNone(read_spec_cache(spec_path))
@@ -0,0 +1,159 @@
+"""Tests for the opt-in instrumentation of the data access methods."""
+
+import json
+import os
+import tempfile
+import threading
+
+from hdmf.common import DynamicTableRegion
+from pynwb import NWBHDF5IO
+from pynwb.testing import TestCase, remove_test_file
+from pynwb.testing.mock.file import mock_NWBFile
+from ndx_binned_spikes import instrumentation
+from ndx_binned_spikes.instrumentation import instrument
+from ndx_binned_spikes.testing.mock import mock_BinnedAlignedSpikes
+
+
+class TestInstrumentation(TestCase):
+
+    def setUp(self):
+        self.binned_aligned_spikes = mock_BinnedAlignedSpikes(
+            number_of_units=3, number_of_events=20, number_of_bins=5, number_of_conditions=2
+        )
+
+    def test_disabled_by_default(self):
+        self.assertFalse(instrumentation._enabled)
+        with instrument():
+            self.assertTrue(instrumentation._enabled)
+        self.assertFalse(instrumentation._enabled)
+
+    def test_calls_are_recorded(self):
+        with instrument() as recorder:
+            data = self.binned_aligned_spikes.get_data_for_condition(0)
+            self.binned_aligned_spikes.get_data_for_condition(1)
+            self.binned_aligned_spikes.rebin(factor=2)
+
+        calls = recorder.stats["calls"]
+        call = calls["BinnedAlignedSpikes.get_data_for_condition"]
+        self.assertEqual(call["count"], 2)
+        self.assertGreaterEqual(call["total_time_s"], call["max_time_s"])
+        self.assertGreaterEqual(call["bytes_returned"], data.nbytes)
+        self.assertEqual(calls["BinnedAlignedSpikes.rebin"]["count"], 1)
+        # Building the rebinned container validates its event arrays
+        self.assertEqual(calls["BinnedAlignedSpikes._validate"]["count"], 1)
+
+    def test_nothing_is_recorded_outside_of_the_context(self):
+        with instrument() as recorder:
+            pass
+        self.binned_aligned_spikes.get_data_for_condition(0)
+
+        self.assertEqual(recorder.stats["calls"], {})
+
+    def test_nested_recorders(self):
+        with instrument() as outer:
+            self.binned_aligned_spikes.get_data_for_condition(0)
+            with instrument() as inner:
+                self.binned_aligned_spikes.get_data_for_condition(0)
+
+        self.assertEqual(outer.stats["calls"]["BinnedAlignedSpikes.get_data_for_condition"]["count"], 2)
+        self.assertEqual(inner.stats["calls"]["BinnedAlignedSpikes.get_data_for_condition"]["count"], 1)
+
+    def test_calls_from_threads(self):
+        with instrument() as recorder:
+            threads = [
+                threading.Thread(target=self.binned_aligned_spikes.get_data_for_condition, args=(0,))
+                for _ in range(4)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(recorder.stats["calls"]["BinnedAlignedSpikes.get_data_for_condition"]["count"], 4)
+
+    def test_export(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with instrument(trace=True) as recorder:
+                self.binned_aligned_spikes.get_event_timestamps_for_condition(1)
+
+            stats_path = os.path.join(directory, "stats.json")
+            recorder.to_json(stats_path)
+            with open(stats_path) as file:
+                self.assertEqual(json.load(file), recorder.stats)
+
+            trace_path = os.path.join(directory, "trace.json")
+            recorder.to_chrome_trace(trace_path)
+            with open(trace_path) as file:
+                trace_events = json.load(file)["traceEvents"]
+
+        self.assertEqual(len(trace_events), 1)
+        self.assertEqual(trace_events[0]["name"], "BinnedAlignedSpikes.get_event_timestamps_for_condition")
+        self.assertEqual(trace_events[0]["ph"], "X")
+
+    def test_chrome_trace_requires_trace(self):
+        with instrument() as recorder:
+            pass
+        with self.assertRaises(ValueError):
+            recorder.to_chrome_trace("unused.json")
+
+
+class TestInstrumentationOfReads(TestCase):
+
+    def setUp(self):
+        self.nwbfile = mock_NWBFile()
+        for _ in range(4):
+            self.nwbfile.add_unit(spike_times=[0.1, 0.2])
+        units_table = self.nwbfile.units
+
+        binned_aligned_spikes = mock_BinnedAlignedSpikes(
+            number_of_units=4, number_of_events=10, number_of_bins=6, number_of_conditions=2
+        )
+        binned_aligned_spikes.units_region = DynamicTableRegion(
+            name="units_region", data=[0, 1, 2, 3], table=units_table, description="all the units"
+        )
+        ecephys_module = self.nwbfile.create_processing_module(name="ecephys", description="a description")
+        ecephys_module.add(binned_aligned_spikes)
+
+        self.path = "test_instrumentation.nwb"
+        with NWBHDF5IO(self.path, mode="w") as io:
+            io.write(self.nwbfile)
+
+    def tearDown(self):
+        remove_test_file(self.path)
+
+    def test_reads_and_cache_accesses(self):
+        with NWBHDF5IO(self.path, mode="r") as io:
+            read_nwbfile = io.read()
+            binned_aligned_spikes = read_nwbfile.processing["ecephys"]["BinnedAlignedSpikes"]
+
+            with instrument() as recorder:
+                # Rows 0, 1 and 3 are read with two selections
+                selected = binned_aligned_spikes.select_units(ids=[0, 1, 3])
+                binned_aligned_spikes.select_units(ids=[2])
+                binned_aligned_spikes.to_population_matrix(events_per_chunk=4)
+
+        stats = recorder.stats
+        self.assertEqual(stats["caches"]["unit_id_to_data_row"], dict(hits=1, misses=1))
+        # 2 + 1 data selections and 3 chunks of events; reading the unit ids counts one more
+        self.assertEqual(stats["reads"]["count"], 7)
+        self.assertGreaterEqual(stats["reads"]["bytes"], selected.nbytes)
+        self.assertEqual(stats["calls"]["BinnedAlignedSpikes.select_units"]["count"], 2)
+        self.assertIn("BinnedAlignedSpikes.to_population_matrix", stats["calls"])
+
+    def test_data_for_condition_is_counted_as_reads(self):
+        with NWBHDF5IO(self.path, mode="r") as io:
+            read_nwbfile = io.read()
+            binned_aligned_spikes = read_nwbfile.processing["ecephys"]["BinnedAlignedSpikes"]
+
+            with instrument() as recorder:
+                data_for_condition = binned_aligned_spikes.get_data_for_condition(1)
+
+        self.assertEqual(recorder.stats["reads"]["count"], 1)
+        self.assertEqual(recorder.stats["reads"]["bytes"], data_for_condition.nbytes)
+
+    def test_in_memory_data_is_not_counted_as_reads(self):
+        binned_aligned_spikes = self.nwbfile.processing["ecephys"]["BinnedAlignedSpikes"]
+        with instrument() as recorder:
+            binned_aligned_spikes.to_population_matrix()
+
+        self.assertEqual(recorder.stats["reads"]["count"], 0)
@@ -0,0 +1,128 @@
+"""Tests for the response onset detection of BinnedAlignedSpikes."""
+
+import numpy as np
+
+from pynwb import NWBHDF5IO
+from pynwb.testing import TestCase, remove_test_file
+from pynwb.testing.mock.file import mock_NWBFile
+from ndx_binned_spikes import BinnedAlignedSpikes
+from ndx_binned_spikes.latency import ONSET_DTYPE
+
+
+class TestComputeResponseOnset(TestCase):
+
+    def setUp(self):
+        number_of_units, number_of_events, number_of_bins = 3, 60, 20
+        self.condition_indices = np.tile(np.array([0, 1], dtype="uint64"), number_of_events // 2)
+        # A baseline alternating between 1 and 2 spikes, and a response of 6 spikes per bin
+        self.data = np.tile(np.array([1, 2]), (number_of_units, number_of_events, number_of_bins // 2))
+        # The first unit responds from bin 8 in condition 0 and from bin 12 in condition 1
+        self.data[0, self.condition_indices == 0, 8:] = 6
+        self.data[0, self.condition_indices == 1, 12:] = 6
+        # The second unit only responds to condition 1, from bin 10, with a peak at bin 15
+        self.data[1, self.condition_indices == 1, 10:] = 6
+        self.data[1, self.condition_indices == 1, 15] = 9
+
+        # Bins of 10 ms, the first one starting 50 ms before the event: the baseline is the first 5 bins
+        self.binned_aligned_spikes = BinnedAlignedSpikes(
+            bin_width_in_ms=10.0,
+            event_to_bin_offset_in_ms=-50.0,
+            data=self.data,
+            event_timestamps=np.arange(number_of_events, dtype="float64"),
+            condition_indices=self.condition_indices,
+        )
+
+    def test_zscore_onsets(self):
+        result = self.binned_aligned_spikes.compute_response_onset()
+
+        self.assertEqual(result.dtype, ONSET_DTYPE)
+        np.testing.assert_array_equal(result["unit_index"], [0, 0, 1, 1, 2, 2])
+        np.testing.assert_array_equal(result["condition_index"], [0, 1, 0, 1, 0, 1])
+        np.testing.assert_array_equal(result["onset_bin"], [8, 12, -1, 10, -1, -1])
+        np.testing.assert_array_equal(result["onset_in_ms"][[0, 1, 3]], [30.0, 70.0, 50.0])
+        self.assertTrue(np.all(np.isnan(result["onset_in_ms"][[2, 4, 5]])))
+        self.assertEqual(result["peak_bin"][3], 15)
+        self.assertEqual(result["peak_in_ms"][3], 100.0)
+        self.assertEqual(result["peak_value"][3], 9.0)
+        np.testing.assert_allclose(result["baseline_mean"], 1.4)
+        np.testing.assert_allclose(result["baseline_std"], np.std([1, 2, 1, 2, 1]))
+        np.testing.assert_array_equal(result["number_of_events"], 30)
+
+    def test_fraction_of_peak_and_consecutive_bins(self):
+        result = self.binned_aligned_spikes.compute_response_onset(method="fraction_of_peak", threshold=0.9)
+        # The second unit only reaches 90 % of its peak at the peak, and the baseline fluctuations of the units
+        # without response reach 90 % of their (baseline) peak in the first response bin
+        np.testing.assert_array_equal(result["onset_bin"], [8, 12, 5, 15, 5, 5])
+
+        result = self.binned_aligned_spikes.compute_response_onset(
+            method="fraction_of_peak", threshold=0.9, min_consecutive_bins=2
+        )
+        np.testing.assert_array_equal(result["onset_bin"], [8, 12, -1, -1, -1, -1])
+
+        with self.assertRaises(ValueError):
+            self.binned_aligned_spikes.compute_response_onset(method="fraction_of_peak", threshold=2.0)
+
+    def test_first_spike_latency(self):
+        data = np.zeros((2, 4, 10), dtype="int64")
+        data[0, 0, 3] = data[0, 1, 5] = data[0, 2, 4] = 1
+        data[0, 2, 8] = 1
+        data[1, 0, 1] = 1
+        binned_aligned_spikes = BinnedAlignedSpikes(
+            bin_width_in_ms=5.0, event_to_bin_offset_in_ms=-10.0, data=data, event_timestamps=np.arange(4.0)
+        )
+
+        result = binned_aligned_spikes.compute_response_onset(method="first_spike")
+        # The response bins start at the event (bin 2); the first spikes of unit 0 are in the bins 3, 5 and 4
+        np.testing.assert_array_equal(result["onset_bin"], [4, -1])
+        self.assertEqual(result["onset_in_ms"][0], 10.0)
+
+        with self.assertRaises(ValueError):
+            binned_aligned_spikes.compute_response_onset(method="first_spike", threshold=1.0)
+
+    def test_first_spike_median_over_chunks(self):
+        rng = np.random.default_rng(seed=3)
+        data = (rng.random((4, 60, 12)) < 0.08).astype("uint8")
+        condition_indices = rng.integers(0, 3, size=60).astype("uint64")
+        binned_aligned_spikes = BinnedAlignedSpikes(
+            bin_width_in_ms=5.0,
+            event_to_bin_offset_in_ms=-10.0,
+            data=data,
+            event_timestamps=np.arange(60.0),
+            condition_indices=condition_indices,
+        )
+        result = binned_aligned_spikes.compute_response_onset(method="first_spike", events_per_chunk=7)
+
+        response = data[:, :, 2:] > 0
+        first_bins = np.where(response.any(axis=2), np.argmax(response, axis=2), np.nan)
+        for unit_index in range(4):
+            for condition_index in range(3):
+                latencies = first_bins[unit_index, condition_indices == condition_index]
+                latencies = latencies[~np.isnan(latencies)]
+                expected = int(np.quantile(latencies, 0.5, method="lower")) + 2 if latencies.size else -1
+                self.assertEqual(result["onset_bin"][unit_index * 3 + condition_index], expected)
+
+    def test_invalid_baseline(self):
+        binned_aligned_spikes = BinnedAlignedSpikes(
+            bin_width_in_ms=10.0, data=self.data, event_timestamps=np.arange(60.0)
+        )
+        with self.assertRaises(ValueError):
+            binned_aligned_spikes.compute_response_onset()
+        result = binned_aligned_spikes.compute_response_onset(baseline_bins=slice(0, 5))
+        self.assertEqual(result["onset_bin"][0], 8)
+
+    def test_streams_over_events_of_disk_backed_data(self):
+        path = "test_latency.nwb"
+        nwbfile = mock_NWBFile()
+        nwbfile.add_acquisition(self.binned_aligned_spikes)
+        try:
+            with NWBHDF5IO(path, mode="w") as io:
+                io.write(nwbfile)
+            with NWBHDF5IO(path, mode="r") as io:
+                read_binned_aligned_spikes = io.read().acquisition["BinnedAlignedSpikes"]
+                for method in ("zscore", "first_spike"):
+                    streamed = read_binned_aligned_spikes.compute_response_onset(method=method, events_per_chunk=7)
+                    expected = self.binned_aligned_spikes.compute_response_onset(method=method)
+                    for field in ONSET_DTYPE.names:
+                        np.testing.assert_array_equal(streamed[field], expected[field])
+        finally:
+            remove_test_file(path)
@@ -0,0 +1,290 @@
+"""Tests for the bit-packed validity masks of BinnedSpikes and BinnedAlignedSpikes."""
+
+import asyncio
+
+import h5py
+import numpy as np
+
+from pynwb import NWBHDF5IO
+from pynwb.testing import TestCase, remove_test_file
+from pynwb.testing.mock.file import mock_NWBFile
+from ndx_binned_spikes import BinnedAlignedSpikes, BinnedSpikes
+from ndx_binned_spikes.arrow import iter_long_format_columns
+from ndx_binned_spikes.decoding import build_feature_matrix
+from ndx_binned_spikes.instrumentation import instrument
+from ndx_binned_spikes.masking import ValidityMask
+from ndx_binned_spikes.testing.mock import mock_BinnedAlignedSpikes, mock_BinnedSpikes
+
+
+class TestValidityMask(TestCase):
+
+    def test_packing(self):
+        rng = np.random.default_rng(seed=0)
+        valid = rng.random((3, 7, 5)) > 0.2
+        validity_mask = ValidityMask.from_bool(valid)
+
+        self.assertEqual(validity_mask.shape, (3, 7, 5))
+        self.assertEqual(validity_mask.nbytes, 14)
+        np.testing.assert_array_equal(validity_mask.to_bool(), valid)
+        np.testing.assert_array_equal(ValidityMask(validity_mask.packed, valid.shape).to_bool(), valid)
+        merged_valid = valid[..., :4].reshape(3, 7, 2, 2).all(axis=-1)
+        np.testing.assert_array_equal(validity_mask.reduce_bins(2).to_bool(), merged_valid)
+
+        with self.assertRaises(ValueError):
+            ValidityMask(validity_mask.packed[:-1], valid.shape)
+
+    def test_axis_masks_broadcast(self):
+        validity_mask = ValidityMask.for_axis([True, False, True, True], axis=1, ndim=3)
+
+        self.assertEqual(validity_mask.shape, (1, 4, 1))
+        validity_mask.check_data_shape((2, 4, 6))
+        with self.assertRaises(ValueError):
+            validity_mask.check_data_shape((2, 5, 6))
+        valid = validity_mask.get_valid((2, 4, 6), (slice(None), slice(1, 3)))
+        self.assertEqual(valid.shape, (2, 2, 6))
+        self.assertFalse(valid[:, 0].any())
+        self.assertTrue(valid[:, 1].all())
+        self.assertIs(validity_mask.select(axis=2, index=slice(1, 3)), validity_mask)
+
+
+    def test_get_valid_unpacks_only_the_selected_bytes(self):
+        rng = np.random.default_rng(seed=2)
+        valid = rng.random((40, 10, 8)) > 0.2
+        packed = ValidityMask.from_bool(valid).packed
+        path = "test_validity_mask_selection.h5"
+        try:
+            with h5py.File(path, mode="w") as file:
+                validity_mask = ValidityMask(file.create_dataset("packed", data=packed), valid.shape)
+                selections = [
+                    (slice(3, 5),),
+                    (7, slice(2, 4)),
+                    ([12, 10, 11], slice(None), slice(1, 3)),
+                    (slice(9, 2, -3),),
+                ]
+                for selection in selections:
+                    with instrument() as recorder:
+                        selected_valid = validity_mask.get_valid(valid.shape, selection)
+                    np.testing.assert_array_equal(selected_valid, valid[selection])
+                    self.assertLess(recorder.reads["bytes"], validity_mask.nbytes // 4)
+        finally:
+            remove_test_file(path)
+
+
+class TestBinnedAlignedSpikesWithValidityMask(TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(seed=1)
+        self.data = rng.integers(0, 5, size=(3, 12, 8)).astype("uint16")
+        self.condition_indices = np.tile(np.array([0, 1], dtype="uint64"), 6)
+        # Events 2 and 7 are invalid trials, with artifact counts
+        self.valid_events = np.ones(12, dtype=bool)
+        self.valid_events[[2, 7]] = False
+        self.data[:, ~self.valid_events] = 1000
+        self.binned_aligned_spikes = BinnedAlignedSpikes(
+            bin_width_in_ms=10.0,
+            event_to_bin_offset_in_ms=-30.0,
+            data=self.data,
+            event_timestamps=np.arange(12.0),
+            condition_indices=self.condition_indices,
+            validity_mask=ValidityMask.for_axis(self.valid_events, axis=1, ndim=3),
+        )
+        self.masked_data = np.ma.MaskedArray(
+            self.data, mask=np.broadcast_to(~self.valid_events[np.newaxis, :, np.newaxis], self.data.shape)
+        )
+
+    def test_accessors_keep_the_integer_dtype(self):
+        condition_data = self.binned_aligned_spikes.get_data_for_condition(1)
+        self.assertIsInstance(condition_data, np.ma.MaskedArray)
+        self.assertEqual(condition_data.dtype, np.uint16)
+        np.testing.assert_array_equal(condition_data.mask, self.masked_data[:, self.condition_indices == 1].mask)
+        self.assertEqual(condition_data.sum(axis=1).max(), self.masked_data[:, 1::2].sum(axis=1).max())
+
+        masked = self.binned_aligned_spikes.get_masked_data((slice(None), slice(1, 4), 2))
+        self.assertEqual(masked.dtype, np.uint16)
+        np.testing.assert_array_equal(masked.mask, [[False, True, False]] * 3)
+
+    def test_reductions_exclude_the_invalid_entries(self):
+        population = self.binned_aligned_spikes.to_population_matrix(layout="units_by_samples")
+        means = np.stack([self.masked_data[:, self.condition_indices == c].mean(axis=1) for c in (0, 1)], axis=1)
+        np.testing.assert_allclose(population, means.reshape(3, -1))
+
+        onsets = self.binned_aligned_spikes.compute_response_onset()
+        clean = BinnedAlignedSpikes(
+            bin_width_in_ms=10.0,
+            event_to_bin_offset_in_ms=-30.0,
+            data=self.data[:, self.valid_events],
+            event_timestamps=np.arange(10.0),
+            condition_indices=self.condition_indices[self.valid_events],
+        )
+        expected = clean.compute_response_onset()
+        np.testing.assert_array_equal(onsets["onset_bin"], expected["onset_bin"])
+        np.testing.assert_allclose(onsets["baseline_mean"], expected["baseline_mean"])
+
+    def test_iterators_and_async_accessors_keep_the_mask(self):
+        for condition_index, condition_data in self.binned_aligned_spikes.iter_conditions(prefetch=1):
+            self.assertIsInstance(condition_data, np.ma.MaskedArray)
+            expected = self.masked_data[:, self.condition_indices == condition_index]
+            np.testing.assert_array_equal(condition_data.mask, expected.mask)
+
+        for event_slice, block in self.binned_aligned_spikes.iter_event_blocks(block_size=5):
+            self.assertIsInstance(block, np.ma.MaskedArray)
+            np.testing.assert_array_equal(block.mask, self.masked_data[:, event_slice].mask)
+
+        condition_data = asyncio.run(self.binned_aligned_spikes.aget_data_for_condition(0))
+        self.assertIsInstance(condition_data, np.ma.MaskedArray)
+        np.testing.assert_array_equal(condition_data.mask, self.masked_data[:, self.condition_indices == 0].mask)
+
+    def test_analyses_match_the_data_without_the_invalid_events(self):
+        clean = BinnedAlignedSpikes(
+            bin_width_in_ms=10.0,
+            event_to_bin_offset_in_ms=-30.0,
+            data=self.data[:, self.valid_events],
+            event_timestamps=np.arange(10.0),
+            condition_indices=self.condition_indices[self.valid_events],
+        )
+
+        for per_condition in (True, False):
+            for unit_block_size, dtype, atol in [(None, "float64", 1e-10), (2, "float64", 1e-10), (2, "float32", 1e-4)]:
+                np.testing.assert_allclose(
+                    self.binned_aligned_spikes.compute_noise_correlations(
+                        per_condition=per_condition, return_covariance=True, unit_block_size=unit_block_size,
+                        dtype=dtype,
+                    ),
+                    clean.compute_noise_correlations(per_condition=per_condition, return_covariance=True),
+                    atol=atol,
+                )
+
+        bootstrap = self.binned_aligned_spikes.bootstrap_psth(n_resamples=50, seed=0)
+        np.testing.assert_allclose(bootstrap.estimate, clean.bootstrap_psth(n_resamples=2, seed=0).estimate)
+        self.assertFalse(np.isnan(bootstrap.standard_error).any())
+        self.assertTrue(np.all(bootstrap.confidence_high < 1000))
+
+        test = self.binned_aligned_spikes.permutation_test(0, 1, n_resamples=200, seed=0)
+        np.testing.assert_allclose(test.difference, clean.permutation_test(0, 1, n_resamples=2, seed=0).difference)
+        self.assertTrue(np.all((test.p_values > 0) & (test.p_values <= 1)))
+
+        population = self.binned_aligned_spikes.to_population_matrix(average_over_events=False)
+        self.assertTrue(np.isnan(population.reshape(12, 8, 3)[[2, 7]]).all())
+        np.testing.assert_array_equal(population.reshape(12, 8, 3)[0], self.data[:, 0].T)
+        with self.assertRaises(ValueError):
+            self.binned_aligned_spikes.to_population_matrix(average_over_events=False, dtype="uint16")
+
+    def test_features_and_rates_leave_out_the_invalid_counts(self):
+        event_indices = np.arange(12)
+        features = build_feature_matrix(self.binned_aligned_spikes, event_indices, feature_bins=slice(2, 6))
+        self.assertTrue(np.isnan(features[[2, 7]]).all())
+        np.testing.assert_array_equal(features[0], self.data[:, 0, 2:6].ravel())
+        with self.assertRaises(ValueError):
+            build_feature_matrix(self.binned_aligned_spikes, event_indices, dtype="int64")
+
+        # A mask of some bins: the summed features are the mean of the valid bins times the number of bins
+        valid = np.ones((3, 12, 8), dtype=bool)
+        valid[0, 0, 2] = False
+        binned_aligned_spikes = BinnedAlignedSpikes(
+            bin_width_in_ms=10.0, data=self.data, event_timestamps=np.arange(12.0), validity_mask=valid
+        )
+        summed = build_feature_matrix(
+            binned_aligned_spikes, event_indices, feature_bins=slice(2, 6), sum_over_bins=True
+        )
+        self.assertAlmostEqual(summed[0, 0], self.data[0, 0, 3:6].mean() * 4, places=4)
+        self.assertEqual(summed[0, 1], self.data[1, 0, 2:6].sum())
+
+        rates = self.binned_aligned_spikes.to_firing_rate(kernel="boxcar", sigma_ms=30.0)
+        clean_rates = BinnedAlignedSpikes(
+            bin_width_in_ms=10.0, data=self.data[:, self.valid_events], event_timestamps=np.arange(10.0)
+        ).to_firing_rate(kernel="boxcar", sigma_ms=30.0)
+        self.assertTrue(np.isnan(rates[:, ~self.valid_events]).all())
+        np.testing.assert_allclose(rates[:, self.valid_events], clean_rates)
+
+    def test_derived_containers_keep_the_mask(self):
+        validity_mask = ValidityMask.from_bool(np.broadcast_to(self.valid_events[:, np.newaxis], (12, 8))[np.newaxis])
+        binned_aligned_spikes = BinnedAlignedSpikes(
+            bin_width_in_ms=10.0,
+            data=self.data,
+            event_timestamps=np.arange(12.0),
+            validity_mask=validity_mask,
+        )
+        rebinned = binned_aligned_spikes.rebin(3)
+        self.assertEqual(rebinned.validity_mask.shape, (1, 12, 2))
+        cropped = self.binned_aligned_spikes.crop(-10.0, 20.0)
+        self.assertIs(cropped.validity_mask, self.binned_aligned_spikes.validity_mask)
+
+    def test_roundtrip(self):
+        path = "test_masking.nwb"
+        nwbfile = mock_NWBFile()
+        nwbfile.add_acquisition(self.binned_aligned_spikes)
+        nwbfile.add_acquisition(mock_BinnedSpikes(number_of_units=3, number_of_bins=50, add_random_invalid_bins=True))
+        try:
+            with NWBHDF5IO(path, mode="w") as io:
+                io.write(nwbfile)
+
+            with h5py.File(path, mode="r") as file:
+                dataset = file["acquisition/BinnedAlignedSpikes/validity_mask"]
+                self.assertEqual(dataset.dtype, np.uint8)
+                self.assertEqual(dataset.shape, (2,))
+                np.testing.assert_array_equal(dataset.attrs["mask_shape"], [1, 12, 1])
+                self.assertEqual(file["acquisition/BinnedAlignedSpikes/data"].dtype, np.uint16)
+
+            with NWBHDF5IO(path, mode="r") as io:
+                read_nwbfile = io.read()
+                read_binned_aligned_spikes = read_nwbfile.acquisition["BinnedAlignedSpikes"]
+                self.assertIsInstance(read_binned_aligned_spikes.validity_mask, ValidityMask)
+                np.testing.assert_array_equal(
+                    read_binned_aligned_spikes.validity_mask.to_bool(), self.valid_events.reshape(1, 12, 1)
+                )
+                np.testing.assert_array_equal(
+                    read_binned_aligned_spikes.get_data_for_condition(0).mask,
+                    self.masked_data[:, self.condition_indices == 0].mask,
+                )
+
+                read_binned_spikes = read_nwbfile.acquisition["BinnedSpikes"]
+                expected = nwbfile.acquisition["BinnedSpikes"].validity_mask.to_bool()
+                np.testing.assert_array_equal(read_binned_spikes.validity_mask.to_bool(), expected)
+        finally:
+            remove_test_file(path)
+
+
+class TestBinnedSpikesWithValidityMask(TestCase):
+
+    def test_artifact_periods(self):
+        data = np.arange(40, dtype="uint16").reshape(2, 20)
+        valid_bins = np.ones(20, dtype=bool)
+        valid_bins[5:8] = False
+        binned_spikes = BinnedSpikes(bin_width_in_ms=10.0, data=data, validity_mask=valid_bins[np.newaxis])
+
+        data_in_range = binned_spikes.get_data_in_time_range(40.0, 100.0)
+        self.assertEqual(data_in_range.dtype, np.uint16)
+        np.testing.assert_array_equal(data_in_range.mask, np.broadcast_to(~valid_bins[4:10], (2, 6)))
+        np.testing.assert_array_equal(data_in_range.sum(axis=1), [4 + 8 + 9, 24 + 28 + 29])
+
+        with self.assertRaises(ValueError):
+            BinnedSpikes(bin_width_in_ms=10.0, data=data, validity_mask=np.ones((3, 20), dtype=bool))
+
+    def test_rates_and_exports_leave_out_the_invalid_bins(self):
+        data = np.full((2, 20), 2, dtype="uint16")
+        data[:, 5:8] = 1000
+        valid_bins = np.ones(20, dtype=bool)
+        valid_bins[5:8] = False
+        binned_spikes = BinnedSpikes(bin_width_in_ms=10.0, data=data, validity_mask=valid_bins[np.newaxis])
+
+        # The boxcar mean of the valid bins is the constant count away from the edges
+        rates = binned_spikes.to_firing_rate(kernel="boxcar", sigma_ms=50.0, bins_per_chunk=6)
+        np.testing.assert_allclose(rates[:, np.r_[2:5, 8:18]], 200.0)
+        self.assertTrue(np.isnan(rates[:, 5:8]).all())
+        self.assertIsNotNone(binned_spikes.to_firing_rate(as_container=True).validity_mask)
+
+        batches = list(iter_long_format_columns(binned_spikes, units_per_batch=1))
+        self.assertEqual([batch["count"].size for batch in batches], [17, 17])
+        self.assertTrue(np.all(batches[0]["count"] == 2))
+        np.testing.assert_array_equal(batches[1]["bin"], np.flatnonzero(valid_bins))
+        with self.assertRaises(ValueError):
+            binned_spikes.__dlpack__()
+
+        selection = asyncio.run(binned_spikes.aget_data_in_time_range(40.0, 100.0))
+        self.assertIsInstance(selection, np.ma.MaskedArray)
+        np.testing.assert_array_equal(selection.mask, np.broadcast_to(~valid_bins[4:10], (2, 6)))
+
+    def test_mock_keeps_integer_data(self):
+        binned_aligned_spikes = mock_BinnedAlignedSpikes(add_random_invalid_bins=True)
+        self.assertEqual(binned_aligned_spikes.data.dtype, np.uint64)
+        self.assertEqual(binned_aligned_spikes.validity_mask.shape, binned_aligned_spikes.data.shape)
@@ -0,0 +1,141 @@
+"""Tests for the mock data generators in ndx_binned_spikes.testing."""
+
+from unittest.mock import patch
+
+import numpy as np
+
+from pynwb import NWBHDF5IO
+from pynwb.testing.mock.file import mock_NWBFile
+from pynwb.testing import TestCase, remove_test_file
+from ndx_binned_spikes.testing import mock
+from ndx_binned_spikes.testing.mock import (
+    MockBinnedAlignedSpikesDataChunkIterator,
+    generate_condition_indices,
+    mock_BinnedAlignedSpikes,
+    mock_streamed_BinnedAlignedSpikes,
+)
+
+
+def assemble(iterator) -> np.ndarray:
+    """Write all the chunks of a data chunk iterator into an array."""
+    data = np.zeros(iterator.maxshape, dtype=iterator.dtype)
+    for chunk in iterator:
+        data[chunk.selection] = chunk.data
+    return data
+
+
+class TestConditionIndices(TestCase):
+
+    def test_mock_conditions_are_not_dominated_by_zero(self):
+        binned_aligned_spikes = mock_BinnedAlignedSpikes(number_of_events=1000, number_of_conditions=5)
+
+        counts = np.bincount(binned_aligned_spikes.condition_indices.astype("int64"), minlength=5)
+        self.assertTrue(np.all(counts > 100))
+
+    def test_mock_with_data_and_no_condition_indices(self):
+        data = np.ones((2, 10, 3), dtype="uint64")
+        binned_aligned_spikes = mock_BinnedAlignedSpikes(data=data, number_of_conditions=3)
+
+        self.assertEqual(binned_aligned_spikes.number_of_conditions, 3)
+
+    def test_balanced(self):
+        condition_indices = generate_condition_indices(number_of_events=100, number_of_conditions=4)
+        np.testing.assert_array_equal(np.bincount(condition_indices.astype("int64")), [25, 25, 25, 25])
+
+    def test_skewed(self):
+        condition_indices = generate_condition_indices(
+            number_of_events=10_000, number_of_conditions=4, condition_distribution="skewed"
+        )
+        counts = np.bincount(condition_indices.astype("int64"))
+        self.assertTrue(np.all(np.diff(counts) < 0))
+
+    def test_explicit_probabilities(self):
+        condition_indices = generate_condition_indices(
+            number_of_events=50, number_of_conditions=3, condition_distribution=[0.0, 0.0, 1.0]
+        )
+        np.testing.assert_array_equal(np.bincount(condition_indices.astype("int64")), [1, 1, 48])
+
+
+class TestMockBinnedAlignedSpikesDataChunkIterator(TestCase):
+
+    def setUp(self):
+        self.condition_indices = generate_condition_indices(number_of_events=40, number_of_conditions=3)
+        self.kwargs = dict(condition_indices=self.condition_indices, number_of_units=5, number_of_bins=12, seed=3)
+
+    def test_deterministic_regardless_of_chunking(self):
+        whole = MockBinnedAlignedSpikesDataChunkIterator(**self.kwargs, buffer_shape=(5, 40, 12))
+        chunked = MockBinnedAlignedSpikesDataChunkIterator(
+            **self.kwargs, chunk_shape=(2, 3, 4), buffer_shape=(4, 9, 8)
+        )
+
+        data = assemble(whole)
+        np.testing.assert_array_equal(data, assemble(chunked))
+        self.assertGreater(data.sum(), 0)
+
+    def test_blocks_of_events_regardless_of_chunking(self):
+        # Blocks of 7 events, so the chunks and buffers span several blocks and split them
+        with patch.object(mock, "_GENERATION_BLOCK_SIZE_IN_BYTES", 7 * 8 * 5 * 12):
+            whole = MockBinnedAlignedSpikesDataChunkIterator(**self.kwargs, buffer_shape=(5, 40, 12))
+            chunked = MockBinnedAlignedSpikesDataChunkIterator(
+                **self.kwargs, chunk_shape=(2, 3, 4), buffer_shape=(4, 9, 8)
+            )
+        self.assertEqual(whole.events_per_block, 7)
+
+        data = assemble(whole)
+        np.testing.assert_array_equal(data, assemble(chunked))
+        np.testing.assert_array_equal(chunked.get_event_counts(15), data[:, 15, :])
+
+    def test_different_seeds(self):
+        kwargs = dict(self.kwargs, seed=4)
+        self.assertFalse(
+            np.array_equal(
+                assemble(MockBinnedAlignedSpikesDataChunkIterator(**self.kwargs)),
+                assemble(MockBinnedAlignedSpikesDataChunkIterator(**kwargs)),
+            )
+        )
+
+    def test_sparsity(self):
+        condition_indices = generate_condition_indices(number_of_events=400, number_of_conditions=3)
+        iterator = MockBinnedAlignedSpikesDataChunkIterator(
+            condition_indices=condition_indices, number_of_units=20, number_of_bins=20, sparsity=0.9
+        )
+
+        fraction_of_zeros = np.mean(assemble(iterator) == 0)
+        self.assertAlmostEqual(fraction_of_zeros, 0.9, delta=0.03)
+
+
+class TestStreamedBinnedAlignedSpikesRoundtrip(TestCase):
+
+    def setUp(self):
+        self.path = "test.nwb"
+
+    def tearDown(self):
+        remove_test_file(self.path)
+
+    def test_roundtrip(self):
+        binned_aligned_spikes = mock_streamed_BinnedAlignedSpikes(
+            number_of_units=4,
+            number_of_events=30,
+            number_of_bins=6,
+            number_of_conditions=3,
+            seed=1,
+            chunk_shape=(2, 5, 6),
+            buffer_shape=(4, 10, 6),
+        )
+        self.assertEqual(binned_aligned_spikes.number_of_events, 30)
+
+        nwbfile = mock_NWBFile()
+        nwbfile.add_acquisition(binned_aligned_spikes)
+        with NWBHDF5IO(self.path, mode="w") as io:
+            io.write(nwbfile)
+
+        expected = mock_streamed_BinnedAlignedSpikes(
+            number_of_units=4, number_of_events=30, number_of_bins=6, number_of_conditions=3, seed=1
+        )
+        with NWBHDF5IO(self.path, mode="r", load_namespaces=True) as io:
+            read_binned_aligned_spikes = io.read().acquisition["BinnedAlignedSpikes"]
+
+            self.assertEqual(read_binned_aligned_spikes.data.dtype, np.uint16)
+            self.assertEqual(read_binned_aligned_spikes.data.chunks, (2, 5, 6))
+            np.testing.assert_array_equal(read_binned_aligned_spikes.data[:], assemble(expected.data))
+            np.testing.assert_array_equal(read_binned_aligned_spikes.condition_indices[:], expected.condition_indices)
@@ -0,0 +1,145 @@
+"""Tests for the pool of open NWB files."""
+
+import os
+import tempfile
+import threading
+from unittest import mock
+
+import numpy as np
+
+from pynwb import NWBHDF5IO
+from pynwb.testing import TestCase
+from pynwb.testing.mock.file import mock_NWBFile
+from ndx_binned_spikes.pool import NWBFilePool, open_binned
+from ndx_binned_spikes.testing.mock import mock_BinnedAlignedSpikes
+
+
+class TestNWBFilePool(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.paths = []
+        for file_index in range(3):
+            nwbfile = mock_NWBFile()
+            nwbfile.add_acquisition(mock_BinnedAlignedSpikes(seed=file_index))
+            ecephys_module = nwbfile.create_processing_module(name="ecephys", description="a description")
+            ecephys_module.add(mock_BinnedAlignedSpikes(number_of_units=3, seed=file_index))
+
+            path = os.path.join(self.directory.name, f"session_{file_index}.nwb")
+            with NWBHDF5IO(path, mode="w") as io:
+                io.write(nwbfile)
+            self.paths.append(path)
+
+        self.pool = NWBFilePool(max_open_files=2)
+
+    def tearDown(self):
+        self.pool.close()
+        self.directory.cleanup()
+
+    def test_containers_are_reused(self):
+        object_path = "processing/ecephys/BinnedAlignedSpikes"
+        binned_aligned_spikes = open_binned(self.paths[0], object_path, pool=self.pool)
+
+        self.assertEqual(binned_aligned_spikes.parent.name, "ecephys")
+        self.assertEqual(binned_aligned_spikes.number_of_units, 3)
+        self.assertIs(open_binned(self.paths[0], object_path, pool=self.pool), binned_aligned_spikes)
+        self.assertEqual(len(self.pool), 1)
+
+    def test_acquisition_path(self):
+        binned_aligned_spikes = self.pool.get(self.paths[0], "acquisition/BinnedAlignedSpikes")
+
+        expected = mock_BinnedAlignedSpikes(seed=0)
+        np.testing.assert_array_equal(binned_aligned_spikes.data[:], expected.data)
+
+    def test_missing_object(self):
+        with self.assertRaises(KeyError):
+            self.pool.get(self.paths[0], "processing/behavior/BinnedAlignedSpikes")
+
+    def test_least_recently_used_file_is_closed(self):
+        first = self.pool.get(self.paths[0], "acquisition/BinnedAlignedSpikes")
+        self.pool.get(self.paths[1], "acquisition/BinnedAlignedSpikes")
+        self.pool.get(self.paths[0], "acquisition/BinnedAlignedSpikes")
+        self.pool.get(self.paths[2], "acquisition/BinnedAlignedSpikes")
+
+        self.assertIn(self.paths[0], self.pool)
+        self.assertNotIn(self.paths[1], self.pool)
+        self.assertIn(self.paths[2], self.pool)
+        self.assertEqual(first.data.shape[0], 2)
+
+    @mock.patch("ndx_binned_spikes.pool.time.monotonic")
+    def test_idle_files_are_closed(self, monotonic):
+        pool = NWBFilePool(ttl_seconds=10.0)
+        try:
+            monotonic.return_value = 0.0
+            first = pool.get(self.paths[0], "acquisition/BinnedAlignedSpikes")
+            monotonic.return_value = 20.0
+            second = pool.get(self.paths[1], "acquisition/BinnedAlignedSpikes")
+
+            self.assertNotIn(self.paths[0], pool)
+            self.assertIsNot(pool.get(self.paths[0], "acquisition/BinnedAlignedSpikes"), first)
+            self.assertIs(pool.get(self.paths[1], "acquisition/BinnedAlignedSpikes"), second)
+        finally:
+            pool.close()
+
+    def test_concurrent_access(self):
+        results = []
+
+        def get_container():
+            results.append(self.pool.get(self.paths[0], "acquisition/BinnedAlignedSpikes"))
+
+        threads = [threading.Thread(target=get_container) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(results), 8)
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertEqual(len(self.pool), 1)
+
+    def test_leased_file_is_closed_when_the_lease_ends(self):
+        with self.pool.lease(self.paths[0], "acquisition/BinnedAlignedSpikes") as leased:
+            self.pool.get(self.paths[1], "acquisition/BinnedAlignedSpikes")
+            self.pool.get(self.paths[2], "acquisition/BinnedAlignedSpikes")
+
+            # Evicted from the pool, but still readable until the lease ends
+            self.assertNotIn(self.paths[0], self.pool)
+            np.testing.assert_array_equal(leased.data[:], mock_BinnedAlignedSpikes(seed=0).data)
+            file = leased.data.file
+
+        self.assertFalse(file.id.valid)
+
+    def test_files_are_opened_outside_of_the_lock(self):
+        open_entry = NWBFilePool._open_entry
+        first_file_opening = threading.Event()
+        release_first_file = threading.Event()
+        opened_paths = []
+
+        def slow_open_entry(path):
+            opened_paths.append(path)
+            if path == os.path.abspath(self.paths[0]):
+                first_file_opening.set()
+                release_first_file.wait(timeout=10)
+            return open_entry(path)
+
+        results = []
+
+        def get_first_file():
+            results.append(self.pool.get(self.paths[0], "acquisition/BinnedAlignedSpikes"))
+
+        with mock.patch.object(NWBFilePool, "_open_entry", side_effect=slow_open_entry):
+            threads = [threading.Thread(target=get_first_file) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            first_file_opening.wait(timeout=10)
+
+            # Another file can be opened while the first one is being opened
+            self.pool.get(self.paths[1], "acquisition/BinnedAlignedSpikes")
+            release_first_file.set()
+            for thread in threads:
+                thread.join()
+
+        # The concurrent requests for the first file share a single opening
+        self.assertEqual(opened_paths.count(os.path.abspath(self.paths[0])), 1)
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertEqual(len(results), 4)
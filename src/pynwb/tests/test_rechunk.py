@@ -0,0 +1,157 @@
+"""Tests for the out-of-core rechunking of binned data."""
+
+import h5py
+import numpy as np
+
+from hdmf.common import DynamicTableRegion
+from pynwb import NWBHDF5IO
+from pynwb.testing import TestCase, remove_test_file
+from pynwb.testing.mock.file import mock_NWBFile
+from ndx_binned_spikes import BinnedAlignedSpikes, BinnedSpikes
+from ndx_binned_spikes.rechunk import copy_blocks, plan_rechunk, rechunk_binned
+from ndx_binned_spikes.testing.mock import mock_BinnedAlignedSpikes
+from ndx_binned_spikes.windows import OverlappingWindowsData
+
+
+class TestPlanRechunk(TestCase):
+
+    def test_single_pass_when_aligned_blocks_fit(self):
+        plan = plan_rechunk(
+            shape=(10, 100, 20), itemsize=8, source_chunks=(1, 100, 20), target_chunks=(10, 10, 20),
+            max_memory_in_bytes=4 * 10 * 100 * 20 * 8,
+        )
+        self.assertEqual(plan.number_of_passes, 1)
+        self.assertIsNone(plan.intermediate_chunks)
+        self.assertEqual(plan.block_shapes, ((10, 100, 20),))
+
+    def test_two_passes_within_the_budget(self):
+        max_memory_in_bytes = 4 * 300 * 8
+        plan = plan_rechunk(
+            shape=(10, 100, 20), itemsize=8, source_chunks=(1, 100, 20), target_chunks=(10, 1, 20),
+            max_memory_in_bytes=max_memory_in_bytes,
+        )
+        self.assertEqual(plan.number_of_passes, 2)
+        self.assertEqual(plan.intermediate_chunks, (1, 1, 20))
+        for block_shape in plan.block_shapes:
+            self.assertLessEqual(4 * int(np.prod(block_shape)) * 8, max_memory_in_bytes)
+
+    def test_budget_too_small(self):
+        with self.assertRaises(ValueError):
+            plan_rechunk((4, 4), itemsize=8, source_chunks=(1, 4), target_chunks=(4, 1), max_memory_in_bytes=16)
+
+    def test_copy_blocks(self):
+        source = np.arange(7 * 9 * 5).reshape(7, 9, 5)
+        destination = np.zeros_like(source)
+        copy_blocks(source, destination, block_shape=(2, 4, 3), max_workers=3)
+        np.testing.assert_array_equal(destination, source)
+
+
+class TestRechunkBinned(TestCase):
+
+    def setUp(self):
+        nwbfile = mock_NWBFile()
+        for unit_index in range(6):
+            nwbfile.add_unit(spike_times=[0.1 * unit_index])
+
+        mock = mock_BinnedAlignedSpikes(
+            number_of_units=6, number_of_events=50, number_of_bins=8, number_of_conditions=3
+        )
+        self.binned_aligned_spikes = BinnedAlignedSpikes(
+            bin_width_in_ms=mock.bin_width_in_ms,
+            event_to_bin_offset_in_ms=mock.event_to_bin_offset_in_ms,
+            data=mock.data,
+            event_timestamps=mock.event_timestamps,
+            condition_indices=mock.condition_indices,
+            condition_labels=mock.condition_labels,
+            units_region=DynamicTableRegion(
+                name="units_region", data=[0, 2, 4, 1, 3, 5], table=nwbfile.units, description="all the units"
+            ),
+        )
+        self.data = mock.data
+        nwbfile.add_acquisition(self.binned_aligned_spikes)
+        self.binned_spikes_data = np.arange(3 * 40).reshape(3, 40)
+        nwbfile.add_acquisition(BinnedSpikes(bin_width_in_ms=10.0, data=self.binned_spikes_data))
+
+        self.path = "test_rechunk_source.nwb"
+        self.rechunked_path = "test_rechunk_destination.nwb"
+        with NWBHDF5IO(self.path, mode="w") as io:
+            io.write(nwbfile)
+
+        # Store the aligned data unit by unit, as written by a pipeline that bins one unit at a time
+        with h5py.File(self.path, mode="a") as file:
+            del file["acquisition/BinnedAlignedSpikes/data"]
+            file["acquisition/BinnedAlignedSpikes"].create_dataset(
+                "data", data=self.data, chunks=(1, 50, 8), compression="gzip"
+            )
+
+    def tearDown(self):
+        remove_test_file(self.path)
+        remove_test_file(self.rechunked_path)
+
+    def test_two_pass_rechunk_keeps_the_container(self):
+        # Too small for a block of 6 units and 50 events, so the data goes through an intermediate dataset
+        rechunk_binned(
+            self.path, self.rechunked_path, {"acquisition/BinnedAlignedSpikes": (None, 5, None)},
+            max_memory_in_bytes=2 * 100 * 8 * self.data.itemsize, max_workers=2,
+        )
+
+        with h5py.File(self.rechunked_path, mode="r") as file:
+            dataset = file["acquisition/BinnedAlignedSpikes/data"]
+            self.assertIsInstance(file["acquisition/BinnedAlignedSpikes"].get("data", getlink=True), h5py.HardLink)
+            self.assertEqual(dataset.chunks, (6, 5, 8))
+            self.assertEqual(dataset.compression, "gzip")
+            self.assertEqual(file["acquisition/BinnedSpikes/data"].chunks, None)
+
+        with NWBHDF5IO(self.rechunked_path, mode="r") as io:
+            read_binned_aligned_spikes = io.read().acquisition["BinnedAlignedSpikes"]
+            np.testing.assert_array_equal(read_binned_aligned_spikes.data[:], self.data)
+            np.testing.assert_array_equal(
+                read_binned_aligned_spikes.condition_indices[:], self.binned_aligned_spikes.condition_indices
+            )
+            self.assertEqual(read_binned_aligned_spikes.bin_width_in_ms, self.binned_aligned_spikes.bin_width_in_ms)
+            self.assertEqual(read_binned_aligned_spikes.units_region.table.name, "units")
+            np.testing.assert_array_equal(read_binned_aligned_spikes.units_region.data[:], [0, 2, 4, 1, 3, 5])
+
+    def test_all_binned_containers(self):
+        # A tuple only applies to the containers whose data has as many dimensions
+        rechunk_binned(self.path, self.rechunked_path, target_chunks=(None, 10, None))
+        with h5py.File(self.rechunked_path, mode="r") as file:
+            self.assertEqual(file["acquisition/BinnedAlignedSpikes/data"].chunks, (6, 10, 8))
+            self.assertEqual(file["acquisition/BinnedSpikes/data"].chunks, None)
+            np.testing.assert_array_equal(file["acquisition/BinnedSpikes/data"][:], self.binned_spikes_data)
+
+        with self.assertRaisesRegex(ValueError, "4 dimensions"):
+            rechunk_binned(self.path, self.rechunked_path, target_chunks=(None, 10, None, None))
+
+        rechunk_binned(self.path, self.rechunked_path, target_chunks={"acquisition/BinnedSpikes": (1, 10)})
+        with NWBHDF5IO(self.rechunked_path, mode="r") as io:
+            read_binned_spikes = io.read().acquisition["BinnedSpikes"]
+            self.assertEqual(read_binned_spikes.data.chunks, (1, 10))
+            np.testing.assert_array_equal(read_binned_spikes.data[:], self.binned_spikes_data)
+
+    def test_overlapping_windows(self):
+        session_data = np.random.default_rng(seed=2).integers(0, 5, size=(4, 300))
+        window_starts = np.arange(0, 250, 5)
+        windows = OverlappingWindowsData.from_binned(session_data, window_starts, number_of_bins=25)
+        nwbfile = mock_NWBFile()
+        nwbfile.add_acquisition(
+            BinnedAlignedSpikes(bin_width_in_ms=10.0, data=windows, event_timestamps=window_starts * 0.01)
+        )
+        nwbfile.add_acquisition(BinnedSpikes(bin_width_in_ms=10.0, data=self.binned_spikes_data))
+        with NWBHDF5IO(self.path, mode="w") as io:
+            io.write(nwbfile)
+
+        # The windows are stored as their 2D covered bins, which a 2D tuple rechunks with the BinnedSpikes
+        rechunk_binned(self.path, self.rechunked_path, target_chunks=(1, 20))
+        with NWBHDF5IO(self.rechunked_path, mode="r") as io:
+            acquisition = io.read().acquisition
+            read_windows = acquisition["BinnedAlignedSpikes"].data
+            self.assertIsInstance(read_windows, OverlappingWindowsData)
+            self.assertEqual(read_windows.window_data.chunks, (1, 20))
+            np.testing.assert_array_equal(read_windows.window_starts, window_starts)
+            np.testing.assert_array_equal(np.asarray(read_windows), np.asarray(windows))
+            self.assertEqual(acquisition["BinnedSpikes"].data.chunks, (1, 20))
+
+    def test_same_path(self):
+        with self.assertRaises(ValueError):
+            rechunk_binned(self.path, self.path, target_chunks=(None, 10))
@@ -0,0 +1,75 @@
+"""Tests for the bootstrap and permutation statistics of BinnedAlignedSpikes."""
+
+import numpy as np
+
+from pynwb.testing import TestCase
+from ndx_binned_spikes import BinnedAlignedSpikes
+
+
+class TestResampling(TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(seed=0)
+        number_of_units, number_of_events, number_of_bins = 6, 80, 10
+        self.condition_indices = np.repeat(np.array([0, 1], dtype="uint64"), number_of_events // 2)
+        rates = np.full((number_of_units, number_of_events, number_of_bins), 2.0)
+        # The first unit responds to condition 1 in the bins 4 to 7
+        rates[0, self.condition_indices == 1, 4:8] = 8.0
+        self.data = rng.poisson(rates)
+        self.binned_aligned_spikes = BinnedAlignedSpikes(
+            bin_width_in_ms=10.0,
+            data=self.data,
+            event_timestamps=np.arange(number_of_events, dtype="float64"),
+            condition_indices=self.condition_indices,
+        )
+
+    def test_bootstrap_psth(self):
+        result = self.binned_aligned_spikes.bootstrap_psth(n_resamples=500, seed=1)
+
+        np.testing.assert_array_equal(result.conditions, [0, 1])
+        self.assertEqual(result.estimate.shape, (2, 6, 10))
+        np.testing.assert_allclose(result.estimate[1], self.data[:, self.condition_indices == 1].mean(axis=1))
+        self.assertTrue(np.all(result.confidence_low <= result.estimate))
+        self.assertTrue(np.all(result.estimate <= result.confidence_high))
+
+        # The bootstrap standard error approximates the standard error of the mean
+        standard_error_of_the_mean = self.data[:, self.condition_indices == 0].std(axis=1) / np.sqrt(40)
+        np.testing.assert_allclose(result.standard_error[0], standard_error_of_the_mean, rtol=0.35)
+
+        rates = self.binned_aligned_spikes.bootstrap_psth(n_resamples=500, statistic="rate", conditions=[1], seed=1)
+        np.testing.assert_allclose(rates.estimate[0], result.estimate[1] * 100.0)
+
+    def test_seed_makes_results_reproducible_with_threads(self):
+        first = self.binned_aligned_spikes.bootstrap_psth(n_resamples=200, seed=3, max_workers=1)
+        second = self.binned_aligned_spikes.bootstrap_psth(n_resamples=200, seed=3, max_workers=4)
+        np.testing.assert_array_equal(first.confidence_low, second.confidence_low)
+
+        first = self.binned_aligned_spikes.permutation_test(0, 1, n_resamples=2000, seed=3, max_workers=1)
+        second = self.binned_aligned_spikes.permutation_test(0, 1, n_resamples=2000, seed=3, max_workers=4)
+        np.testing.assert_array_equal(first.p_values, second.p_values)
+
+    def test_permutation_test(self):
+        result = self.binned_aligned_spikes.permutation_test(
+            condition_a=1, condition_b=0, bin_slice=slice(4, 8), n_resamples=2000, alternative="greater", seed=0
+        )
+
+        self.assertEqual(result.p_values.shape, (6,))
+        self.assertAlmostEqual(result.p_values[0], 1 / 2001)
+        self.assertTrue(np.all(result.p_values[1:] > 0.001))
+        counts = self.data[:, :, 4:8].sum(axis=2)
+        np.testing.assert_allclose(
+            result.difference,
+            counts[:, self.condition_indices == 1].mean(axis=1) - counts[:, self.condition_indices == 0].mean(axis=1),
+        )
+
+    def test_identical_conditions_are_not_significant(self):
+        result = self.binned_aligned_spikes.permutation_test(condition_a=0, condition_b=0, n_resamples=100, seed=0)
+        np.testing.assert_array_equal(result.p_values, np.ones(6))
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            self.binned_aligned_spikes.permutation_test(0, 1, alternative="unequal")
+        with self.assertRaises(ValueError):
+            self.binned_aligned_spikes.permutation_test(0, 5)
+        with self.assertRaises(ValueError):
+            self.binned_aligned_spikes.bootstrap_psth(statistic="median")
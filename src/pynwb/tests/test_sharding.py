@@ -0,0 +1,172 @@
+"""Tests for BinnedAlignedSpikes sharded across several NWB files."""
+
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from pynwb import NWBHDF5IO
+from pynwb.testing import TestCase
+from pynwb.testing.mock.file import mock_NWBFile
+from ndx_binned_spikes import BinnedAlignedSpikes
+from ndx_binned_spikes.instrumentation import instrument
+from ndx_binned_spikes.latency import compute_response_onset
+from ndx_binned_spikes.testing.mock import mock_BinnedAlignedSpikes
+from ndx_binned_spikes.sharding import ShardedBinnedAlignedSpikes, get_shard, write_shard_manifest, write_shards
+
+
+class TestShardedBinnedAlignedSpikes(TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(seed=0)
+        self.data = rng.integers(0, 10, size=(5, 23, 6))
+        self.event_timestamps = np.arange(23, dtype="float64")
+        self.condition_indices = rng.integers(0, 3, size=23).astype("uint64")
+        self.binned_aligned_spikes = BinnedAlignedSpikes(
+            bin_width_in_ms=20.0,
+            event_to_bin_offset_in_ms=-40.0,
+            data=self.data,
+            event_timestamps=self.event_timestamps,
+            condition_indices=self.condition_indices,
+            condition_labels=["a", "b", "c"],
+        )
+        self.nwbfile = mock_NWBFile()
+        self.nwbfile.add_acquisition(self.binned_aligned_spikes)
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.manifest_path = os.path.join(self.directory.name, "experiment.json")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_event_shards(self):
+        manifest = write_shards(self.binned_aligned_spikes, self.manifest_path, shard_length=7)
+
+        self.assertEqual(manifest["shape"], [5, 23, 6])
+        shard_ranges = [(shard["start"], shard["stop"]) for shard in manifest["shards"]]
+        self.assertEqual(shard_ranges, [(0, 7), (7, 14), (14, 21), (21, 23)])
+        self.assertTrue(all(not os.path.isabs(shard["path"]) for shard in manifest["shards"]))
+
+        with ShardedBinnedAlignedSpikes(self.manifest_path) as sharded:
+            self.assertEqual(sharded.number_of_units, 5)
+            self.assertEqual(sharded.number_of_events, 23)
+            self.assertEqual(sharded.number_of_bins, 6)
+            self.assertEqual(sharded.number_of_conditions, 3)
+            self.assertEqual(sharded.bin_width_in_ms, 20.0)
+            np.testing.assert_array_equal(sharded.condition_labels, ["a", "b", "c"])
+            np.testing.assert_array_equal(sharded.event_timestamps, self.event_timestamps)
+            np.testing.assert_array_equal(sharded.condition_indices, self.condition_indices)
+
+            mask = self.condition_indices == 1
+            selections = [
+                Ellipsis,
+                (slice(None), slice(5, 16)),
+                (slice(None), 13),
+                (slice(1, 4), slice(20, 2, -3), slice(1, 5)),
+                (slice(None), np.array([22, 0, 8, 8])),
+                (slice(None), mask),
+                (np.array([4, 1]), slice(6, 9)),
+                (2, slice(None), np.array([5, 0])),
+                (slice(None), slice(None, None, 4), np.array([5, 0])),
+                (slice(None), slice(3, 3)),
+            ]
+            for selection in selections:
+                with self.subTest(selection=selection):
+                    np.testing.assert_array_equal(sharded.data[selection], self.data[selection])
+
+            # Only the selected events of a shard are read, not the range they span
+            with instrument() as recorder:
+                np.testing.assert_array_equal(sharded.data[:, [6, 0, 6]], self.data[:, [6, 0, 6]])
+            self.assertEqual(recorder.reads["bytes"], 5 * 2 * 6 * self.data.itemsize)
+
+            for condition_index in range(3):
+                np.testing.assert_array_equal(
+                    sharded.get_data_for_condition(condition_index),
+                    self.binned_aligned_spikes.get_data_for_condition(condition_index),
+                )
+                np.testing.assert_array_equal(
+                    sharded.get_event_timestamps_for_condition(condition_index),
+                    self.event_timestamps[self.condition_indices == condition_index],
+                )
+
+    def test_masked_shards(self):
+        masked = mock_BinnedAlignedSpikes(
+            number_of_units=3, number_of_events=20, number_of_bins=4, number_of_conditions=2,
+            add_random_invalid_bins=True,
+        )
+        nwbfile_kwargs = dict(
+            session_description="masked", identifier="masked", session_start_time=self.nwbfile.session_start_time
+        )
+        for axis, shard_length in [("events", 6), ("units", 2)]:
+            with self.subTest(axis=axis):
+                manifest = write_shards(
+                    masked, self.manifest_path, shard_length=shard_length, axis=axis, nwbfile_kwargs=nwbfile_kwargs
+                )
+                self.assertTrue(manifest["has_validity_mask"])
+                with ShardedBinnedAlignedSpikes(self.manifest_path) as sharded:
+                    np.testing.assert_array_equal(
+                        sharded.validity_mask.get_valid(sharded.data.shape), masked.validity_mask.to_bool()
+                    )
+                    for condition_index in range(2):
+                        expected = masked.get_data_for_condition(condition_index)
+                        condition_data = sharded.get_data_for_condition(condition_index)
+                        np.testing.assert_array_equal(np.ma.getmaskarray(condition_data), np.ma.getmaskarray(expected))
+                        np.testing.assert_array_equal(condition_data.filled(0), expected.filled(0))
+
+    def test_unit_shards_read_in_the_calling_thread(self):
+        write_shards(self.binned_aligned_spikes, self.manifest_path, shard_length=2, axis="units")
+
+        with ShardedBinnedAlignedSpikes(self.manifest_path, max_workers=1) as sharded:
+            self.assertEqual(len(sharded.shards), 3)
+            np.testing.assert_array_equal(sharded.data[:], self.data)
+            np.testing.assert_array_equal(sharded.data[np.array([4, 0, 2]), 3:9], self.data[np.array([4, 0, 2]), 3:9])
+            np.testing.assert_array_equal(sharded.event_timestamps, self.event_timestamps)
+            np.testing.assert_array_equal(sharded.get_data_for_condition(2), self.data[:, self.condition_indices == 2])
+
+    def test_shards_written_independently(self):
+        # Each writer produces a regular NWB file with its range of events
+        shards = []
+        for index, (start, stop) in enumerate([(0, 10), (10, 23)]):
+            nwbfile = mock_NWBFile()
+            nwbfile.add_acquisition(get_shard(self.binned_aligned_spikes, start, stop))
+            path = f"node-{index}.nwb"
+            with NWBHDF5IO(os.path.join(self.directory.name, path), mode="w") as io:
+                io.write(nwbfile)
+            shards.append((path, "acquisition/BinnedAlignedSpikes"))
+
+        with self.assertRaises(ValueError):
+            write_shard_manifest(self.manifest_path, shards[::-1])
+
+        write_shard_manifest(self.manifest_path, shards)
+        with open(self.manifest_path, "r") as file:
+            self.assertEqual(json.load(file)["axis"], "events")
+        with ShardedBinnedAlignedSpikes(self.manifest_path) as sharded:
+            np.testing.assert_array_equal(sharded.data[:, 8:12], self.data[:, 8:12])
+            # The analysis functions of the package accept the sharded data
+            onsets = compute_response_onset(sharded, events_per_chunk=4)
+            expected = self.binned_aligned_spikes.compute_response_onset()
+            np.testing.assert_array_equal(onsets["peak_value"], expected["peak_value"])
+
+    def test_mismatched_shards(self):
+        other = BinnedAlignedSpikes(
+            bin_width_in_ms=10.0,
+            event_to_bin_offset_in_ms=-40.0,
+            data=self.data,
+            event_timestamps=self.event_timestamps + 100,
+            condition_indices=self.condition_indices,
+            condition_labels=["a", "b", "c"],
+        )
+        shards = []
+        for index, container in enumerate([self.binned_aligned_spikes, other]):
+            nwbfile = mock_NWBFile()
+            nwbfile.add_acquisition(get_shard(container, 0, 23))
+            path = f"shard-{index}.nwb"
+            with NWBHDF5IO(os.path.join(self.directory.name, path), mode="w") as io:
+                io.write(nwbfile)
+            shards.append((path, "acquisition/BinnedAlignedSpikes"))
+
+        with self.assertRaisesRegex(ValueError, "bin_width_in_ms"):
+            write_shard_manifest(self.manifest_path, shards)
+        with self.assertRaises(ValueError):
+            write_shards(other, self.manifest_path, shard_length=5)
@@ -0,0 +1,150 @@
+"""Tests for the overlapping windows storage of aligned data."""
+
+import h5py
+import numpy as np
+
+from pynwb import NWBHDF5IO
+from pynwb.testing import TestCase, remove_test_file
+from pynwb.testing.mock.file import mock_NWBFile
+from ndx_binned_spikes import BinnedAlignedSpikes
+from ndx_binned_spikes.windows import OverlappingWindowsData
+
+
+class TestOverlappingWindowsData(TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(seed=0)
+        self.session_data = rng.integers(0, 5, size=(4, 600))
+        self.number_of_bins = 20
+        # A periodic train of events with overlapping windows followed by isolated events
+        self.window_starts = np.concatenate((np.arange(10, 200, 5), [300, 450, 460]))
+        self.dense_data = np.stack(
+            [self.session_data[:, start : start + self.number_of_bins] for start in self.window_starts], axis=1
+        )
+        self.windows = OverlappingWindowsData.from_binned(
+            self.session_data, self.window_starts, self.number_of_bins, units_per_chunk=3
+        )
+
+    def test_covered_bins_are_stored_once(self):
+        self.assertEqual(self.windows.shape, self.dense_data.shape)
+        # One run from 10 to 215, one window at 300 and a run from 450 to 480
+        self.assertEqual(self.windows.window_data.shape, (4, 205 + 20 + 30))
+        self.assertGreater(self.windows.compression_ratio, 3)
+
+    def test_selections_match_the_dense_data(self):
+        mask = np.zeros(len(self.window_starts), dtype=bool)
+        mask[[0, 7, 38, 40]] = True
+        selections = [
+            Ellipsis,
+            1,
+            (slice(None), 3),
+            (np.array([3, 0, 3]),),
+            (slice(None), np.array([40, 2])),
+            (slice(None), mask),
+            (slice(1, 3), slice(2, 30, 3), slice(4, 9)),
+            (Ellipsis, -1),
+            (slice(None), slice(5, 5)),
+            (2, slice(None), np.array([0, 19])),
+        ]
+        for selection in selections:
+            with self.subTest(selection=selection):
+                np.testing.assert_array_equal(self.windows[selection], self.dense_data[selection])
+
+    def test_evenly_spaced_events_are_views(self):
+        events = self.windows[:, 0:30, :]
+        self.assertTrue(np.shares_memory(events, self.windows.window_data))
+        np.testing.assert_array_equal(events, self.dense_data[:, 0:30, :])
+
+    def test_invalid_window_starts(self):
+        with self.assertRaises(ValueError):
+            OverlappingWindowsData.from_binned(self.session_data, [10, 5], self.number_of_bins)
+        with self.assertRaises(ValueError):
+            OverlappingWindowsData.from_binned(self.session_data, [590], self.number_of_bins)
+        with self.assertRaises(IndexError):
+            self.windows[np.array([0]), np.array([1])]
+
+
+class TestBinnedAlignedSpikesWithOverlappingWindows(TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(seed=1)
+        session_data = rng.integers(0, 5, size=(3, 300))
+        window_starts = np.arange(0, 250, 4)
+        self.windows = OverlappingWindowsData.from_binned(session_data, window_starts, number_of_bins=25)
+        self.dense_data = np.asarray(self.windows)
+
+        self.condition_indices = rng.integers(0, 3, size=window_starts.size).astype("uint64")
+        self.binned_aligned_spikes = BinnedAlignedSpikes(
+            bin_width_in_ms=10.0,
+            data=self.windows,
+            event_timestamps=window_starts * 0.01,
+            condition_indices=self.condition_indices,
+        )
+
+        self.path = "test_windows.nwb"
+        nwbfile = mock_NWBFile()
+        nwbfile.add_acquisition(self.binned_aligned_spikes)
+        with NWBHDF5IO(self.path, mode="w") as io:
+            io.write(nwbfile)
+
+    def tearDown(self):
+        remove_test_file(self.path)
+
+    def test_methods(self):
+        self.assertEqual(self.binned_aligned_spikes.number_of_events, 63)
+        self.assertEqual(self.binned_aligned_spikes.number_of_bins, 25)
+        np.testing.assert_array_equal(
+            self.binned_aligned_spikes.get_data_for_condition(1), self.dense_data[:, self.condition_indices == 1]
+        )
+        np.testing.assert_array_equal(
+            self.binned_aligned_spikes.rebin(5).data, self.dense_data.reshape(3, 63, 5, 5).sum(axis=-1)
+        )
+
+    def test_roundtrip(self):
+        with h5py.File(self.path, mode="r") as file:
+            group = file["acquisition/BinnedAlignedSpikes"]
+            self.assertNotIn("data", group)
+            self.assertEqual(group["window_data"].shape, (3, 273))
+            self.assertEqual(group["window_data"].attrs["number_of_bins"], 25)
+
+        with NWBHDF5IO(self.path, mode="r") as io:
+            read_binned_aligned_spikes = io.read().acquisition["BinnedAlignedSpikes"]
+            self.assertIsInstance(read_binned_aligned_spikes.data, OverlappingWindowsData)
+            self.assertIsInstance(read_binned_aligned_spikes.data.window_data, h5py.Dataset)
+            np.testing.assert_array_equal(read_binned_aligned_spikes.data[:, 10:20, :], self.dense_data[:, 10:20, :])
+            for condition_index in range(3):
+                np.testing.assert_array_equal(
+                    read_binned_aligned_spikes.get_data_for_condition(condition_index),
+                    self.dense_data[:, self.condition_indices == condition_index],
+                )
+
+    def test_exactly_one_of_data_and_window_data(self):
+        with h5py.File(self.path, mode="a") as file:
+            file["acquisition/BinnedAlignedSpikes"].create_dataset("data", data=self.dense_data)
+        with NWBHDF5IO(self.path, mode="r") as io:
+            with self.assertRaisesRegex(Exception, "exactly one of the `data` and `window_data`"):
+                io.read()
+
+        with h5py.File(self.path, mode="a") as file:
+            group = file["acquisition/BinnedAlignedSpikes"]
+            del group["data"], group["window_data"], group["window_starts"]
+        with NWBHDF5IO(self.path, mode="r") as io:
+            with self.assertRaisesRegex(Exception, "exactly one of the `data` and `window_data`"):
+                io.read()
+
+    def test_dense_data_roundtrip_is_unchanged(self):
+        binned_aligned_spikes = BinnedAlignedSpikes(
+            bin_width_in_ms=10.0, data=self.dense_data, event_timestamps=np.arange(63.0)
+        )
+        nwbfile = mock_NWBFile()
+        nwbfile.add_acquisition(binned_aligned_spikes)
+        path = "test_windows_dense.nwb"
+        try:
+            with NWBHDF5IO(path, mode="w") as io:
+                io.write(nwbfile)
+            with NWBHDF5IO(path, mode="r") as io:
+                read_binned_aligned_spikes = io.read().acquisition["BinnedAlignedSpikes"]
+                self.assertIsInstance(read_binned_aligned_spikes.data, h5py.Dataset)
+                np.testing.assert_array_equal(read_binned_aligned_spikes.data[:], self.dense_data)
+        finally:
+            remove_test_file(path)
@@ -8,7 +8,7 @@ def main():
     # these arguments were auto-generated from your cookiecutter inputs
     ns_builder = NWBNamespaceBuilder(
         name="""ndx-binned-spikes""",
-        version="""0.3.2""",
+        version="""0.4.0""",
         doc="""to-do""",
         author=[
             "Ben Dicther",
@@ -27,13 +27,69 @@ def main():
         name="data",
         doc=(
             "The binned data. It should be an array whose first dimension is the number of units, the second dimension "
-            "is the number of events, and the third dimension is the number of bins."
+            "is the number of events, and the third dimension is the number of bins. It is omitted when the data "
+            "is stored as overlapping windows in `window_data` and `window_starts`; exactly one of `data` and "
+            "`window_data` must be present."
             ),
         dtype="numeric",  
         shape=[None, None, None],
         dims=["num_units", "number_of_events", "number_of_bins"],
+        quantity="?",
+    )
+
+    window_data = NWBDatasetSpec(
+        name="window_data",
+        doc=(
+            "The union of the bins covered by the windows of the events, stored once, when the windows of dense "
+            "events overlap. The window of event e is window_data[:, window_starts[e]:window_starts[e] + "
+            "number_of_bins]. It replaces `data` and is used together with `window_starts`; exactly one of `data` "
+            "and `window_data` must be present."
+            ),
+        dtype="numeric",
+        shape=[None, None],
+        dims=["num_units", "number_of_covered_bins"],
+        attributes=[
+            NWBAttributeSpec(
+                name="number_of_bins",
+                doc="The number of bins of the window of each event.",
+                dtype="uint64",
+            ),
+        ],
+        quantity="?",
+    )
+
+    window_starts = NWBDatasetSpec(
+        name="window_starts",
+        doc="The index in the second dimension of `window_data` of the first bin of the window of each event.",
+        dtype="uint64",
+        shape=[None],
+        dims=["number_of_events"],
+        quantity="?",
     )
     
+    validity_mask = NWBDatasetSpec(
+        name="validity_mask",
+        doc=(
+            "A bit-packed boolean mask of the valid entries of `data`, with one bit per entry in row-major order "
+            "(the first entry is the least significant bit of the first byte). Its unpacked shape has the number of "
+            "dimensions of `data` and each axis has either the length of the data axis or 1, in which case the mask "
+            "applies to all the entries of that axis (e.g. a mask of units, events or bins)."
+            ),
+        dtype="uint8",
+        shape=[None],
+        dims=["number_of_bytes"],
+        attributes=[
+            NWBAttributeSpec(
+                name="mask_shape",
+                doc="The shape of the unpacked mask.",
+                dtype="uint64",
+                shape=[None],
+                dims=["number_of_dimensions"],
+            ),
+        ],
+        quantity="?",
+    )
+
     units_region = NWBDatasetSpec(
         name="units_region",
         neurodata_type_inc="DynamicTableRegion",
@@ -76,12 +132,36 @@ def main():
         quantity="?",
     )
     
+    checksum_manifest = NWBAttributeSpec(
+        name="checksum_manifest",
+        doc=(
+            "A JSON manifest with content hashes of the data per unit and per block of events or bins, together "
+            "with the binning parameters and the hashes of the source spike times. It is used to detect whether "
+            "the binned data is still valid and which units or blocks need to be recomputed."
+        ),
+        dtype="text",
+        required=False,
+    )
+
     binned_aligned_spikes = NWBGroupSpec(
         neurodata_type_def="BinnedAlignedSpikes",
         neurodata_type_inc="NWBDataInterface",
         default_name="BinnedAlignedSpikes",
-        doc="A data interface for binned spike data aligned to an event (e.g. a stimulus or the beginning of a trial).",
-        datasets=[binned_aligned_spikes_data, event_timestamps, condition_indices, condition_labels, units_region],
+        doc=(
+            "A data interface for binned spike data aligned to an event (e.g. a stimulus or the beginning of a "
+            "trial). The data is stored either in `data` or, for overlapping windows, in `window_data` and "
+            "`window_starts`; exactly one of `data` and `window_data` must be present."
+        ),
+        datasets=[
+            binned_aligned_spikes_data,
+            window_data,
+            window_starts,
+            validity_mask,
+            event_timestamps,
+            condition_indices,
+            condition_labels,
+            units_region,
+        ],
         attributes=[
             NWBAttributeSpec(
                 name="name",
@@ -109,7 +189,8 @@ def main():
                 ),
                 dtype="float64",
                 default_value=0.0,
-            )
+            ),
+            checksum_manifest,
         ],
     )
     
@@ -131,7 +212,7 @@ def main():
         neurodata_type_inc="NWBDataInterface",
         default_name="BinnedSpikes",
         doc="A data interface for non-aligned binned spike counts.",
-        datasets=[binned_spikes_data, units_region],
+        datasets=[binned_spikes_data, validity_mask, units_region],
         attributes=[
             NWBAttributeSpec(
                 name="name",
@@ -159,7 +240,8 @@ def main():
                 dtype="float64",
                 default_value=0.0,
                 required=False,
-            )
+            ),
+            checksum_manifest,
         ],
     )
     
@@ -169,6 +251,11 @@ def main():
     output_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "spec"))
     export_spec(ns_builder, new_data_types, output_dir)
 
+    # store the parsed spec so that the package can load the namespace without parsing the yaml files
+    from ndx_binned_spikes._namespace import write_spec_cache
+
+    write_spec_cache(os.path.join(output_dir, "ndx-binned-spikes.namespace.yaml"))
+
 
 if __name__ == "__main__":
     # usage: python create_extension_spec.py